@@ -6,11 +6,12 @@ print("DEBUG: FIREBASE_PROJECT_ID =", os.getenv("FIREBASE_PROJECT_ID"))
 from starlette.middleware.cors import CORSMiddleware
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Dict
 import uuid
 from datetime import datetime, timedelta
 import asyncio
 import json
+import re
 import time
 from services.health_platform import HealthPlatformFactory
 
@@ -57,17 +58,55 @@ from services.pdf_rag_service import pdf_rag_service
 # Add import for diet notification service
 from services.diet_notification_service import diet_notification_service
 # Add import for notification scheduler
-from services.notification_scheduler_simple import get_simple_notification_scheduler as get_notification_scheduler
+from services.notification_scheduler_simple import get_simple_notification_scheduler
+# Add import for the heap-based backend diet reminder scheduler (BACKEND_DIET_REMINDERS_ENABLED)
+from services.diet_reminder_scheduler import get_diet_reminder_scheduler, ENABLED as BACKEND_DIET_REMINDERS_ENABLED
+get_notification_scheduler = get_diet_reminder_scheduler if BACKEND_DIET_REMINDERS_ENABLED else get_simple_notification_scheduler
+# Add import for nutrition lookup cache
+from services.nutrition_cache import get_nutrition_cache, make_cache_key
+# Add import for single-flight coalescing of identical Gemini lookups
+from services.single_flight import get_single_flight, get_single_flight_stats
+# Add import for local food composition database
+from services.food_composition_db import food_composition_db
+# Add import for batched nutrition lookups
+from services.nutrition_batch import NutritionBatchResolver, parse_nutrition_triplet as _parse_nutrition_triplet
+# Add import for batched food logging
+from services.food_log_batch import log_food_batch
+# Add import for per-day nutrition rollups
+from services.nutrition_rollups import get_nutrition_rollups, day_range, EMPTY_ROLLUP, MAX_RANGE_DAYS
+# Add import for recent/popular food autocomplete
+from services.food_suggestions import get_food_suggestions
+# Add import for the shared Gemini gateway (model reuse, bounded pool, timeouts, circuit breaker)
+from services.gemini_gateway import gemini_gateway, GeminiUnavailableError
+# Add import for server-side NutriBot chat sessions
+from services.chat_sessions import get_chat_session_store
+# Add import for bounded NutriBot context (recent turns + rolling summary)
+from services.chat_context import chat_context_manager
+# Add import for cached answers to repeat NutriBot questions
+from services.chat_response_cache import chat_response_cache
+# Add import for the process pool used for PDF parsing and diet activity extraction
+from services.extraction_pool import extraction_service, ExtractionBusyError, ExtractionTimeoutError
+from services.pdf_text_cache import content_key
+# Add import for the batched Expo push sender
+from services.expo_push_gateway import expo_push_gateway
+# Add import for the durable notification outbox and its delivery workers
+from services.notification_outbox import get_notification_outbox
+# Add import for cached push token lookups
+from services.push_token_registry import get_push_token_registry
+# Add import for Expo push receipt polling and dead token pruning
+from services.push_receipts import get_push_receipt_tracker, POLL_INTERVAL_SECONDS as PUSH_RECEIPT_POLL_INTERVAL_SECONDS
+# Add import for sampled tracing of hot paths
+from services.tracing import tracer, trace, FOOD_LOG_TRACE, SUMMARY_TRACE
+# Add import for scheduled food/workout log retention
+from services.log_retention import get_log_retention_job, DEFAULT_INTERVAL_SECONDS as LOG_RETENTION_INTERVAL_SECONDS
 import logging
 import warnings
 from concurrent.futures import ThreadPoolExecutor
 import requests
-from google.generativeai.generative_models import GenerativeModel
 from google.generativeai.client import configure
-from google.generativeai.types import ContentDict
 import tempfile
 from fastapi import Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # Helper function to check Firebase availability
 def check_firebase_availability():
@@ -112,6 +151,13 @@ class FoodItem(BaseModel):
 class FoodSearchResponse(BaseModel):
     foods: List[FoodItem]
 
+class FoodNutritionBatchItem(BaseModel):
+    food_name: str
+    quantity: str = "100"
+
+class FoodNutritionBatchRequest(BaseModel):
+    items: List[FoodNutritionBatchItem]
+
 class FoodLogRequest(BaseModel):
     userId: str
     foodName: str
@@ -123,11 +169,33 @@ class FoodLogRequest(BaseModel):
     # Timezone offset from frontend (in minutes, e.g., -480 for PST)
     timezoneOffset: Optional[int] = None
 
+class TracingConfigRequest(BaseModel):
+    # Sampling rate per category, 0 (off) to 1 (every trace)
+    rates: Dict[str, float] = {}
+    default_rate: Optional[float] = None
+
+class FoodLogBatchItem(BaseModel):
+    foodName: str
+    servingSize: str = "100"
+    # Optional pre-calculated nutrition data (if provided, the item is not resolved)
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    fat: Optional[float] = None
+
+class FoodLogBatchRequest(BaseModel):
+    userId: str
+    items: List[FoodLogBatchItem]
+    # Timezone offset from frontend (in minutes, e.g., -480 for PST)
+    timezoneOffset: Optional[int] = None
+
 class FoodLog(BaseModel):
     userId: str
     food: FoodItem
     servingSize: str = "100"
     timestamp: Optional[datetime] = None
+    # Where the nutrition values came from (local_db, cache, gemini or client) and fuzzy match confidence
+    source: Optional[str] = None
+    matchConfidence: Optional[float] = None
 
 class LogSummaryResponse(BaseModel):
     history: List[dict]
@@ -213,12 +281,17 @@ class UpdateUserProfile(BaseModel):
 
 class ChatMessageRequest(BaseModel):
     userId: str
-    chat_history: list
-    user_profile: dict
+    # With a sessionId the server keeps the history and looks up the profile itself,
+    # so clients only need to send the new message
+    chat_history: list = []
+    user_profile: Optional[dict] = None
     user_message: str
+    sessionId: Optional[str] = None
 
 class ChatMessageResponse(BaseModel):
     bot_message: str
+    sessionId: Optional[str] = None
+    cached: bool = False
 
 class SubscriptionPlan(BaseModel):
     planId: str
@@ -475,13 +548,49 @@ if GEMINI_API_KEY:
 else:
     print("⚠️  Gemini API key not found")
 
+# Upper bound on items resolved by one /food/nutrition/batch request (one Gemini prompt)
+MAX_NUTRITION_BATCH_ITEMS = 50
+
 # Firebase is now handled automatically in the firebase_client.py
 # No need for reinitialization since it has multiple fallback mechanisms
 
 async def get_nutrition_from_gemini(food_name, quantity):
+    food_name = str(food_name).strip()
+    # Check the nutrition cache before paying for a Gemini round trip
+    nutrition_cache = get_nutrition_cache(firestore_db)
+    try:
+        cached = nutrition_cache.get_local(food_name, quantity)
+        if cached is None:
+            cached = await asyncio.get_event_loop().run_in_executor(executor, lambda: nutrition_cache.get(food_name, quantity))
+        if cached is not None:
+            logger.info(f"[NUTRITION CACHE] Hit for food_name='{food_name}', quantity={quantity}")
+            return {**cached, 'source': 'cache'}
+    except Exception as cache_error:
+        logger.warning(f"[NUTRITION CACHE] Lookup failed, falling back to Gemini: {cache_error}")
     if not GEMINI_API_KEY:
         return {'calories': 'Error', 'protein': 'Error', 'fat': 'Error'}
-    food_name = str(food_name).strip()
+    # Concurrent identical lookups share one in-flight Gemini call
+    nutrition = await get_single_flight("nutrition").do(
+        make_cache_key(food_name, quantity),
+        lambda: _request_nutrition_from_gemini(food_name, quantity, nutrition_cache)
+    )
+    return {**nutrition, 'source': 'gemini'}
+
+async def resolve_food_nutrition(food_name, quantity):
+    """
+    Resolve nutrition for a serving, trying the bundled food composition DB before the cache/Gemini path.
+    Results are tagged with their 'source' and, for local matches, the fuzzy match 'confidence'.
+    """
+    try:
+        local = food_composition_db.resolve(food_name, quantity)
+        if local is not None:
+            logger.info(f"[FOOD DB] Resolved '{food_name}', {quantity} locally as '{local['matched_name']}' (confidence {local['confidence']})")
+            return local
+    except Exception as db_error:
+        logger.warning(f"[FOOD DB] Local lookup failed for '{food_name}', falling back to Gemini: {db_error}")
+    return await get_nutrition_from_gemini(food_name, quantity)
+
+async def _request_nutrition_from_gemini(food_name, quantity, nutrition_cache):
     try:
         qty = float(quantity)
     except Exception:
@@ -494,24 +603,20 @@ async def get_nutrition_from_gemini(food_name, quantity):
     )
     logger.info(f"[GEMINI PROMPT STRING] {prompt}")
     try:
-        model = GenerativeModel('gemini-2.5-flash')
-        response = await asyncio.get_event_loop().run_in_executor(None, lambda: model.generate_content(prompt))
-        raw = response.text.strip()
+        raw = (await gemini_gateway.generate("nutrition", prompt)).strip()
         logger.info(f"[GEMINI RAW RESPONSE - UNCHANGED] {raw}")
         logger.info(f"[GEMINI RAW RESPONSE] {raw}")
         if raw.strip().lower() == "error":
             logger.error(f"[GEMINI ERROR] Model returned 'Error' for prompt: {prompt}")
             return {'calories': 'Error', 'protein': 'Error', 'fat': 'Error', 'raw': raw}
         try:
-            # Take number before first comma
-            part1, rest = raw.split(',', 1)
-            calories = float(part1.strip())
-            # Take number before next comma
-            part2, rest = rest.split(',', 1)
-            protein = float(part2.strip())
-            # The rest is the third number
-            fat = float(rest.strip())
-            return {'calories': calories, 'protein': protein, 'fat': fat, 'raw': raw}
+            calories, protein, fat = _parse_nutrition_triplet(raw)
+            nutrition = {'calories': calories, 'protein': protein, 'fat': fat, 'raw': raw}
+            try:
+                await asyncio.get_event_loop().run_in_executor(executor, lambda: nutrition_cache.set(food_name, quantity, nutrition))
+            except Exception as cache_error:
+                logger.warning(f"[NUTRITION CACHE] Failed to store result: {cache_error}")
+            return nutrition
         except Exception as e:
             logger.error(f"[GEMINI PARSE ERROR] Could not extract 3 numbers from: {raw}, error: {e}")
             # Log the raw response at ERROR level for debugging
@@ -521,11 +626,33 @@ async def get_nutrition_from_gemini(food_name, quantity):
         logger.error(f"[GEMINI ERROR] Exception: {e}", exc_info=True)
         return {'calories': 'Error', 'protein': 'Error', 'fat': 'Error'}
 
+async def get_batch_nutrition_from_gemini(items):
+    """
+    Resolve nutrition for many (food_name, quantity) pairs at once.
+    Local DB and cache hits are answered locally; all remaining misses go to Gemini in one prompt.
+    Returns one nutrition dict per item, in request order, tagged with its source.
+    """
+    resolver = NutritionBatchResolver(
+        gemini_gateway.generate if GEMINI_API_KEY else None,
+        get_nutrition_from_gemini,
+        local_lookup=food_composition_db.resolve,
+        cache=get_nutrition_cache(firestore_db),
+        executor=executor
+    )
+    return await resolver.resolve(items)
+
 async def get_workout_nutrition_from_gemini(workout_name, duration):
     if not GEMINI_API_KEY:
         return {'calories': 0}
     workout_name = str(workout_name).strip()
-    
+    # Concurrent identical lookups share one in-flight Gemini call
+    nutrition = await get_single_flight("workout").do(
+        make_cache_key(workout_name, duration),
+        lambda: _request_workout_nutrition_from_gemini(workout_name, duration)
+    )
+    return dict(nutrition)
+
+async def _request_workout_nutrition_from_gemini(workout_name, duration):
     # Pass duration as-is to Gemini, regardless of whether it's numeric or not
     logger.info(f"[GEMINI WORKOUT PROMPT] workout_name='{workout_name}', duration={duration}")
     
@@ -537,13 +664,7 @@ async def get_workout_nutrition_from_gemini(workout_name, duration):
     
     logger.info(f"[GEMINI WORKOUT PROMPT STRING] {prompt}")
     try:
-        model = GenerativeModel('gemini-2.5-flash')
-        # Add timeout to the Gemini API call
-        response = await asyncio.wait_for(
-            asyncio.get_event_loop().run_in_executor(None, lambda: model.generate_content(prompt)),
-            timeout=20.0  # 20 second timeout for Gemini API call
-        )
-        raw = response.text.strip()
+        raw = (await gemini_gateway.generate("workout", prompt)).strip()
         logger.info(f"[GEMINI WORKOUT RAW RESPONSE - UNCHANGED] {raw}")
         logger.info(f"[GEMINI WORKOUT RAW RESPONSE] {raw}")
         if raw.strip().lower() == "error":
@@ -601,8 +722,8 @@ async def get_food_nutrition(food_name: str, quantity: str = "100"):
     """Get nutrition data for a food item without logging it"""
     try:
         logger.info(f"[NUTRITION] Getting nutrition for: {food_name}, {quantity}")
-        nutrition = await get_nutrition_from_gemini(food_name, quantity)
-        logger.info(f"[NUTRITION] Gemini nutrition response: {nutrition}")
+        nutrition = await resolve_food_nutrition(food_name, quantity)
+        logger.info(f"[NUTRITION] Nutrition response ({nutrition.get('source')}): {nutrition}")
         
         food = FoodItem(
             name=food_name,
@@ -612,60 +733,290 @@ async def get_food_nutrition(food_name: str, quantity: str = "100"):
             per_100g=True
         )
         
-        return {"food": food.dict(), "success": True}
+        return {"food": food.dict(), "success": True, "source": nutrition.get("source"), "confidence": nutrition.get("confidence")}
     except Exception as e:
         logger.error(f"[NUTRITION] Error getting nutrition data: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get nutrition data: {e}")
 
+@api_router.post("/food/nutrition/batch")
+async def get_food_nutrition_batch(request: FoodNutritionBatchRequest):
+    """Get nutrition data for many food items in one call without logging them"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(request.items) > MAX_NUTRITION_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_NUTRITION_BATCH_ITEMS} items can be resolved per request")
+    try:
+        logger.info(f"[NUTRITION BATCH] Getting nutrition for {len(request.items)} items")
+        nutritions = await get_batch_nutrition_from_gemini([(item.food_name, item.quantity) for item in request.items])
+        results = []
+        for item, nutrition in zip(request.items, nutritions):
+            if nutrition["calories"] == "Error":
+                results.append({
+                    "food_name": item.food_name,
+                    "quantity": item.quantity,
+                    "success": False,
+                    "error": "Could not resolve nutrition data for this item",
+                    "source": nutrition.get("source")
+                })
+                continue
+            food = FoodItem(
+                name=item.food_name,
+                calories=float(nutrition["calories"]),
+                protein=float(nutrition["protein"]),
+                fat=float(nutrition["fat"]),
+                per_100g=True
+            )
+            results.append({
+                "food_name": item.food_name,
+                "quantity": item.quantity,
+                "success": True,
+                "food": food.dict(),
+                "source": nutrition.get("source"),
+                "confidence": nutrition.get("confidence")
+            })
+        return {"results": results, "success": True}
+    except Exception as e:
+        logger.error(f"[NUTRITION BATCH] Error getting batch nutrition data: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get batch nutrition data: {e}")
+
+# --- Nutrition Cache Admin Endpoints ---
+@api_router.get("/admin/nutrition-cache")
+async def get_nutrition_cache_status(limit: int = Query(50, ge=0, le=1000)):
+    """Inspect nutrition cache hit/miss counters and the most recently used entries"""
+    nutrition_cache = get_nutrition_cache(firestore_db)
+    return {"stats": nutrition_cache.stats(), "entries": nutrition_cache.entries(limit)}
+
+@api_router.delete("/admin/nutrition-cache")
+async def purge_nutrition_cache(food_name: Optional[str] = None, quantity: Optional[str] = None):
+    """Purge nutrition cache entries. Without food_name the whole cache is cleared."""
+    loop = asyncio.get_event_loop()
+    try:
+        nutrition_cache = get_nutrition_cache(firestore_db)
+        removed = await loop.run_in_executor(executor, lambda: nutrition_cache.purge(food_name, quantity))
+        return {"success": True, "removed": removed}
+    except Exception as e:
+        logger.error(f"[NUTRITION CACHE] Error purging cache: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to purge nutrition cache: {e}")
+
+@api_router.get("/admin/food-db")
+async def get_food_db_status(food_name: Optional[str] = None, quantity: str = "100"):
+    """Inspect the local food composition DB, optionally resolving one food against it"""
+    response = {"stats": food_composition_db.stats()}
+    if food_name:
+        response["match"] = food_composition_db.resolve(food_name, quantity)
+    return response
+
+@api_router.post("/admin/nutrition-rollups/{user_id}/rebuild")
+async def rebuild_nutrition_rollups(user_id: str):
+    """Recompute a user's daily nutrition rollups from their raw food and workout logs"""
+    loop = asyncio.get_event_loop()
+    try:
+        check_firebase_availability()
+        rollups = await loop.run_in_executor(executor, lambda: get_nutrition_rollups(firestore_db).rebuild(user_id))
+        return {"success": True, "days": len(rollups), "rollups": rollups}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[ROLLUPS] Error rebuilding rollups for user {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild nutrition rollups: {e}")
+
+@api_router.get("/admin/log-retention")
+async def get_log_retention_status():
+    """Inspect the log retention job's settings, totals and recent run metrics"""
+    return get_log_retention_job(firestore_db).stats()
+
+@api_router.post("/admin/log-retention/run")
+async def run_log_retention(retention_days: Optional[int] = Query(None, ge=1, le=365)):
+    """Run the log retention job now, optionally with a different retention window"""
+    loop = asyncio.get_event_loop()
+    try:
+        check_firebase_availability()
+        metrics = await loop.run_in_executor(executor, lambda: get_log_retention_job(firestore_db).run(retention_days))
+        return {"success": True, "metrics": metrics}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[LOG RETENTION] Error running retention job: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to run log retention: {e}")
+
+@api_router.get("/admin/tracing")
+async def get_tracing_config():
+    """Inspect trace sampling rates and how many traces each category emitted"""
+    return tracer.stats()
+
+@api_router.put("/admin/tracing")
+async def update_tracing_config(request: TracingConfigRequest):
+    """Change trace sampling rates at runtime, e.g. {"rates": {"FOOD LOG TRACE": 1, "PUSH DEBUG": 0.1}}"""
+    for category, rate in request.rates.items():
+        if not 0 <= rate <= 1:
+            raise HTTPException(status_code=400, detail=f"Sampling rate for {category} must be between 0 and 1")
+    if request.default_rate is not None and not 0 <= request.default_rate <= 1:
+        raise HTTPException(status_code=400, detail="default_rate must be between 0 and 1")
+    for category, rate in request.rates.items():
+        tracer.set_rate(category, rate)
+    if request.default_rate is not None:
+        tracer.set_default_rate(request.default_rate)
+    return {"success": True, **tracer.stats()}
+
+@api_router.get("/admin/gemini/gateway")
+async def get_gemini_gateway_stats():
+    """Gemini gateway pool, circuit breaker and per-prompt-type metrics."""
+    return {"gateway": gemini_gateway.stats()}
+
+@api_router.get("/admin/chatbot/context")
+async def get_chatbot_context_stats():
+    """NutriBot prompt size telemetry (estimated tokens per request) and summary refresh counters."""
+    return {"context": chat_context_manager.stats()}
+
+@api_router.get("/admin/chatbot/response-cache")
+async def get_chatbot_response_cache_stats():
+    """Hit rate and size of the NutriBot response cache for repeat questions."""
+    return {"response_cache": chat_response_cache.stats()}
+
+@api_router.get("/admin/pdf-cache")
+async def get_pdf_text_cache_stats():
+    """Hit rate, size and evictions of the content-hash PDF text cache"""
+    return {"pdf_cache": pdf_rag_service.text_cache.stats()}
+
+@api_router.delete("/admin/pdf-cache")
+async def clear_pdf_text_cache():
+    """Drop this worker's in-memory PDF text cache (the shared disk tier is kept)"""
+    pdf_rag_service.text_cache.clear()
+    return {"success": True, "pdf_cache": pdf_rag_service.text_cache.stats()}
+
+@api_router.get("/admin/extraction")
+async def get_extraction_stats():
+    """Queue depth, timeouts and latencies of the PDF/diet extraction process pool"""
+    return {"extraction": extraction_service.stats()}
+
+@api_router.get("/admin/push/gateway")
+async def get_push_gateway_stats():
+    """Batch sizes, latencies and ticket errors of the batched Expo push sender"""
+    return {"push_gateway": expo_push_gateway.stats()}
+
+@api_router.get("/admin/push/tokens")
+async def get_push_token_stats():
+    """Hit rate and size of the push token cache"""
+    return {"push_tokens": get_push_token_registry(firestore_db).stats()}
+
+@api_router.post("/admin/push/tokens/dietician/rebuild")
+async def rebuild_dietician_push_tokens():
+    """Rewrite push_tokens/dietician from the dietician profiles"""
+    check_firebase_availability()
+    loop = asyncio.get_event_loop()
+    token = await loop.run_in_executor(executor, lambda: get_push_token_registry(firestore_db).rebuild_dietician_tokens())
+    return {"success": True, "tokenFound": token is not None}
+
+@api_router.get("/admin/push/receipts")
+async def get_push_receipt_stats():
+    """Delivery success/failure rates from Expo tickets and receipts, and dead tokens pruned"""
+    return {"push_receipts": get_push_receipt_tracker(firestore_db).stats()}
+
+@api_router.post("/admin/push/receipts/run")
+async def run_push_receipts():
+    """Fetch due Expo receipts now instead of waiting for the scheduled run"""
+    loop = asyncio.get_event_loop()
+    metrics = await loop.run_in_executor(executor, lambda: get_push_receipt_tracker(firestore_db).run())
+    return {"success": True, "metrics": metrics}
+
+@api_router.get("/admin/diet-reminders")
+async def get_diet_reminder_stats():
+    """Reminders held in memory, next due time and fire lateness of the backend diet reminder scheduler"""
+    return {"diet_reminders": get_diet_reminder_scheduler(firestore_db).stats()}
+
+@api_router.get("/admin/notification-outbox")
+async def get_notification_outbox_stats():
+    """Backlog, delivery outcomes and latency of the notification outbox workers"""
+    loop = asyncio.get_event_loop()
+    stats = await loop.run_in_executor(executor, lambda: get_notification_outbox(firestore_db).stats())
+    return {"notification_outbox": stats}
+
+@api_router.get("/admin/gemini/single-flight")
+async def get_gemini_single_flight_stats():
+    """Inspect how many concurrent Gemini lookups were coalesced into shared calls"""
+    return {"single_flight": get_single_flight_stats()}
+
+def _write_food_logs(user_id: str, logs: List[dict]):
+    """
+    Write food logs, their daily rollup increments and recent food updates in one batch
+    (popularity counts are queued and written by the suggestions flusher). Blocking - call from an executor.
+    """
+    batch = firestore_db.batch()
+    get_nutrition_rollups(firestore_db).log_entries(user_id, food_logs=logs, batch=batch)
+    food_suggestions = get_food_suggestions(firestore_db)
+    suggestion_entries = food_suggestions.stage_food_logs(batch, user_id, logs)
+    batch.commit()
+    food_suggestions.record(user_id, suggestion_entries)
+
+async def _check_daily_reset(user_id: str, timezone_offset: Optional[int]):
+    """Reset the user's daily data if their last food log was on an earlier (local) day."""
+    try:
+        user_doc = firestore_db.collection("user_profiles").document(user_id).get()
+        if user_doc.exists:
+            user_data = user_doc.to_dict()
+            last_food_log_date = user_data.get("lastFoodLogDate")
+            # Use user's timezone for daily reset if available
+            if timezone_offset is not None:
+                utc_time = datetime.utcnow()
+                user_local_time = utc_time - timedelta(minutes=timezone_offset)
+                today = user_local_time.strftime('%Y-%m-%d')
+                trace(FOOD_LOG_TRACE, lambda: f"Using user's local date for daily reset: UTC {utc_time} - {timezone_offset}min = {user_local_time} -> {today}")
+            else:
+                today = datetime.now().strftime('%Y-%m-%d')
+                trace(FOOD_LOG_TRACE, lambda: f"Using server date for daily reset: {today}")
+            
+            if last_food_log_date != today:
+                logger.info(f"[FOOD LOG] Daily reset needed for user {user_id}. Last: {last_food_log_date}, Today: {today}")
+                # Reset daily data
+                await reset_daily_data(user_id)
+    except Exception as reset_error:
+        logger.warning(f"[FOOD LOG] Error checking daily reset: {reset_error}")
+        # Continue with food logging even if reset fails
+
+def _food_log_timestamp(timezone_offset: Optional[int]) -> datetime:
+    """Timestamp for a new food log in the user's local time."""
+    # CRITICAL FIX: Use user's local time by applying timezone offset correctly
+    if timezone_offset is not None:
+        # JavaScript getTimezoneOffset() returns minutes to subtract from UTC to get local time
+        # For PST: getTimezoneOffset() = 480 (UTC - 480 minutes = PST)
+        # For EDT: getTimezoneOffset() = 240 (UTC - 240 minutes = EDT)
+        utc_time = datetime.utcnow()
+        local_time = utc_time - timedelta(minutes=timezone_offset)
+        trace(FOOD_LOG_TRACE, lambda: f"Using user's local time: UTC {utc_time} - {timezone_offset}min = {local_time}")
+        return local_time
+    # Fallback to server time if no timezone provided
+    local_time = datetime.now()
+    trace(FOOD_LOG_TRACE, lambda: f"Using server local time (no timezone provided): {local_time}")
+    return local_time
+
 @api_router.post("/food/log", response_model=FoodLog)
 async def log_food_item(request: FoodLogRequest):
     loop = asyncio.get_event_loop()
     try:
-        logger.info(f"[FOOD LOG] Incoming request: {request}")
-        logger.info(f"[FOOD LOG] Request nutrition data - calories: {request.calories}, protein: {request.protein}, fat: {request.fat}")
+        trace(FOOD_LOG_TRACE, lambda: f"Incoming request: {request}")
+        trace(FOOD_LOG_TRACE, lambda: f"Request nutrition data - calories: {request.calories}, protein: {request.protein}, fat: {request.fat}")
         user_id = request.userId
         if not user_id:
             logger.error("[FOOD LOG] userId missing in request")
             raise HTTPException(status_code=400, detail="userId is required")
         
         # Check if daily reset is needed
-        try:
-            user_doc = firestore_db.collection("user_profiles").document(user_id).get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                last_food_log_date = user_data.get("lastFoodLogDate")
-                # Use user's timezone for daily reset if available
-                if request.timezoneOffset is not None:
-                    utc_time = datetime.utcnow()
-                    user_local_time = utc_time - timedelta(minutes=request.timezoneOffset)
-                    today = user_local_time.strftime('%Y-%m-%d')
-                    logger.info(f"[FOOD LOG] Using user's local date for daily reset: UTC {utc_time} - {request.timezoneOffset}min = {user_local_time} -> {today}")
-                else:
-                    today = datetime.now().strftime('%Y-%m-%d')
-                    logger.info(f"[FOOD LOG] Using server date for daily reset: {today}")
-                
-                if last_food_log_date != today:
-                    logger.info(f"[FOOD LOG] Daily reset needed for user {user_id}. Last: {last_food_log_date}, Today: {today}")
-                    # Reset daily data
-                    await reset_daily_data(user_id)
-        except Exception as reset_error:
-            logger.warning(f"[FOOD LOG] Error checking daily reset: {reset_error}")
-            # Continue with food logging even if reset fails
+        await _check_daily_reset(user_id, request.timezoneOffset)
         
         # COMPREHENSIVE LOGGING: Trace every step of nutrition data handling
-        logger.info(f"[FOOD LOG TRACE] 🔍 Starting nutrition data analysis...")
-        logger.info(f"[FOOD LOG TRACE] - Food name: {request.foodName}")
-        logger.info(f"[FOOD LOG TRACE] - Serving size: {request.servingSize}")
-        logger.info(f"[FOOD LOG TRACE] - Provided calories: {request.calories}")
-        logger.info(f"[FOOD LOG TRACE] - Provided protein: {request.protein}")
-        logger.info(f"[FOOD LOG TRACE] - Provided fat: {request.fat}")
+        trace(FOOD_LOG_TRACE, "🔍 Starting nutrition data analysis...")
+        trace(FOOD_LOG_TRACE, lambda: f"- Food name: {request.foodName}")
+        trace(FOOD_LOG_TRACE, lambda: f"- Serving size: {request.servingSize}")
+        trace(FOOD_LOG_TRACE, lambda: f"- Provided calories: {request.calories}")
+        trace(FOOD_LOG_TRACE, lambda: f"- Provided protein: {request.protein}")
+        trace(FOOD_LOG_TRACE, lambda: f"- Provided fat: {request.fat}")
         
         # Use provided nutrition data if available, otherwise get from Gemini
         if request.calories is not None and request.protein is not None and request.fat is not None:
-            logger.info(f"[FOOD LOG TRACE] ✅ Using provided nutrition data from frontend")
-            logger.info(f"[FOOD LOG TRACE] - Raw calories value: {request.calories} (type: {type(request.calories)})")
-            logger.info(f"[FOOD LOG TRACE] - Raw protein value: {request.protein} (type: {type(request.protein)})")
-            logger.info(f"[FOOD LOG TRACE] - Raw fat value: {request.fat} (type: {type(request.fat)})")
+            trace(FOOD_LOG_TRACE, "✅ Using provided nutrition data from frontend")
+            trace(FOOD_LOG_TRACE, lambda: f"- Raw calories value: {request.calories} (type: {type(request.calories)})")
+            trace(FOOD_LOG_TRACE, lambda: f"- Raw protein value: {request.protein} (type: {type(request.protein)})")
+            trace(FOOD_LOG_TRACE, lambda: f"- Raw fat value: {request.fat} (type: {type(request.fat)})")
             
             # CRITICAL FIX: Frontend provides TOTAL calories for the serving, not per-100g
             # We need to store these as total calories and set per_100g=False
@@ -677,17 +1028,17 @@ async def log_food_item(request: FoodLogRequest):
                 per_100g=False  # These are TOTAL calories for the serving, not per-100g
             )
             
-            logger.info(f"[FOOD LOG TRACE] ✅ Created FoodItem with provided data (TOTAL calories):")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.calories: {food.calories} (TOTAL for serving)")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.protein: {food.protein} (TOTAL for serving)")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.fat: {food.fat} (TOTAL for serving)")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.per_100g: {food.per_100g} (FALSE = total calories)")
+            trace(FOOD_LOG_TRACE, "✅ Created FoodItem with provided data (TOTAL calories):")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.calories: {food.calories} (TOTAL for serving)")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.protein: {food.protein} (TOTAL for serving)")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.fat: {food.fat} (TOTAL for serving)")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.per_100g: {food.per_100g} (FALSE = total calories)")
             
-            nutrition = {"calories": request.calories, "protein": request.protein, "fat": request.fat, "raw": "provided"}
+            nutrition = {"calories": request.calories, "protein": request.protein, "fat": request.fat, "raw": "provided", "source": "client"}
         else:
-            logger.info(f"[FOOD LOG TRACE] ⚠️ No nutrition data provided, getting from Gemini")
-            nutrition = await get_nutrition_from_gemini(request.foodName, request.servingSize)
-            logger.info(f"[FOOD LOG TRACE] Gemini nutrition response: {nutrition}")
+            trace(FOOD_LOG_TRACE, "⚠️ No nutrition data provided, resolving from local DB or Gemini")
+            nutrition = await resolve_food_nutrition(request.foodName, request.servingSize)
+            trace(FOOD_LOG_TRACE, lambda: f"Nutrition response ({nutrition.get('source')}): {nutrition}")
             food = FoodItem(
                 name=request.foodName,
                 calories=float(nutrition["calories"]) if nutrition["calories"] != "Error" else 0,
@@ -696,175 +1047,104 @@ async def log_food_item(request: FoodLogRequest):
                 per_100g=True
             )
             
-            logger.info(f"[FOOD LOG TRACE] ✅ Created FoodItem from Gemini:")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.calories: {food.calories}")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.protein: {food.protein}")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.fat: {food.fat}")
-            logger.info(f"[FOOD LOG TRACE] - FoodItem.per_100g: {food.per_100g}")
+            trace(FOOD_LOG_TRACE, lambda: f"✅ Created FoodItem from {nutrition.get('source')}:")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.calories: {food.calories}")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.protein: {food.protein}")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.fat: {food.fat}")
+            trace(FOOD_LOG_TRACE, lambda: f"- FoodItem.per_100g: {food.per_100g}")
         log_entry = FoodLog(
             userId=user_id,
             food=food,
-            servingSize=request.servingSize
+            servingSize=request.servingSize,
+            source=nutrition.get("source"),
+            matchConfidence=nutrition.get("confidence")
         )
         def log_food_in_db():
-            # CRITICAL FIX: Use user's local time by applying timezone offset correctly
-            if request.timezoneOffset is not None:
-                # JavaScript getTimezoneOffset() returns minutes to subtract from UTC to get local time
-                # For PST: getTimezoneOffset() = 480 (UTC - 480 minutes = PST)
-                # For EDT: getTimezoneOffset() = 240 (UTC - 240 minutes = EDT)
-                utc_time = datetime.utcnow()
-                local_time = utc_time - timedelta(minutes=request.timezoneOffset)
-                log_entry.timestamp = local_time
-                logger.info(f"[FOOD LOG] Using user's local time: UTC {utc_time} - {request.timezoneOffset}min = {log_entry.timestamp}")
-            else:
-                # Fallback to server time if no timezone provided
-                log_entry.timestamp = datetime.now()
-                logger.info(f"[FOOD LOG] Using server local time (no timezone provided): {log_entry.timestamp}")
-                
-            firestore_db.collection(f"users/{user_id}/food_logs").add(log_entry.dict())
-            logger.info(f"[FOOD LOG] Written to Firestore: {log_entry.dict()}")
-            
-            # Delete food logs older than 7 days (using same time calculation)
-            if request.timezoneOffset is not None:
-                seven_days_ago = local_time - timedelta(days=7)
-            else:
-                seven_days_ago = datetime.now() - timedelta(days=7)
-            old_logs_query = firestore_db.collection(f"users/{user_id}/food_logs").where("timestamp", "<", seven_days_ago)
-            old_logs = list(old_logs_query.stream())
-            for doc in old_logs:
-                doc.reference.delete()
-                logger.info(f"[FOOD LOG] Deleted old log: {doc.id}")
+            log_entry.timestamp = _food_log_timestamp(request.timezoneOffset)
+            # The log and its day's rollup increment are written atomically
+            _write_food_logs(user_id, [log_entry.dict()])
+            trace(FOOD_LOG_TRACE, lambda: f"Written to Firestore: {log_entry.dict()}")
+            # Logs older than the retention window are pruned by the scheduled log retention job
         await loop.run_in_executor(executor, log_food_in_db)
-        logger.info(f"[FOOD LOG] Returning log entry: {log_entry}")
+        trace(FOOD_LOG_TRACE, lambda: f"Returning log entry: {log_entry}")
         # Always include the raw Gemini response in the API response for debugging
         return {**log_entry.dict(), 'raw_gemini_response': nutrition.get('raw', None)}
     except Exception as e:
         logger.error(f"[FOOD LOG] Error logging food for user {request.userId}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to log food: {e}")
 
+@api_router.get("/food/suggest")
+async def suggest_foods(q: str = Query(..., min_length=1), userId: Optional[str] = None, limit: int = Query(10, ge=1, le=50)):
+    """Autocomplete food names from the user's recent/frequent foods, then globally popular ones, with their last macros"""
+    loop = asyncio.get_event_loop()
+    try:
+        suggestions = await loop.run_in_executor(executor, lambda: get_food_suggestions(firestore_db).suggest(q, userId, limit))
+        return {"query": q, "suggestions": suggestions}
+    except Exception as e:
+        logger.error(f"[FOOD SUGGEST] Error suggesting foods for '{q}': {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to suggest foods: {e}")
+
+@api_router.post("/food/log/batch")
+async def log_food_items_batch(request: FoodLogBatchRequest):
+    """Log several food items for one user with a single reset check, bulk macro resolution and one batched write"""
+    user_id = request.userId
+    if not user_id:
+        raise HTTPException(status_code=400, detail="userId is required")
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(request.items) > MAX_NUTRITION_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_NUTRITION_BATCH_ITEMS} items can be logged per request")
+    try:
+        check_firebase_availability()
+        logger.info(f"[FOOD LOG BATCH] Logging {len(request.items)} items for user {user_id}")
+        await _check_daily_reset(user_id, request.timezoneOffset)
+
+        # Items that came with macros are stored as serving totals; the rest are resolved in one bulk lookup
+        # and everything loggable is written in one WriteBatch
+        return await log_food_batch(
+            get_nutrition_rollups(firestore_db),
+            user_id,
+            [item.dict() for item in request.items],
+            _food_log_timestamp(request.timezoneOffset),
+            get_batch_nutrition_from_gemini,
+            _write_food_logs,
+            executor
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[FOOD LOG BATCH] Error logging food batch for user {user_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to log food batch: {e}")
+
+async def _get_daily_rollups(user_id: str, days: int):
+    """Read a user's daily rollups for the last `days` days ending today (server local date)."""
+    loop = asyncio.get_event_loop()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    day_keys = day_range(today, days)
+    rollups = await loop.run_in_executor(executor, lambda: get_nutrition_rollups(firestore_db).get_days(user_id, day_keys))
+    return today.strftime('%Y-%m-%d'), day_keys, rollups
+
 @api_router.get("/food/log/summary/{user_id}", response_model=LogSummaryResponse)
-async def get_food_log_summary(user_id: str):
+async def get_food_log_summary(user_id: str, days: int = Query(7, ge=1, le=MAX_RANGE_DAYS)):
     try:
-        logger.info(f"[SUMMARY] Fetching summary for user: {user_id}")
+        logger.info(f"[SUMMARY] Fetching {days}-day summary for user: {user_id}")
         
         # Check if Firebase is available
         if not FIREBASE_AVAILABLE or firestore_db is None:
             logger.error("[SUMMARY] Firebase is not available, returning service unavailable")
             raise HTTPException(status_code=503, detail="Database service is currently unavailable. Please try again later.")
         
-        # CRITICAL FIX: Use local time instead of UTC for consistent user experience
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        start_of_week = today - timedelta(days=6)
-        logger.info(f"[SUMMARY] Using local time - today: {today}, start_of_week: {start_of_week}")
-        logs_ref = firestore_db.collection(f"users/{user_id}/food_logs")
-        
-        # Use datetime object for query, not isoformat string
-        query = logs_ref.where("timestamp", ">=", start_of_week)
-        docs_stream = query.stream()
-        
-        history = {}
-        all_logs = []
-        
-        logger.info(f"[SUMMARY TRACE] 🔍 Processing {len(list(docs_stream))} documents...")
-        docs_stream = query.stream()  # Re-create stream since we consumed it
-        
-        for doc_index, doc in enumerate(docs_stream):
-            log = doc.to_dict()
-            all_logs.append(log)
-            
-            logger.info(f"[SUMMARY TRACE] 📄 Document {doc_index + 1}:")
-            logger.info(f"[SUMMARY TRACE] - Raw log data: {log}")
-            
-            if not log or not isinstance(log, dict):
-                logger.warning(f"[SUMMARY TRACE] ⚠️ Skipping invalid log data")
-                continue
-                
-            ts = log.get("timestamp")
-            logger.info(f"[SUMMARY TRACE] - Timestamp: {ts} (type: {type(ts)})")
-            
-            # Firestore may return a datetime or a string
-            if isinstance(ts, str):
-                try:
-                    log_date = datetime.fromisoformat(ts).strftime('%Y-%m-%d')
-                    logger.info(f"[SUMMARY TRACE] - Parsed date from string: {log_date}")
-                except Exception as e:
-                    logger.warning(f"[SUMMARY TRACE] ⚠️ Failed to parse date from string: {e}")
-                    continue
-            elif isinstance(ts, datetime):
-                log_date = ts.strftime('%Y-%m-%d')
-                logger.info(f"[SUMMARY TRACE] - Parsed date from datetime: {log_date}")
-            else:
-                logger.warning(f"[SUMMARY TRACE] ⚠️ Unknown timestamp type: {type(ts)}")
-                continue
-                
-            if log_date not in history:
-                history[log_date] = {"calories": 0, "protein": 0, "fat": 0}
-                logger.info(f"[SUMMARY TRACE] - Created new history entry for {log_date}")
-            
-            food_item = log.get("food")
-            logger.info(f"[SUMMARY TRACE] - Food item data: {food_item}")
-            
-            if food_item is None or not isinstance(food_item, dict):
-                logger.warning(f"[SUMMARY TRACE] ⚠️ Invalid food item data")
-                food_item = {}
-                
-            serving_size = log.get("servingSize", "100")
-            logger.info(f"[SUMMARY TRACE] - Serving size: {serving_size} (type: {type(serving_size)})")
-            
-            try:
-                serving_size_num = float(serving_size)
-                logger.info(f"[SUMMARY TRACE] - Parsed serving size: {serving_size_num}")
-            except Exception as e:
-                logger.warning(f"[SUMMARY TRACE] ⚠️ Failed to parse serving size, using 100: {e}")
-                serving_size_num = 100
-                
-            calories = food_item.get("calories", 0)
-            protein = food_item.get("protein", 0)
-            fat = food_item.get("fat", 0)
-            per_100g = food_item.get("per_100g", True)
-            
-            logger.info(f"[SUMMARY TRACE] - Raw nutrition from food_item:")
-            logger.info(f"[SUMMARY TRACE]   * calories: {calories} (type: {type(calories)})")
-            logger.info(f"[SUMMARY TRACE]   * protein: {protein} (type: {type(protein)})")
-            logger.info(f"[SUMMARY TRACE]   * fat: {fat} (type: {type(fat)})")
-            logger.info(f"[SUMMARY TRACE]   * per_100g: {per_100g}")
-            
-            # CRITICAL FIX: Handle both per-100g and total calories correctly
-            if per_100g:
-                # Old logic: calories are per 100g, multiply by serving size
-                calories_contribution = (calories * serving_size_num) / 100
-                protein_contribution = (protein * serving_size_num) / 100
-                fat_contribution = (fat * serving_size_num) / 100
-                logger.info(f"[SUMMARY TRACE] - Per-100g calculation: ({calories} * {serving_size_num}) / 100 = {calories_contribution}")
-            else:
-                # New logic: calories are total for the serving, use as-is
-                calories_contribution = calories
-                protein_contribution = protein
-                fat_contribution = fat
-                logger.info(f"[SUMMARY TRACE] - Total serving calculation: {calories} (used as-is) = {calories_contribution}")
-            
-            logger.info(f"[SUMMARY TRACE] - Final contributions:")
-            logger.info(f"[SUMMARY TRACE]   * Calories: {calories_contribution}")
-            logger.info(f"[SUMMARY TRACE]   * Protein: {protein_contribution}")
-            logger.info(f"[SUMMARY TRACE]   * Fat: {fat_contribution}")
-            
-            # Add to history
-            history[log_date]["calories"] += calories_contribution
-            history[log_date]["protein"] += protein_contribution
-            history[log_date]["fat"] += fat_contribution
-            
-            logger.info(f"[SUMMARY TRACE] - Updated totals for {log_date}:")
-            logger.info(f"[SUMMARY TRACE]   * Total calories: {history[log_date]['calories']}")
-            logger.info(f"[SUMMARY TRACE]   * Total protein: {history[log_date]['protein']}")
-            logger.info(f"[SUMMARY TRACE]   * Total fat: {history[log_date]['fat']}")
-            
-        logger.info(f"[SUMMARY DEBUG] All logs fetched for user {user_id}: {all_logs}")
-        today_str = today.strftime('%Y-%m-%d')
+        # Totals come from the per-day rollups maintained on every log write
+        today_str, _, rollups = await _get_daily_rollups(user_id, days)
+        history = {
+            day: {"calories": rollup["calories"], "protein": rollup["protein"], "fat": rollup["fat"]}
+            for day, rollup in rollups.items() if rollup.get("items", 0) > 0
+        }
         if today_str not in history:
             history[today_str] = {"calories": 0, "protein": 0, "fat": 0}
         sorted_dates = sorted(history.keys(), reverse=True)
         formatted_history = [{"day": date, **history[date]} for date in sorted_dates]
-        logger.info(f"[SUMMARY] Returning summary for user {user_id}: {formatted_history}")
+        trace(SUMMARY_TRACE, lambda: f"Returning summary for user {user_id}: {formatted_history}")
         return LogSummaryResponse(history=formatted_history)
         
     except HTTPException:
@@ -873,117 +1153,20 @@ async def get_food_log_summary(user_id: str):
         logger.error(f"[SUMMARY] Error getting food log summary for user {user_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve summary.")
 
-async def _get_food_log_summary_internal(user_id: str, loop):
+async def _get_food_log_summary_internal(user_id: str, loop, days: int = 7):
     """Internal function to get food log summary with better error handling"""
     try:
-        # CRITICAL FIX: Use local time consistently
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        start_of_week = today - timedelta(days=6)
-        logger.info(f"[SUMMARY INTERNAL] Using local time - today: {today}, start_of_week: {start_of_week}")
-        logs_ref = firestore_db.collection(f"users/{user_id}/food_logs")
-        
-        # Use datetime object for query, not isoformat string
-        query = logs_ref.where("timestamp", ">=", start_of_week)
-        docs_stream = await loop.run_in_executor(executor, query.stream)
-        
-        history = {}
-        all_logs = []
-        
-        for doc in docs_stream:
-            log = doc.to_dict()
-            all_logs.append(log)
-            if not log or not isinstance(log, dict):
-                continue
-            ts = log.get("timestamp")
-            # Firestore may return a datetime or a string
-            if isinstance(ts, str):
-                try:
-                    log_date = datetime.fromisoformat(ts).strftime('%Y-%m-%d')
-                except Exception:
-                    continue
-            elif isinstance(ts, datetime):
-                log_date = ts.strftime('%Y-%m-%d')
-            else:
-                continue
-            if log_date not in history:
-                history[log_date] = {"calories": 0, "protein": 0, "fat": 0}
-            food_item = log.get("food")
-            if food_item is None or not isinstance(food_item, dict):
-                food_item = {}
-            serving_size = log.get("servingSize", "100")
-            try:
-                # Extract numeric value from serving size (e.g., "2 slices" -> 2)
-                import re
-                numeric_match = re.search(r'(\d+(?:\.\d+)?)', str(serving_size))
-                if numeric_match:
-                    serving_size_num = float(numeric_match.group(1))
-                else:
-                    serving_size_num = 100
-            except Exception:
-                serving_size_num = 100
-            calories = food_item.get("calories", 0)
-            protein = food_item.get("protein", 0)
-            fat = food_item.get("fat", 0)
-            per_100g = food_item.get("per_100g", True)
-            
-            # If per_100g is True, apply serving size multiplier
-            # If per_100g is False, values are already calculated for the serving
-            if per_100g:
-                calculated_calories = (calories * serving_size_num) / 100
-                calculated_protein = (protein * serving_size_num) / 100
-                calculated_fat = (fat * serving_size_num) / 100
-            else:
-                calculated_calories = calories
-                calculated_protein = protein
-                calculated_fat = fat
-            
-            logger.info(f"[SUMMARY DEBUG] Processing log for {log_date}:")
-            logger.info(f"[SUMMARY DEBUG] - Food: {food_item.get('name', 'Unknown')}")
-            logger.info(f"[SUMMARY DEBUG] - Serving size: {serving_size_num}g")
-            logger.info(f"[SUMMARY DEBUG] - Per 100g: {per_100g}")
-            logger.info(f"[SUMMARY DEBUG] - Raw calories: {calories}")
-            logger.info(f"[SUMMARY DEBUG] - Raw protein: {protein}")
-            logger.info(f"[SUMMARY DEBUG] - Raw fat: {fat}")
-            logger.info(f"[SUMMARY DEBUG] - Calculated calories: {calculated_calories}")
-            logger.info(f"[SUMMARY DEBUG] - Calculated protein: {calculated_protein}")
-            logger.info(f"[SUMMARY DEBUG] - Calculated fat: {calculated_fat}")
-            
-            history[log_date]["calories"] += calculated_calories
-            history[log_date]["protein"] += calculated_protein
-            history[log_date]["fat"] += calculated_fat
-            
-            logger.info(f"[SUMMARY DEBUG] - Running totals for {log_date}: calories={history[log_date]['calories']}, protein={history[log_date]['protein']}, fat={history[log_date]['fat']}")
-            
-        logger.info(f"[SUMMARY DEBUG] All logs fetched for user {user_id}: {all_logs}")
-        
-        # Ensure we have data for all 7 days, even if some days have no food logs
-        # Generate the same 7 days that the frontend expects (6 days ago to today)
-        for i in range(6, -1, -1):  # 6 days ago to today (matches frontend logic)
-            day_date = today - timedelta(days=i)
-            day_str = day_date.strftime('%Y-%m-%d')
-            if day_str not in history:
-                history[day_str] = {"calories": 0, "protein": 0, "fat": 0}
-        
-        logger.info(f"[SUMMARY] Generated date range for last 7 days ending {today.strftime('%Y-%m-%d')}")
-        
-        # Sort dates in descending order (most recent first)
-        sorted_dates = sorted(history.keys(), reverse=True)
-        formatted_history = [{"day": date, **history[date]} for date in sorted_dates]
-        # Enhanced logging for debugging tracker issues
-        logger.info(f"[SUMMARY] 📊 Returning summary for user {user_id}")
-        logger.info(f"[SUMMARY] Total days in history: {len(formatted_history)}")
-        logger.info(f"[SUMMARY] Date order: {[item['day'] for item in formatted_history]}")
-        logger.info(f"[SUMMARY] Today's date (backend): {today.strftime('%Y-%m-%d')}")
-        
-        # Log today's specific data for debugging
-        today_str = today.strftime('%Y-%m-%d')
-        today_data_in_history = next((item for item in formatted_history if item['day'] == today_str), None)
+        today_str, day_keys, rollups = await _get_daily_rollups(user_id, days)
         
-        logger.info(f"[SUMMARY] Today's data in response: {today_data_in_history}")
+        # Ensure we have data for every day in range, even if some days have no food logs
+        # (most recent first, matching the frontend's 6-days-ago-to-today window for days=7)
+        formatted_history = []
+        for day in day_keys:
+            rollup = rollups.get(day, EMPTY_ROLLUP)
+            formatted_history.append({"day": day, "calories": rollup["calories"], "protein": rollup["protein"], "fat": rollup["fat"]})
         
-        # Log all history data for debugging
-        for item in formatted_history:
-            logger.info(f"[SUMMARY] Date {item['day']}: calories={item['calories']}, protein={item['protein']}, fat={item['fat']}")
+        logger.info(f"[SUMMARY] 📊 Returning {len(formatted_history)}-day summary for user {user_id} ending {today_str}")
+        logger.info(f"[SUMMARY] Today's data in response: {formatted_history[0]}")
         
         return LogSummaryResponse(history=formatted_history)
         
@@ -1024,49 +1207,17 @@ async def search_workouts(query: str = Query(..., min_length=1)):
         raise HTTPException(status_code=500, detail="Failed to search for workout.")
 
 @api_router.get("/workout/log/summary/{user_id}", response_model=LogSummaryResponse)
-async def get_workout_log_summary(user_id: str):
-    loop = asyncio.get_event_loop()
+async def get_workout_log_summary(user_id: str, days: int = Query(7, ge=1, le=MAX_RANGE_DAYS)):
     try:
-        logger.info(f"[WORKOUT SUMMARY] Fetching workout summary for user: {user_id}")
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        start_of_week = today - timedelta(days=6)
-        logs_ref = firestore_db.collection("workout_logs")
-        # Only logs for this user and in the last 7 days
-        query = logs_ref.where("userId", "==", user_id).where("date", ">=", start_of_week.isoformat())
-        docs_stream = await loop.run_in_executor(executor, query.stream)
-        history = {}
-        all_logs = []
-        for doc in docs_stream:
-            log = doc.to_dict()
-            if not log or not isinstance(log, dict):
-                continue
-            all_logs.append(log)
-            ts = log.get("date")
-            # Firestore may return a datetime or a string
-            if isinstance(ts, str):
-                try:
-                    log_date = datetime.fromisoformat(ts).strftime('%Y-%m-%d')
-                except Exception:
-                    continue
-            elif isinstance(ts, datetime):
-                log_date = ts.strftime('%Y-%m-%d')
-            else:
-                continue
-            if log_date not in history:
-                history[log_date] = {"calories": 0}
-            calories = log.get("calories", 0)
-            try:
-                calories = float(calories)
-            except Exception:
-                calories = 0
-            history[log_date]["calories"] += calories
-        logger.info(f"[WORKOUT SUMMARY DEBUG] All workout logs fetched for user {user_id}: {all_logs}")
-        today_str = today.strftime('%Y-%m-%d')
+        logger.info(f"[WORKOUT SUMMARY] Fetching {days}-day workout summary for user: {user_id}")
+        # Burned calories come from the same per-day rollups as the food summary
+        today_str, _, rollups = await _get_daily_rollups(user_id, days)
+        history = {day: {"calories": rollup["burned"]} for day, rollup in rollups.items() if rollup.get("workouts", 0) > 0}
         if today_str not in history:
             history[today_str] = {"calories": 0}
         sorted_dates = sorted(history.keys(), reverse=True)
         formatted_history = [{"day": date, **history[date]} for date in sorted_dates]
-        logger.info(f"[WORKOUT SUMMARY] Returning summary for user {user_id}: {formatted_history}")
+        trace(SUMMARY_TRACE, lambda: f"Returning workout summary for user {user_id}: {formatted_history}")
         return LogSummaryResponse(history=formatted_history)
     except Exception as e:
         logger.error(f"[WORKOUT SUMMARY] Error getting workout log summary for user {user_id}: {e}", exc_info=True)
@@ -1183,6 +1334,8 @@ async def create_user_profile(profile: UserProfile):
         profile_dict["new_diet_received"] = False
         
         await loop.run_in_executor(executor, lambda: doc_ref.set(profile_dict))
+        get_chat_session_store(firestore_db).invalidate_profile(user_id)
+        await loop.run_in_executor(executor, lambda: get_push_token_registry(firestore_db).profile_updated(user_id, profile_dict))
         logger.info(f"Created profile for user {user_id} with isDietician={profile_dict.get('isDietician')}")
         return profile_dict
     except Exception as e:
@@ -1386,10 +1539,13 @@ async def update_user_profile(user_id: str, profile_update: UpdateUserProfile):
         if not doc.exists:
             # Create new profile with defaults and any provided updates
             await loop.run_in_executor(executor, lambda: doc_ref.set(defaults))
+            get_chat_session_store(firestore_db).invalidate_profile(user_id)
             logger.info(f"Created profile for user {user_id} via PATCH")
             return defaults
         # If profile exists, update with provided fields (fill missing with defaults if needed)
         await loop.run_in_executor(executor, lambda: doc_ref.update(update_dict))
+        get_chat_session_store(firestore_db).invalidate_profile(user_id)
+        await loop.run_in_executor(executor, lambda: get_push_token_registry(firestore_db).profile_updated(user_id, update_dict))
         updated_doc = await loop.run_in_executor(executor, doc_ref.get)
         profile = updated_doc.to_dict()
         if profile is None:
@@ -1462,12 +1618,85 @@ async def log_workout_item(log: dict):
             "protein": 0, # No protein/fat burned in this simplified model
             "fat": 0 # No protein/fat burned in this simplified model
         }
-        await loop.run_in_executor(executor, lambda: firestore_db.collection("workout_logs").add(entry))
+        await loop.run_in_executor(executor, lambda: get_nutrition_rollups(firestore_db).log_entries(user_id, workout_logs=[entry]))
         return entry
     except Exception as e:
         logger.error(f"Error logging workout: {e}")
         raise HTTPException(status_code=500, detail="Failed to log workout item.")
 
+async def _load_chat_context(request: ChatMessageRequest):
+    """
+    Chat session (None without a sessionId), profile and history for a chatbot request.
+    Session history and the cached profile replace whatever the client sent.
+    """
+    if not request.sessionId:
+        return None, request.user_profile or {}, request.chat_history
+    loop = asyncio.get_event_loop()
+    store = get_chat_session_store(firestore_db)
+    try:
+        session = await loop.run_in_executor(executor, lambda: store.get_or_create(request.userId, request.sessionId))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    profile = request.user_profile or await loop.run_in_executor(executor, lambda: store.get_profile(request.userId))
+    with session.lock:
+        turns = list(session.turns)
+    return session, profile, turns
+
+async def _save_chat_turns(session, user_message: str, bot_message: str):
+    """Append a question and its answer to the session, if there is one, and refresh its summary if due."""
+    if session is None:
+        return
+    try:
+        store = get_chat_session_store(firestore_db)
+        turns = [{"sender": "user", "text": user_message}, {"sender": "bot", "text": bot_message}]
+        await asyncio.get_event_loop().run_in_executor(executor, lambda: store.append_turns(session, turns))
+        chat_context_manager.schedule_summary_refresh(session, store)
+    except Exception as e:
+        logger.error(f"[CHATBOT] Failed to save turns for session {session.session_id}: {e}")
+
+def _build_chatbot_history(user_id: str, profile: dict, chat_history: list, user_message: str, session=None):
+    """
+    System prompt (profile and diet PDF context) plus the chat so far, as Gemini chat history
+    bounded by the context manager's token budget. Returns the history and its token telemetry.
+    """
+    # Build system prompt with user profile
+    system_prompt = (
+        "You are NutriBot, a cautious and helpful nutrition assistant. "
+        "You provide diet and nutrition advice based on the user's profile. "
+        "Never give medical advice, and always recommend consulting a healthcare professional for medical concerns. "
+        "If you are unsure, say so.\n"
+    )
+    if profile:
+        system_prompt += "\nUser Profile:\n"
+        for k, v in profile.items():
+            if v:
+                system_prompt += f"{k}: {v}\n"
+    system_prompt += '\nNever change or update user information. Only use it for context.'
+
+    # Enhance prompt with diet PDF context using RAG
+    diet_pdf_url = profile.get("dietPdfUrl") if profile else None
+    if diet_pdf_url:
+        try:
+            system_prompt = pdf_rag_service.enhance_chatbot_prompt(
+                user_id, 
+                diet_pdf_url, 
+                firestore_db, 
+                system_prompt,
+                question=user_message,
+                cache_version=profile.get("dietCacheVersion")
+            )
+            logger.info(f"[CHATBOT] Enhanced prompt with diet PDF for user {user_id}")
+        except Exception as e:
+            logger.warning(f"[CHATBOT] Failed to enhance prompt with diet PDF: {e}")
+            # Continue with original prompt if RAG enhancement fails
+
+    # Keep the last turns verbatim; older session turns are represented by the rolling summary
+    summary, summarized_through = (session.summary, session.summarized_through) if session is not None else ("", 0)
+    history, telemetry = chat_context_manager.build(system_prompt, chat_history, user_message, summary, summarized_through)
+    logger.info(f"[CHATBOT] Context for {user_id}: {telemetry['total_tokens']}/{telemetry['token_budget']} tokens, "
+                f"{telemetry['turns_included']} turns verbatim, {telemetry['turns_summarized']} summarized, {telemetry['turns_dropped']} dropped")
+    return history, telemetry
+
 @api_router.post("/chatbot/message", response_model=ChatMessageResponse)
 async def chatbot_message(request: ChatMessageRequest):
     """
@@ -1477,68 +1706,136 @@ async def chatbot_message(request: ChatMessageRequest):
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured on server.")
     try:
-        # Build system prompt with user profile
-        profile = request.user_profile or {}
-        system_prompt = (
-            "You are NutriBot, a cautious and helpful nutrition assistant. "
-            "You provide diet and nutrition advice based on the user's profile. "
-            "Never give medical advice, and always recommend consulting a healthcare professional for medical concerns. "
-            "If you are unsure, say so.\n"
-        )
-        if profile:
-            system_prompt += "\nUser Profile:\n"
-            for k, v in profile.items():
-                if v:
-                    system_prompt += f"{k}: {v}\n"
-        system_prompt += '\nNever change or update user information. Only use it for context.'
-
-        # Enhance prompt with diet PDF context using RAG
-        diet_pdf_url = profile.get("dietPdfUrl") if profile else None
-        if diet_pdf_url:
-            try:
-                system_prompt = pdf_rag_service.enhance_chatbot_prompt(
-                    request.userId, 
-                    diet_pdf_url, 
-                    firestore_db, 
-                    system_prompt
-                )
-                logger.info(f"[CHATBOT] Enhanced prompt with diet PDF for user {request.userId}")
-            except Exception as e:
-                logger.warning(f"[CHATBOT] Failed to enhance prompt with diet PDF: {e}")
-                # Continue with original prompt if RAG enhancement fails
-
-        # Format chat history for Gemini using dicts (SDK may accept these directly)
-        # If the SDK requires Content objects, you may need to convert them here.
-        formatted_history = [
-            {"role": "user", "parts": [{"text": system_prompt}]}
-        ]
-        for msg in request.chat_history:
-            role = msg.get("sender")
-            text = msg.get("text")
-            if not text:
-                continue
-            if role == "user":
-                formatted_history.append({"role": "user", "parts": [{"text": text}]})
-            elif role == "bot":
-                formatted_history.append({"role": "model", "parts": [{"text": text}]})
-        # Add the latest user message
-        formatted_history.append({"role": "user", "parts": [{"text": request.user_message}]})
-        # If the SDK requires Content objects, convert here (example):
-        # formatted_history = [genai.Content(**msg) for msg in formatted_history]
+        session, profile, chat_history = await _load_chat_context(request)
+        # Repeat questions about the same diet and profile are answered without calling Gemini
+        cached = chat_response_cache.lookup(request.userId, request.user_message, profile)
+        if cached is not None:
+            await _save_chat_turns(session, request.user_message, cached)
+            return ChatMessageResponse(bot_message=cached, sessionId=request.sessionId, cached=True)
+        content_history, _ = _build_chatbot_history(request.userId, profile, chat_history, request.user_message, session)
 
         # Call Gemini
-        model = GenerativeModel('gemini-2.5-flash')
-        def get_response():
-            content_history = [ContentDict(**msg) for msg in formatted_history]
-            chat = model.start_chat(history=content_history)
-            return chat.send_message(request.user_message)
-        response = await asyncio.get_event_loop().run_in_executor(None, get_response)
-        bot_text = response.text if hasattr(response, 'text') else str(response)
-        return ChatMessageResponse(bot_message=bot_text)
+        bot_text = await gemini_gateway.send_chat_message("chatbot", content_history, request.user_message)
+        chat_response_cache.store(request.userId, request.user_message, profile, bot_text)
+        await _save_chat_turns(session, request.user_message, bot_text)
+        return ChatMessageResponse(bot_message=bot_text, sessionId=request.sessionId)
+    except HTTPException:
+        raise
+    except GeminiUnavailableError as e:
+        logger.error(f"[CHATBOT] Gemini unavailable: {e}")
+        raise HTTPException(status_code=503, detail="NutriBot is temporarily unavailable. Please try again shortly.")
+    except asyncio.TimeoutError:
+        logger.error(f"[CHATBOT] Gemini timed out for user {request.userId}")
+        raise HTTPException(status_code=504, detail="NutriBot took too long to respond. Please try again.")
     except Exception as e:
         logger.error(f"[CHATBOT] Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to get chatbot response: {e}")
 
+def _sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_router.post("/chatbot/message/stream")
+async def chatbot_message_stream(request: ChatMessageRequest):
+    """
+    Same request as /chatbot/message, but the answer is streamed as Server-Sent Events:
+    "delta" events carry partial text, then one "done" event carries the full message, token usage
+    and latency (or an "error" event if Gemini fails mid-stream).
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured on server.")
+    try:
+        session, profile, chat_history = await _load_chat_context(request)
+        cached = chat_response_cache.lookup(request.userId, request.user_message, profile)
+        content_history, context_telemetry = None, None
+        if cached is None:
+            content_history, context_telemetry = _build_chatbot_history(request.userId, profile, chat_history, request.user_message, session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[CHATBOT STREAM] Error building prompt: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to get chatbot response: {e}")
+
+    async def cached_events():
+        await _save_chat_turns(session, request.user_message, cached)
+        yield _sse_event("delta", {"text": cached})
+        yield _sse_event("done", {
+            "bot_message": cached,
+            "sessionId": request.sessionId,
+            "usage": {},
+            "context": None,
+            "latency": {"first_chunk_seconds": 0.0, "total_seconds": 0.0},
+            "cached": True,
+        })
+
+    async def events():
+        started = time.time()
+        first_chunk_seconds = None
+        usage = {}
+        parts = []
+        try:
+            async for text in gemini_gateway.stream_chat_message("chatbot_stream", content_history, request.user_message, usage=usage):
+                if first_chunk_seconds is None:
+                    first_chunk_seconds = round(time.time() - started, 3)
+                parts.append(text)
+                yield _sse_event("delta", {"text": text})
+        except GeminiUnavailableError as e:
+            logger.error(f"[CHATBOT STREAM] Gemini unavailable: {e}")
+            yield _sse_event("error", {"detail": "NutriBot is temporarily unavailable. Please try again shortly."})
+            return
+        except asyncio.TimeoutError:
+            logger.error(f"[CHATBOT STREAM] Gemini stream timed out for user {request.userId}")
+            yield _sse_event("error", {"detail": "NutriBot took too long to respond. Please try again."})
+            return
+        except Exception as e:
+            logger.error(f"[CHATBOT STREAM] Error: {e}", exc_info=True)
+            yield _sse_event("error", {"detail": f"Failed to get chatbot response: {e}"})
+            return
+        total_seconds = round(time.time() - started, 3)
+        bot_message = "".join(parts)
+        chat_response_cache.store(request.userId, request.user_message, profile, bot_message)
+        await _save_chat_turns(session, request.user_message, bot_message)
+        logger.info(f"[CHATBOT STREAM] Streamed {len(parts)} chunks to {request.userId} (first chunk {first_chunk_seconds}s, total {total_seconds}s)")
+        yield _sse_event("done", {
+            "bot_message": bot_message,
+            "sessionId": request.sessionId,
+            "usage": usage,
+            "context": context_telemetry,
+            "latency": {"first_chunk_seconds": first_chunk_seconds, "total_seconds": total_seconds},
+            "cached": False,
+        })
+
+    return StreamingResponse(
+        cached_events() if cached is not None else events(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.get("/users/{user_id}/chat-sessions/{session_id}")
+async def get_chat_session(user_id: str, session_id: str):
+    """Turns of a server-side chat session, oldest first."""
+    loop = asyncio.get_event_loop()
+    try:
+        session = await loop.run_in_executor(executor, lambda: get_chat_session_store(firestore_db).get_or_create(user_id, session_id))
+        return {"sessionId": session_id, "turnCount": session.turn_count, "messages": session.history()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[CHATBOT] Error fetching session {session_id} for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch chat session: {e}")
+
+@api_router.delete("/users/{user_id}/chat-sessions/{session_id}")
+async def delete_chat_session(user_id: str, session_id: str):
+    """Delete a server-side chat session and its turns."""
+    loop = asyncio.get_event_loop()
+    try:
+        deleted = await loop.run_in_executor(executor, lambda: get_chat_session_store(firestore_db).delete(user_id, session_id))
+        return {"success": True, "deletedTurns": deleted}
+    except Exception as e:
+        logger.error(f"[CHATBOT] Error deleting session {session_id} for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete chat session: {e}")
+
 # --- Routine Models ---
 class RoutineItem(BaseModel):
     type: str  # 'food' or 'workout'
@@ -1726,6 +2023,7 @@ async def log_routine(user_id: str, routine_id: str):
         n_food = len(food_items) if len(food_items) > 0 else 1
         n_workout = len(workout_items) if len(workout_items) > 0 else 1
         # Log food
+        food_logs = []
         for item in food_items:
             food_log = {
                 "userId": user_id,
@@ -1739,8 +2037,9 @@ async def log_routine(user_id: str, routine_id: str):
                 "servingSize": item.quantity or "100",
                 "timestamp": now
             }
-            firestore_db.collection(f"users/{user_id}/food_logs").add(food_log)
+            food_logs.append(food_log)
         # Log workout
+        workout_logs = []
         for item in workout_items:
             workout_log = {
                 "userId": user_id,
@@ -1753,23 +2052,43 @@ async def log_routine(user_id: str, routine_id: str):
                 "date": now.isoformat(),
                 "calories": float(routine_obj.burned) / n_workout
             }
-            firestore_db.collection("workout_logs").add(workout_log)
-        # Delete food logs older than 7 days
-        seven_days_ago = now - timedelta(days=7)
-        food_logs_ref = firestore_db.collection(f"users/{user_id}/food_logs")
-        old_food_logs = list(food_logs_ref.where("timestamp", "<", seven_days_ago).stream())
-        for doc in old_food_logs:
-            doc.reference.delete()
-        # Delete workout logs older than 7 days
-        workout_logs_ref = firestore_db.collection("workout_logs")
-        old_workout_logs = list(workout_logs_ref.where("userId", "==", user_id).where("date", "<", (now - timedelta(days=7)).isoformat()).stream())
-        for doc in old_workout_logs:
-            doc.reference.delete()
+            workout_logs.append(workout_log)
+        # Write all logs and their daily rollup increments in one batch
+        await loop.run_in_executor(executor, lambda: get_nutrition_rollups(firestore_db).log_entries(user_id, food_logs, workout_logs))
+        # Logs older than the retention window are pruned by the scheduled log retention job
         return {"success": True}
     except Exception as e:
         logger.error(f"Error logging routine: {e}")
         raise HTTPException(status_code=500, detail="Failed to log routine")
 
+async def _precompute_diet_text(user_id: str, diet_pdf_url: str, cache_version: float, pdf_bytes: bytes) -> Optional[str]:
+    """
+    Extract a newly assigned diet in the extraction pool and store it with its retrieval chunks,
+    so the chatbot and notification extraction don't download and re-parse the PDF.
+    """
+    report = {}
+    diet_text = await extraction_service.extract_text(pdf_bytes, report=report)
+    if diet_text:
+        await asyncio.get_event_loop().run_in_executor(executor, lambda: pdf_rag_service.save_diet_text(
+            user_id, diet_pdf_url, diet_text, firestore_db, cache_version, content_key(pdf_bytes), extraction=report
+        ))
+    return diet_text
+
+async def _extract_diet_notifications(user_id: str, diet_pdf_url: str, diet_text: Optional[str] = None,
+                                      cache_version: Optional[float] = None) -> list:
+    """
+    Parse timed diet activities into notifications in the extraction pool, off the event loop.
+    Without diet_text, the text of the upload identified by cache_version (the profile's dietCacheVersion) is used.
+    """
+    if diet_text is None:
+        diet_text = await asyncio.get_event_loop().run_in_executor(
+            executor, lambda: pdf_rag_service.get_diet_pdf_text(user_id, diet_pdf_url, firestore_db, cache_version)
+        )
+    if not diet_text:
+        logger.warning(f"No diet text found for user {user_id}")
+        return []
+    return await extraction_service.create_notifications(user_id, diet_text)
+
 # --- Diet PDF Upload Endpoint (Dietician Only) ---
 @api_router.post("/users/{user_id}/diet/upload")
 async def upload_user_diet_pdf(user_id: str, file: UploadFile = File(...), dietician_id: str = Form(...)):
@@ -1821,6 +2140,8 @@ async def upload_user_diet_pdf(user_id: str, file: UploadFile = File(...), dieti
             with ThreadPoolExecutor() as executor:
                 # Update the document
                 await loop.run_in_executor(executor, lambda: firestore_db.collection("user_profiles").document(user_id).update(diet_info))
+                get_chat_session_store(firestore_db).invalidate_profile(user_id)
+                chat_response_cache.invalidate(user_id)
                 print(f"Successfully updated Firestore for user {user_id}")
                 
                 # Verify the update with retry mechanism
@@ -1862,12 +2183,18 @@ async def upload_user_diet_pdf(user_id: str, file: UploadFile = File(...), dieti
             print(f"ERROR updating Firestore: {firestore_error}")
             raise firestore_error
         
+        # Extract the diet text once from the uploaded bytes (in the extraction process pool)
+        # and store it with its retrieval chunks
+        diet_text = None
+        try:
+            diet_text = await _precompute_diet_text(user_id, file.filename, diet_info["dietCacheVersion"], file_data)
+        except Exception as e:
+            logger.error(f"[DIET UPLOAD] Failed to precompute diet text for user {user_id}: {e}")
+        
         # Extract notifications from the new diet PDF but DON'T automatically schedule
         try:
             print(f"Starting notification extraction from new diet PDF: {file.filename}")
-            notifications = diet_notification_service.extract_and_create_notifications(
-                user_id, file.filename, firestore_db
-            )
+            notifications = await _extract_diet_notifications(user_id, file.filename, diet_text, diet_info["dietCacheVersion"])
             
             if notifications:
                 # Store notifications in Firestore with the new PDF URL
@@ -2007,13 +2334,12 @@ async def upload_user_diet_pdf(user_id: str, file: UploadFile = File(...), dieti
                 elif first_name:
                     dietician_name = first_name
             
-            success = notification_service.send_new_diet_notification(user_id, dietician_name)
-            
-            if success:
-                print(f"[DIET UPLOAD] ✅ NOTIFICATION SENT SUCCESSFULLY to user {user_id}")
-                print(f"[DIET UPLOAD] 🎯 User should see notification")
-            else:
-                print(f"[DIET UPLOAD] ❌ NOTIFICATION FAILED to send to user {user_id}")
+            # Queued in the outbox; the delivery workers send it, so the upload does not wait on Expo
+            content = notification_service.new_diet_content(user_id, dietician_name)
+            outbox_id = await asyncio.get_event_loop().run_in_executor(
+                executor, lambda: get_notification_outbox(firestore_db).enqueue(user_id, **content, source="new_diet")
+            )
+            print(f"[DIET UPLOAD] ✅ NOTIFICATION QUEUED for user {user_id} (outbox {outbox_id})")
                 
         except Exception as notif_error:
             print(f"[DIET UPLOAD] ❌ Error sending notification: {notif_error}")
@@ -2774,9 +3100,7 @@ async def extract_diet_notifications(user_id: str):
         # Extract notifications from diet PDF
         logger.info(f"[DIET EXTRACTION] Starting PDF text extraction for {user_id}")
         extraction_start = time.time()
-        notifications = diet_notification_service.extract_and_create_notifications(
-            user_id, diet_pdf_url, firestore_db
-        )
+        notifications = await _extract_diet_notifications(user_id, diet_pdf_url, cache_version=user_data.get("dietCacheVersion"))
         extraction_time = time.time() - extraction_start
         logger.info(f"[DIET EXTRACTION] PDF extraction completed in {extraction_time:.2f}s for user {user_id}")
         
@@ -2802,9 +3126,12 @@ async def extract_diet_notifications(user_id: str):
             "new_diet_received": False
         })
         
-        # DISABLED: Schedule the notifications on the backend to prevent conflicts
-        # Manual extraction now uses only local scheduling on the device for reliability
-        logger.info(f"[DIET EXTRACTION] Skipping backend scheduling - using local scheduling only for reliability")
+        if BACKEND_DIET_REMINDERS_ENABLED:
+            scheduled_count = await get_notification_scheduler(firestore_db).schedule_user_notifications(user_id)
+            logger.info(f"[DIET EXTRACTION] Scheduled {scheduled_count} backend diet reminders for user {user_id}")
+        else:
+            # Backend scheduling is off by default so it does not conflict with local scheduling on the device
+            logger.info(f"[DIET EXTRACTION] Skipping backend scheduling - using local scheduling only for reliability")
         
         total_time = time.time() - start_time
         logger.info(f"[DIET EXTRACTION] Completed extraction in {total_time:.2f}s for user {user_id}: {len(notifications)} notifications")
@@ -2814,6 +3141,12 @@ async def extract_diet_notifications(user_id: str):
             "notifications": notifications
         }
         
+    except ExtractionBusyError as e:
+        logger.warning(f"[DIET EXTRACTION] Extraction queue full for user {user_id}: {e}")
+        raise HTTPException(status_code=503, detail="Diet extraction is busy. Please try again shortly.")
+    except ExtractionTimeoutError as e:
+        logger.error(f"[DIET EXTRACTION] Extraction timed out for user {user_id}: {e}")
+        raise HTTPException(status_code=504, detail="Diet extraction took too long. Please try again.")
     except Exception as e:
         total_time = time.time() - start_time
         import traceback
@@ -2852,25 +3185,34 @@ async def get_diet_raw_text(user_id: str):
     """
     Get raw extracted text from diet PDF for debugging.
     """
+    loop = asyncio.get_event_loop()
     try:
-        # Get user's diet PDF URL
-        user_doc = firestore_db.collection("users").document(user_id).get()
+        # Get user's current diet PDF
+        user_doc = await loop.run_in_executor(executor, lambda: firestore_db.collection("user_profiles").document(user_id).get())
         if not user_doc.exists:
             raise HTTPException(status_code=404, detail="User not found")
         
         user_data = user_doc.to_dict()
         diet_pdf_url = user_data.get("dietPdfUrl")
+        cache_version = user_data.get("dietCacheVersion")
         
         if not diet_pdf_url:
             raise HTTPException(status_code=404, detail="No diet PDF found for user")
         
-        # Extract raw text
-        raw_text = pdf_rag_service.get_diet_pdf_text(user_id, diet_pdf_url, firestore_db)
+        # Text stored when the diet was uploaded, only if it came from this PDF (and upload)
+        stored = await loop.run_in_executor(executor, lambda: pdf_rag_service.load_diet_text(user_id, firestore_db, diet_pdf_url, cache_version))
+        if stored:
+            return {"raw_text": stored["text"], "dietPdfUrl": diet_pdf_url, "dietCacheVersion": stored.get("dietCacheVersion")}
+        
+        # Stale or missing: extract the current PDF again (stored for next time)
+        raw_text = await loop.run_in_executor(executor, lambda: pdf_rag_service.get_diet_pdf_text(user_id, diet_pdf_url, firestore_db, cache_version))
         
         if not raw_text:
             raise HTTPException(status_code=404, detail="Failed to extract text from diet PDF")
         
-        return {"raw_text": raw_text}
+        return {"raw_text": raw_text, "dietPdfUrl": diet_pdf_url, "dietCacheVersion": cache_version}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting raw diet text for user {user_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to get raw diet text")
@@ -2946,7 +3288,9 @@ async def send_notification(request: dict):
         
         if notification_type == "new_diet":
             dietician_name = request.get("dieticianName", "Your dietician")
-            success = notification_service.send_new_diet_notification(recipient_id, dietician_name)
+            success = await asyncio.get_event_loop().run_in_executor(
+                executor, lambda: notification_service.send_new_diet_notification(recipient_id, dietician_name)
+            )
             
         elif notification_type == "message":
             # This old endpoint is deprecated - use /push-notifications/send instead
@@ -2958,7 +3302,9 @@ async def send_notification(request: dict):
             
         elif notification_type == "diet_reminder":
             user_name = request.get("userName", "User")
-            success = notification_service.send_diet_reminder_notification(recipient_id, user_name)
+            success = await asyncio.get_event_loop().run_in_executor(
+                executor, lambda: notification_service.send_diet_reminder_notification(recipient_id, user_name)
+            )
             
         elif notification_type == "dietician_diet_reminder":
             # This old endpoint is deprecated - use scheduled job instead
@@ -2969,7 +3315,7 @@ async def send_notification(request: dict):
             title = request.get("title", "Notification")
             body = request.get("body", "")
             data = request.get("data", {})
-            success = notification_service.send_notification(recipient_id, title, body, data)
+            success = await notification_service.send_notification_async(recipient_id, title, body, data)
         
         if success:
             logger.info(f"[SIMPLE NOTIFICATION] ✅ Notification sent successfully to {recipient_id}")
@@ -2994,7 +3340,7 @@ async def test_notification(user_id: str):
         
         notification_service = get_notification_service(firestore_db)
         
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title="Test Notification 🧪",
             body="This is a test notification to verify the system is working.",
@@ -3034,8 +3380,8 @@ async def send_push_notification_new(request: dict):
             logger.info(f"[PUSH NOTIFICATION] Message notification: {sender_name} -> {recipient_id}")
             
             notification_service = get_notification_service(firestore_db)
-            success = notification_service.send_message_notification(
-                recipient_id, sender_name, message, is_from_dietician
+            success = await asyncio.get_event_loop().run_in_executor(
+                executor, lambda: notification_service.send_message_notification(recipient_id, sender_name, message, is_from_dietician)
             )
             
         elif notification_type == "appointment_scheduled":
@@ -3047,7 +3393,7 @@ async def send_push_notification_new(request: dict):
             logger.info(f"[PUSH NOTIFICATION] Appointment scheduled: {user_name} at {date} {time_slot}")
             
             notification_service = get_notification_service(firestore_db)
-            success = notification_service.send_notification(
+            success = await notification_service.send_notification_async(
                 recipient_id="dietician",
                 title="New Appointment Scheduled",
                 body=f"{user_name} scheduled an appointment for {date} at {time_slot}",
@@ -3063,7 +3409,7 @@ async def send_push_notification_new(request: dict):
             logger.info(f"[PUSH NOTIFICATION] Appointment cancelled: {user_name} at {date} {time_slot}")
             
             notification_service = get_notification_service(firestore_db)
-            success = notification_service.send_notification(
+            success = await notification_service.send_notification_async(
                 recipient_id="dietician",
                 title="Appointment Cancelled",
                 body=f"{user_name} cancelled appointment for {date} at {time_slot}",
@@ -3533,16 +3879,19 @@ async def check_diet_countdown_job():
         
         # Send notification to dietician for each user
         if users_needing_diet:
-            notification_service = get_notification_service(firestore_db)
+            outbox = get_notification_outbox(firestore_db)
             for user in users_needing_diet:
                 try:
-                    notification_service.send_notification(
+                    # Keyed by user and upload, so a rerun after a crash does not queue it twice
+                    outbox.enqueue(
                         recipient_id="dietician",
                         title="Diet Expiring Soon ⏰",
                         body=f"{user['name']} has 1 day left in their diet plan",
-                        data={"type": "diet_countdown", "userId": user["id"], "userName": user["name"]}
+                        data={"type": "diet_countdown", "userId": user["id"], "userName": user["name"]},
+                        source="diet_countdown",
+                        key=f"diet_countdown_{user['id']}_{content_key(str(user['last_upload']).encode())[:16]}"
                     )
-                    logger.info(f"[DIET COUNTDOWN] ✅ Sent notification for user: {user['name']}")
+                    logger.info(f"[DIET COUNTDOWN] ✅ Queued notification for user: {user['name']}")
                     firestore_db.collection("user_profiles").document(user["id"]).update({
                         "lastDietCountdownNotificationSentForUpload": user["last_upload"]
                     })
@@ -3780,7 +4129,7 @@ async def send_payment_reminder_notification(user_id: str, user_data: dict, time
         
         # Send push notification using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title=title,
             body=message,
@@ -3830,7 +4179,7 @@ async def send_trial_reminder_notification(user_id: str, user_data: dict, time_r
         
         # Send push notification using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title=title,
             body=message,
@@ -3865,7 +4214,7 @@ async def send_trial_expiry_notification(user_id: str, user_data: dict):
         
         # Send push notification to user using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title="Free Trial Ended",
             body=f"Hi {user_name}, your free trial has ended. Select a plan to continue!",
@@ -3994,7 +4343,7 @@ async def activate_pending_plan_switch(user_id: str, user_data: dict):
         
         # Send push notification to user using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title="Plan Switched",
             body=f"Hi {user_name}, your {old_plan_name} has ended. Switched to {new_plan_name}. Your new plan is now active!",
@@ -4149,17 +4498,16 @@ async def send_dietician_subscription_notification(user_id: str, user_data: dict
         
         firestore_db.collection("notifications").add(dietician_notification)
         
-        # Send push notification to dietician using SimpleNotificationService (same as messages/appointments)
-        notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
-            recipient_id="dietician",  # Special ID for dietician
-            title=title,
-            body=body,
-            data=notification_data
+        # Queue the push to the dietician in the outbox; the delivery workers send it
+        await asyncio.get_event_loop().run_in_executor(
+            executor, lambda: get_notification_outbox(firestore_db).enqueue(
+                recipient_id="dietician",  # Special ID for dietician
+                title=title,
+                body=body,
+                data=notification_data,
+                source=f"user_{event_type}"
+            )
         )
-        
-        if not success:
-            logger.warning(f"[DIETICIAN SUBSCRIPTION NOTIFICATION] Failed to send push notification to dietician for event: {event_type}")
             
     except Exception as e:
         logger.error(f"[DIETICIAN SUBSCRIPTION NOTIFICATION] Error: {e}")
@@ -4191,7 +4539,7 @@ async def send_subscription_renewal_notifications(user_id: str, user_data: dict,
         
         # Send push notification to user using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title="Subscription Auto-Renewed",
             body=f"Hi {user_name}, your {plan_name} has ended. Automatically renewed to {plan_name}. Your subscription continues seamlessly!",
@@ -4254,7 +4602,7 @@ async def send_subscription_expiry_notifications(user_id: str, user_data: dict):
         
         # Send push notification to user using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        user_success = notification_service.send_notification(
+        user_success = await notification_service.send_notification_async(
             recipient_id=user_id,
             title="Consultation Period Expired",
             body=f"Hi {user_name}, your {plan_name} consultation period has ended. Select a new consultation period to continue!",
@@ -4295,7 +4643,7 @@ async def send_new_subscription_notification(user_id: str, user_data: dict, plan
         
         # Send push notification to dietician using SimpleNotificationService (same as messages/appointments)
         notification_service = get_notification_service(firestore_db)
-        success = notification_service.send_notification(
+        success = await notification_service.send_notification_async(
             recipient_id="dietician",  # Special ID for dietician
             title="New Subscription",
             body=f"User {user_name} ({user_id}) has subscribed to {plan_name}.",
@@ -4328,25 +4676,6 @@ import asyncio
 import threading
 import time
 
-async def notification_scheduler_job():
-    """
-    Scheduled job to send due notifications and clean up old ones.
-    This runs every minute to check for notifications that need to be sent.
-    """
-    try:
-        if FIREBASE_AVAILABLE and firestore_db:
-            scheduler = get_notification_scheduler(firestore_db)
-            
-            # Send due notifications
-            sent_count = await scheduler.send_due_notifications()
-            
-            # Clean up old notifications (run once per hour)
-            if datetime.now().minute == 0:  # Only run at the top of each hour
-                await scheduler.cleanup_old_notifications()
-                
-    except Exception as e:
-        print(f"[Notification Scheduler] Error: {e}")
-
 # --- Subscription Endpoints ---
 
 @api_router.get("/subscription/plans")
@@ -4881,14 +5210,9 @@ async def reset_daily_data(userId: str):
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         today_str = today.strftime('%Y-%m-%d')
         
-        # Clear today's food logs to reset daily nutritional values
+        # Clear today's food logs to reset daily nutritional values (and take them out of today's rollup)
         food_logs_ref = firestore_db.collection(f"users/{userId}/food_logs")
-        today_logs = food_logs_ref.where("timestamp", ">=", today).stream()
-        
-        deleted_count = 0
-        for doc in today_logs:
-            doc.reference.delete()
-            deleted_count += 1
+        deleted_count = get_nutrition_rollups(firestore_db).delete_food_logs(userId, food_logs_ref.where("timestamp", ">=", today))
         
         # Update the lastFoodLogDate to today
         firestore_db.collection("user_profiles").document(userId).update({
@@ -5031,6 +5355,30 @@ async def delete_user_account(userId: str):
             logger.info(f"[DELETE ACCOUNT] Deleted {count} food logs for {userId}")
             return count
         
+        # 1b. Delete daily nutrition rollups (parallel with food logs)
+        async def delete_nutrition_rollups():
+            count = await loop.run_in_executor(executor, lambda: get_nutrition_rollups(firestore_db).delete_all(userId))
+            deleted_items["daily_nutrition"] = count
+            logger.info(f"[DELETE ACCOUNT] Deleted {count} daily nutrition rollups for {userId}")
+            return count
+        
+        # 1c. Delete recent foods used for suggestions (parallel with food logs)
+        async def delete_recent_foods():
+            recent_foods_ref = firestore_db.collection(f"users/{userId}/recent_foods")
+            count = await delete_collection_batch(recent_foods_ref)
+            deleted_items["recent_foods"] = count
+            logger.info(f"[DELETE ACCOUNT] Deleted {count} recent foods for {userId}")
+            return count
+        
+        # 1d. Delete NutriBot chat sessions (parallel with food logs)
+        async def delete_chat_sessions():
+            count = await loop.run_in_executor(executor, lambda: get_chat_session_store(firestore_db).delete_all(userId))
+            chat_response_cache.invalidate(userId)
+            get_push_token_registry(firestore_db).invalidate(userId)
+            deleted_items["chat_sessions"] = count
+            logger.info(f"[DELETE ACCOUNT] Deleted {count} chat sessions for {userId}")
+            return count
+        
         # 2. Delete routines subcollection (parallel with food logs)
         async def delete_routines():
             routines_ref = firestore_db.collection(f"users/{userId}/routines")
@@ -5114,8 +5462,10 @@ async def delete_user_account(userId: str):
             logger.info(f"[DELETE ACCOUNT] Deleted {count} appointments for {userId}")
             return count
         
-        # 6. Delete user_notifications collection (diet notifications)
+        # 6. Delete user_notifications collection (diet notifications) and the stored diet text
         async def delete_user_notifications():
+            await loop.run_in_executor(executor, firestore_db.collection("diet_text").document(userId).delete)
+            deleted_items["diet_text"] = True
             user_notifications_ref = firestore_db.collection("user_notifications").document(userId)
             doc = await loop.run_in_executor(executor, user_notifications_ref.get)
             if doc.exists:
@@ -5149,6 +5499,9 @@ async def delete_user_account(userId: str):
             if batch_count > 0:
                 await loop.run_in_executor(executor, batch.commit)
                 count += batch_count
+            if BACKEND_DIET_REMINDERS_ENABLED:
+                # Backend diet reminders are keyed by user_id and also held in the scheduler's heap
+                count += await get_diet_reminder_scheduler(firestore_db).cancel_user_notifications(userId)
             deleted_items["scheduled_notifications"] = count
             logger.info(f"[DELETE ACCOUNT] Deleted {count} scheduled notifications for {userId}")
             return count
@@ -5214,6 +5567,9 @@ async def delete_user_account(userId: str):
         logger.info(f"[DELETE ACCOUNT] Starting parallel deletion of subcollections for {userId}")
         await asyncio.gather(
             delete_with_timeout("food_logs", delete_food_logs),
+            delete_with_timeout("daily_nutrition", delete_nutrition_rollups),
+            delete_with_timeout("recent_foods", delete_recent_foods),
+            delete_with_timeout("chat_sessions", delete_chat_sessions),
             delete_with_timeout("routines", delete_routines),
             return_exceptions=True
         )
@@ -5483,12 +5839,17 @@ async def assign_default_diet_to_user(user_id: str, user_data: dict, trial_start
             logger.error(f"[DEFAULT DIET] Traceback: {traceback.format_exc()}")
             return False
         
+        # Store the extracted text and retrieval chunks (same as when dietician uploads)
+        diet_text = None
+        try:
+            diet_text = await _precompute_diet_text(user_id, default_diet_filename, diet_info["dietCacheVersion"], pdf_data)
+        except Exception as precompute_error:
+            logger.error(f"[DEFAULT DIET] Failed to precompute diet text for user {user_id}: {precompute_error}")
+        
         # Extract notifications from the diet PDF (same as when dietician uploads)
         try:
             logger.info(f"[DEFAULT DIET] Extracting notifications from free trial diet PDF for user {user_id}")
-            notifications = diet_notification_service.extract_and_create_notifications(
-                user_id, default_diet_filename, firestore_db
-            )
+            notifications = await _extract_diet_notifications(user_id, default_diet_filename, diet_text, diet_info["dietCacheVersion"])
             
             if notifications:
                 # Store notifications in Firestore
@@ -5508,8 +5869,10 @@ async def assign_default_diet_to_user(user_id: str, user_data: dict, trial_start
         # Send notification about new diet (same as when dietician uploads)
         try:
             from services.simple_notification_service import get_notification_service
-            notification_service = get_notification_service(firestore_db)
-            notification_service.send_new_diet_notification(user_id, "System")
+            content = get_notification_service(firestore_db).new_diet_content(user_id, "System")
+            await asyncio.get_event_loop().run_in_executor(
+                executor, lambda: get_notification_outbox(firestore_db).enqueue(user_id, **content, source="new_diet")
+            )
         except Exception as notif_error:
             logger.warning(f"[DEFAULT DIET] Failed to send notification: {notif_error}")
         
@@ -5611,17 +5974,25 @@ def run_diet_countdown_job():
         # Wait for 6 hours
         time.sleep(6 * 60 * 60)
 
-def run_notification_scheduler():
-    """Run notification scheduler in a separate thread (every minute)"""
+def run_log_retention_job():
+    """Prune expired food and workout logs for all users (every LOG_RETENTION_INTERVAL_SECONDS, default hourly)"""
     while True:
         try:
-            # Run the notification scheduler job
-            asyncio.run(notification_scheduler_job())
+            get_log_retention_job(firestore_db).run()
         except Exception as e:
-            print(f"[Notification Scheduler] Error: {e}")
+            print(f"[Log Retention Job] Error: {e}")
         
-        # Wait for 1 minute
-        time.sleep(60)
+        time.sleep(LOG_RETENTION_INTERVAL_SECONDS)
+
+def run_push_receipts_job():
+    """Fetch Expo receipts for recent pushes and prune dead tokens (every PUSH_RECEIPT_POLL_INTERVAL_SECONDS, default 15 minutes)"""
+    while True:
+        # The first run loads tickets saved before a restart, and any that are already due are polled straight away
+        try:
+            get_push_receipt_tracker(firestore_db).run()
+        except Exception as e:
+            print(f"[Push Receipts Job] Error: {e}")
+        time.sleep(PUSH_RECEIPT_POLL_INTERVAL_SECONDS)
 
 # Start the scheduled job threads
 # Subscription reminders run every 6 hours to check for 1 week and 1 day reminders
@@ -5632,10 +6003,36 @@ scheduler_thread.start()
 diet_countdown_thread = threading.Thread(target=run_diet_countdown_job, daemon=True)
 diet_countdown_thread.start()
 
-# DISABLED: Backend notification scheduler to prevent conflicts with local scheduling
-# notification_scheduler_thread = threading.Thread(target=run_notification_scheduler, daemon=True)
-# notification_scheduler_thread.start()
-print("🔕 Backend notification scheduler DISABLED - using local scheduling only")
+# Food/workout log retention runs off the request path
+log_retention_thread = threading.Thread(target=run_log_retention_job, daemon=True)
+log_retention_thread.start()
+
+# Outbox delivery workers send queued push notifications off the request path
+try:
+    get_notification_outbox(firestore_db).start()
+except Exception as e:
+    print(f"[Notification Outbox] Failed to start delivery workers: {e}")
+
+# Track push tickets and poll their receipts to prune tokens of uninstalled apps
+expo_push_gateway.add_listener(get_push_receipt_tracker(firestore_db).record)
+push_receipts_thread = threading.Thread(target=run_push_receipts_job, daemon=True)
+push_receipts_thread.start()
+
+# Keep cached push tokens current as the apps register new ones
+try:
+    get_push_token_registry(firestore_db).watch()
+except Exception as e:
+    print(f"[Push Tokens] Failed to watch token updates: {e}")
+
+# Backend diet reminders fire from an in-memory heap of upcoming reminders instead of a per-minute scan.
+# Off by default to avoid conflicts with local scheduling on the device
+if BACKEND_DIET_REMINDERS_ENABLED and FIREBASE_AVAILABLE and firestore_db:
+    try:
+        get_diet_reminder_scheduler(firestore_db).start()
+    except Exception as e:
+        print(f"[Diet Reminders] Failed to start scheduler: {e}")
+else:
+    print("🔕 Backend notification scheduler DISABLED - using local scheduling only")
 
 # Include the router in the main app (after all endpoints are defined)
 # Add new endpoints for dietician user management
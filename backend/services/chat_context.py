@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+NutriBot Context Manager
+Bounds the prompt to a token budget: last K turns verbatim, older turns folded into a rolling summary.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Tuple
+
+from google.generativeai.types import ContentDict
+
+from services.gemini_gateway import gemini_gateway
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+RECENT_TURNS = int(os.getenv("CHAT_CONTEXT_RECENT_TURNS", "8"))
+TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "6000"))
+# Share of the budget the system prompt (profile + diet context) may use at most
+SYSTEM_BUDGET_SHARE = float(os.getenv("CHAT_CONTEXT_SYSTEM_SHARE", "0.6"))
+# Older turns are folded into the summary once this many are waiting
+SUMMARY_BATCH_TURNS = int(os.getenv("CHAT_CONTEXT_SUMMARY_BATCH_TURNS", "4"))
+SUMMARY_MAX_WORDS = int(os.getenv("CHAT_CONTEXT_SUMMARY_MAX_WORDS", "150"))
+
+# Rough tokens-per-character ratio for English text; close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+# Telemetry of the most recent requests kept for the admin endpoint
+TELEMETRY_HISTORY_SIZE = 50
+
+# The event loop only keeps weak references to tasks, so running summary refreshes are held here
+_background_tasks = set()
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    limit = max(0, tokens) * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:max(0, limit - 3)] + "..."
+
+
+class ChatContextManager:
+    """
+    Builds Gemini chat history within a token budget and keeps session summaries current.
+    The system prompt is capped at SYSTEM_BUDGET_SHARE of the budget; the rest goes to the new
+    message, the summary and as many of the last recent_turns turns as fit, newest first.
+    """
+
+    def __init__(self, recent_turns: int = RECENT_TURNS, token_budget: int = TOKEN_BUDGET,
+                 summary_batch_turns: int = SUMMARY_BATCH_TURNS, gateway=gemini_gateway):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_batch_turns = summary_batch_turns
+        self.gateway = gateway
+        self._telemetry = deque(maxlen=TELEMETRY_HISTORY_SIZE)
+        self._lock = threading.Lock()
+        self._totals = {"requests": 0, "total_tokens": 0, "max_tokens": 0, "summaries_refreshed": 0, "summary_failures": 0}
+
+    def build(self, system_prompt: str, turns: List[Dict[str, Any]], user_message: str,
+              summary: str = "", summarized_through: int = 0) -> Tuple[List[ContentDict], Dict[str, Any]]:
+        """
+        Chat history for Gemini plus telemetry for this request.
+        turns are {"sender", "text"[, "sequence"]} oldest first; turns with a sequence below
+        summarized_through are covered by summary.
+        """
+        message_tokens = estimate_tokens(user_message)
+        system_prompt = _truncate_to_tokens(system_prompt, int(self.token_budget * SYSTEM_BUDGET_SHARE))
+        system_tokens = estimate_tokens(system_prompt)
+        remaining = self.token_budget - system_tokens - message_tokens
+
+        turns = [turn for turn in turns if turn.get("text") and turn.get("sender") in ("user", "bot")]
+        recent = turns[-self.recent_turns:] if self.recent_turns > 0 else []
+        older = turns[:len(turns) - len(recent)]
+        summarized = [turn for turn in older if turn.get("sequence", summarized_through) < summarized_through]
+
+        summary_tokens = 0
+        if summary:
+            summary = _truncate_to_tokens(summary, max(0, remaining // 3))
+            summary_tokens = estimate_tokens(summary)
+            remaining -= summary_tokens
+
+        # Newest turns win when the budget is tight
+        included = []
+        history_tokens = 0
+        for turn in reversed(recent):
+            tokens = estimate_tokens(turn["text"])
+            if history_tokens + tokens > remaining:
+                break
+            included.append(turn)
+            history_tokens += tokens
+        included.reverse()
+
+        if summary:
+            system_prompt += f"\n\nSummary of the earlier conversation:\n{summary}"
+        history = [ContentDict(role="user", parts=[{"text": system_prompt}])]
+        for turn in included:
+            history.append(ContentDict(role="user" if turn["sender"] == "user" else "model", parts=[{"text": turn["text"]}]))
+        history.append(ContentDict(role="user", parts=[{"text": user_message}]))
+
+        telemetry = {
+            "system_tokens": system_tokens,
+            "summary_tokens": summary_tokens,
+            "history_tokens": history_tokens,
+            "message_tokens": message_tokens,
+            "total_tokens": system_tokens + summary_tokens + history_tokens + message_tokens,
+            "token_budget": self.token_budget,
+            "turns_included": len(included),
+            "turns_summarized": len(summarized) if summary else 0,
+            "turns_dropped": len(turns) - len(included) - (len(summarized) if summary else 0),
+        }
+        self._record(telemetry)
+        return history, telemetry
+
+    def _record(self, telemetry: Dict[str, Any]):
+        with self._lock:
+            self._telemetry.append(telemetry)
+            self._totals["requests"] += 1
+            self._totals["total_tokens"] += telemetry["total_tokens"]
+            self._totals["max_tokens"] = max(self._totals["max_tokens"], telemetry["total_tokens"])
+
+    def turns_to_summarize(self, session) -> List[Dict[str, Any]]:
+        """Turns outside the recent window that the session summary does not cover yet."""
+        with session.lock:
+            older = session.turns[:max(0, len(session.turns) - self.recent_turns)]
+            return [turn for turn in older if turn.get("sequence", 0) >= session.summarized_through]
+
+    def schedule_summary_refresh(self, session, store) -> bool:
+        """
+        Fold older turns into the session summary in the background once enough are waiting.
+        Returns True if a refresh was started. Must be called from the event loop.
+        """
+        pending = self.turns_to_summarize(session)
+        if len(pending) < self.summary_batch_turns:
+            return False
+        with session.lock:
+            if session.summary_refreshing:
+                return False
+            session.summary_refreshing = True
+        task = asyncio.get_running_loop().create_task(self._refresh_summary(session, store, pending))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return True
+
+    async def _refresh_summary(self, session, store, pending: List[Dict[str, Any]]):
+        try:
+            transcript = "\n".join(f"{'User' if turn['sender'] == 'user' else 'NutriBot'}: {turn['text']}" for turn in pending)
+            prompt = (
+                f"You maintain a running summary of a conversation between a user and NutriBot, a nutrition assistant. "
+                f"Update the summary with the new messages below. Keep facts the user shared about themselves, their goals, "
+                f"preferences and questions still open; drop small talk. Reply with the updated summary only, at most "
+                f"{SUMMARY_MAX_WORDS} words.\n\nCurrent summary:\n{session.summary or '(none)'}\n\nNew messages:\n{transcript}"
+            )
+            summary = (await self.gateway.generate("chat_summary", prompt)).strip()
+            through = pending[-1]["sequence"] + 1
+            await asyncio.get_running_loop().run_in_executor(None, lambda: store.save_summary(session, summary, through))
+            with self._lock:
+                self._totals["summaries_refreshed"] += 1
+            logger.info(f"[CHAT CONTEXT] Folded {len(pending)} turns into summary for session {session.session_id}")
+        except Exception as e:
+            with self._lock:
+                self._totals["summary_failures"] += 1
+            logger.warning(f"[CHAT CONTEXT] Summary refresh failed for session {session.session_id}: {e}")
+        finally:
+            with session.lock:
+                session.summary_refreshing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+            recent = list(reversed(self._telemetry))
+        totals["avg_tokens"] = round(totals["total_tokens"] / totals["requests"], 1) if totals["requests"] else 0
+        return {
+            "recent_turns": self.recent_turns,
+            "token_budget": self.token_budget,
+            "summary_batch_turns": self.summary_batch_turns,
+            "totals": totals,
+            "recent_requests": recent,
+        }
+
+
+# Global instance
+chat_context_manager = ChatContextManager()
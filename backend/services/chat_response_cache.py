@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+NutriBot Response Cache
+Answers to near-identical standalone questions, matched by shingle similarity and scoped to the user's diet version and profile.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple, FrozenSet
+
+from services.diet_retrieval import TOKEN_PATTERN, STOPWORDS, WEEKDAYS
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+ENABLED = os.getenv("CHAT_RESPONSE_CACHE_ENABLED", "1") != "0"
+# Minimum Jaccard similarity of question shingles for a cached answer to be reused
+SIMILARITY_THRESHOLD = float(os.getenv("CHAT_RESPONSE_CACHE_THRESHOLD", "0.85"))
+TTL_SECONDS = float(os.getenv("CHAT_RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+MAX_USERS = int(os.getenv("CHAT_RESPONSE_CACHE_MAX_USERS", "2000"))
+MAX_ENTRIES_PER_USER = int(os.getenv("CHAT_RESPONSE_CACHE_MAX_ENTRIES", "50"))
+
+# Character n-gram size for question shingles (tolerates plurals and small typos)
+SHINGLE_SIZE = 3
+# Questions with fewer content words than this are too vague to match on
+MIN_CONTENT_TOKENS = 1
+# Words that make a question depend on the conversation so far ("what about that?")
+FOLLOW_UP_WORDS = {
+    "it", "that", "this", "these", "those", "them", "they", "also", "instead", "else", "again",
+    "more", "above", "previous", "earlier", "same",
+}
+RELATIVE_DAYS = {"today": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1}
+# Words that tie the answer to the clock ("what is my next meal", "what should I eat now"); never cached
+TIME_RELATIVE_WORDS = {"now", "next", "current", "currently", "upcoming", "soon", "later", "left", "remaining", "yet"}
+# Same-day questions that do not name a meal are keyed by the meal slot they were asked in
+SAME_DAY_WORDS = {"today", "tonight"}
+MEAL_WORDS = {"breakfast", "brunch", "lunch", "dinner", "supper", "snack", "snacks"}
+# (hour the slot ends, slot name)
+MEAL_SLOTS = ((11, "breakfast"), (16, "lunch"), (19, "snacks"), (24, "dinner"))
+
+# (exact tokens that must match, e.g. days and numbers; shingles of the rest)
+Signature = Tuple[FrozenSet[str], FrozenSet[str]]
+
+
+def meal_slot(now: datetime) -> str:
+    return next(slot for end_hour, slot in MEAL_SLOTS if now.hour < end_hour)
+
+
+def is_time_relative(words: List[str]) -> bool:
+    """Whether the answer depends on the time of asking rather than just the day."""
+    if TIME_RELATIVE_WORDS.intersection(words):
+        return True
+    return any(first == "what" and second == "time" for first, second in zip(words, words[1:]))
+
+
+def question_signature(question: str, today: Optional[datetime] = None) -> Optional[Signature]:
+    """
+    Signature of a standalone question, or None if it reads like a follow-up, depends on the clock or has no content.
+    Relative days are resolved to weekdays, so "today" questions stop matching the next day, and
+    "today" questions without a meal also carry the current meal slot.
+    """
+    words = TOKEN_PATTERN.findall((question or "").lower())
+    if not words or FOLLOW_UP_WORDS.intersection(words) or is_time_relative(words):
+        return None
+    today = today or datetime.now()
+    exact, content = set(), set()
+    if SAME_DAY_WORDS.intersection(words) and not MEAL_WORDS.intersection(words):
+        exact.add(f"slot:{meal_slot(today)}")
+    for word in words:
+        if word in RELATIVE_DAYS:
+            word = WEEKDAYS[(today + timedelta(days=RELATIVE_DAYS[word])).weekday()]
+        if word in STOPWORDS:
+            continue
+        if word in WEEKDAYS or word.isdigit():
+            exact.add(word)
+        else:
+            content.add(word)
+    if len(content) < MIN_CONTENT_TOKENS:
+        return None
+    text = f" {' '.join(sorted(content))} "
+    shingles = {text[index:index + SHINGLE_SIZE] for index in range(len(text) - SHINGLE_SIZE + 1)}
+    return frozenset(exact), frozenset(shingles)
+
+
+def similarity(a: Signature, b: Signature) -> float:
+    """Jaccard similarity of the shingles; 0 when the exact tokens differ."""
+    if a[0] != b[0]:
+        return 0.0
+    union = len(a[1] | b[1])
+    return len(a[1] & b[1]) / union if union else 0.0
+
+
+def profile_hash(profile: Optional[Dict[str, Any]]) -> str:
+    """Hash of the profile fields NutriBot's prompt is built from."""
+    fields = {key: value for key, value in (profile or {}).items() if value}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class ChatResponseCache:
+    """
+    Per-user answers keyed by (dietCacheVersion, profile hash). Entries from an older diet or
+    profile are dropped on the next lookup, so a new diet upload invalidates them automatically.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: float = TTL_SECONDS,
+                 max_users: int = MAX_USERS, max_entries_per_user: int = MAX_ENTRIES_PER_USER,
+                 enabled: bool = ENABLED, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self.enabled = enabled
+        self._clock = clock
+        # user_id -> (diet version, profile hash, [(signature, answer, stored_at)])
+        self._users: "OrderedDict[str, Tuple[Any, str, List[Tuple[Signature, str, float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0, "stores": 0, "invalidations": 0, "expired": 0}
+
+    def _entries(self, user_id: str, profile: Optional[Dict[str, Any]]) -> List[Tuple[Signature, str, float]]:
+        """The user's entries for the current diet and profile, resetting them if either changed. Caller holds the lock."""
+        version, hashed = (profile or {}).get("dietCacheVersion"), profile_hash(profile)
+        cached = self._users.get(user_id)
+        if cached is None or cached[0] != version or cached[1] != hashed:
+            if cached is not None:
+                self._stats["invalidations"] += 1
+            cached = (version, hashed, [])
+            self._users[user_id] = cached
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return cached[2]
+
+    def lookup(self, user_id: str, question: str, profile: Optional[Dict[str, Any]]) -> Optional[str]:
+        """A cached answer to a sufficiently similar question, or None."""
+        if not self.enabled:
+            return None
+        signature = question_signature(question)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if signature is None:
+                self._stats["skipped"] += 1
+                return None
+            entries = self._entries(user_id, profile)
+            now = self._clock()
+            fresh = [entry for entry in entries if now - entry[2] < self.ttl_seconds]
+            self._stats["expired"] += len(entries) - len(fresh)
+            entries[:] = fresh
+            best, best_score = None, 0.0
+            for entry in entries:
+                score = similarity(signature, entry[0])
+                if score > best_score:
+                    best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+        logger.info(f"[CHAT CACHE] Hit for user {user_id} (similarity {best_score:.2f})")
+        return best[1]
+
+    def store(self, user_id: str, question: str, profile: Optional[Dict[str, Any]], answer: str) -> bool:
+        """Remember the answer to a standalone question. Returns False if the question is not cacheable."""
+        if not self.enabled or not answer:
+            return False
+        signature = question_signature(question)
+        if signature is None:
+            return False
+        with self._lock:
+            entries = self._entries(user_id, profile)
+            entries[:] = [entry for entry in entries if entry[0] != signature]
+            entries.append((signature, answer, self._clock()))
+            del entries[:-self.max_entries_per_user]
+            self._stats["stores"] += 1
+        return True
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._users)
+            stats["entries"] = sum(len(cached[2]) for cached in self._users.values())
+        eligible = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / eligible, 4) if eligible else 0.0
+        stats["enabled"] = self.enabled
+        stats["threshold"] = self.threshold
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
+
+
+# Global instance
+chat_response_cache = ChatResponseCache()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Chat Sessions
+Server-side NutriBot sessions in Firestore with an in-memory hot cache, plus a short-lived profile cache.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# users/{user_id}/chat_sessions/{session_id}, turns in .../{session_id}/turns/{sequence}
+SESSIONS_COLLECTION = "chat_sessions"
+TURNS_COLLECTION = "turns"
+
+# Defaults can be overridden from the environment
+MAX_CACHED_SESSIONS = int(os.getenv("CHAT_SESSION_CACHE_SIZE", "500"))
+# Most recent turns loaded (and kept in memory) per session
+MAX_SESSION_TURNS = int(os.getenv("CHAT_SESSION_MAX_TURNS", "200"))
+PROFILE_TTL_SECONDS = float(os.getenv("CHAT_PROFILE_TTL_SECONDS", "300"))
+MAX_CACHED_PROFILES = int(os.getenv("CHAT_PROFILE_CACHE_SIZE", "1000"))
+
+# Session IDs are chosen by the client and used as Firestore document IDs
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ChatSession:
+    """
+    One conversation: its turns (oldest first), the next turn sequence number and the rolling
+    summary of turns before sequence summarized_through.
+    """
+
+    def __init__(self, user_id: str, session_id: str, turns: Optional[List[Dict[str, Any]]] = None, turn_count: int = 0,
+                 summary: str = "", summarized_through: int = 0):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.turns: List[Dict[str, Any]] = list(turns or [])
+        self.turn_count = turn_count
+        self.summary = summary
+        self.summarized_through = summarized_through
+        self.summary_refreshing = False
+        self.lock = threading.Lock()
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Turns as {"sender", "text"} messages, the shape clients send in chat_history."""
+        with self.lock:
+            return [{"sender": turn["sender"], "text": turn["text"]} for turn in self.turns]
+
+
+class ChatSessionStore:
+    """
+    Sessions are read from Firestore once and then served from an LRU cache; each message only
+    writes its new turns. Profiles are cached for PROFILE_TTL_SECONDS and invalidated on profile writes.
+    Methods are blocking - call from an executor.
+    """
+
+    def __init__(self, db, clock=time.monotonic):
+        self.db = db
+        self._clock = clock
+        self._sessions: "OrderedDict[Tuple[str, str], ChatSession]" = OrderedDict()
+        self._profiles: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"session_hits": 0, "session_loads": 0, "profile_hits": 0, "profile_loads": 0, "turns_written": 0}
+
+    def _sessions_ref(self, user_id: str):
+        return self.db.collection(f"users/{user_id}/{SESSIONS_COLLECTION}")
+
+    def get_or_create(self, user_id: str, session_id: str) -> ChatSession:
+        """The session, from cache or Firestore; unknown IDs start a new, empty session."""
+        if not SESSION_ID_PATTERN.match(session_id or ""):
+            raise ValueError("sessionId must be 1-64 letters, digits, '-' or '_'")
+        key = (user_id, session_id)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                self._stats["session_hits"] += 1
+                return session
+
+        session = ChatSession(user_id, session_id)
+        if self.db is not None:
+            session_ref = self._sessions_ref(user_id).document(session_id)
+            snapshot = session_ref.get()
+            if snapshot.exists:
+                data = snapshot.to_dict() or {}
+                session.turn_count = data.get("turnCount", 0)
+                session.summary = data.get("summary", "")
+                session.summarized_through = data.get("summarizedThrough", 0)
+                query = (session_ref.collection(TURNS_COLLECTION)
+                         .order_by("sequence", direction=firestore.Query.DESCENDING).limit(MAX_SESSION_TURNS))
+                session.turns = [doc.to_dict() for doc in query.stream()][::-1]
+
+        with self._lock:
+            self._stats["session_loads"] += 1
+            session = self._sessions.setdefault(key, session)
+            while len(self._sessions) > MAX_CACHED_SESSIONS:
+                self._sessions.popitem(last=False)
+        return session
+
+    def append_turns(self, session: ChatSession, turns: List[Dict[str, Any]]):
+        """Append {"sender", "text"} turns to the session, writing only the new turns."""
+        now = datetime.now()
+        with session.lock:
+            start = session.turn_count
+            records = [{**turn, "sequence": start + offset, "timestamp": now} for offset, turn in enumerate(turns)]
+            session.turn_count += len(records)
+            session.turns.extend(records)
+            del session.turns[:-MAX_SESSION_TURNS]
+
+        if self.db is not None:
+            session_ref = self._sessions_ref(session.user_id).document(session.session_id)
+            batch = self.db.batch()
+            for record in records:
+                batch.set(session_ref.collection(TURNS_COLLECTION).document(f"{record['sequence']:06d}"), record)
+            batch.set(session_ref, {
+                "sessionId": session.session_id,
+                "turnCount": firestore.Increment(len(records)),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+            batch.commit()
+        with self._lock:
+            self._stats["turns_written"] += len(records)
+
+    def save_summary(self, session: ChatSession, summary: str, summarized_through: int):
+        """Store a refreshed rolling summary covering turns before summarized_through."""
+        with session.lock:
+            if summarized_through < session.summarized_through:
+                return
+            session.summary = summary
+            session.summarized_through = summarized_through
+        if self.db is not None:
+            self._sessions_ref(session.user_id).document(session.session_id).set({
+                "summary": summary,
+                "summarizedThrough": summarized_through,
+                "summaryUpdatedAt": firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+
+    def delete(self, user_id: str, session_id: str) -> int:
+        """Delete a session and its turns. Returns the number of turns deleted."""
+        with self._lock:
+            self._sessions.pop((user_id, session_id), None)
+        if self.db is None:
+            return 0
+        session_ref = self._sessions_ref(user_id).document(session_id)
+        count = 0
+        batch = self.db.batch()
+        for doc in session_ref.collection(TURNS_COLLECTION).select([]).stream():
+            batch.delete(doc.reference)
+            count += 1
+            if count % 499 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.delete(session_ref)
+        batch.commit()
+        return count
+
+    def delete_all(self, user_id: str) -> int:
+        """Delete every session of a user. Returns the number of sessions deleted."""
+        with self._lock:
+            for key in [key for key in self._sessions if key[0] == user_id]:
+                del self._sessions[key]
+        if self.db is None:
+            return 0
+        session_ids = [doc.id for doc in self._sessions_ref(user_id).select([]).stream()]
+        for session_id in session_ids:
+            self.delete(user_id, session_id)
+        return len(session_ids)
+
+    def get_profile(self, user_id: str) -> Dict[str, Any]:
+        """The user's profile from user_profiles, cached for PROFILE_TTL_SECONDS."""
+        now = self._clock()
+        with self._lock:
+            cached = self._profiles.get(user_id)
+            if cached is not None and now - cached[0] < PROFILE_TTL_SECONDS:
+                self._profiles.move_to_end(user_id)
+                self._stats["profile_hits"] += 1
+                return cached[1]
+
+        profile = {}
+        if self.db is not None:
+            snapshot = self.db.collection("user_profiles").document(user_id).get()
+            profile = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        with self._lock:
+            self._stats["profile_loads"] += 1
+            self._profiles[user_id] = (now, profile)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > MAX_CACHED_PROFILES:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate_profile(self, user_id: str):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_sessions"] = len(self._sessions)
+            stats["cached_profiles"] = len(self._profiles)
+        return stats
+
+
+# Global instance
+_chat_session_store = None
+
+def get_chat_session_store(db) -> ChatSessionStore:
+    """
+    Get the global chat session store instance.
+    """
+    global _chat_session_store
+    if _chat_session_store is None:
+        _chat_session_store = ChatSessionStore(db)
+    return _chat_session_store
@@ -4,7 +4,7 @@ from typing import List, Dict, Optional, Tuple
 from datetime import datetime, time
 import requests
 from services.pdf_rag_service import pdf_rag_service
-from services.firebase_client import send_push_notification, get_user_notification_token
+from services.tracing import trace, DIET_EXTRACTION_TRACE
 
 logger = logging.getLogger(__name__)
 
@@ -321,7 +321,7 @@ class DietNotificationService:
                     trial_day_num = int(trial_day_match.group(1))
                     current_day = trial_day_num  # Store as 1, 2, or 3 for free trial
                     is_trial_day_source = True
-                    logger.info(f"Found free trial day header: DAY {trial_day_num}")
+                    trace(DIET_EXTRACTION_TRACE, lambda: f"Found free trial day header: DAY {trial_day_num}")
                     continue
                 
                 # SECOND: Check if this is a regular day header
@@ -338,7 +338,7 @@ class DietNotificationService:
                     if day_name in day_mapping:
                         current_day = day_mapping[day_name]
                         is_trial_day_source = False
-                        logger.info(f"Found day header: {day_name.upper()} (day {current_day})")
+                        trace(DIET_EXTRACTION_TRACE, lambda: f"Found day header: {day_name.upper()} (day {current_day})")
                         continue
                 
                 # Look for time patterns
@@ -388,7 +388,7 @@ class DietNotificationService:
                                 'original_text': line
                             }
                             activities.append(activity)
-                            logger.info(f"Extracted mixed activity: {hour:02d}:{minute:02d} - {activity_text} (Day {current_day})")
+                            trace(DIET_EXTRACTION_TRACE, lambda: f"Extracted mixed activity: {hour:02d}:{minute:02d} - {activity_text} (Day {current_day})")
                             
                     except (ValueError, IndexError) as e:
                         logger.warning(f"Error parsing time in mixed diet line: {line}, error: {e}")
@@ -462,7 +462,7 @@ class DietNotificationService:
                 current_day = trial_day_num  # Store as 1, 2, or 3 for free trial
                 is_trial_day_source = True
                 is_free_trial = True
-                logger.info(f"  📅 Found free trial day: DAY {trial_day_num}")
+                trace(DIET_EXTRACTION_TRACE, lambda: f"📅 Found free trial day: DAY {trial_day_num}")
                 continue
             
             # SECOND: Check if this is a regular day header
@@ -480,7 +480,7 @@ class DietNotificationService:
                     current_day = day_mapping[day_name]
                     is_trial_day_source = False
                     is_free_trial = False
-                    print(f"  📅 Found day: {day_name.upper()} (day {current_day})")
+                    trace(DIET_EXTRACTION_TRACE, lambda: f"📅 Found day: {day_name.upper()} (day {current_day})")
                     continue
             
             # Skip lines that don't contain time patterns
@@ -573,7 +573,7 @@ class DietNotificationService:
                             }
                             
                             activities.append(activity)
-                            print(f"  ✅ {hour:02d}:{minute:02d} - {activity_text} (Day {current_day})")
+                            trace(DIET_EXTRACTION_TRACE, lambda: f"✅ {hour:02d}:{minute:02d} - {activity_text} (Day {current_day})")
                         
                 except (ValueError, IndexError) as e:
                     logger.warning(f"Error parsing time in line: {line}, error: {e}")
@@ -792,6 +792,25 @@ class DietNotificationService:
             logger.error(f"Error determining diet days: {e}")
             return []
 
+    def parse_day_header(self, line: str) -> Optional[str]:
+        """
+        Return the normalized day label ("TUESDAY", "DAY 2") if the line is a day header, else None.
+        Recognises the same headers as the structured extractor: weekday names, optionally
+        followed by "- date" or ": date", and free trial "DAY 1"/"DAY2"/"DAY 3" headers.
+        """
+        line = (line or "").strip()
+        trial_day_match = re.search(r'^DAY\s*([123])\b', line, re.IGNORECASE)
+        if trial_day_match:
+            return f"DAY {trial_day_match.group(1)}"
+        day_match = re.search(
+            r'^(MONDAY|TUESDAY|WEDNESDAY|THURSDAY|FRIDAY|SATURDAY|SUNDAY)\b(?:\s*[-:]\s*.*)?$',
+            line,
+            re.IGNORECASE
+        )
+        if day_match:
+            return day_match.group(1).upper()
+        return None
+
     def _detect_days_from_text_structure(self, diet_text: str) -> List[int]:
         """
         Detect diet days from the text structure by looking for day headers.
@@ -827,7 +846,7 @@ class DietNotificationService:
                 for i, pattern in enumerate(trial_day_patterns, start=1):
                     if re.search(pattern, line, re.IGNORECASE):
                         found_trial_days.add(i)
-                        logger.info(f"Found free trial day header: DAY {i}")
+                        trace(DIET_EXTRACTION_TRACE, lambda: f"Found free trial day header: DAY {i}")
                         break
                 
                 # SECOND: Look for regular day headers in various formats
@@ -983,7 +1002,7 @@ class DietNotificationService:
             # Create grouped notification
             grouped_notif = self._create_grouped_notification(current_group)
             grouped.append(grouped_notif)
-            logger.info(f"[GROUPING] Created group with {len(current_group)} notifications, fires at {grouped_notif.get('time')}")
+            trace(DIET_EXTRACTION_TRACE, lambda: f"[GROUPING] Created group with {len(current_group)} notifications, fires at {grouped_notif.get('time')}")
         
         # Verify no duplicates
         all_times = []
@@ -1066,7 +1085,7 @@ class DietNotificationService:
             'originalNotifications': group  # Keep original for reference/debugging
         }
         
-        logger.info(f"[GROUPING] Created grouped notification at {grouped_notification['time']} with {len(group)} tasks")
+        trace(DIET_EXTRACTION_TRACE, lambda: f"[GROUPING] Created grouped notification at {grouped_notification['time']} with {len(group)} tasks")
         return grouped_notification
     
     def create_notification_from_activity(self, activity: Dict) -> Dict:
@@ -1092,11 +1111,11 @@ class DietNotificationService:
             if is_trial_day_source and day_value in [1, 2, 3]:
                 is_free_trial_day = True
                 trial_day = day_value
-                logger.info(f"Created free trial notification for DAY {trial_day}: {activity['activity'][:50]}...")
+                trace(DIET_EXTRACTION_TRACE, lambda: f"Created free trial notification for DAY {trial_day}: {activity['activity'][:50]}...")
             else:
                 # Regular weekday (0-6)
                 selected_days = [day_value]
-                logger.info(f"Created day-specific notification for day {day_value}: {activity['activity'][:50]}...")
+                trace(DIET_EXTRACTION_TRACE, lambda: f"Created day-specific notification for day {day_value}: {activity['activity'][:50]}...")
         else:
             # Activity without day header - will be determined later
             selected_days = []
@@ -1124,157 +1143,167 @@ class DietNotificationService:
         
         return notification
     
-    def extract_and_create_notifications(self, user_id: str, diet_pdf_url: str, db) -> List[Dict]:
+    def extract_and_create_notifications(self, user_id: str, diet_pdf_url: str, db, cache_version: Optional[float] = None) -> List[Dict]:
         """
         Extract timed activities from a user's diet PDF and create notifications.
+        cache_version is the profile's dietCacheVersion, so text from an earlier upload of the same file is not used.
         """
         try:
             # Get diet text using the existing RAG service
-            diet_text = pdf_rag_service.get_diet_pdf_text(user_id, diet_pdf_url, db)
+            diet_text = pdf_rag_service.get_diet_pdf_text(user_id, diet_pdf_url, db, cache_version)
             
             if not diet_text:
                 logger.warning(f"No diet text found for user {user_id}")
                 return []
             
-            # Extract timed activities
-            activities = self.extract_timed_activities(diet_text)
-            
-            if not activities:
-                logger.info(f"No timed activities found in diet PDF for user {user_id}")
-                return []
-            
-            # CRITICAL FIX: Determine diet days from the overall structure
-            diet_days = self._determine_diet_days_from_activities(activities, diet_text)
-            logger.info(f"Determined diet days from structure: {diet_days}")
-            
-            # Check if this is a free trial diet (empty diet_days means free trial was detected)
-            is_free_trial_diet = False
-            if not diet_days:
-                # Check if any activities have trial days (1, 2, 3)
-                trial_days_found = any(
-                    activity.get('is_trial_day_source') and activity.get('day') in [1, 2, 3]
-                    for activity in activities
-                )
-                if trial_days_found:
-                    is_free_trial_diet = True
-                    logger.info(f"Detected free trial diet (DAY 1, DAY2, DAY 3 format)")
-            
-            # Create notifications from activities
-            notifications = []
-            for activity in activities:
-                notification = self.create_notification_from_activity(activity)
-                
-                # For free trial diets, notifications already have trialDay set
-                # For regular diets, apply selectedDays if not set
-                if not is_free_trial_diet:
-                    if not notification.get('selectedDays'):
-                        if diet_days:
-                            notification['selectedDays'] = diet_days
-                            logger.info(f"Applied diet days {diet_days} to notification: {notification['message'][:50]}...")
-                        else:
-                            # CONSERVATIVE FIX: If we can't determine days, DON'T default to any days
-                            # Let the user manually configure this to prevent wrong notifications
-                            notification['selectedDays'] = []  # Empty - user must configure
-                        notification['isActive'] = False  # Inactive until user configures
-                        logger.warning(f"Could not determine days for notification: {notification['message'][:50]}... - marked as inactive")
-                
-                notifications.append(notification)
+            return self.create_notifications_from_text(diet_text, user_id)
             
-            logger.info(f"Extracted {len(notifications)} timed activities from diet PDF for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error extracting notifications from diet PDF for user {user_id}: {e}")
+            return []
+    
+    def create_notifications_from_text(self, diet_text: str, user_id: str = "") -> List[Dict]:
+        """
+        Turn extracted diet text into grouped notifications. Pure CPU work with plain-dict
+        results, so it can run in an extraction worker process.
+        """
+        # Extract timed activities
+        activities = self.extract_timed_activities(diet_text)
+        
+        if not activities:
+            logger.info(f"No timed activities found in diet PDF for user {user_id}")
+            return []
+        
+        # CRITICAL FIX: Determine diet days from the overall structure
+        diet_days = self._determine_diet_days_from_activities(activities, diet_text)
+        logger.info(f"Determined diet days from structure: {diet_days}")
+        
+        # Check if this is a free trial diet (empty diet_days means free trial was detected)
+        is_free_trial_diet = False
+        if not diet_days:
+            # Check if any activities have trial days (1, 2, 3)
+            trial_days_found = any(
+                activity.get('is_trial_day_source') and activity.get('day') in [1, 2, 3]
+                for activity in activities
+            )
+            if trial_days_found:
+                is_free_trial_diet = True
+                logger.info(f"Detected free trial diet (DAY 1, DAY2, DAY 3 format)")
+        
+        # Create notifications from activities
+        notifications = []
+        for activity in activities:
+            notification = self.create_notification_from_activity(activity)
             
-            # For free trial diets, group consecutive notifications within 1 hour per trial day
-            if is_free_trial_diet:
-                grouped_notifications = []
-                trial_days = sorted({n.get('trialDay') for n in notifications if n.get('trialDay') in [1, 2, 3]})
-                
-                for trial_day in trial_days:
-                    day_notifications = [
-                        n for n in notifications
-                        if n.get('trialDay') == trial_day
-                    ]
-                    
-                    if day_notifications:
-                        day_grouped = self._group_consecutive_notifications(day_notifications, max_gap_minutes=60)
-                        
-                        # Ensure grouped notifications retain trial metadata
-                        for grouped_notif in day_grouped:
-                            grouped_notif['isFreeTrialDiet'] = True
-                            grouped_notif['trialDay'] = trial_day
-                            if grouped_notif.get('grouped'):
-                                grouped_notif['id'] = f"{grouped_notif.get('id', '')}_trialday{trial_day}"
-                        
-                        grouped_notifications.extend(day_grouped)
-                        logger.info(f"[GROUPING] Trial Day {trial_day}: {len(day_notifications)} notifications grouped into {len(day_grouped)} groups")
-                
-                # Safety: preserve any notifications missing trialDay without grouping
-                notifications_without_trial_day = [
-                    n for n in notifications
-                    if n.get('trialDay') not in [1, 2, 3]
-                ]
-                if notifications_without_trial_day:
-                    logger.warning(f"[GROUPING] Found {len(notifications_without_trial_day)} free trial notifications without trialDay, skipping grouping")
-                    grouped_notifications.extend(notifications_without_trial_day)
-                
-                logger.info(f"[GROUPING] Final (free trial): {len(notifications)} individual notifications grouped into {len(grouped_notifications)} notifications")
-                return grouped_notifications
+            # For free trial diets, notifications already have trialDay set
+            # For regular diets, apply selectedDays if not set
+            if not is_free_trial_diet:
+                if not notification.get('selectedDays'):
+                    if diet_days:
+                        notification['selectedDays'] = diet_days
+                        trace(DIET_EXTRACTION_TRACE, lambda: f"Applied diet days {diet_days} to notification: {notification['message'][:50]}...")
+                    else:
+                        # CONSERVATIVE FIX: If we can't determine days, DON'T default to any days
+                        # Let the user manually configure this to prevent wrong notifications
+                        notification['selectedDays'] = []  # Empty - user must configure
+                    notification['isActive'] = False  # Inactive until user configures
+                    logger.warning(f"Could not determine days for notification: {notification['message'][:50]}... - marked as inactive")
             
-            # Group consecutive notifications within 1 hour for each day (regular diets only)
-            # This reduces notification count while maintaining all tasks
+            notifications.append(notification)
+        
+        logger.info(f"Extracted {len(notifications)} timed activities from diet PDF for user {user_id}")
+        
+        # For free trial diets, group consecutive notifications within 1 hour per trial day
+        if is_free_trial_diet:
             grouped_notifications = []
+            trial_days = sorted({n.get('trialDay') for n in notifications if n.get('trialDay') in [1, 2, 3]})
             
-            # Get all unique days from notifications
-            all_days = set()
-            for notif in notifications:
-                all_days.update(notif.get('selectedDays', []))
-            
-            # If no specific days, use all days (fallback)
-            if not all_days:
-                all_days = diet_days if diet_days else []
-            
-            # Group notifications by day, then group consecutive within each day
-            for day in all_days:
-                # Filter notifications for this specific day
+            for trial_day in trial_days:
                 day_notifications = [
-                    n for n in notifications 
-                    if day in n.get('selectedDays', [])
+                    n for n in notifications
+                    if n.get('trialDay') == trial_day
                 ]
                 
                 if day_notifications:
-                    # Group consecutive notifications for this day (max gap: 60 minutes)
                     day_grouped = self._group_consecutive_notifications(day_notifications, max_gap_minutes=60)
                     
-                    # Ensure all grouped notifications are set to only this day
-                    # (since grouping happens per day, each notification should only fire on that day)
+                    # Ensure grouped notifications retain trial metadata
                     for grouped_notif in day_grouped:
-                        # Set selectedDays to only this day for all notifications in this day's group
-                        grouped_notif['selectedDays'] = [day]
-                        # Update ID to include day for uniqueness if it's a grouped notification
+                        grouped_notif['isFreeTrialDiet'] = True
+                        grouped_notif['trialDay'] = trial_day
                         if grouped_notif.get('grouped'):
-                            grouped_notif['id'] = f"{grouped_notif.get('id', '')}_day{day}"
+                            grouped_notif['id'] = f"{grouped_notif.get('id', '')}_trialday{trial_day}"
                     
                     grouped_notifications.extend(day_grouped)
-                    logger.info(f"[GROUPING] Day {day}: {len(day_notifications)} notifications grouped into {len(day_grouped)} groups")
+                    logger.info(f"[GROUPING] Trial Day {trial_day}: {len(day_notifications)} notifications grouped into {len(day_grouped)} groups")
             
-            # Also handle notifications without selectedDays (shouldn't happen after our fixes, but safety check)
-            notifications_without_days = [
-                n for n in notifications 
-                if not n.get('selectedDays')
+            # Safety: preserve any notifications missing trialDay without grouping
+            notifications_without_trial_day = [
+                n for n in notifications
+                if n.get('trialDay') not in [1, 2, 3]
             ]
-            if notifications_without_days:
-                logger.warning(f"[GROUPING] Found {len(notifications_without_days)} notifications without selectedDays, skipping grouping")
-                grouped_notifications.extend(notifications_without_days)
+            if notifications_without_trial_day:
+                logger.warning(f"[GROUPING] Found {len(notifications_without_trial_day)} free trial notifications without trialDay, skipping grouping")
+                grouped_notifications.extend(notifications_without_trial_day)
             
-            logger.info(f"[GROUPING] Final: {len(notifications)} individual notifications grouped into {len(grouped_notifications)} notifications")
+            logger.info(f"[GROUPING] Final (free trial): {len(notifications)} individual notifications grouped into {len(grouped_notifications)} notifications")
             return grouped_notifications
+        
+        # Group consecutive notifications within 1 hour for each day (regular diets only)
+        # This reduces notification count while maintaining all tasks
+        grouped_notifications = []
+        
+        # Get all unique days from notifications
+        all_days = set()
+        for notif in notifications:
+            all_days.update(notif.get('selectedDays', []))
+        
+        # If no specific days, use all days (fallback)
+        if not all_days:
+            all_days = diet_days if diet_days else []
+        
+        # Group notifications by day, then group consecutive within each day
+        for day in all_days:
+            # Filter notifications for this specific day
+            day_notifications = [
+                n for n in notifications 
+                if day in n.get('selectedDays', [])
+            ]
             
-        except Exception as e:
-            logger.error(f"Error extracting notifications from diet PDF for user {user_id}: {e}")
-            return []
+            if day_notifications:
+                # Group consecutive notifications for this day (max gap: 60 minutes)
+                day_grouped = self._group_consecutive_notifications(day_notifications, max_gap_minutes=60)
+                
+                # Ensure all grouped notifications are set to only this day
+                # (since grouping happens per day, each notification should only fire on that day)
+                for grouped_notif in day_grouped:
+                    # Set selectedDays to only this day for all notifications in this day's group
+                    grouped_notif['selectedDays'] = [day]
+                    # Update ID to include day for uniqueness if it's a grouped notification
+                    if grouped_notif.get('grouped'):
+                        grouped_notif['id'] = f"{grouped_notif.get('id', '')}_day{day}"
+                
+                grouped_notifications.extend(day_grouped)
+                logger.info(f"[GROUPING] Day {day}: {len(day_notifications)} notifications grouped into {len(day_grouped)} groups")
+        
+        # Also handle notifications without selectedDays (shouldn't happen after our fixes, but safety check)
+        notifications_without_days = [
+            n for n in notifications 
+            if not n.get('selectedDays')
+        ]
+        if notifications_without_days:
+            logger.warning(f"[GROUPING] Found {len(notifications_without_days)} notifications without selectedDays, skipping grouping")
+            grouped_notifications.extend(notifications_without_days)
+        
+        logger.info(f"[GROUPING] Final: {len(notifications)} individual notifications grouped into {len(grouped_notifications)} notifications")
+        return grouped_notifications
     
     def send_immediate_notification(self, user_id: str, notification: Dict) -> bool:
         """
         Send an immediate notification to a user.
         """
+        # Imported here so extraction worker processes don't initialize Firebase
+        from services.firebase_client import send_push_notification, get_user_notification_token
         try:
             user_token = get_user_notification_token(user_id)
             if not user_token:
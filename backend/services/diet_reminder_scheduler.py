@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Diet Reminder Scheduler
+Backend diet reminders fired from an in-memory min-heap of upcoming fire times, filled by a scheduled_for range query instead of a scan of every scheduled notification.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_COLLECTION = "scheduled_notifications"
+USER_NOTIFICATIONS_COLLECTION = "user_notifications"
+PROFILES_COLLECTION = "user_profiles"
+
+# Defaults can be overridden from the environment
+# Off by default: the apps schedule diet reminders locally on the device
+ENABLED = os.getenv("BACKEND_DIET_REMINDERS_ENABLED", "false").lower() in ("1", "true", "yes")
+# Reminders due within the horizon are held in memory; the window is extended every REFRESH_SECONDS
+HORIZON_SECONDS = float(os.getenv("DIET_REMINDER_HORIZON_SECONDS", str(60 * 60)))
+REFRESH_SECONDS = float(os.getenv("DIET_REMINDER_REFRESH_SECONDS", str(5 * 60)))
+# Reminders due up to this much later are sent together with the one that woke the scheduler
+JITTER_SECONDS = float(os.getenv("DIET_REMINDER_JITTER_SECONDS", "30"))
+# Reminders overdue by more than this (e.g. the server was down) roll on to next week unsent
+MISSED_GRACE_SECONDS = float(os.getenv("DIET_REMINDER_MISSED_GRACE_SECONDS", str(15 * 60)))
+RETRY_SECONDS = float(os.getenv("DIET_REMINDER_RETRY_SECONDS", "30"))
+
+STATUS_SCHEDULED = "scheduled"
+# Final states of one-shot (free trial) reminders
+STATUS_SENT = "sent"
+STATUS_MISSED = "missed"
+WEEK_SECONDS = 7 * 24 * 60 * 60
+# Fire lateness samples kept for percentiles
+LATENESS_SAMPLES = 500
+
+
+def _iso(ts: float) -> str:
+    # Always the same format, so scheduled_for strings sort (and range-query) in time order
+    return datetime.fromtimestamp(ts, timezone.utc).replace(microsecond=0).isoformat()
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def next_occurrence(hour: int, minute: int, day: int, now: float) -> float:
+    """Next fire time after now of hour:minute (UTC) on weekday day (0 = Monday)."""
+    current = datetime.fromtimestamp(now, timezone.utc)
+    target = (current + timedelta(days=(day - current.weekday()) % 7)).replace(
+        hour=hour, minute=minute, second=0, microsecond=0
+    )
+    if target.timestamp() <= now:
+        target += timedelta(days=7)
+    return target.timestamp()
+
+
+def trial_occurrence(hour: int, minute: int, trial_day: int, trial_start: float) -> float:
+    """Fire time of hour:minute (UTC) on free trial day trial_day (1 = the day the trial started)."""
+    start = datetime.fromtimestamp(trial_start, timezone.utc)
+    target = start.replace(hour=hour, minute=minute, second=0, microsecond=0) + timedelta(days=trial_day - 1)
+    return target.timestamp()
+
+
+def reminder_doc_id(user_id: str, notification_id: str, day: int) -> str:
+    return f"{user_id}_{notification_id}_{day}"
+
+
+def trial_reminder_doc_id(user_id: str, notification_id: str, trial_day: int) -> str:
+    return f"{user_id}_{notification_id}_trial{trial_day}"
+
+
+class DietReminderScheduler:
+    """
+    One scheduled_notifications document per reminder and weekday, with a deterministic ID that
+    rolls forward a week each time it fires (free trial reminders fire once and are then marked
+    sent). Reminders due before loaded_until sit in a min-heap of
+    (due time, sequence, doc ID); a status/scheduled_for range query extends that window by
+    HORIZON_SECONDS, so loading and firing only ever read reminders that are due soon.
+    schedule_user()/cancel_user() update the heap as they write; replaced and cancelled entries are
+    dropped lazily when they reach the top. Each reminder is re-read before it fires (catching
+    changes made by another process) and queued on the notification outbox under a per-occurrence
+    key, so it is sent once even if several processes run the scheduler.
+    Methods are blocking - the async wrappers and the background thread keep them off the event loop.
+    """
+
+    def __init__(self, db, enqueue: Optional[Callable[..., Optional[str]]] = None,
+                 horizon: float = HORIZON_SECONDS, refresh: float = REFRESH_SECONDS,
+                 jitter: float = JITTER_SECONDS, missed_grace: float = MISSED_GRACE_SECONDS,
+                 retry: float = RETRY_SECONDS, clock=time.time):
+        self.db = db
+        self._enqueue = enqueue
+        self.horizon = horizon
+        self.refresh = refresh
+        self.jitter = jitter
+        self.missed_grace = missed_grace
+        self.retry = retry
+        self._clock = clock
+        self._heap: List[Tuple[float, int, str]] = []
+        # doc ID -> (sequence of its live heap entry, scheduled fire time)
+        self._entries: Dict[str, Tuple[int, float]] = {}
+        self._sequence = itertools.count()
+        self._loaded_until: Optional[float] = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        # Held while the window is loaded or fired and while a user's reminders are rewritten
+        self._run_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lateness = deque(maxlen=LATENESS_SAMPLES)
+        self._stats = {"loaded": 0, "load_queries": 0, "scheduled": 0, "cancelled": 0,
+                       "fired": 0, "missed": 0, "stale": 0, "errors": 0}
+
+    def _collection(self):
+        return self.db.collection(SCHEDULED_COLLECTION)
+
+    def _count(self, field: str, amount: int = 1):
+        with self._lock:
+            self._stats[field] += amount
+
+    # --- Heap ---
+
+    def _push(self, doc_id: str, fire_at: float, due_at: Optional[float] = None):
+        """Track doc_id at fire_at if it falls inside the loaded window; otherwise the range query finds it later."""
+        due_at = fire_at if due_at is None else due_at
+        with self._lock:
+            if self._loaded_until is None or fire_at >= self._loaded_until:
+                self._entries.pop(doc_id, None)
+                return
+            sequence = next(self._sequence)
+            self._entries[doc_id] = (sequence, fire_at)
+            heapq.heappush(self._heap, (due_at, sequence, doc_id))
+            earliest = self._heap[0][1] == sequence
+        if earliest:
+            self._wake.set()
+
+    def _discard(self, doc_id: str):
+        with self._lock:
+            self._entries.pop(doc_id, None)
+
+    def _pop_due(self, now: float) -> List[Tuple[str, float]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now + self.jitter:
+                _, sequence, doc_id = heapq.heappop(self._heap)
+                entry = self._entries.get(doc_id)
+                if entry is None or entry[0] != sequence:
+                    continue
+                del self._entries[doc_id]
+                due.append((doc_id, entry[1]))
+            # Entries replaced or cancelled are compacted once they outnumber the live ones
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                live = {(doc_id, sequence) for doc_id, (sequence, _) in self._entries.items()}
+                self._heap = [item for item in self._heap if (item[2], item[1]) in live]
+                heapq.heapify(self._heap)
+        return due
+
+    def load(self, now: Optional[float] = None) -> int:
+        """Extend the in-memory window to now + horizon with a range query on scheduled_for; returns reminders added."""
+        now = self._clock() if now is None else now
+        with self._run_lock:
+            return self._load(now)
+
+    def _load(self, now: float) -> int:
+        with self._lock:
+            start = self._loaded_until
+        # Whole seconds, matching the scheduled_for strings compared against
+        end = float(int(now + self.horizon))
+        if start is not None and end <= start:
+            return 0
+        query = self._collection().where("status", "==", STATUS_SCHEDULED)
+        # The first load has no lower bound, so reminders that fell due while the server was down roll forward
+        if start is not None:
+            query = query.where("scheduled_for", ">=", _iso(start))
+        query = query.where("scheduled_for", "<", _iso(end)).order_by("scheduled_for")
+        found = [(doc.id, _timestamp(doc.to_dict()["scheduled_for"])) for doc in query.stream()]
+        added = 0
+        with self._lock:
+            self._stats["load_queries"] += 1
+            self._loaded_until = end
+            self._next_refresh = now + self.refresh
+        for doc_id, fire_at in found:
+            with self._lock:
+                entry = self._entries.get(doc_id)
+            if entry is not None and entry[1] == fire_at:
+                continue
+            self._push(doc_id, fire_at)
+            added += 1
+        self._count("loaded", added)
+        if added:
+            logger.info(f"[DIET REMINDERS] Loaded {added} reminder(s) due before {_iso(end)}")
+        return added
+
+    # --- Creating, editing and cancelling ---
+
+    def _trial_start(self, user_id: str) -> Optional[float]:
+        """When the user's free trial started: freeTrialStartDate, else lastDietUpload (set to the trial start for the default diet)."""
+        doc = self.db.collection(PROFILES_COLLECTION).document(user_id).get(field_paths=["freeTrialStartDate", "lastDietUpload"])
+        profile = (doc.to_dict() or {}) if doc.exists else {}
+        started = profile.get("freeTrialStartDate") or profile.get("lastDietUpload")
+        if not started:
+            return None
+        value = datetime.fromisoformat(started.replace("Z", "+00:00"))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    def schedule_user(self, user_id: str) -> int:
+        """
+        Write the reminders wanted for the user's active diet notifications, removing those no
+        longer wanted; unchanged reminders keep their document untouched. Returns reminders scheduled.
+        Weekly notifications get one rolling reminder per selected weekday; notifications without
+        selectedDays are left for the user to configure, as the extractor marks them. Free trial
+        notifications (trialDay 1-3) get a single one-shot reminder on that day of the trial,
+        unless it is already past.
+        """
+        now = self._clock()
+        doc = self.db.collection(USER_NOTIFICATIONS_COLLECTION).document(user_id).get()
+        notifications = (doc.to_dict() or {}).get("diet_notifications", []) if doc.exists else []
+
+        wanted: Dict[str, Dict[str, Any]] = {}
+        trial_start: Optional[float] = None
+        trial_start_read = False
+        for notification in notifications:
+            if not notification.get("isActive", True) or not notification.get("id"):
+                continue
+            hour, minute = notification.get("hour"), notification.get("minute")
+            if hour is None or minute is None:
+                try:
+                    parsed = datetime.strptime(notification.get("time", ""), "%H:%M")
+                except ValueError:
+                    logger.warning(f"[DIET REMINDERS] Skipping notification {notification['id']} with time {notification.get('time')!r}")
+                    continue
+                hour, minute = parsed.hour, parsed.minute
+            base = {
+                "user_id": user_id,
+                "notification_id": notification["id"],
+                "message": notification.get("message", ""),
+                "time": f"{hour:02d}:{minute:02d}",
+                "hour": hour,
+                "minute": minute,
+                "status": STATUS_SCHEDULED,
+            }
+
+            trial_day = notification.get("trialDay")
+            if trial_day is not None:
+                if not trial_start_read:
+                    trial_start, trial_start_read = self._trial_start(user_id), True
+                    if trial_start is None:
+                        logger.warning(f"[DIET REMINDERS] No trial start for user {user_id}, skipping free trial reminders")
+                if trial_start is None:
+                    continue
+                fire_at = trial_occurrence(hour, minute, trial_day, trial_start)
+                if fire_at <= now:
+                    continue
+                wanted[trial_reminder_doc_id(user_id, notification["id"], trial_day)] = {
+                    **base, "day": None, "trialDay": trial_day, "scheduled_for": _iso(fire_at),
+                }
+                continue
+
+            for day in notification.get("selectedDays") or []:
+                wanted[reminder_doc_id(user_id, notification["id"], day)] = {
+                    **base, "day": day, "scheduled_for": _iso(next_occurrence(hour, minute, day, now)),
+                }
+
+        existing = {d.id: d.to_dict() or {} for d in self._collection().where("user_id", "==", user_id).stream()}
+        removed = existing.keys() - wanted.keys()
+        # Unchanged reminders keep their upcoming occurrence (and heap entry) as they are, and
+        # one-shot reminders that already fired are not sent again
+        changed = {
+            doc_id: reminder for doc_id, reminder in wanted.items()
+            if existing.get(doc_id, {}).get("status") not in (STATUS_SCHEDULED, STATUS_SENT, STATUS_MISSED)
+            or any(existing[doc_id].get(field) != reminder[field] for field in ("message", "time", "day"))
+        }
+        with self._run_lock:
+            self._write_user(removed, changed)
+        self._count("scheduled", len(changed))
+        self._count("cancelled", len(removed))
+        logger.info(
+            f"[DIET REMINDERS] {len(wanted)} reminder(s) for user {user_id}: "
+            f"{len(changed)} written, {len(removed)} removed"
+        )
+        return len(wanted)
+
+    def _write_user(self, removed, changed: Dict[str, Dict[str, Any]]):
+        if removed or changed:
+            batch = self.db.batch()
+            for doc_id in removed:
+                batch.delete(self._collection().document(doc_id))
+            for doc_id, reminder in changed.items():
+                batch.set(self._collection().document(doc_id), {**reminder, "created_at": datetime.now(timezone.utc).isoformat()})
+            batch.commit()
+
+        for doc_id in removed:
+            self._discard(doc_id)
+        for doc_id, reminder in changed.items():
+            self._push(doc_id, _timestamp(reminder["scheduled_for"]))
+
+    def cancel_user(self, user_id: str) -> int:
+        """Delete every reminder of the user; returns how many were removed."""
+        docs = list(self._collection().where("user_id", "==", user_id).stream())
+        if docs:
+            with self._run_lock:
+                self._write_user({doc.id for doc in docs}, {})
+        self._count("cancelled", len(docs))
+        logger.info(f"[DIET REMINDERS] Cancelled {len(docs)} reminder(s) for user {user_id}")
+        return len(docs)
+
+    # --- Firing ---
+
+    def _send(self, reminder: Dict[str, Any], key: str):
+        enqueue = self._enqueue
+        if enqueue is None:
+            from services.notification_outbox import get_notification_outbox
+            enqueue = get_notification_outbox(self.db).enqueue
+        enqueue(
+            reminder["user_id"], "Diet Reminder", reminder.get("message", ""),
+            {
+                "type": "diet_reminder",
+                "source": "diet_pdf",
+                "time": reminder.get("time"),
+                "day": reminder.get("day"),
+                "notification_id": reminder.get("notification_id"),
+                "scheduled_for": reminder.get("scheduled_for"),
+            },
+            source="diet_reminder", key=key,
+        )
+
+    def _fire(self, doc_id: str, fire_at: float, now: float, metrics: Dict[str, Any]):
+        ref = self._collection().document(doc_id)
+        snapshot = ref.get()
+        reminder = snapshot.to_dict() if snapshot.exists else None
+        if not reminder or reminder.get("status") != STATUS_SCHEDULED:
+            metrics["stale"] += 1
+            return
+        scheduled_at = _timestamp(reminder["scheduled_for"])
+        if scheduled_at != fire_at:
+            # Moved by another process since it was loaded
+            metrics["stale"] += 1
+            self._push(doc_id, scheduled_at)
+            return
+
+        missed = now - fire_at > self.missed_grace
+        if missed:
+            metrics["missed"] += 1
+            logger.warning(f"[DIET REMINDERS] Reminder {doc_id} missed by {now - fire_at:.0f}s, skipping it")
+        else:
+            self._send(reminder, key=f"diet_reminder_{doc_id}_{int(fire_at)}")
+            metrics["fired"] += 1
+            with self._lock:
+                self._lateness.append(now - fire_at)
+
+        if reminder.get("trialDay") is not None:
+            # Free trial reminders fire once
+            ref.update({"status": STATUS_MISSED if missed else STATUS_SENT, "last_fired_at": _iso(now)})
+            return
+        next_at = fire_at + WEEK_SECONDS
+        while next_at <= now:
+            next_at += WEEK_SECONDS
+        ref.update({"scheduled_for": _iso(next_at), "last_fired_at": _iso(now)})
+        self._push(doc_id, next_at)
+
+    def run_once(self) -> Dict[str, Any]:
+        """Extend the window if it is time to, then send every reminder due within the jitter window."""
+        with self._run_lock:
+            now = self._clock()
+            if self._loaded_until is None or now >= self._next_refresh:
+                self.load(now)
+            metrics = {"due": 0, "fired": 0, "missed": 0, "stale": 0, "errors": 0}
+            due = self._pop_due(now)
+            metrics["due"] = len(due)
+            for doc_id, fire_at in due:
+                try:
+                    self._fire(doc_id, fire_at, now, metrics)
+                except Exception as e:
+                    logger.error(f"[DIET REMINDERS] Failed to fire reminder {doc_id}: {e}")
+                    metrics["errors"] += 1
+                    self._push(doc_id, fire_at, due_at=now + self.retry)
+            with self._lock:
+                for field in ("fired", "missed", "stale", "errors"):
+                    self._stats[field] += metrics[field]
+            return metrics
+
+    def _sleep_seconds(self) -> float:
+        with self._lock:
+            wake_at = self._next_refresh
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+        return max(0.0, wake_at - self._clock())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[DIET REMINDERS] Scheduler run failed: {e}")
+                self._count("errors")
+                self._stop.wait(self.retry)
+                continue
+            self._wake.wait(self._sleep_seconds())
+
+    def start(self):
+        """Start the scheduler thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="diet-reminders", daemon=True)
+            self._thread.start()
+        logger.info("[DIET REMINDERS] Scheduler started")
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    # --- Same async interface as SimpleNotificationScheduler ---
+
+    async def schedule_user_notifications(self, user_id: str) -> int:
+        return await asyncio.get_event_loop().run_in_executor(None, self.schedule_user, user_id)
+
+    async def cancel_user_notifications(self, user_id: str) -> int:
+        return await asyncio.get_event_loop().run_in_executor(None, self.cancel_user, user_id)
+
+    async def send_due_notifications(self) -> int:
+        metrics = await asyncio.get_event_loop().run_in_executor(None, self.run_once)
+        return metrics["fired"]
+
+    async def cleanup_old_notifications(self) -> int:
+        """Reminders roll forward in place and cancelled ones are deleted, so nothing piles up."""
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked"] = len(self._entries)
+            stats["heap_size"] = len(self._heap)
+            next_due = min((fire_at for _, fire_at in self._entries.values()), default=None)
+            lateness = sorted(self._lateness)
+            loaded_until = self._loaded_until
+        stats["next_due"] = _iso(next_due) if next_due is not None else None
+        stats["loaded_until"] = _iso(loaded_until) if loaded_until is not None else None
+        stats["lateness_p50_seconds"] = round(lateness[len(lateness) // 2], 3) if lateness else None
+        stats["lateness_p95_seconds"] = round(lateness[int(len(lateness) * 0.95)], 3) if lateness else None
+        stats["lateness_max_seconds"] = round(lateness[-1], 3) if lateness else None
+        stats["running"] = self._thread is not None
+        stats["enabled"] = ENABLED
+        stats["horizon_seconds"] = self.horizon
+        stats["jitter_seconds"] = self.jitter
+        return stats
+
+
+# Global instance
+_diet_reminder_scheduler = None
+
+def get_diet_reminder_scheduler(db) -> DietReminderScheduler:
+    """
+    Get the global diet reminder scheduler instance.
+    """
+    global _diet_reminder_scheduler
+    if _diet_reminder_scheduler is None:
+        _diet_reminder_scheduler = DietReminderScheduler(db)
+    return _diet_reminder_scheduler
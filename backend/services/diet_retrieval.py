@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Diet Retrieval
+Splits extracted diet text into day/meal chunks and ranks them per question with a local BM25 index.
+"""
+
+import os
+import re
+import math
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from services.diet_notification_service import diet_notification_service
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+DEFAULT_TOP_K = int(os.getenv("DIET_CONTEXT_TOP_K", "4"))
+# Chunks longer than this are split on line boundaries
+MAX_CHUNK_CHARS = int(os.getenv("DIET_CHUNK_MAX_CHARS", "800"))
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Short header lines that start a meal section within a day
+MEAL_HEADER_PATTERN = re.compile(
+    r'^(EARLY\s+MORNING|MORNING|BREAKFAST|MID[\s-]*MORNING|PRE[\s-]*LUNCH|LUNCH|POST[\s-]*LUNCH|'
+    r'EVENING(?:\s+SNACKS?)?|SNACKS?|PRE[\s-]*WORKOUT|POST[\s-]*WORKOUT|DINNER|POST[\s-]*DINNER|BED\s*TIME)\b\s*[:\-]?',
+    re.IGNORECASE
+)
+MAX_MEAL_HEADER_CHARS = 40
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "can", "do", "does", "for", "from", "how", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "should", "the", "to", "what", "when", "which", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall((text or "").lower()) if token not in STOPWORDS]
+
+
+def _meal_header(line: str) -> Optional[str]:
+    if len(line) > MAX_MEAL_HEADER_CHARS:
+        return None
+    match = MEAL_HEADER_PATTERN.match(line)
+    return re.sub(r"[\s-]+", " ", match.group(1)).upper() if match else None
+
+
+def chunk_diet_text(diet_text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[Dict[str, Any]]:
+    """
+    Split diet text into chunks at day headers (as recognised by DietNotificationService)
+    and meal headers. Each chunk is {"day", "meal", "text"}; text starts with its day/meal
+    label so the label itself is searchable. Text before the first day header has day None.
+    """
+    chunks: List[Dict[str, Any]] = []
+    day, meal, lines = None, None, []
+
+    def flush():
+        body = [line for line in lines if line]
+        if not body:
+            return
+        label = " - ".join(part for part in (day, meal) if part)
+        current, size = [], 0
+        for line in body:
+            if current and size + len(line) > max_chars:
+                chunks.append({"day": day, "meal": meal, "text": "\n".join(([label] if label else []) + current)})
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        chunks.append({"day": day, "meal": meal, "text": "\n".join(([label] if label else []) + current)})
+
+    for raw_line in (diet_text or "").split("\n"):
+        line = raw_line.strip()
+        day_header = diet_notification_service.parse_day_header(line) if line else None
+        if day_header:
+            flush()
+            day, meal, lines = day_header, None, []
+            # Keep any date or note that follows the day name on the header line
+            if line.upper() != day_header:
+                lines.append(line)
+            continue
+        meal_header = _meal_header(line) if line else None
+        if meal_header:
+            flush()
+            meal, lines = meal_header, [line] if line.upper().rstrip(":- ") != meal_header else []
+            continue
+        lines.append(line)
+    flush()
+    return chunks
+
+
+def expand_relative_days(query: str, today: Optional[datetime] = None) -> str:
+    """Add weekday names for "today"/"tomorrow"/"yesterday" so they match day chunks."""
+    today = today or datetime.now()
+    words = set(TOKEN_PATTERN.findall((query or "").lower()))
+    extra = []
+    for word, offset in (("today", 0), ("tonight", 0), ("tomorrow", 1), ("yesterday", -1)):
+        if word in words:
+            extra.append(WEEKDAYS[(today + timedelta(days=offset)).weekday()])
+    return f"{query} {' '.join(extra)}" if extra else query
+
+
+class DietIndex:
+    """BM25 index over the chunks of one diet."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], k1: float = BM25_K1, b: float = BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._term_counts = [Counter(tokenize(chunk["text"])) for chunk in chunks]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        n = len(chunks)
+        self._idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    @classmethod
+    def from_text(cls, diet_text: str) -> "DietIndex":
+        return cls(chunk_diet_text(diet_text))
+
+    def score(self, query_terms: List[str], index: int) -> float:
+        counts = self._term_counts[index]
+        length_norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._avg_length or 1))
+        score = 0.0
+        for term in query_terms:
+            frequency = counts.get(term)
+            if frequency:
+                score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + length_norm)
+        return score
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K) -> List[Dict[str, Any]]:
+        """
+        Top-k chunks for the query in document order. When nothing matches, the first k
+        chunks are returned so general questions still get the start of the plan.
+        """
+        query_terms = list(set(tokenize(expand_relative_days(query))))
+        scored = [(self.score(query_terms, index), index) for index in range(len(self.chunks))]
+        top = sorted((item for item in scored if item[0] > 0), reverse=True)[:k]
+        indexes = sorted(index for _, index in top) if top else list(range(min(k, len(self.chunks))))
+        return [self.chunks[index] for index in indexes]
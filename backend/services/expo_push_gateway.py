@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Expo Push Gateway
+Batches push messages into Expo's 100-message send API over one long-lived HTTP/2 keep-alive client.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import importlib.util
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+# Optional; only needed when enhanced push security is enabled for the Expo project
+EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN", "")
+# Expo accepts at most 100 messages per request
+MAX_BATCH_SIZE = 100
+# How long a message waits for others to share its request
+LINGER_SECONDS = float(os.getenv("EXPO_PUSH_LINGER_MS", "10")) / 1000
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("EXPO_PUSH_TIMEOUT_SECONDS", "10"))
+MAX_CONCURRENT_BATCHES = int(os.getenv("EXPO_PUSH_MAX_CONCURRENT_BATCHES", "4"))
+MAX_ATTEMPTS = int(os.getenv("EXPO_PUSH_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE_SECONDS = float(os.getenv("EXPO_PUSH_BACKOFF_BASE_SECONDS", "0.5"))
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); without it the client stays on HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Status codes worth retrying: rate limiting and server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Batch latency samples kept for percentiles
+LATENCY_SAMPLES = 200
+
+
+def push_message(token: str, title: str, body: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Expo push message in the shape the app has always sent."""
+    return {"to": token, "sound": "default", "title": title, "body": body, "data": data or {}}
+
+
+def error_ticket(error: str, message: str) -> Dict[str, Any]:
+    """A ticket in Expo's error shape, for messages that never got a ticket from Expo."""
+    return {"status": "error", "message": message, "details": {"error": error}}
+
+
+def ticket_ok(ticket: Optional[Dict[str, Any]]) -> bool:
+    return bool(ticket) and ticket.get("status") == "ok"
+
+
+class ExpoPushGateway:
+    """
+    Messages from any thread or event loop are queued on the gateway's own event loop thread,
+    held for up to linger_seconds, and posted in batches of up to 100 on a shared httpx.AsyncClient.
+    Each caller gets back the ticket Expo returned for its message (tickets come back in message order).
+    """
+
+    def __init__(self, url: str = EXPO_PUSH_URL, batch_size: int = MAX_BATCH_SIZE, linger_seconds: float = LINGER_SECONDS,
+                 timeout: float = REQUEST_TIMEOUT_SECONDS, max_concurrent_batches: int = MAX_CONCURRENT_BATCHES,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE_SECONDS,
+                 access_token: str = EXPO_ACCESS_TOKEN, http2: bool = HTTP2_AVAILABLE):
+        self.url = url
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.linger_seconds = linger_seconds
+        self.timeout = timeout
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.access_token = access_token
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queue: List[Tuple[Dict[str, Any], Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = {"messages": 0, "batches": 0, "tickets_ok": 0, "tickets_error": 0, "request_errors": 0, "retries": 0}
+        self._errors: Dict[str, int] = {}
+        self._listeners: List[Callable[[Dict[str, Any], Dict[str, Any]], None]] = []
+
+    # --- Event loop thread ---
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+                    self._client = self._create_client()
+                    ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="expo-push", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+                logger.info(f"[EXPO PUSH] Gateway started ({'HTTP/2' if self.http2 else 'HTTP/1.1'} keep-alive, url={self.url})")
+            return self._loop
+
+    def _create_client(self) -> httpx.AsyncClient:
+        headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate", "Content-Type": "application/json"}
+        if self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        return httpx.AsyncClient(
+            http2=self.http2,
+            headers=headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrent_batches, max_keepalive_connections=self.max_concurrent_batches,
+                                keepalive_expiry=120),
+        )
+
+    def _enqueue(self, messages: List[Dict[str, Any]], futures: List[Future]):
+        """Runs on the gateway loop."""
+        self._queue.extend(zip(messages, futures))
+        while len(self._queue) >= self.batch_size:
+            self._start_batch()
+        if self._queue and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.linger_seconds, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        while self._queue:
+            self._start_batch()
+
+    def _start_batch(self):
+        batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+        if not self._queue and self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        asyncio.get_running_loop().create_task(self._send_batch(batch))
+
+    async def _send_batch(self, batch: List[Tuple[Dict[str, Any], Future]]):
+        try:
+            async with self._semaphore:
+                tickets = await self._post([message for message, _ in batch])
+        except Exception as e:
+            logger.error(f"[EXPO PUSH] Unexpected error sending batch of {len(batch)}: {e}")
+            tickets = [error_ticket(type(e).__name__, str(e)) for _ in batch]
+        for (message, future), ticket in zip(batch, tickets):
+            self._record_ticket(ticket)
+            for listener in self._listeners:
+                try:
+                    listener(message, ticket)
+                except Exception as e:
+                    logger.error(f"[EXPO PUSH] Ticket listener failed: {e}")
+            if not future.done():
+                future.set_result(ticket)
+
+    async def _post(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """POST one batch, retrying rate limits, server errors and connection failures with jittered backoff."""
+        started = time.monotonic()
+        with self._lock:
+            self._stats["batches"] += 1
+        failure = error_ticket("RequestFailed", "Push request failed")
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = await self._client.post(self.url, json=messages)
+                if response.status_code == 200:
+                    tickets = self._parse_tickets(response.json(), len(messages))
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - started)
+                    return tickets
+                failure = error_ticket(f"HTTP{response.status_code}", f"Expo returned {response.status_code}: {response.text[:200]}")
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+            except (httpx.TransportError, ValueError) as e:
+                failure = error_ticket(type(e).__name__, f"Push request failed: {e}")
+                # Only retry when the request certainly never reached Expo, so nobody gets a push twice
+                if not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+                    break
+            if attempt < self.max_attempts:
+                with self._lock:
+                    self._stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, self.backoff_base * 2 ** (attempt - 1)))
+        with self._lock:
+            self._stats["request_errors"] += 1
+        logger.error(f"[EXPO PUSH] Batch of {len(messages)} failed: {failure['message']}")
+        return [dict(failure) for _ in messages]
+
+    @staticmethod
+    def _parse_tickets(result: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+        data = result.get("data") if isinstance(result, dict) else None
+        if isinstance(data, dict):
+            # A single-message request may get a single ticket object back
+            data = [data]
+        if not isinstance(data, list) or len(data) != count:
+            errors = result.get("errors") if isinstance(result, dict) else None
+            message = f"Unexpected Expo response: {errors or result}"
+            return [error_ticket("InvalidResponse", message[:300]) for _ in range(count)]
+        return data
+
+    def _record_ticket(self, ticket: Dict[str, Any]):
+        with self._lock:
+            if ticket_ok(ticket):
+                self._stats["tickets_ok"] += 1
+            else:
+                self._stats["tickets_error"] += 1
+                error = (ticket.get("details") or {}).get("error") or "Unknown"
+                self._errors[error] = self._errors.get(error, 0) + 1
+
+    # --- Public API (any thread or event loop) ---
+
+    def add_listener(self, listener: Callable[[Dict[str, Any], Dict[str, Any]], None]):
+        """Call listener(message, ticket) for every ticket; it runs on the gateway loop, so it must not block."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def submit(self, messages: List[Dict[str, Any]]) -> List[Future]:
+        """Queue messages; each returned concurrent Future resolves to that message's ticket."""
+        loop = self._ensure_started()
+        futures = [Future() for _ in messages]
+        with self._lock:
+            self._stats["messages"] += len(messages)
+        loop.call_soon_threadsafe(self._enqueue, list(messages), futures)
+        return futures
+
+    async def send(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send one message and return its Expo ticket."""
+        return (await self.send_many([message]))[0]
+
+    async def send_many(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send messages (batched with everything else in flight) and return their tickets in order."""
+        if not messages:
+            return []
+        return list(await asyncio.gather(*(asyncio.wrap_future(future) for future in self.submit(messages))))
+
+    def send_sync(self, message: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Blocking send for code running in worker threads."""
+        future = self.submit([message])[0]
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.timeout * self.max_attempts + 5)
+        except Exception as e:
+            return error_ticket(type(e).__name__, f"Push send did not complete: {e}")
+
+    def close(self):
+        """Close the client and stop the loop thread (queued messages are flushed first)."""
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def shutdown():
+            self._flush()
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*pending, return_exceptions=True)
+            await self._client.aclose()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=self.timeout * self.max_attempts + 5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["errors"] = dict(self._errors)
+            latencies = sorted(self._latencies)
+        stats["avg_batch_size"] = round(stats["messages"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["batch_latency_p50"] = round(latencies[len(latencies) // 2], 3) if latencies else None
+        stats["batch_latency_p95"] = round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3) if latencies else None
+        stats["http2"] = self.http2
+        stats["linger_ms"] = round(self.linger_seconds * 1000, 1)
+        stats["started"] = self._loop is not None
+        return stats
+
+
+# Global instance
+expo_push_gateway = ExpoPushGateway()
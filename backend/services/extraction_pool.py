@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Extraction Service
+Runs CPU-bound PDF text extraction and diet activity parsing in a process pool with a bounded queue and per-job timeouts.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from services.pdf_text_cache import content_key
+from services.pdf_extraction import PARALLEL_MIN_PAGES, merge_reports, page_count
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs queued or running before new ones are rejected instead of waiting
+MAX_PENDING = int(os.getenv("EXTRACTION_MAX_PENDING", "16"))
+JOB_TIMEOUTS = {
+    "pdf_text": float(os.getenv("EXTRACTION_TIMEOUT_PDF_TEXT", "60")),
+    "diet_notifications": float(os.getenv("EXTRACTION_TIMEOUT_DIET_NOTIFICATIONS", "30")),
+}
+DEFAULT_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT_DEFAULT", "60"))
+# Set to 0 to run jobs on a thread instead (e.g. where worker processes cannot be started)
+USE_PROCESSES = os.getenv("EXTRACTION_USE_PROCESSES", "1") != "0"
+
+# Latency samples kept per job type for percentiles
+LATENCY_SAMPLES = 200
+
+
+class ExtractionBusyError(Exception):
+    """Raised without queueing the job when the extraction queue is full."""
+
+
+class ExtractionTimeoutError(asyncio.TimeoutError):
+    """Raised when an extraction job runs past its timeout."""
+
+
+# Jobs run in the worker processes. They import the services they need there and return
+# plain dicts, so results pickle cleanly and errors come back as plain RuntimeErrors.
+
+def _extract_text_job(pdf_bytes: bytes, pages: Optional[List[int]] = None) -> Dict[str, Any]:
+    from services.pdf_extraction import extract_pdf_text
+    try:
+        return extract_pdf_text(pdf_bytes, pages)
+    except Exception as e:
+        raise RuntimeError(f"PDF text extraction failed: {e}")
+
+
+def _diet_notifications_job(diet_text: str, user_id: str) -> Dict[str, Any]:
+    from services.diet_notification_service import diet_notification_service
+    try:
+        return {"notifications": diet_notification_service.create_notifications_from_text(diet_text, user_id)}
+    except Exception as e:
+        raise RuntimeError(f"Diet activity parsing failed: {e}")
+
+
+def _percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+
+class ExtractionService:
+    """
+    Process pool for PDF parsing and diet activity extraction, so large uploads neither block the
+    event loop nor hold the GIL. The pool is started on first use with the spawn start method
+    (forking a process with gRPC threads is unsafe). A job that times out while running cannot be
+    interrupted, so the pool is replaced and its workers terminated; other jobs running on it fail.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING,
+                 timeouts: Optional[Dict[str, float]] = None, use_processes: bool = USE_PROCESSES):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(max_pending, self.max_workers)
+        self.timeouts = dict(JOB_TIMEOUTS if timeouts is None else timeouts)
+        self.use_processes = use_processes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._restarts = 0
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._engines = {"documents": 0, "parallel_documents": 0, "pages": Counter(), "escalated_pages": 0}
+
+    def _metric(self, job_type: str) -> Dict[str, Any]:
+        metric = self._metrics.get(job_type)
+        if metric is None:
+            metric = self._metrics.setdefault(job_type, {
+                "jobs": 0, "completed": 0, "failed": 0, "timeouts": 0, "rejected": 0, "cache_hits": 0,
+                "latencies": deque(maxlen=LATENCY_SAMPLES),
+            })
+        return metric
+
+    def _count(self, job_type: str, field: str, latency: Optional[float] = None):
+        with self._lock:
+            metric = self._metric(job_type)
+            metric[field] += 1
+            if latency is not None:
+                metric["latencies"].append(latency)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _recycle_pool(self, pool: ProcessPoolExecutor):
+        """Replace a pool whose worker is stuck on a timed-out job (or that broke) and kill its workers."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self._restarts += 1
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                process.terminate()
+            except Exception:
+                pass
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning("[EXTRACTION] Replaced the extraction process pool")
+
+    async def run(self, job_type: str, func: Callable[..., Dict[str, Any]], *args,
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run func(*args) in the pool and return its dict result.
+        Raises ExtractionBusyError, ExtractionTimeoutError or the job's RuntimeError.
+        """
+        with self._lock:
+            self._metric(job_type)["jobs"] += 1
+            if self._pending >= self.max_pending:
+                self._metric(job_type)["rejected"] += 1
+                raise ExtractionBusyError(f"Extraction queue is full ({self._pending} jobs pending)")
+            self._pending += 1
+
+        def release(_):
+            # Released when the job actually finishes (or its pool is torn down)
+            with self._lock:
+                self._pending -= 1
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        pool = None
+        try:
+            if self.use_processes:
+                pool = self._get_pool()
+                future = pool.submit(func, *args)
+            else:
+                future = loop.run_in_executor(None, func, *args)
+        except Exception:
+            release(None)
+            raise
+        future.add_done_callback(release)
+
+        budget = timeout if timeout is not None else self.timeouts.get(job_type, DEFAULT_TIMEOUT)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future) if pool is not None else future, budget)
+        except asyncio.TimeoutError:
+            self._count(job_type, "timeouts")
+            if pool is not None and not future.cancel():
+                self._recycle_pool(pool)
+            logger.warning(f"[EXTRACTION] {job_type} job timed out after {budget}s")
+            raise ExtractionTimeoutError(f"{job_type} extraction timed out after {budget}s")
+        except BrokenProcessPool as e:
+            self._count(job_type, "failed")
+            self._recycle_pool(pool)
+            raise RuntimeError(f"{job_type} extraction worker died: {e}")
+        except Exception:
+            self._count(job_type, "failed")
+            raise
+        self._count(job_type, "completed", time.monotonic() - started)
+        return result
+
+    async def extract_text(self, pdf_bytes: bytes, text_cache=None, report: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Text of a PDF, from the content-hash cache or parsed in the pool (and then cached).
+        If report is given it is filled with the extraction report (engine, pages, timings) or {"cached": True}.
+        """
+        if text_cache is None:
+            from services.pdf_rag_service import pdf_rag_service
+            text_cache = pdf_rag_service.text_cache
+        key = content_key(pdf_bytes)
+        cached = text_cache.get(key)
+        if cached is not None:
+            self._count("pdf_text", "cache_hits")
+            if report is not None:
+                report["cached"] = True
+            return cached
+        result = await self._extract_pdf(pdf_bytes)
+        if report is not None:
+            report.update({name: value for name, value in result.items() if name != "text"})
+        if result["text"]:
+            text_cache.set(key, result["text"])
+        return result["text"]
+
+    async def _extract_pdf(self, pdf_bytes: bytes) -> Dict[str, Any]:
+        """
+        One job for short documents; longer ones are split into contiguous page ranges extracted
+        in parallel when the pool has room, then merged in page order.
+        """
+        parts = 1
+        if self.use_processes and self.max_workers > 1:
+            try:
+                pages = await asyncio.get_running_loop().run_in_executor(None, page_count, pdf_bytes)
+            except Exception:
+                pages = 0  # Let the job fall back to pdfplumber and report the error
+            with self._lock:
+                free = self.max_pending - self._pending
+            if pages >= PARALLEL_MIN_PAGES:
+                parts = max(1, min(self.max_workers, pages, free))
+        if parts == 1:
+            result = await self.run("pdf_text", _extract_text_job, pdf_bytes)
+        else:
+            started = time.monotonic()
+            # Contiguous ranges, so merging the reports in order keeps the pages in order
+            size = -(-pages // parts)
+            ranges = [list(range(start, min(pages, start + size))) for start in range(0, pages, size)]
+            reports = await asyncio.gather(*(self.run("pdf_text", _extract_text_job, pdf_bytes, part) for part in ranges))
+            result = merge_reports(list(reports), time.monotonic() - started)
+        with self._lock:
+            self._engines["documents"] += 1
+            self._engines["parallel_documents"] += 1 if parts > 1 else 0
+            self._engines["pages"].update(page["engine"] for page in result["pages"])
+            self._engines["escalated_pages"] += result["escalated_pages"]
+        return result
+
+    async def create_notifications(self, user_id: str, diet_text: str) -> List[Dict[str, Any]]:
+        """Grouped diet notifications parsed from extracted diet text in the pool."""
+        result = await self.run("diet_notifications", _diet_notifications_job, diet_text, user_id)
+        return result["notifications"]
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = {}
+            for job_type, metric in self._metrics.items():
+                latencies = list(metric["latencies"])
+                jobs[job_type] = {key: value for key, value in metric.items() if key != "latencies"}
+                jobs[job_type]["latency_p50"] = _percentile(latencies, 0.5)
+                jobs[job_type]["latency_p95"] = _percentile(latencies, 0.95)
+            return {
+                "mode": "process" if self.use_processes else "thread",
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "pool_started": self._pool is not None,
+                "pool_restarts": self._restarts,
+                "timeouts": dict(self.timeouts),
+                "jobs": jobs,
+                "pdf_engines": {**self._engines, "pages": dict(self._engines["pages"])},
+            }
+
+
+# Global instance
+extraction_service = ExtractionService()
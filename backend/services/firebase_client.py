@@ -4,9 +4,11 @@ import os
 from fastapi import HTTPException
 # Add storage import
 from firebase_admin import storage
-import requests
 import json
 from datetime import datetime, timedelta
+from services.tracing import trace, PUSH_DEBUG, TOKEN_DEBUG
+from services.expo_push_gateway import expo_push_gateway, push_message, ticket_ok
+from services.push_token_registry import get_push_token_registry
 
 # Initialize Firebase using environment variables
 def initialize_firebase():
@@ -276,65 +278,30 @@ def list_non_dietician_users():
 
 # --- Get User Notification Token ---
 def get_user_notification_token(user_id: str) -> str:
-    print(f"[TOKEN DEBUG] ===== GETTING USER NOTIFICATION TOKEN =====")
-    print(f"[TOKEN DEBUG] User ID: {user_id}")
+    trace(TOKEN_DEBUG, "===== GETTING USER NOTIFICATION TOKEN =====")
+    trace(TOKEN_DEBUG, lambda: f"User ID: {user_id}")
     
     if db is None:
         print("[TOKEN DEBUG] ❌ Firebase not initialized, cannot get notification token")
         return None
     
     try:
-        print(f"[TOKEN DEBUG] Step 1: Looking up document in user_profiles collection")
-        doc = db.collection("user_profiles").document(user_id).get()
-        
-        if not doc.exists:
-            print(f"[TOKEN DEBUG] ❌ User {user_id} document does not exist")
-            return None
-        
-        print(f"[TOKEN DEBUG] ✅ User {user_id} document exists")
-        data = doc.to_dict()
-        
-        print(f"[TOKEN DEBUG] Step 2: Checking document fields")
-        print(f"[TOKEN DEBUG] Document fields: {list(data.keys())}")
-        
-        # CRITICAL FIX: Ensure we're getting a USER token, not dietician token
-        is_dietician = data.get("isDietician", False)
-        print(f"[TOKEN DEBUG] isDietician field: {is_dietician}")
-        
-        if is_dietician:
-            print(f"[TOKEN DEBUG] ❌ User {user_id} is marked as dietician, skipping user token retrieval")
-            return None
-        
-        print(f"[TOKEN DEBUG] ✅ User {user_id} is not dietician")
-        
-        # Check for both expoPushToken and notificationToken
-        expo_token = data.get("expoPushToken")
-        notif_token = data.get("notificationToken")
-        token = expo_token or notif_token
-        
-        print(f"[TOKEN DEBUG] Step 3: Checking token fields")
-        print(f"[TOKEN DEBUG] expoPushToken exists: {expo_token is not None}")
-        print(f"[TOKEN DEBUG] notificationToken exists: {notif_token is not None}")
-        print(f"[TOKEN DEBUG] Selected token: {token[:20] if token else 'None'}...")
-        
-        # Validate token format
-        if token and not token.startswith("ExponentPushToken"):
-            print(f"[TOKEN DEBUG] ❌ Invalid token format for user {user_id}: {token[:20]}...")
-            return None
+        # Cached, projected lookup; dietician accounts get no user token
+        token = get_push_token_registry(db).get_user_token(user_id, include_dieticians=False)
         
         if token:
-            print(f"[TOKEN DEBUG] ✅ Valid token found for user {user_id}")
-            print(f"[TOKEN DEBUG] Token preview: {token[:30]}...")
+            trace(TOKEN_DEBUG, lambda: f"✅ Valid token found for user {user_id}")
+            trace(TOKEN_DEBUG, lambda: f"Token preview: {token[:30]}...")
         else:
             print(f"[TOKEN DEBUG] ❌ No valid token found for user {user_id}")
             
-        print(f"[TOKEN DEBUG] ===== TOKEN RETRIEVAL COMPLETE =====")
+        trace(TOKEN_DEBUG, "===== TOKEN RETRIEVAL COMPLETE =====")
         return token
         
     except Exception as e:
         print(f"[TOKEN DEBUG] ❌ Exception getting notification token for user {user_id}: {e}")
         import traceback
-        print(f"[TOKEN DEBUG] Traceback: {traceback.format_exc()}")
+        trace(TOKEN_DEBUG, lambda: f"Traceback: {traceback.format_exc()}")
         return None
 
 # --- Send Push Notification via Expo ---
@@ -342,11 +309,11 @@ def send_push_notification(token: str, title: str, body: str, data: dict = None)
     """
     Send push notification using Expo's push service
     """
-    print(f"[PUSH DEBUG] ===== SENDING PUSH NOTIFICATION =====")
-    print(f"[PUSH DEBUG] Token: {token[:20] if token else 'None'}...")
-    print(f"[PUSH DEBUG] Title: {title}")
-    print(f"[PUSH DEBUG] Body: {body}")
-    print(f"[PUSH DEBUG] Data: {data}")
+    trace(PUSH_DEBUG, "===== SENDING PUSH NOTIFICATION =====")
+    trace(PUSH_DEBUG, lambda: f"Token: {token[:20] if token else 'None'}...")
+    trace(PUSH_DEBUG, lambda: f"Title: {title}")
+    trace(PUSH_DEBUG, lambda: f"Body: {body}")
+    trace(PUSH_DEBUG, lambda: f"Data: {data}")
     
     if not token:
         print("[PUSH DEBUG] ❌ No notification token provided")
@@ -357,73 +324,37 @@ def send_push_notification(token: str, title: str, body: str, data: dict = None)
         print(f"[PUSH DEBUG] ❌ Invalid token format: {token[:20]}...")
         return False
     
-    print(f"[PUSH DEBUG] ✅ Token format is valid")
+    trace(PUSH_DEBUG, "✅ Token format is valid")
     
     try:
-        # Expo push notification payload
-        message = {
-            "to": token,
-            "sound": "default",
-            "title": title,
-            "body": body,
-            "data": data or {}
-        }
+        message = push_message(token, title, body, data)
         
-        print(f"[PUSH DEBUG] Step 1: Preparing Expo payload")
-        print(f"[PUSH DEBUG] Payload: {json.dumps(message, indent=2)}")
-        
-        print(f"[PUSH DEBUG] Step 2: Sending to Expo Push Service")
-        print(f"[PUSH DEBUG] URL: https://exp.host/--/api/v2/push/send")
-        
-        # Send to Expo's push service
-        response = requests.post(
-            "https://exp.host/--/api/v2/push/send",
-            headers={
-                "Accept": "application/json",
-                "Accept-encoding": "gzip, deflate",
-                "Content-Type": "application/json",
-            },
-            data=json.dumps(message),
-            timeout=10  # Add timeout
-        )
+        trace(PUSH_DEBUG, "Step 1: Preparing Expo payload")
+        trace(PUSH_DEBUG, lambda: f"Payload: {json.dumps(message, indent=2)}")
         
-        print(f"[PUSH DEBUG] Step 3: Received Expo response")
-        print(f"[PUSH DEBUG] Status Code: {response.status_code}")
-        print(f"[PUSH DEBUG] Response Headers: {dict(response.headers)}")
-        print(f"[PUSH DEBUG] Response Body: {response.text}")
+        trace(PUSH_DEBUG, "Step 2: Sending to Expo Push Service")
+        trace(PUSH_DEBUG, lambda: f"URL: {expo_push_gateway.url}")
         
-        if response.status_code == 200:
-            result = response.json()
-            print(f"[PUSH DEBUG] Step 4: Parsing Expo response")
-            print(f"[PUSH DEBUG] Parsed Result: {json.dumps(result, indent=2)}")
-            
-            if result.get("data", {}).get("status") == "error":
-                print(f"[PUSH DEBUG] ❌ Expo push error: {result}")
-                return False
-            
-            print(f"[PUSH DEBUG] ✅ Push notification sent successfully")
-            print(f"[PUSH DEBUG] ===== NOTIFICATION SEND COMPLETE =====")
-            return True
-        else:
-            print(f"[PUSH DEBUG] ❌ Failed to send push notification")
-            print(f"[PUSH DEBUG] Status: {response.status_code}")
-            print(f"[PUSH DEBUG] Error: {response.text}")
-            print(f"[PUSH DEBUG] ===== NOTIFICATION SEND FAILED =====")
+        # Send through the shared push gateway, which batches concurrent sends into one request
+        ticket = expo_push_gateway.send_sync(message)
+        
+        trace(PUSH_DEBUG, "Step 3: Received Expo ticket")
+        trace(PUSH_DEBUG, lambda: f"Ticket: {json.dumps(ticket, indent=2)}")
+        
+        if not ticket_ok(ticket):
+            print(f"[PUSH DEBUG] ❌ Expo push error: {ticket}")
+            trace(PUSH_DEBUG, "===== NOTIFICATION SEND FAILED =====")
             return False
+        
+        trace(PUSH_DEBUG, "✅ Push notification sent successfully")
+        trace(PUSH_DEBUG, "===== NOTIFICATION SEND COMPLETE =====")
+        return True
             
-    except requests.exceptions.Timeout:
-        print(f"[PUSH DEBUG] ❌ Timeout sending push notification")
-        print(f"[PUSH DEBUG] ===== NOTIFICATION SEND TIMEOUT =====")
-        return False
-    except requests.exceptions.RequestException as e:
-        print(f"[PUSH DEBUG] ❌ Request error sending push notification: {e}")
-        print(f"[PUSH DEBUG] ===== NOTIFICATION SEND REQUEST ERROR =====")
-        return False
     except Exception as e:
         print(f"[PUSH DEBUG] ❌ Error sending push notification: {e}")
         import traceback
-        print(f"[PUSH DEBUG] Traceback: {traceback.format_exc()}")
-        print(f"[PUSH DEBUG] ===== NOTIFICATION SEND EXCEPTION =====")
+        trace(PUSH_DEBUG, lambda: f"Traceback: {traceback.format_exc()}")
+        trace(PUSH_DEBUG, "===== NOTIFICATION SEND EXCEPTION =====")
         return False
 
 # --- Get Dietician Notification Token ---
@@ -436,31 +367,15 @@ def get_dietician_notification_token() -> str:
         return None
     
     try:
-        # Find the dietician user
-        users_ref = db.collection("user_profiles")
-        dietician_query = users_ref.where("isDietician", "==", True).limit(1).stream()
+        # Cached; read from the small push_tokens/dietician document instead of querying user_profiles
+        token = get_push_token_registry(db).get_dietician_token()
         
-        for user in dietician_query:
-            data = user.to_dict()
-            
-            # CRITICAL FIX: Ensure we're getting a DIETICIAN token
-            is_dietician = data.get("isDietician", False)
-            if not is_dietician:
-                print(f"[NOTIFICATION DEBUG] WARNING: User {user.id} is not marked as dietician, skipping")
-                continue
-            
-            token = data.get("expoPushToken") or data.get("notificationToken")
-            
-            # Validate token format
-            if token and not token.startswith("ExponentPushToken"):
-                print(f"[NOTIFICATION DEBUG] WARNING: Invalid token format for dietician {user.id}: {token[:20]}...")
-                continue
-                
-            print(f"[NOTIFICATION DEBUG] Dietician token: {token[:20] if token else 'None'}...")
-            return token
+        if not token:
+            print("[NOTIFICATION DEBUG] No dietician token found")
+            return None
         
-        print("[NOTIFICATION DEBUG] No dietician found in database")
-        return None
+        print(f"[NOTIFICATION DEBUG] Dietician token: {token[:20]}...")
+        return token
     except Exception as e:
         print(f"Failed to get dietician notification token: {e}")
         return None
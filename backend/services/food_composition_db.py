@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Local Food Composition Database
+Bundled per-100g composition table with a trigram fuzzy index, resolved before asking Gemini.
+"""
+
+import os
+import json
+import logging
+from array import array
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, Tuple
+
+from services.nutrition_cache import normalize_food_name, normalize_quantity
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "food_composition.json")
+
+# Minimum similarity for a fuzzy match to be trusted over Gemini
+DEFAULT_MIN_CONFIDENCE = float(os.getenv("FOOD_DB_MIN_CONFIDENCE", "0.8"))
+# Every word of a fuzzily matched name must be at least this similar to a word of the alias,
+# so an extra word ("brown rice cake", "cold coffee") is not dropped as a typo
+MIN_WORD_SIMILARITY = 0.5
+
+# Weights in grams for units that do not depend on the food (ml treated as grams)
+GRAM_UNITS = {"g": 1.0, "kg": 1000.0, "ml": 1.0, "l": 1000.0, "oz": 28.35}
+
+# A bare number is grams, as everywhere else a servingSize is used ("100" = 100 g)
+BARE_UNIT = "g"
+
+
+def _trigrams(text: str) -> set:
+    """Character trigrams of a padded, normalized string."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a: set, b: set) -> float:
+    """Dice coefficient of two trigram sets."""
+    return 2.0 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+def _words_covered(name: str, alias: str) -> bool:
+    """True if every word of name resembles some word of alias."""
+    alias_words = [_trigrams(word) for word in alias.split()]
+    return all(
+        any(_similarity(_trigrams(word), candidate) >= MIN_WORD_SIMILARITY for candidate in alias_words)
+        for word in name.split()
+    )
+
+
+class FoodCompositionDB:
+    """
+    Array-backed composition table with an alias -> row map and a trigram index over aliases.
+    Lookups try an exact alias match first, then the best trigram (Dice) match above min_confidence.
+    """
+
+    def __init__(self, data_path: str = DEFAULT_DATA_PATH, min_confidence: float = DEFAULT_MIN_CONFIDENCE):
+        self.data_path = data_path
+        self.min_confidence = min_confidence
+        self.version: Optional[str] = None
+
+        # Column storage, one slot per food row
+        self.names: List[str] = []
+        self.calories = array("f")
+        self.protein = array("f")
+        self.fat = array("f")
+        self.servings: List[Dict[str, float]] = []
+
+        # Alias index: alias id -> (alias, row); trigram -> alias ids
+        self._alias_rows: Dict[str, int] = {}
+        self._aliases: List[Tuple[str, int]] = []
+        self._alias_trigram_counts = array("H")
+        self._trigram_index: Dict[str, array] = defaultdict(lambda: array("I"))
+
+        self._stats = {"lookups": 0, "exact_hits": 0, "fuzzy_hits": 0, "misses": 0, "unit_misses": 0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.data_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"[FOOD DB] Composition data not found at {self.data_path}, local lookups disabled")
+            return
+        except Exception as e:
+            logger.error(f"[FOOD DB] Failed to load composition data from {self.data_path}: {e}")
+            return
+
+        self.version = str(data.get("version", "unknown"))
+        for food in data.get("foods", []):
+            try:
+                row = len(self.names)
+                calories, protein, fat = float(food["calories"]), float(food["protein"]), float(food["fat"])
+                self.names.append(food["name"])
+                self.calories.append(calories)
+                self.protein.append(protein)
+                self.fat.append(fat)
+                self.servings.append({normalize_quantity(f"1 {unit}")[1]: float(grams) for unit, grams in food.get("servings", {}).items()})
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"[FOOD DB] Skipping malformed entry {food.get('name') if isinstance(food, dict) else food}: {e}")
+                continue
+
+            for alias in [food["name"]] + list(food.get("aliases", [])):
+                alias = normalize_food_name(alias)
+                if not alias or alias in self._alias_rows:
+                    continue
+                self._alias_rows[alias] = row
+                alias_id = len(self._aliases)
+                self._aliases.append((alias, row))
+                grams = _trigrams(alias)
+                self._alias_trigram_counts.append(len(grams))
+                for gram in grams:
+                    self._trigram_index[gram].append(alias_id)
+
+        self._trigram_index = dict(self._trigram_index)
+        logger.info(f"[FOOD DB] Loaded {len(self.names)} foods / {len(self._aliases)} aliases (version {self.version})")
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.names)
+
+    def match(self, food_name: str) -> Optional[Tuple[int, float]]:
+        """Best matching row and its confidence (1.0 for an exact alias), or None below min_confidence."""
+        name = normalize_food_name(food_name)
+        if not name or not self.loaded:
+            return None
+        if name in self._alias_rows:
+            return self._alias_rows[name], 1.0
+
+        grams = _trigrams(name)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for alias_id in self._trigram_index.get(gram, ()):
+                shared[alias_id] += 1
+
+        best_id, best_score = None, 0.0
+        for alias_id, count in shared.items():
+            score = 2.0 * count / (len(grams) + self._alias_trigram_counts[alias_id])
+            if score > best_score:
+                best_id, best_score = alias_id, score
+        if best_id is None or best_score < self.min_confidence:
+            return None
+        alias, row = self._aliases[best_id]
+        if not _words_covered(name, alias):
+            return None
+        return row, round(best_score, 3)
+
+    def _serving_grams(self, row: int, quantity) -> Optional[float]:
+        """Weight in grams of the requested serving, or None if the unit is unknown for this food."""
+        amount_str, unit = normalize_quantity(quantity if quantity not in (None, "") else "100 g")
+        try:
+            amount = float(amount_str)
+        except ValueError:
+            return None
+        unit = unit or BARE_UNIT
+        if unit in GRAM_UNITS:
+            return amount * GRAM_UNITS[unit]
+        if unit in self.servings[row]:
+            return amount * self.servings[row][unit]
+        return None
+
+    def resolve(self, food_name: str, quantity) -> Optional[Dict[str, Any]]:
+        """
+        Nutrition for a serving of a food, in the same shape as the Gemini lookup.
+        Returns None when the food or its unit is not known locally.
+        """
+        self._stats["lookups"] += 1
+        matched = self.match(food_name)
+        if matched is None:
+            self._stats["misses"] += 1
+            return None
+        row, confidence = matched
+
+        grams = self._serving_grams(row, quantity)
+        if grams is None:
+            self._stats["unit_misses"] += 1
+            return None
+
+        self._stats["exact_hits" if confidence == 1.0 else "fuzzy_hits"] += 1
+        factor = grams / 100.0
+        return {
+            "calories": round(self.calories[row] * factor, 1),
+            "protein": round(self.protein[row] * factor, 1),
+            "fat": round(self.fat[row] * factor, 1),
+            "raw": f"local_db:{self.version}",
+            "source": "local_db",
+            "confidence": confidence,
+            "matched_name": self.names[row],
+        }
+
+    def seed_entries(self) -> List[Dict[str, Any]]:
+        """One per-100g entry per food, used to seed the global food suggestion index."""
+        return [
+            {
+                "name": name,
+                "normalizedName": normalize_food_name(name),
+                "servingSize": "100",
+                "calories": round(self.calories[row], 1),
+                "protein": round(self.protein[row], 1),
+                "fat": round(self.fat[row], 1),
+                "per_100g": True,
+                "source": "local_db",
+                "count": 0,
+            }
+            for row, name in enumerate(self.names)
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["version"] = self.version
+        stats["foods"] = len(self.names)
+        stats["aliases"] = len(self._aliases)
+        stats["min_confidence"] = self.min_confidence
+        return stats
+
+
+# Global instance
+food_composition_db = FoodCompositionDB()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Food Log Batch
+Logs several food items for one user with a single bulk macro lookup, one batched write and a read of the day's totals.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from services.nutrition_rollups import EMPTY_ROLLUP
+
+logger = logging.getLogger(__name__)
+
+
+def has_macros(item: Dict[str, Any]) -> bool:
+    """Items that came with all three macros are stored as serving totals and not resolved"""
+    return item.get("calories") is not None and item.get("protein") is not None and item.get("fat") is not None
+
+
+def build_food_logs(user_id: str, items: List[Dict[str, Any]], resolved: Dict[int, Dict[str, Any]],
+                    timestamp: datetime) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Turn request items and their resolved nutrition (by item index) into food log documents.
+    Returns (logs to write, one result per item in request order); unresolved items are reported, not logged.
+    """
+    logs, results = [], []
+    for index, item in enumerate(items):
+        food_name, serving_size = item["foodName"], item.get("servingSize", "100")
+        if index in resolved:
+            nutrition = resolved[index]
+            if nutrition["calories"] == "Error":
+                results.append({
+                    "foodName": food_name,
+                    "servingSize": serving_size,
+                    "success": False,
+                    "error": "Could not resolve nutrition data for this item",
+                    "source": nutrition.get("source")
+                })
+                continue
+            food = {
+                "name": food_name,
+                "calories": float(nutrition["calories"]),
+                "protein": float(nutrition["protein"]),
+                "fat": float(nutrition["fat"]),
+                "per_100g": True
+            }
+        else:
+            nutrition = {"source": "client"}
+            food = {
+                "name": food_name,
+                "calories": float(item["calories"]),
+                "protein": float(item["protein"]),
+                "fat": float(item["fat"]),
+                "per_100g": False  # These are TOTAL calories for the serving, not per-100g
+            }
+        log = {
+            "userId": user_id,
+            "food": food,
+            "servingSize": serving_size,
+            "timestamp": timestamp,
+            "source": nutrition.get("source"),
+            "matchConfidence": nutrition.get("confidence")
+        }
+        logs.append(log)
+        results.append({"foodName": food_name, "servingSize": serving_size, "success": True, "log": dict(log)})
+    return logs, results
+
+
+async def log_food_batch(rollups, user_id: str, items: List[Dict[str, Any]], timestamp: datetime,
+                         resolve_batch: Callable[[List[Tuple[str, Any]]], Awaitable[List[Dict[str, Any]]]],
+                         write_logs: Callable[[str, List[Dict[str, Any]]], None],
+                         executor=None) -> Dict[str, Any]:
+    """
+    Resolve the items missing macros in one bulk lookup, write every loggable item in one batch
+    (write_logs is blocking and runs in the executor) and return the per-item results with the day's
+    totals read back from rollups.
+    """
+    loop = asyncio.get_event_loop()
+    to_resolve = [index for index, item in enumerate(items) if not has_macros(item)]
+    resolved = {}
+    if to_resolve:
+        nutritions = await resolve_batch([(items[index]["foodName"], items[index].get("servingSize", "100")) for index in to_resolve])
+        resolved = dict(zip(to_resolve, nutritions))
+
+    logs, results = build_food_logs(user_id, items, resolved, timestamp)
+    day = timestamp.strftime('%Y-%m-%d')
+
+    def write_and_read_totals():
+        # All logs and their rollup increments go out in one WriteBatch
+        if logs:
+            write_logs(user_id, logs)
+        return rollups.get_days(user_id, [day]).get(day, EMPTY_ROLLUP)
+
+    totals = await loop.run_in_executor(executor, write_and_read_totals)
+    logger.info(f"[FOOD LOG BATCH] Logged {len(logs)}/{len(items)} items for user {user_id}")
+    return {
+        "success": True,
+        "logged": len(logs),
+        "results": results,
+        "dayTotals": {"day": day, "calories": totals["calories"], "protein": totals["protein"], "fat": totals["fat"], "items": totals["items"]}
+    }
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Food Suggestions
+Per-user recent/frequent foods and global popularity, served from in-memory prefix tries.
+"""
+
+import os
+import atexit
+import heapq
+import hashlib
+import logging
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterable
+
+from firebase_admin import firestore
+
+from services.nutrition_cache import normalize_food_name
+from services.food_composition_db import food_composition_db
+
+logger = logging.getLogger(__name__)
+
+# users/{user_id}/recent_foods/{doc} and food_popularity/{doc}, keyed by normalized name
+RECENT_FOODS_COLLECTION = "recent_foods"
+POPULARITY_COLLECTION = "food_popularity"
+
+# Defaults can be overridden from the environment
+MAX_CACHED_USERS = int(os.getenv("FOOD_SUGGEST_MAX_USERS", "1000"))
+MAX_USER_FOODS = int(os.getenv("FOOD_SUGGEST_MAX_USER_FOODS", "200"))
+MAX_GLOBAL_FOODS = int(os.getenv("FOOD_SUGGEST_MAX_GLOBAL_FOODS", "2000"))
+# Popularity increments are summed in memory and written this often, so a popular food's
+# document takes one write per interval instead of one per food log
+POPULARITY_FLUSH_SECONDS = float(os.getenv("FOOD_SUGGEST_POPULARITY_FLUSH_SECONDS", "30"))
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+def _document_id(normalized_name: str) -> str:
+    return hashlib.sha1(normalized_name.encode("utf-8")).hexdigest()
+
+
+def suggestion_from_log(log: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The fields of a food log kept in the suggestion index, or None if it has no usable name."""
+    food = log.get("food") or {}
+    normalized = normalize_food_name(food.get("name"))
+    if not normalized:
+        return None
+    return {
+        "name": str(food.get("name")).strip(),
+        "normalizedName": normalized,
+        "servingSize": str(log.get("servingSize", "100")),
+        "calories": food.get("calories", 0),
+        "protein": food.get("protein", 0),
+        "fat": food.get("fat", 0),
+        "per_100g": food.get("per_100g", True),
+        "source": log.get("source"),
+    }
+
+
+class FoodTrie:
+    """
+    Prefix index over food names. Every word start of a name is indexed, so "but"
+    finds "paneer butter masala". Results are ranked by log count, then recency.
+    """
+
+    def __init__(self):
+        self._root: Dict[str, Any] = {}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _index(self, normalized: str):
+        words = normalized.split(" ")
+        for start in range(len(words)):
+            node = self._root
+            for char in " ".join(words[start:]):
+                node = node.setdefault(char, {})
+                node.setdefault("$", set()).add(normalized)
+
+    def upsert(self, entry: Dict[str, Any], count_delta: int = 0, count: Optional[int] = None):
+        """
+        Insert or update an entry. count replaces the stored count (e.g. one loaded from Firestore);
+        otherwise count_delta is added to any existing count.
+        """
+        normalized = entry["normalizedName"]
+        with self._lock:
+            existing = self._entries.get(normalized)
+            if existing is None:
+                self._entries[normalized] = dict(entry)
+                if count is not None:
+                    self._entries[normalized]["count"] = count
+                self._index(normalized)
+            else:
+                new_count = count if count is not None else existing.get("count", 0) + count_delta
+                existing.update(entry)
+                existing["count"] = new_count
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        prefix = normalize_food_name(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            node = self._root
+            for char in prefix:
+                node = node.get(char)
+                if node is None:
+                    return []
+            candidates = [self._entries[name] for name in node.get("$", ())]
+            ranked = heapq.nlargest(limit, candidates, key=lambda e: (e.get("count", 0), e.get("lastLoggedAt") or ""))
+            return [dict(entry) for entry in ranked]
+
+
+class FoodSuggestions:
+    """
+    Maintains the per-user recent_foods documents (staged into the same batch as the food logs)
+    and the global food_popularity documents (summed in memory and flushed every
+    POPULARITY_FLUSH_SECONDS), and mirrors both into in-memory tries for autocomplete.
+    """
+
+    def __init__(self, db, flush_seconds: float = POPULARITY_FLUSH_SECONDS):
+        self.db = db
+        self.flush_seconds = flush_seconds
+        self._user_tries: "OrderedDict[str, FoodTrie]" = OrderedDict()
+        self._global_trie: Optional[FoodTrie] = None
+        # normalized name -> (latest entry, logs not yet added to its popularity count)
+        self._pending_popularity: Dict[str, Dict[str, Any]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._popularity_writes = 0
+        self._lock = threading.Lock()
+
+    def stage_food_logs(self, writer, user_id: str, logs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Stage recent-food updates for food logs on a WriteBatch. Returns the entries staged."""
+        entries = []
+        for log in logs:
+            entry = suggestion_from_log(log)
+            if entry is None:
+                continue
+            entry["lastLoggedAt"] = log.get("timestamp") or datetime.now()
+            doc_id = _document_id(entry["normalizedName"])
+            update = {**entry, "count": firestore.Increment(1)}
+            if self.db is not None:
+                writer.set(self.db.collection(f"users/{user_id}/{RECENT_FOODS_COLLECTION}").document(doc_id), update, merge=True)
+            entries.append(entry)
+        return entries
+
+    def record(self, user_id: str, entries: Iterable[Dict[str, Any]]):
+        """Apply committed entries to the loaded in-memory tries and queue their popularity increments."""
+        with self._lock:
+            user_trie = self._user_tries.get(user_id)
+            global_trie = self._global_trie
+            for entry in entries:
+                pending = self._pending_popularity.setdefault(entry["normalizedName"], {"count": 0})
+                pending["entry"] = entry
+                pending["count"] += 1
+        for entry in entries:
+            entry = {**entry, "lastLoggedAt": str(entry.get("lastLoggedAt"))}
+            if user_trie is not None:
+                user_trie.upsert({**entry, "count": 1}, count_delta=1)
+            if global_trie is not None:
+                global_trie.upsert({**entry, "count": 1}, count_delta=1)
+        self._start_flusher()
+
+    def flush_popularity(self) -> int:
+        """Write the queued popularity increments, one document per food. Returns documents written. Blocking."""
+        with self._lock:
+            pending, self._pending_popularity = self._pending_popularity, {}
+        if self.db is None or not pending:
+            return 0
+        items = list(pending.items())
+        written = 0
+        try:
+            for start in range(0, len(items), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for normalized, item in items[start:start + MAX_BATCH_WRITES]:
+                    update = {**item["entry"], "count": firestore.Increment(item["count"])}
+                    batch.set(self.db.collection(POPULARITY_COLLECTION).document(_document_id(normalized)), update, merge=True)
+                batch.commit()
+                written += len(items[start:start + MAX_BATCH_WRITES])
+        except Exception as e:
+            logger.error(f"[FOOD SUGGEST] Failed to write popularity counts: {e}")
+            # Requeue what was not written, merged with anything logged since
+            with self._lock:
+                for normalized, item in items[written:]:
+                    pending = self._pending_popularity.setdefault(normalized, {"count": 0, "entry": item["entry"]})
+                    pending["count"] += item["count"]
+        with self._lock:
+            self._popularity_writes += written
+        return written
+
+    def _start_flusher(self):
+        if self.db is None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="food-popularity-flush", daemon=True)
+            self._flusher.start()
+        # Worker restarts should not drop the counts of the last interval
+        atexit.register(self.flush_popularity)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush_popularity()
+
+    @staticmethod
+    def _load(trie: FoodTrie, docs):
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if not data.get("normalizedName"):
+                continue
+            data["lastLoggedAt"] = str(data.get("lastLoggedAt"))
+            trie.upsert(data, count=data.get("count", 0))
+
+    def _user_trie(self, user_id: str) -> FoodTrie:
+        """The user's trie, loaded from Firestore on first use. Blocking - call from an executor."""
+        with self._lock:
+            trie = self._user_tries.get(user_id)
+            if trie is not None:
+                self._user_tries.move_to_end(user_id)
+                return trie
+        trie = FoodTrie()
+        if self.db is not None:
+            query = (self.db.collection(f"users/{user_id}/{RECENT_FOODS_COLLECTION}")
+                     .order_by("count", direction=firestore.Query.DESCENDING).limit(MAX_USER_FOODS))
+            self._load(trie, query.stream())
+        with self._lock:
+            trie = self._user_tries.setdefault(user_id, trie)
+            while len(self._user_tries) > MAX_CACHED_USERS:
+                self._user_tries.popitem(last=False)
+        return trie
+
+    def _popular_trie(self) -> FoodTrie:
+        """The global trie, seeded with bundled foods and loaded from Firestore on first use. Blocking."""
+        with self._lock:
+            if self._global_trie is not None:
+                return self._global_trie
+        trie = FoodTrie()
+        # Bundled foods make suggestions useful before anything has been logged
+        for food in food_composition_db.seed_entries():
+            trie.upsert(food)
+        if self.db is not None:
+            query = (self.db.collection(POPULARITY_COLLECTION)
+                     .order_by("count", direction=firestore.Query.DESCENDING).limit(MAX_GLOBAL_FOODS))
+            self._load(trie, query.stream())
+        with self._lock:
+            if self._global_trie is None:
+                self._global_trie = trie
+            return self._global_trie
+
+    def suggest(self, query: str, user_id: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Foods matching the prefix: the user's own foods first, then globally popular ones.
+        Blocking on the first call per user (trie load) - call from an executor.
+        """
+        results = []
+        seen = set()
+        if user_id:
+            for entry in self._user_trie(user_id).search(query, limit):
+                seen.add(entry["normalizedName"])
+                results.append({**entry, "scope": "recent"})
+        if len(results) < limit:
+            for entry in self._popular_trie().search(query, limit + len(seen)):
+                if entry["normalizedName"] in seen:
+                    continue
+                results.append({**entry, "scope": "popular"})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached_users": len(self._user_tries),
+                "global_foods": len(self._global_trie) if self._global_trie is not None else None,
+                "max_cached_users": MAX_CACHED_USERS,
+                "pending_popularity": len(self._pending_popularity),
+                "popularity_writes": self._popularity_writes,
+            }
+
+
+# Global instance
+_food_suggestions = None
+
+def get_food_suggestions(db) -> FoodSuggestions:
+    """
+    Get the global food suggestions instance.
+    """
+    global _food_suggestions
+    if _food_suggestions is None:
+        _food_suggestions = FoodSuggestions(db)
+    return _food_suggestions
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Gemini Gateway
+Shared Gemini client: reused models, a bounded worker pool, per-prompt timeouts, retries and a circuit breaker.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+MAX_WORKERS = int(os.getenv("GEMINI_MAX_WORKERS", "8"))
+# Calls queued or running before new ones are rejected instead of waiting
+MAX_PENDING = int(os.getenv("GEMINI_MAX_PENDING", "32"))
+MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "2"))
+BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "0.5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+
+# Total time budget per prompt type, retries included; all stay under the 30s request timeout
+PROMPT_TIMEOUTS = {
+    "nutrition": float(os.getenv("GEMINI_TIMEOUT_NUTRITION", "15")),
+    "nutrition_batch": float(os.getenv("GEMINI_TIMEOUT_NUTRITION_BATCH", "25")),
+    "workout": float(os.getenv("GEMINI_TIMEOUT_WORKOUT", "20")),
+    "chatbot": float(os.getenv("GEMINI_TIMEOUT_CHATBOT", "25")),
+    # For streams this bounds the wait for each chunk rather than the whole answer
+    "chatbot_stream": float(os.getenv("GEMINI_TIMEOUT_CHATBOT_STREAM", "25")),
+    # Background summary refreshes are off the request path but should not hold workers for long
+    "chat_summary": float(os.getenv("GEMINI_TIMEOUT_CHAT_SUMMARY", "20")),
+}
+DEFAULT_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT_DEFAULT", "20"))
+
+# Upstream errors worth retrying; they also count towards opening the breaker
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    ConnectionError,
+)
+
+# Latency samples kept per prompt type for percentiles
+LATENCY_SAMPLES = 200
+
+
+class GeminiUnavailableError(Exception):
+    """Raised without calling Gemini when the breaker is open or the worker pool is full."""
+
+
+class GeminiTimeoutError(asyncio.TimeoutError):
+    """Raised when a prompt type's time budget runs out, retries included."""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transient failures and rejects calls for
+    reset_seconds. After that a single probe call is let through: success closes it,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("[GEMINI GATEWAY] Circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                    logger.warning(f"[GEMINI GATEWAY] Circuit breaker opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probe_in_flight = False
+
+    def record_neutral(self):
+        """A call finished with an error that says nothing about upstream health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+            }
+
+
+class GeminiGateway:
+    """
+    All Gemini calls go through here. Blocking SDK calls run on a dedicated, bounded pool so a slow
+    upstream cannot tie up the shared executor; each prompt type has its own total time budget.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING, max_attempts: int = MAX_ATTEMPTS,
+                 backoff_base: float = BACKOFF_BASE_SECONDS, timeouts: Optional[Dict[str, float]] = None,
+                 breaker: Optional[CircuitBreaker] = None, model_factory: Optional[Callable[[str], Any]] = None):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.timeouts = dict(PROMPT_TIMEOUTS if timeouts is None else timeouts)
+        self.breaker = breaker or CircuitBreaker()
+        self._model_factory = model_factory
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._models: Dict[str, Any] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+
+    def model(self, name: str = DEFAULT_MODEL):
+        """Shared model instance for name (models hold no per-request state)."""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                if self._model_factory is not None:
+                    model = self._model_factory(name)
+                else:
+                    from google.generativeai.generative_models import GenerativeModel
+                    model = GenerativeModel(name)
+                self._models[name] = model
+            return model
+
+    def _metric(self, prompt_type: str) -> Dict[str, Any]:
+        metric = self._metrics.get(prompt_type)
+        if metric is None:
+            metric = self._metrics.setdefault(prompt_type, {
+                "calls": 0, "successes": 0, "failures": 0, "timeouts": 0, "retries": 0, "rejected": 0,
+                "latencies": deque(maxlen=LATENCY_SAMPLES),
+                "first_chunk_latencies": deque(maxlen=LATENCY_SAMPLES),
+            })
+        return metric
+
+    def _count(self, prompt_type: str, field: str, latency: Optional[float] = None):
+        with self._lock:
+            metric = self._metric(prompt_type)
+            metric[field] += 1
+            if latency is not None:
+                metric["latencies"].append(latency)
+
+    def _record_first_chunk(self, prompt_type: str, latency: float):
+        with self._lock:
+            self._metric(prompt_type)["first_chunk_latencies"].append(latency)
+
+    def _submit(self, func: Callable[[], Any]):
+        """Run func on the Gemini pool, rejecting it if too many calls are already queued or running."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise GeminiUnavailableError(f"Gemini worker pool is full ({self._pending} calls pending)")
+            self._pending += 1
+        future = self._executor.submit(func)
+
+        def release(_):
+            # Released when the worker actually finishes, so calls that timed out still count
+            with self._lock:
+                self._pending -= 1
+
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future)
+
+    async def call(self, prompt_type: str, func: Callable[[Any], Any], model_name: str = DEFAULT_MODEL,
+                   timeout: Optional[float] = None) -> Any:
+        """
+        Run func(model) on the Gemini pool with the prompt type's time budget, retrying transient
+        errors with jittered exponential backoff while budget remains.
+        Raises GeminiUnavailableError, GeminiTimeoutError or the last upstream error.
+        """
+        self._count(prompt_type, "calls")
+        budget = timeout if timeout is not None else self.timeouts.get(prompt_type, DEFAULT_TIMEOUT)
+        deadline = time.monotonic() + budget
+        model = self.model(model_name)
+        started = time.monotonic()
+
+        for attempt in range(1, self.max_attempts + 1):
+            if not self.breaker.allow():
+                self._count(prompt_type, "rejected")
+                raise GeminiUnavailableError("Gemini circuit breaker is open")
+            try:
+                future = self._submit(lambda: func(model))
+            except GeminiUnavailableError:
+                self.breaker.record_neutral()
+                self._count(prompt_type, "rejected")
+                raise
+
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(future, timeout=max(remaining, 0.001))
+            except asyncio.CancelledError:
+                # The caller went away (e.g. the request timeout middleware): release a half-open probe
+                self.breaker.record_neutral()
+                raise
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                error = GeminiTimeoutError(f"Gemini {prompt_type} call exceeded {budget}s")
+            except TRANSIENT_ERRORS as e:
+                self.breaker.record_failure()
+                error = e
+            except Exception:
+                # Bad requests, blocked responses and the like: not retried, upstream is healthy
+                self.breaker.record_neutral()
+                self._count(prompt_type, "failures", time.monotonic() - started)
+                raise
+            else:
+                self.breaker.record_success()
+                self._count(prompt_type, "successes", time.monotonic() - started)
+                return result
+
+            # Full jitter: sleep a random amount up to the exponential backoff step
+            backoff = random.uniform(0, self.backoff_base * (2 ** (attempt - 1)))
+            if attempt == self.max_attempts or isinstance(error, GeminiTimeoutError) or time.monotonic() + backoff >= deadline:
+                break
+            logger.warning(f"[GEMINI GATEWAY] {prompt_type} attempt {attempt} failed ({error}), retrying in {backoff:.2f}s")
+            self._count(prompt_type, "retries")
+            await asyncio.sleep(backoff)
+
+        self._count(prompt_type, "timeouts" if isinstance(error, GeminiTimeoutError) else "failures", time.monotonic() - started)
+        raise error
+
+    async def generate(self, prompt_type: str, prompt: Any, model_name: str = DEFAULT_MODEL, timeout: Optional[float] = None) -> str:
+        """Text of model.generate_content(prompt)."""
+        return await self.call(prompt_type, lambda model: model.generate_content(prompt).text, model_name, timeout)
+
+    async def send_chat_message(self, prompt_type: str, history: List[Any], message: str,
+                                model_name: str = DEFAULT_MODEL, timeout: Optional[float] = None) -> str:
+        """Text of the reply to message in a chat started from history."""
+        def send(model):
+            response = model.start_chat(history=history).send_message(message)
+            return response.text if hasattr(response, "text") else str(response)
+        return await self.call(prompt_type, send, model_name, timeout)
+
+    async def stream_chat_message(self, prompt_type: str, history: List[Any], message: str, model_name: str = DEFAULT_MODEL,
+                                  timeout: Optional[float] = None, usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Yield the reply to message chunk by chunk as Gemini streams it.
+        timeout bounds the wait for each chunk. Streams are not retried, since text may already
+        have reached the client. Token counts are written into usage, if given, once the stream ends.
+        """
+        self._count(prompt_type, "calls")
+        idle_timeout = timeout if timeout is not None else self.timeouts.get(prompt_type, DEFAULT_TIMEOUT)
+        model = self.model(model_name)
+        if not self.breaker.allow():
+            self._count(prompt_type, "rejected")
+            raise GeminiUnavailableError("Gemini circuit breaker is open")
+
+        loop = asyncio.get_running_loop()
+        chunks: "asyncio.Queue[tuple]" = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(kind, value):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, (kind, value))
+            except RuntimeError:
+                # Event loop already closed; nobody is listening any more
+                cancelled.set()
+
+        def produce():
+            try:
+                response = model.start_chat(history=history).send_message(message, stream=True)
+                for chunk in response:
+                    if cancelled.is_set():
+                        return
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. the final one carrying only metadata)
+                        text = ""
+                    if text:
+                        put("chunk", text)
+                put("done", getattr(response, "usage_metadata", None))
+            except Exception as e:
+                put("error", e)
+
+        try:
+            self._submit(produce)
+        except GeminiUnavailableError:
+            self.breaker.record_neutral()
+            self._count(prompt_type, "rejected")
+            raise
+
+        started = time.monotonic()
+        first_chunk = True
+        outcome_recorded = False
+        try:
+            while True:
+                try:
+                    kind, value = await asyncio.wait_for(chunks.get(), timeout=idle_timeout)
+                except asyncio.TimeoutError:
+                    outcome_recorded = True
+                    self.breaker.record_failure()
+                    self._count(prompt_type, "timeouts", time.monotonic() - started)
+                    raise GeminiTimeoutError(f"Gemini {prompt_type} stream stalled for {idle_timeout}s")
+                if kind == "chunk":
+                    if first_chunk:
+                        first_chunk = False
+                        self._record_first_chunk(prompt_type, time.monotonic() - started)
+                    yield value
+                elif kind == "done":
+                    outcome_recorded = True
+                    self.breaker.record_success()
+                    self._count(prompt_type, "successes", time.monotonic() - started)
+                    if usage is not None and value is not None:
+                        usage.update({
+                            "prompt_tokens": getattr(value, "prompt_token_count", None),
+                            "response_tokens": getattr(value, "candidates_token_count", None),
+                            "total_tokens": getattr(value, "total_token_count", None),
+                        })
+                    return
+                else:
+                    outcome_recorded = True
+                    if isinstance(value, TRANSIENT_ERRORS):
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_neutral()
+                    self._count(prompt_type, "failures", time.monotonic() - started)
+                    raise value
+        finally:
+            # Stops the worker early if the client went away mid-stream
+            cancelled.set()
+            if not outcome_recorded:
+                # Disconnected before the stream ended: release a half-open probe
+                self.breaker.record_neutral()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            prompt_types = {}
+            for prompt_type, metric in self._metrics.items():
+                latencies = sorted(metric["latencies"])
+                first_chunk_latencies = sorted(metric["first_chunk_latencies"])
+                stats = {field: value for field, value in metric.items() if not isinstance(value, deque)}
+                if latencies:
+                    stats["latency_p50_seconds"] = round(latencies[len(latencies) // 2], 3)
+                    stats["latency_p95_seconds"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+                if first_chunk_latencies:
+                    stats["first_chunk_p50_seconds"] = round(first_chunk_latencies[len(first_chunk_latencies) // 2], 3)
+                stats["timeout_seconds"] = self.timeouts.get(prompt_type, DEFAULT_TIMEOUT)
+                prompt_types[prompt_type] = stats
+            pending = self._pending
+            models = list(self._models)
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": pending,
+            "max_attempts": self.max_attempts,
+            "models": models,
+            "breaker": self.breaker.stats(),
+            "prompt_types": prompt_types,
+        }
+
+
+# Global instance
+gemini_gateway = GeminiGateway()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Food and Workout Log Retention
+Scheduled job that prunes expired food and workout logs for all users in batched deletes.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+DEFAULT_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "7"))
+DEFAULT_INTERVAL_SECONDS = int(os.getenv("LOG_RETENTION_INTERVAL_SECONDS", str(60 * 60)))  # hourly
+
+# Firestore allows at most 500 writes per batch commit
+MAX_BATCH_SIZE = 500
+# Metrics of the most recent runs kept for the admin endpoint
+RUN_HISTORY_SIZE = 20
+
+
+class LogRetentionJob:
+    """
+    Deletes food logs (users/{id}/food_logs, via a collection-group query on timestamp)
+    and top-level workout_logs older than the retention window.
+    Daily nutrition rollups are left untouched so longer summary ranges keep working.
+    """
+
+    def __init__(self, db, retention_days: int = DEFAULT_RETENTION_DAYS, batch_size: int = MAX_BATCH_SIZE):
+        self.db = db
+        self.retention_days = retention_days
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self._runs = deque(maxlen=RUN_HISTORY_SIZE)
+        self._run_lock = threading.Lock()
+        self._totals = {"runs": 0, "food_logs_deleted": 0, "workout_logs_deleted": 0, "batches": 0, "errors": 0}
+
+    def _delete_matching(self, query, metrics: Dict[str, Any]) -> int:
+        """Delete every document matched by query, one batch of up to batch_size per commit."""
+        deleted = 0
+        while True:
+            # Only document references are needed, so project away all fields
+            docs = list(query.select([]).limit(self.batch_size).stream())
+            if not docs:
+                break
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.commit()
+            deleted += len(docs)
+            metrics["batches"] += 1
+            if len(docs) < self.batch_size:
+                break
+        return deleted
+
+    def run(self, retention_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Prune logs older than the retention window and return this run's metrics.
+        Blocking - call from a background thread or an executor. Overlapping runs are skipped.
+        """
+        retention_days = retention_days if retention_days is not None else self.retention_days
+        if not self._run_lock.acquire(blocking=False):
+            logger.info("[LOG RETENTION] Previous run still in progress, skipping")
+            return {"skipped": True, "reason": "already running"}
+        try:
+            started = time.time()
+            cutoff = datetime.now() - timedelta(days=retention_days)
+            metrics = {
+                "started_at": datetime.now().isoformat(),
+                "retention_days": retention_days,
+                "cutoff": cutoff.isoformat(),
+                "food_logs_deleted": 0,
+                "workout_logs_deleted": 0,
+                "batches": 0,
+                "errors": [],
+            }
+            if self.db is None:
+                metrics["errors"].append("Firestore is not available")
+            else:
+                try:
+                    food_logs = self.db.collection_group("food_logs").where("timestamp", "<", cutoff)
+                    metrics["food_logs_deleted"] = self._delete_matching(food_logs, metrics)
+                except Exception as e:
+                    logger.error(f"[LOG RETENTION] Failed pruning food logs: {e}")
+                    metrics["errors"].append(f"food_logs: {e}")
+                try:
+                    workout_logs = self.db.collection("workout_logs").where("date", "<", cutoff.isoformat())
+                    metrics["workout_logs_deleted"] = self._delete_matching(workout_logs, metrics)
+                except Exception as e:
+                    logger.error(f"[LOG RETENTION] Failed pruning workout logs: {e}")
+                    metrics["errors"].append(f"workout_logs: {e}")
+
+            metrics["duration_seconds"] = round(time.time() - started, 3)
+            self._runs.append(metrics)
+            self._totals["runs"] += 1
+            self._totals["food_logs_deleted"] += metrics["food_logs_deleted"]
+            self._totals["workout_logs_deleted"] += metrics["workout_logs_deleted"]
+            self._totals["batches"] += metrics["batches"]
+            self._totals["errors"] += len(metrics["errors"])
+            logger.info(
+                f"[LOG RETENTION] Deleted {metrics['food_logs_deleted']} food / {metrics['workout_logs_deleted']} workout logs "
+                f"older than {retention_days} days in {metrics['batches']} batches ({metrics['duration_seconds']}s)"
+            )
+            return metrics
+        finally:
+            self._run_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Lifetime totals and the metrics of recent runs, newest first."""
+        return {
+            "retention_days": self.retention_days,
+            "batch_size": self.batch_size,
+            "running": self._run_lock.locked(),
+            "totals": dict(self._totals),
+            "recent_runs": list(reversed(self._runs)),
+        }
+
+
+# Global instance
+_log_retention_job = None
+
+def get_log_retention_job(db) -> LogRetentionJob:
+    """
+    Get the global log retention job instance.
+    """
+    global _log_retention_job
+    if _log_retention_job is None:
+        _log_retention_job = LogRetentionJob(db)
+    return _log_retention_job
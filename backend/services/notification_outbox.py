@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Notification Outbox
+Durable queue of push notifications (Firestore, or SQLite in dev) delivered off the request path by a leased worker pool.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import deque
+from contextlib import closing
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from services.expo_push_gateway import expo_push_gateway, push_message, error_ticket, ticket_ok
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "notification_outbox"
+
+# Defaults can be overridden from the environment
+# "firestore" (default when Firestore is available) or "sqlite" for local development
+BACKEND = os.getenv("NOTIFICATION_OUTBOX_BACKEND", "firestore")
+SQLITE_PATH = os.getenv("NOTIFICATION_OUTBOX_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "nutricious4u_notification_outbox.db"))
+WORKERS = int(os.getenv("NOTIFICATION_OUTBOX_WORKERS", "2"))
+# Records claimed (and sent to Expo) together; Expo takes up to 100 messages per request
+BATCH_SIZE = int(os.getenv("NOTIFICATION_OUTBOX_BATCH_SIZE", "100"))
+# A claimed record is handed to another worker if not finished within its lease (e.g. the worker crashed)
+LEASE_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_OUTBOX_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_BACKOFF_BASE_SECONDS", "10"))
+BACKOFF_MAX_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_BACKOFF_MAX_SECONDS", "900"))
+# Idle workers poll this often, backing off to IDLE_POLL_MAX_SECONDS; local enqueues wake them at once
+POLL_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_POLL_SECONDS", "2"))
+IDLE_POLL_MAX_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_IDLE_POLL_MAX_SECONDS", "30"))
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# Ticket errors that will not succeed on retry
+PERMANENT_ERRORS = {
+    "NoToken", "DeviceNotRegistered", "InvalidCredentials", "MessageTooBig",
+    "HTTP400", "HTTP401", "HTTP403", "HTTP404", "HTTP413",
+}
+
+# Delivery latency samples (enqueue to sent) kept for percentiles
+LATENCY_SAMPLES = 500
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat()
+
+
+def _ticket_error(ticket: Dict[str, Any]) -> str:
+    return (ticket.get("details") or {}).get("error") or "Unknown"
+
+
+class FirestoreOutboxStore:
+    """
+    Records in the notification_outbox collection. Pending records are claimed in a transaction by
+    pushing their availableAt past the lease, so a record held by a crashed worker becomes claimable
+    again once its lease runs out. Needs the (status, availableAt) composite index.
+    """
+
+    def __init__(self, db, collection: str = OUTBOX_COLLECTION):
+        self.db = db
+        self.collection = db.collection(collection)
+
+    def add(self, record: Dict[str, Any], key: Optional[str] = None) -> Optional[str]:
+        """Store a new record; with a key, returns None if a record with that key already exists."""
+        if key is None:
+            doc_ref = self.collection.document()
+            doc_ref.set(record)
+            return doc_ref.id
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            self.collection.document(key).create(record)
+        except AlreadyExists:
+            return None
+        return key
+
+    def claim(self, owner: str, limit: int, lease_seconds: float, now: float) -> List[Dict[str, Any]]:
+        from firebase_admin import firestore
+        query = (self.collection.where("status", "==", STATUS_PENDING).where("availableAt", "<=", now)
+                 .order_by("availableAt").limit(limit))
+
+        @firestore.transactional
+        def take(transaction):
+            claimed = []
+            for doc in transaction.get(query):
+                record = doc.to_dict()
+                update = {"availableAt": now + lease_seconds, "leaseOwner": owner,
+                          "attempts": record.get("attempts", 0) + 1, "updatedAt": _now_iso()}
+                transaction.update(doc.reference, update)
+                record.update(update, id=doc.id)
+                claimed.append(record)
+            return claimed
+
+        return take(self.db.transaction())
+
+    def update(self, record_id: str, fields: Dict[str, Any]):
+        self.collection.document(record_id).update(fields)
+
+    def backlog(self) -> Optional[int]:
+        result = self.collection.where("status", "==", STATUS_PENDING).count().get()
+        return int(result[0][0].value)
+
+
+class SQLiteOutboxStore:
+    """
+    The same records in a local SQLite file, for development without Firestore. Claims run in an
+    IMMEDIATE transaction, so several processes can share the file.
+    """
+
+    # Record field -> column; data and ticket are stored as JSON text
+    COLUMNS = {
+        "recipientId": "recipient_id", "token": "token", "title": "title", "body": "body", "data": "data",
+        "source": "source", "status": "status", "attempts": "attempts", "availableAt": "available_at",
+        "leaseOwner": "lease_owner", "lastError": "last_error", "ticket": "ticket", "enqueuedAt": "enqueued_at",
+        "createdAt": "created_at", "updatedAt": "updated_at", "sentAt": "sent_at",
+    }
+    JSON_FIELDS = ("data", "ticket")
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        with closing(self._connect()) as conn:
+            columns = ", ".join(f"{column} {'INTEGER' if field == 'attempts' else 'REAL' if field in ('availableAt', 'enqueuedAt') else 'TEXT'}"
+                                for field, column in self.COLUMNS.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {OUTBOX_COLLECTION} (id TEXT PRIMARY KEY, {columns})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {OUTBOX_COLLECTION}_due ON {OUTBOX_COLLECTION} (status, available_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _encode(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {self.COLUMNS[field]: json.dumps(value) if field in self.JSON_FIELDS and value is not None else value
+                for field, value in fields.items()}
+
+    def _decode(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = {"id": row["id"]}
+        for field, column in self.COLUMNS.items():
+            value = row[column]
+            record[field] = json.loads(value) if field in self.JSON_FIELDS and value is not None else value
+        return record
+
+    def add(self, record: Dict[str, Any], key: Optional[str] = None) -> Optional[str]:
+        record_id = key or uuid.uuid4().hex
+        values = self._encode(record)
+        columns = ", ".join(["id", *values])
+        placeholders = ", ".join("?" * (len(values) + 1))
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(f"INSERT OR IGNORE INTO {OUTBOX_COLLECTION} ({columns}) VALUES ({placeholders})",
+                                  [record_id, *values.values()])
+        return record_id if cursor.rowcount else None
+
+    def claim(self, owner: str, limit: int, lease_seconds: float, now: float) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(f"SELECT * FROM {OUTBOX_COLLECTION} WHERE status = ? AND available_at <= ? "
+                                f"ORDER BY available_at LIMIT ?", (STATUS_PENDING, now, limit)).fetchall()
+            claimed = []
+            for row in rows:
+                record = self._decode(row)
+                record.update(availableAt=now + lease_seconds, leaseOwner=owner, attempts=(record["attempts"] or 0) + 1,
+                              updatedAt=_now_iso())
+                conn.execute(f"UPDATE {OUTBOX_COLLECTION} SET available_at = ?, lease_owner = ?, attempts = ?, updated_at = ? "
+                             f"WHERE id = ?", (record["availableAt"], owner, record["attempts"], record["updatedAt"], record["id"]))
+                claimed.append(record)
+            conn.execute("COMMIT")
+            return claimed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def update(self, record_id: str, fields: Dict[str, Any]):
+        values = self._encode(fields)
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE {OUTBOX_COLLECTION} SET {assignments} WHERE id = ?", [*values.values(), record_id])
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT * FROM {OUTBOX_COLLECTION} WHERE id = ?", (record_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def backlog(self) -> Optional[int]:
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {OUTBOX_COLLECTION} WHERE status = ?", (STATUS_PENDING,)).fetchone()[0]
+
+
+class NotificationOutbox:
+    """
+    Callers enqueue a record and return; workers claim due records in batches, resolve recipient
+    tokens, send the batch through the push gateway and record each outcome. Transient errors are
+    retried with jittered exponential backoff up to max_attempts, then the record is marked failed.
+    Delivery is at-least-once: a worker that dies after sending but before recording the outcome
+    leaves its records to be sent again when their lease expires.
+    """
+
+    def __init__(self, store, token_lookup: Callable[[str], Optional[str]], gateway=expo_push_gateway,
+                 workers: int = WORKERS, batch_size: int = BATCH_SIZE, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE_SECONDS,
+                 backoff_max: float = BACKOFF_MAX_SECONDS, poll_seconds: float = POLL_SECONDS,
+                 idle_poll_max: float = IDLE_POLL_MAX_SECONDS, clock=time.time):
+        self.store = store
+        self.token_lookup = token_lookup
+        self.gateway = gateway
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_seconds = poll_seconds
+        self.idle_poll_max = max(poll_seconds, idle_poll_max)
+        self._clock = clock
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._instance = uuid.uuid4().hex[:8]
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = {"enqueued": 0, "duplicates": 0, "claimed": 0, "batches": 0, "sent": 0, "retried": 0,
+                       "failed": 0, "worker_errors": 0}
+        self._errors: Dict[str, int] = {}
+
+    def _count(self, field: str, error: Optional[str] = None):
+        with self._lock:
+            self._stats[field] += 1
+            if error:
+                self._errors[error] = self._errors.get(error, 0) + 1
+
+    def enqueue(self, recipient_id: str, title: str, body: str, data: Optional[Dict[str, Any]] = None,
+                source: str = "", token: Optional[str] = None, key: Optional[str] = None) -> Optional[str]:
+        """
+        Durably queue a push to recipient_id (a user ID or "dietician"), or straight to token.
+        With a key, a record with the same key is only ever queued once; returns None for a duplicate.
+        Blocking - call from an executor.
+        """
+        now = self._clock()
+        record = {
+            "recipientId": recipient_id, "token": token, "title": title, "body": body, "data": data or {},
+            "source": source, "status": STATUS_PENDING, "attempts": 0, "availableAt": now, "leaseOwner": None,
+            "lastError": None, "ticket": None, "enqueuedAt": now, "createdAt": _now_iso(), "updatedAt": _now_iso(),
+            "sentAt": None,
+        }
+        record_id = self.store.add(record, key)
+        if record_id is None:
+            self._count("duplicates")
+            logger.info(f"[OUTBOX] Skipped duplicate notification {key}")
+            return None
+        self._count("enqueued")
+        self._wake.set()
+        logger.info(f"[OUTBOX] Queued {source or 'notification'} {record_id} for {recipient_id}")
+        return record_id
+
+    def run_once(self, owner: Optional[str] = None) -> int:
+        """Claim and deliver one batch of due records; returns how many were claimed."""
+        owner = owner or f"{self._instance}-{threading.current_thread().name}"
+        records = self.store.claim(owner, self.batch_size, self.lease_seconds, self._clock())
+        if records:
+            with self._lock:
+                self._stats["claimed"] += len(records)
+                self._stats["batches"] += 1
+            self._deliver(records)
+        return len(records)
+
+    def _deliver(self, records: List[Dict[str, Any]]):
+        tokens: Dict[str, Optional[str]] = {}
+        sending, messages = [], []
+        for record in records:
+            if record["attempts"] > self.max_attempts:
+                # Claimed again after its last lease ran out without an outcome
+                self._finish(record, error_ticket("LeaseExpired", "Delivery did not complete within its lease"))
+                continue
+            token = record.get("token")
+            if not token:
+                recipient = record["recipientId"]
+                if recipient not in tokens:
+                    tokens[recipient] = self.token_lookup(recipient)
+                token = tokens[recipient]
+            if not token:
+                self._finish(record, error_ticket("NoToken", f"No push token for {record['recipientId']}"))
+                continue
+            sending.append(record)
+            messages.append(push_message(token, record["title"], record["body"], record["data"]))
+        if not messages:
+            return
+        # Submitted together, so the gateway sends them in as few Expo requests as possible
+        futures = self.gateway.submit(messages)
+        wait = getattr(self.gateway, "timeout", 10) * getattr(self.gateway, "max_attempts", 1) + 5
+        for record, future in zip(sending, futures):
+            try:
+                ticket = future.result(timeout=wait)
+            except FutureTimeoutError:
+                ticket = error_ticket("Timeout", "Push gateway did not return a ticket")
+            self._finish(record, ticket)
+
+    def _finish(self, record: Dict[str, Any], ticket: Dict[str, Any]):
+        now = self._clock()
+        fields = {"leaseOwner": None, "ticket": ticket, "updatedAt": _now_iso()}
+        if ticket_ok(ticket):
+            fields.update(status=STATUS_SENT, sentAt=_now_iso(), lastError=None)
+            self._count("sent")
+            with self._lock:
+                self._latencies.append(now - (record.get("enqueuedAt") or now))
+        else:
+            error = _ticket_error(ticket)
+            fields["lastError"] = f"{error}: {ticket.get('message', '')}"[:500]
+            if error in PERMANENT_ERRORS or record["attempts"] >= self.max_attempts:
+                fields["status"] = STATUS_FAILED
+                self._count("failed", error)
+                logger.warning(f"[OUTBOX] Notification {record['id']} failed after {record['attempts']} attempt(s): {fields['lastError']}")
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (record["attempts"] - 1))
+                fields["availableAt"] = now + random.uniform(delay / 2, delay)
+                self._count("retried", error)
+        try:
+            self.store.update(record["id"], fields)
+        except Exception as e:
+            # The lease expires and the record is delivered again
+            self._count("worker_errors")
+            logger.error(f"[OUTBOX] Could not record outcome of {record['id']}: {e}")
+
+    def _worker(self, owner: str):
+        idle = self.poll_seconds
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once(owner)
+            except Exception as e:
+                self._count("worker_errors")
+                logger.error(f"[OUTBOX] Worker {owner} error: {e}")
+                claimed = 0
+            if claimed:
+                idle = self.poll_seconds
+                continue
+            if self._wake.wait(idle):
+                self._wake.clear()
+                idle = self.poll_seconds
+            else:
+                idle = min(self.idle_poll_max, idle * 2)
+
+    def start(self):
+        """Start the delivery workers (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                owner = f"{self._instance}-{index}"
+                thread = threading.Thread(target=self._worker, args=(owner,), name=f"outbox-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"[OUTBOX] Started {self.workers} delivery worker(s) on {type(self.store).__name__}")
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["errors"] = dict(self._errors)
+            latencies = sorted(self._latencies)
+            stats["workers_running"] = sum(1 for thread in self._threads if thread.is_alive())
+        stats["delivery_latency_p50"] = round(latencies[len(latencies) // 2], 3) if latencies else None
+        stats["delivery_latency_p95"] = round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3) if latencies else None
+        stats["store"] = type(self.store).__name__
+        try:
+            stats["backlog"] = self.store.backlog()
+        except Exception as e:
+            logger.warning(f"[OUTBOX] Could not count backlog: {e}")
+            stats["backlog"] = None
+        return stats
+
+
+# Global instance
+_notification_outbox = None
+
+def get_notification_outbox(db) -> NotificationOutbox:
+    """
+    Get the global notification outbox, on Firestore unless NOTIFICATION_OUTBOX_BACKEND=sqlite
+    (or Firestore is unavailable).
+    """
+    global _notification_outbox
+    if _notification_outbox is None:
+        from services.simple_notification_service import get_notification_service
+        store = FirestoreOutboxStore(db) if db is not None and BACKEND != "sqlite" else SQLiteOutboxStore()
+        _notification_outbox = NotificationOutbox(store, get_notification_service(db).get_user_token)
+    return _notification_outbox
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Nutrition Batch Resolver
+Resolves many food items at once: local DB and cache hits first, then one Gemini prompt, within a request deadline.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.gemini_gateway import GeminiUnavailableError, PROMPT_TIMEOUTS
+from services.nutrition_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+# Whole-request budget; kept under the 30s request timeout middleware so callers get partial results, not a 504
+REQUEST_BUDGET_SECONDS = float(os.getenv("NUTRITION_BATCH_BUDGET_SECONDS", "27"))
+# Time held back from the batch prompt so single lookups can still run if it fails
+FALLBACK_RESERVE_SECONDS = float(os.getenv("NUTRITION_BATCH_FALLBACK_RESERVE_SECONDS", "8"))
+# Below this much time left, single lookups are not attempted at all
+MIN_FALLBACK_SECONDS = float(os.getenv("NUTRITION_BATCH_MIN_FALLBACK_SECONDS", "2"))
+
+# One reply line per item: "<item number>: calories, protein, fat" (also "1." / "1)" / "1 -")
+REPLY_LINE = re.compile(r"^\s*(\d+)\s*[:.)\-]\s*(.+)$")
+
+
+def error_nutrition(**extra) -> Dict[str, Any]:
+    """Nutrition result for an item that could not be resolved"""
+    return {'calories': 'Error', 'protein': 'Error', 'fat': 'Error', **extra}
+
+
+def parse_nutrition_triplet(raw: str) -> Tuple[float, float, float]:
+    """Parse a 'calories, protein, fat' reply into three floats (raises ValueError otherwise)"""
+    # Take number before first comma
+    part1, rest = raw.split(',', 1)
+    calories = float(part1.strip())
+    # Take number before next comma
+    part2, rest = rest.split(',', 1)
+    protein = float(part2.strip())
+    # The rest is the third number
+    fat = float(rest.strip())
+    return calories, protein, fat
+
+
+def build_batch_prompt(pending: List[Tuple[str, Any]]) -> str:
+    """Numbered Gemini prompt asking for one 'calories, protein, fat' line per (food_name, quantity)"""
+    item_lines = "\n".join(
+        f"{number}. {food_name}, {quantity}" for number, (food_name, quantity) in enumerate(pending, start=1)
+    )
+    return (
+        f"""
+        You are a bot that gives us 3 comma separated numbers representing the calories, protein and fat for each of the following numbered food items (name and serving size). Reply with exactly one line per item in the format "<item number>: calories, protein, fat" and nothing else. Under no circumstances include any other text or extra numbers nor ask any further questions. If you can't give an exact value then give an estimate. Only if a food item doesn't exist will you reply "<item number>: Error" for that item.
+        {item_lines}
+        """
+    )
+
+
+def parse_batch_replies(raw: str) -> Dict[int, str]:
+    """Map item numbers to their reply text; lines without an item number are ignored"""
+    replies = {}
+    for line in raw.splitlines():
+        match = REPLY_LINE.match(line)
+        if match:
+            replies[int(match.group(1))] = match.group(2).strip()
+    return replies
+
+
+class NutritionBatchResolver:
+    """
+    Resolves a list of (food_name, quantity) pairs, returning one nutrition dict per item in request order.
+    Misses are deduplicated and sent to Gemini in a single prompt; if that call fails, they fall back to
+    single lookups with whatever time is left of the request budget.
+    """
+
+    def __init__(self, generate: Optional[Callable[..., Awaitable[str]]],
+                 single_lookup: Callable[[str, Any], Awaitable[Dict[str, Any]]],
+                 local_lookup: Optional[Callable[[str, Any], Optional[Dict[str, Any]]]] = None,
+                 cache=None, executor=None,
+                 budget: float = REQUEST_BUDGET_SECONDS,
+                 batch_timeout: float = PROMPT_TIMEOUTS["nutrition_batch"],
+                 fallback_reserve: float = FALLBACK_RESERVE_SECONDS,
+                 min_fallback: float = MIN_FALLBACK_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        # generate is None when Gemini is not configured
+        self.generate = generate
+        self.single_lookup = single_lookup
+        self.local_lookup = local_lookup
+        self.cache = cache
+        self.executor = executor
+        self.budget = budget
+        self.batch_timeout = batch_timeout
+        self.fallback_reserve = fallback_reserve
+        self.min_fallback = min_fallback
+        self.clock = clock
+
+    async def _blocking(self, func):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func)
+
+    async def _cached(self, food_name, quantity):
+        if self.cache is None:
+            return None
+        try:
+            cached = self.cache.get_local(food_name, quantity)
+            if cached is None:
+                cached = await self._blocking(lambda: self.cache.get(food_name, quantity))
+            return cached
+        except Exception as cache_error:
+            logger.warning(f"[NUTRITION BATCH] Cache lookup failed for '{food_name}': {cache_error}")
+            return None
+
+    async def _store(self, food_name, quantity, nutrition):
+        if self.cache is None:
+            return
+        try:
+            await self._blocking(lambda: self.cache.set(food_name, quantity, nutrition))
+        except Exception as cache_error:
+            logger.warning(f"[NUTRITION BATCH] Failed to cache result for '{food_name}': {cache_error}")
+
+    async def resolve(self, items: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        deadline = self.clock() + self.budget
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        misses = {}  # normalized key -> (food_name, quantity, [indexes])
+
+        for index, (food_name, quantity) in enumerate(items):
+            food_name = str(food_name).strip()
+            if self.local_lookup is not None:
+                local = self.local_lookup(food_name, quantity)
+                if local is not None:
+                    results[index] = local
+                    continue
+            cached = await self._cached(food_name, quantity)
+            if cached is not None:
+                results[index] = {**cached, 'source': 'cache'}
+                continue
+            key = make_cache_key(food_name, quantity)
+            if key not in misses:
+                misses[key] = (food_name, quantity, [])
+            misses[key][2].append(index)
+
+        if not misses:
+            return results
+        pending = list(misses.values())
+        if self.generate is None:
+            return self._fill(results, pending, [error_nutrition(source='gemini')] * len(pending))
+
+        prompt = build_batch_prompt([(food_name, quantity) for food_name, quantity, _ in pending])
+        # Leave room for the single-lookup fallback inside the request budget
+        timeout = min(self.batch_timeout, deadline - self.clock() - self.fallback_reserve)
+        logger.info(f"[GEMINI BATCH PROMPT] {len(pending)} items for {len(items)} requested, timeout {timeout:.1f}s")
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError("no time left for the batch prompt")
+            raw = (await self.generate("nutrition_batch", prompt, timeout=timeout)).strip()
+            logger.info(f"[GEMINI BATCH RAW RESPONSE] {raw}")
+        except GeminiUnavailableError as e:
+            # Single lookups would be rejected too, so don't fan out
+            logger.error(f"[GEMINI BATCH ERROR] Gemini unavailable: {e}")
+            return self._fill(results, pending, [error_nutrition(source='gemini')] * len(pending))
+        except Exception as e:
+            logger.error(f"[GEMINI BATCH ERROR] Batch call failed, falling back to single lookups: {e}")
+            return self._fill(results, pending, await self._fallback(pending, deadline - self.clock()))
+
+        replies = parse_batch_replies(raw)
+        nutritions = []
+        for number, (food_name, quantity, _) in enumerate(pending, start=1):
+            reply = replies.get(number)
+            nutrition = error_nutrition(raw=reply, source='gemini')
+            if reply and reply.lower() != "error":
+                try:
+                    calories, protein, fat = parse_nutrition_triplet(reply)
+                    nutrition.update({'calories': calories, 'protein': protein, 'fat': fat})
+                    await self._store(food_name, quantity, nutrition)
+                except ValueError as e:
+                    logger.error(f"[GEMINI BATCH PARSE ERROR] Could not extract 3 numbers for item {number} from: {reply}, error: {e}")
+            elif reply is None:
+                logger.error(f"[GEMINI BATCH PARSE ERROR] No reply line for item {number} ('{food_name}')")
+            nutritions.append(nutrition)
+        return self._fill(results, pending, nutritions)
+
+    async def _fallback(self, pending, remaining: float) -> List[Dict[str, Any]]:
+        """Single lookups (still cached and coalesced) bounded by the time left; unfinished items are errors"""
+        if remaining < self.min_fallback:
+            logger.error(f"[GEMINI BATCH ERROR] Only {remaining:.1f}s left, skipping single lookups")
+            return [error_nutrition(source='gemini')] * len(pending)
+        tasks = [asyncio.ensure_future(self.single_lookup(food_name, quantity)) for food_name, quantity, _ in pending]
+        done, not_done = await asyncio.wait(tasks, timeout=remaining)
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.error(f"[GEMINI BATCH ERROR] {len(not_done)} single lookups did not finish in {remaining:.1f}s")
+        nutritions = []
+        for task in tasks:
+            if task in done and task.exception() is None:
+                nutritions.append({**task.result(), 'source': 'gemini'})
+            else:
+                nutritions.append(error_nutrition(source='gemini'))
+        return nutritions
+
+    @staticmethod
+    def _fill(results, pending, nutritions):
+        for (_, _, indexes), nutrition in zip(pending, nutritions):
+            for index in indexes:
+                results[index] = dict(nutrition)
+        return results
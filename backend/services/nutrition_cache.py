@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Nutrition Lookup Cache
+Two-tier cache (in-process LRU + Firestore) in front of the Gemini nutrition lookup.
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, List
+
+logger = logging.getLogger(__name__)
+
+# Firestore collection used as the persistent tier
+NUTRITION_CACHE_COLLECTION = "nutrition_cache"
+
+# Defaults can be overridden from the environment
+DEFAULT_MAX_ENTRIES = int(os.getenv("NUTRITION_CACHE_MAX_ENTRIES", "5000"))
+DEFAULT_TTL_SECONDS = int(os.getenv("NUTRITION_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))  # 30 days
+
+# Map the many ways users write units onto one spelling
+UNIT_ALIASES = {
+    "": "",
+    "g": "g", "gm": "g", "gms": "g", "gram": "g", "grams": "g", "gr": "g",
+    "kg": "kg", "kgs": "kg", "kilogram": "kg", "kilograms": "kg",
+    "ml": "ml", "mls": "ml", "millilitre": "ml", "milliliter": "ml", "millilitres": "ml", "milliliters": "ml",
+    "l": "l", "litre": "l", "liter": "l", "litres": "l", "liters": "l",
+    "cup": "cup", "cups": "cup",
+    "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "pc": "piece", "pcs": "piece", "piece": "piece", "pieces": "piece",
+    "slice": "slice", "slices": "slice",
+    "bowl": "bowl", "bowls": "bowl",
+    "glass": "glass", "glasses": "glass",
+    "plate": "plate", "plates": "plate",
+    "scoop": "scoop", "scoops": "scoop",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+}
+
+_QUANTITY_PATTERN = re.compile(r"^\s*(\d+\s*/\s*\d+|\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*(.*)$")
+
+
+def normalize_food_name(food_name: str) -> str:
+    """Lowercase, trim and collapse whitespace/punctuation in a food name."""
+    name = str(food_name or "").lower().strip()
+    name = re.sub(r"[^\w\s]", " ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def normalize_quantity(quantity) -> Tuple[str, str]:
+    """
+    Split a serving size into a normalized (amount, unit) pair.
+    "100g", "100 grams" and 100 all become ("100", "g") / ("100", "").
+    Unparseable quantities are kept as normalized free text with an empty unit.
+    """
+    raw = str(quantity if quantity is not None else "").strip().lower()
+    match = _QUANTITY_PATTERN.match(raw)
+    if not match:
+        return normalize_food_name(raw), ""
+
+    number, unit, rest = match.groups()
+    try:
+        if "/" in number:
+            numerator, denominator = [float(part) for part in number.split("/")]
+            amount = numerator / denominator
+        else:
+            amount = float(number)
+        amount_str = f"{amount:g}"
+    except (ValueError, ZeroDivisionError):
+        amount_str = number.replace(" ", "")
+
+    unit = UNIT_ALIASES.get(unit, unit)
+    rest = normalize_food_name(rest)
+    if rest:
+        unit = f"{unit} {rest}".strip()
+    return amount_str, unit
+
+
+def make_cache_key(food_name: str, quantity) -> Tuple[str, str, str]:
+    """Build the normalized (food name, quantity, unit) key for a lookup."""
+    amount, unit = normalize_quantity(quantity)
+    return normalize_food_name(food_name), amount, unit
+
+
+def _document_id(key: Tuple[str, str, str]) -> str:
+    """Stable Firestore document ID for a cache key."""
+    return hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()
+
+
+class NutritionCache:
+    """
+    Bounded LRU cache of resolved nutrition values, backed by a Firestore collection.
+    Only successful lookups are stored; "Error" results are never cached.
+    """
+
+    def __init__(self, db=None, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        logger.info(f"NutritionCache initialized (max_entries={max_entries}, ttl={ttl_seconds}s, persistent={db is not None})")
+
+    def _collection(self):
+        return self.db.collection(NUTRITION_CACHE_COLLECTION) if self.db is not None else None
+
+    def _remember(self, key: Tuple[str, str, str], entry: Dict[str, Any]):
+        """Insert an entry into the memory tier, evicting the least recently used if full."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    @staticmethod
+    def _to_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "calories": entry["calories"],
+            "protein": entry["protein"],
+            "fat": entry["fat"],
+            "raw": entry.get("raw"),
+        }
+
+    def get_local(self, food_name: str, quantity) -> Optional[Dict[str, Any]]:
+        """Look up the memory tier only. Never blocks on I/O."""
+        key = make_cache_key(food_name, quantity)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= now:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._stats["memory_hits"] += 1
+            return self._to_result(entry)
+
+    def get(self, food_name: str, quantity) -> Optional[Dict[str, Any]]:
+        """
+        Look up the memory tier, then the persistent tier.
+        Blocking (Firestore read on a memory miss) - call from an executor.
+        """
+        result = self.get_local(food_name, quantity)
+        if result is not None:
+            return result
+
+        key = make_cache_key(food_name, quantity)
+        collection = self._collection()
+        if collection is not None:
+            try:
+                doc = collection.document(_document_id(key)).get()
+                if doc.exists:
+                    entry = doc.to_dict() or {}
+                    if entry.get("expires_at", 0) > time.time():
+                        self._remember(key, entry)
+                        with self._lock:
+                            self._stats["persistent_hits"] += 1
+                        return self._to_result(entry)
+                    # Expired in the persistent tier - drop it so it gets refreshed
+                    doc.reference.delete()
+                    with self._lock:
+                        self._stats["expired"] += 1
+            except Exception as e:
+                logger.warning(f"[NUTRITION CACHE] Persistent lookup failed for {key}: {e}")
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, food_name: str, quantity, nutrition: Dict[str, Any]) -> bool:
+        """
+        Store a successful lookup in both tiers.
+        Blocking (Firestore write) - call from an executor.
+        """
+        try:
+            calories = float(nutrition["calories"])
+            protein = float(nutrition["protein"])
+            fat = float(nutrition["fat"])
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        key = make_cache_key(food_name, quantity)
+        now = time.time()
+        entry = {
+            "food_name": key[0],
+            "quantity": key[1],
+            "unit": key[2],
+            "calories": calories,
+            "protein": protein,
+            "fat": fat,
+            "raw": nutrition.get("raw"),
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+            "hits": 0,
+        }
+        self._remember(key, dict(entry))
+        with self._lock:
+            self._stats["stores"] += 1
+
+        collection = self._collection()
+        if collection is not None:
+            try:
+                collection.document(_document_id(key)).set(entry)
+            except Exception as e:
+                logger.warning(f"[NUTRITION CACHE] Persistent write failed for {key}: {e}")
+        return True
+
+    def purge(self, food_name: Optional[str] = None, quantity=None) -> int:
+        """
+        Remove entries from both tiers.
+        With food_name (and optionally quantity) only matching entries are removed,
+        otherwise the whole cache is cleared. Returns the number of entries removed.
+        """
+        removed_keys = set()
+        target_name = normalize_food_name(food_name) if food_name else None
+        target_key = make_cache_key(food_name, quantity) if food_name and quantity is not None else None
+
+        def matches(key):
+            if target_key is not None:
+                return key == target_key
+            if target_name is not None:
+                return key[0] == target_name
+            return True
+
+        with self._lock:
+            for key in [k for k in self._entries if matches(k)]:
+                del self._entries[key]
+                removed_keys.add(key)
+
+        collection = self._collection()
+        if collection is not None:
+            try:
+                if target_key is not None:
+                    docs = [collection.document(_document_id(target_key)).get()]
+                elif target_name is not None:
+                    docs = list(collection.where("food_name", "==", target_name).stream())
+                else:
+                    docs = list(collection.stream())
+
+                batch = self.db.batch()
+                pending = 0
+                for doc in docs:
+                    if not doc.exists:
+                        continue
+                    data = doc.to_dict() or {}
+                    removed_keys.add((data.get("food_name"), data.get("quantity"), data.get("unit")))
+                    batch.delete(doc.reference)
+                    pending += 1
+                    if pending == 500:
+                        batch.commit()
+                        batch = self.db.batch()
+                        pending = 0
+                if pending:
+                    batch.commit()
+            except Exception as e:
+                logger.warning(f"[NUTRITION CACHE] Persistent purge failed: {e}")
+
+        logger.info(f"[NUTRITION CACHE] Purged {len(removed_keys)} entries (food_name={food_name}, quantity={quantity})")
+        return len(removed_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size of the memory tier."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["persistent"] = self.db is not None
+        return stats
+
+    def entries(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recently used entries of the memory tier, newest first."""
+        with self._lock:
+            items = list(self._entries.values())[-limit:] if limit > 0 else []
+        return [dict(entry) for entry in reversed(items)]
+
+
+# Global instance
+_nutrition_cache = None
+
+def get_nutrition_cache(db) -> NutritionCache:
+    """
+    Get the global nutrition cache instance.
+    """
+    global _nutrition_cache
+    if _nutrition_cache is None:
+        _nutrition_cache = NutritionCache(db)
+    return _nutrition_cache
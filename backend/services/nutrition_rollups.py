@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Daily Nutrition Rollups
+Per-user, per-day totals kept up to date on every log write so summaries read O(days) documents.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Iterable
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# users/{user_id}/daily_nutrition/{YYYY-MM-DD}
+ROLLUP_COLLECTION = "daily_nutrition"
+# Marker document recording that a user's rollups were backfilled from their raw logs
+META_DOC_ID = "_meta"
+# Longest range the summary endpoints can ask for
+MAX_RANGE_DAYS = 90
+
+FOOD_FIELDS = ("calories", "protein", "fat")
+# Only these fields are fetched when aggregating raw logs
+FOOD_LOG_PROJECTION = ["timestamp", "food", "servingSize"]
+WORKOUT_LOG_PROJECTION = ["date", "calories"]
+EMPTY_ROLLUP = {"calories": 0.0, "protein": 0.0, "fat": 0.0, "items": 0, "burned": 0.0, "workouts": 0}
+
+
+def _day_of(value) -> Optional[str]:
+    """YYYY-MM-DD of a Firestore timestamp, datetime or ISO string."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).strftime('%Y-%m-%d')
+        except ValueError:
+            return None
+    return None
+
+
+def food_log_day(log: Dict[str, Any]) -> Optional[str]:
+    """Day a food log counts towards."""
+    return _day_of(log.get("timestamp"))
+
+
+def workout_log_day(log: Dict[str, Any]) -> Optional[str]:
+    """Day a workout log counts towards."""
+    return _day_of(log.get("date"))
+
+
+def food_log_contribution(log: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Calories, protein and fat a food log adds to its day.
+    per_100g logs are scaled by the serving size (100 when it is not numeric);
+    other logs already hold the totals for the serving.
+    """
+    food_item = log.get("food")
+    if not isinstance(food_item, dict):
+        food_item = {}
+    values = {}
+    for field in FOOD_FIELDS:
+        try:
+            values[field] = float(food_item.get(field, 0) or 0)
+        except (TypeError, ValueError):
+            values[field] = 0.0
+    if food_item.get("per_100g", True):
+        try:
+            serving_size = float(log.get("servingSize", "100"))
+        except (TypeError, ValueError):
+            serving_size = 100.0
+        values = {field: value * serving_size / 100 for field, value in values.items()}
+    return values
+
+
+def workout_log_calories(log: Dict[str, Any]) -> float:
+    try:
+        return float(log.get("calories", 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def aggregate_logs(food_logs: Iterable[Dict[str, Any]], workout_logs: Iterable[Dict[str, Any]] = ()) -> Dict[str, Dict[str, Any]]:
+    """
+    Fold raw food and workout logs into per-day rollups in a single pass (used for backfills).
+    The inputs are only iterated once, so Firestore streams can be passed in directly.
+    """
+    rollups: Dict[str, Dict[str, Any]] = {}
+    for log in food_logs:
+        day = food_log_day(log or {})
+        if day is None:
+            continue
+        rollup = rollups.setdefault(day, dict(EMPTY_ROLLUP))
+        for field, value in food_log_contribution(log).items():
+            rollup[field] += value
+        rollup["items"] += 1
+    for log in workout_logs:
+        day = workout_log_day(log or {})
+        if day is None:
+            continue
+        rollup = rollups.setdefault(day, dict(EMPTY_ROLLUP))
+        rollup["burned"] += workout_log_calories(log)
+        rollup["workouts"] += 1
+    return rollups
+
+
+def day_range(end_day: datetime, days: int) -> List[str]:
+    """The last `days` days ending on end_day, most recent first."""
+    return [(end_day - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+
+
+class NutritionRollups:
+    """
+    Maintains users/{id}/daily_nutrition/{day} documents with Firestore Increment transforms,
+    written in the same atomic batch/transaction as the log documents they summarize.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _rollups(self, user_id: str):
+        return self.db.collection(f"users/{user_id}/{ROLLUP_COLLECTION}")
+
+    def _stage(self, writer, user_id: str, day: str, deltas: Dict[str, float]):
+        """Stage an increment of a day's rollup on a WriteBatch or Transaction."""
+        fields = {field: firestore.Increment(value) for field, value in deltas.items()}
+        fields["day"] = day
+        fields["updatedAt"] = firestore.SERVER_TIMESTAMP
+        writer.set(self._rollups(user_id).document(day), fields, merge=True)
+
+    def stage_food_log(self, writer, user_id: str, log: Dict[str, Any], sign: int = 1):
+        day = food_log_day(log)
+        if day is None:
+            logger.warning(f"[ROLLUPS] Food log for {user_id} has no usable timestamp, not rolled up")
+            return
+        deltas = {field: sign * value for field, value in food_log_contribution(log).items()}
+        deltas["items"] = sign
+        self._stage(writer, user_id, day, deltas)
+
+    def stage_workout_log(self, writer, user_id: str, log: Dict[str, Any], sign: int = 1):
+        day = workout_log_day(log)
+        if day is None:
+            logger.warning(f"[ROLLUPS] Workout log for {user_id} has no usable date, not rolled up")
+            return
+        self._stage(writer, user_id, day, {"burned": sign * workout_log_calories(log), "workouts": sign})
+
+    def log_entries(self, user_id: str, food_logs: Iterable[Dict[str, Any]] = (), workout_logs: Iterable[Dict[str, Any]] = (), batch=None) -> List[str]:
+        """
+        Write food/workout logs and their rollup increments in one atomic batch.
+        When a batch is passed in, the writes are only staged on it and the caller commits.
+        Blocking - call from an executor. Returns the new log document IDs.
+        """
+        commit = batch is None
+        if commit:
+            batch = self.db.batch()
+        doc_ids = []
+        for log in food_logs:
+            doc_ref = self.db.collection(f"users/{user_id}/food_logs").document()
+            batch.set(doc_ref, log)
+            self.stage_food_log(batch, user_id, log)
+            doc_ids.append(doc_ref.id)
+        for log in workout_logs:
+            doc_ref = self.db.collection("workout_logs").document()
+            batch.set(doc_ref, log)
+            self.stage_workout_log(batch, user_id, log)
+            doc_ids.append(doc_ref.id)
+        if commit:
+            batch.commit()
+        return doc_ids
+
+    def delete_food_logs(self, user_id: str, query) -> int:
+        """
+        Delete the food logs matched by query and subtract them from their days, in one transaction.
+        Blocking - call from an executor. Returns the number of logs deleted.
+        """
+        @firestore.transactional
+        def delete_in_transaction(transaction):
+            snapshots = [snapshot for snapshot in transaction.get(query.select(FOOD_LOG_PROJECTION)) if snapshot.exists]
+            for snapshot in snapshots:
+                self.stage_food_log(transaction, user_id, snapshot.to_dict() or {}, sign=-1)
+                transaction.delete(snapshot.reference)
+            return len(snapshots)
+
+        return delete_in_transaction(self.db.transaction())
+
+    def rebuild(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Recompute rollups from the user's raw logs and mark the user as backfilled.
+        Only days that still have logs are rewritten, so days older than log retention keep their totals.
+        Blocking - call from an executor.
+        """
+        food_query = self.db.collection(f"users/{user_id}/food_logs").select(FOOD_LOG_PROJECTION)
+        workout_query = self.db.collection("workout_logs").where("userId", "==", user_id).select(WORKOUT_LOG_PROJECTION)
+        rollups = aggregate_logs(
+            (doc.to_dict() or {} for doc in food_query.stream()),
+            (doc.to_dict() or {} for doc in workout_query.stream()),
+        )
+
+        batch = self.db.batch()
+        for day, rollup in rollups.items():
+            batch.set(self._rollups(user_id).document(day), {**rollup, "day": day, "updatedAt": firestore.SERVER_TIMESTAMP})
+        batch.set(self._rollups(user_id).document(META_DOC_ID), {"backfilledAt": firestore.SERVER_TIMESTAMP, "days": len(rollups)})
+        batch.commit()
+        food_count = sum(rollup["items"] for rollup in rollups.values())
+        workout_count = sum(rollup["workouts"] for rollup in rollups.values())
+        logger.info(f"[ROLLUPS] Rebuilt {len(rollups)} daily rollups for {user_id} from {food_count} food / {workout_count} workout logs")
+        return rollups
+
+    def get_days(self, user_id: str, days: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Rollups for the given days in one batched read (missing days are absent from the result).
+        Users whose rollups were never backfilled are rebuilt from their logs first.
+        Blocking - call from an executor.
+        """
+        collection = self._rollups(user_id)
+        refs = [collection.document(day) for day in days] + [collection.document(META_DOC_ID)]
+        snapshots = {snapshot.id: snapshot for snapshot in self.db.get_all(refs)}
+
+        meta = snapshots.get(META_DOC_ID)
+        if meta is None or not meta.exists:
+            rebuilt = self.rebuild(user_id)
+            return {day: rebuilt[day] for day in days if day in rebuilt}
+
+        result = {}
+        for day in days:
+            snapshot = snapshots.get(day)
+            if snapshot is not None and snapshot.exists:
+                result[day] = {**EMPTY_ROLLUP, **(snapshot.to_dict() or {})}
+        return result
+
+    def delete_all(self, user_id: str) -> int:
+        """Remove every rollup document for a user. Blocking - call from an executor."""
+        count = 0
+        batch = self.db.batch()
+        for doc in self._rollups(user_id).stream():
+            batch.delete(doc.reference)
+            count += 1
+            if count % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        if count % 500:
+            batch.commit()
+        return count
+
+
+# Global instance
+_nutrition_rollups = None
+
+def get_nutrition_rollups(db) -> NutritionRollups:
+    """
+    Get the global nutrition rollups instance.
+    """
+    global _nutrition_rollups
+    if _nutrition_rollups is None:
+        _nutrition_rollups = NutritionRollups(db)
+    return _nutrition_rollups
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+PDF Extraction Engine
+Fast PyPDF2 text extraction per page, scored on what the diet parser needs, escalating bad pages to pdfplumber.
+"""
+
+import io
+import os
+import re
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+# Pages scoring below this are re-extracted with pdfplumber
+ESCALATION_THRESHOLD = float(os.getenv("PDF_ESCALATION_THRESHOLD", "0.6"))
+# Documents with at least this many pages are split across extraction workers
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "4"))
+
+ENGINE_FAST = "pypdf2"
+ENGINE_LAYOUT = "pdfplumber"
+
+# Pages with less text than this are treated as empty (or scanned)
+MIN_PAGE_CHARS = 20
+# Tokens this long are usually words run together by the fast engine
+MERGED_TOKEN_CHARS = 25
+# Each broken time token halves the score: a split time becomes a wrong notification
+BROKEN_TIME_PENALTY = 0.5
+# Each word the fast engine split ("oran ge", "lemon -honey") halves the score: it ends up in reminder messages
+FRAGMENT_PENALTY = 0.5
+# Clean pages with no times or day headers (cover pages, notes) are fine but score lower
+NO_SIGNAL_FACTOR = 0.7
+
+TIME_PATTERN = re.compile(r'\b\d{1,2}(?::\d{2})?\s*(?:AM|PM|A\.M\.|P\.M\.)', re.IGNORECASE)
+# "10:0 0AM", "10 :00", "8 : 30" - times the fast engine split with stray spaces
+BROKEN_TIME_PATTERN = re.compile(r'\b\d{1,2}\s*:\s*\d(?!\d)|\b\d{1,2}\s+:\s*\d{2}|\b\d{1,2}:\s+\d{2}')
+DAY_HEADER_PATTERN = re.compile(
+    r'^\s*(?:MONDAY|TUESDAY|WEDNESDAY|THURSDAY|FRIDAY|SATURDAY|SUNDAY|DAY\s*\d{1,2})\b', re.IGNORECASE | re.MULTILINE
+)
+# One or two letter tokens that are real words or units; any other is likely a piece of a split word
+SHORT_WORDS = {
+    "a", "i", "am", "an", "as", "at", "be", "by", "do", "go", "he", "if", "in", "is", "it", "me", "my", "no", "of",
+    "ok", "on", "or", "pm", "so", "to", "up", "us", "we", "g", "kg", "ml", "l", "gm", "oz", "pc", "x",
+}
+SHORT_TOKEN_PATTERN = re.compile(r"(?<![\w'])[A-Za-z]{1,2}(?![\w'])")
+# A hyphen detached from the word before it: "lemon -honey", or "veg -" at the end of a line
+SPLIT_HYPHEN_PATTERN = re.compile(r'[A-Za-z] +-(?:[A-Za-z]|[ \t]*$)', re.MULTILINE)
+ALLOWED_PUNCTUATION = set(".,:;-/\\()[]{}&%+'\"!?*•@#|_~<>=")
+
+
+def count_fragments(text: str) -> int:
+    """Number of places where a word looks split by the extractor."""
+    short = sum(1 for match in SHORT_TOKEN_PATTERN.finditer(text) if match.group(0).lower() not in SHORT_WORDS)
+    return short + len(SPLIT_HYPHEN_PATTERN.findall(text))
+
+
+def score_page_text(text: Optional[str]) -> float:
+    """
+    0..1 estimate of how usable a page's text is for the diet parser: mostly readable characters,
+    no words run together or split apart, time tokens intact and one time per line, and times or day headers present.
+    """
+    text = text or ""
+    stripped = text.strip()
+    if len(stripped) < MIN_PAGE_CHARS:
+        return 0.0
+    readable = sum(1 for c in stripped if c.isalnum() or c.isspace() or c in ALLOWED_PUNCTUATION) / len(stripped)
+    tokens = stripped.split()
+    merged = sum(1 for token in tokens if len(token) > MERGED_TOKEN_CHARS) / len(tokens)
+    broken = len(BROKEN_TIME_PATTERN.findall(stripped))
+    integrity = max(0.0, 1 - broken * BROKEN_TIME_PENALTY)
+    fragments = count_fragments(stripped)
+    wholeness = max(0.0, 1 - fragments * FRAGMENT_PENALTY)
+    times = len(TIME_PATTERN.findall(stripped))
+    if times:
+        # The parser is line based; several times on one line means lost line breaks
+        lines_with_times = sum(1 for line in stripped.split("\n") if TIME_PATTERN.search(line))
+        separation = lines_with_times / times
+        signal = 1.0
+    else:
+        separation = 1.0
+        signal = 1.0 if DAY_HEADER_PATTERN.search(stripped) else NO_SIGNAL_FACTOR
+    return round(readable * (1 - merged) * integrity * wholeness * separation * signal, 3)
+
+
+def page_count(pdf_bytes: bytes) -> int:
+    import PyPDF2
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def _fast_pages(pdf_bytes: bytes, pages: Optional[Iterable[int]]) -> Dict[int, Dict[str, Any]]:
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    numbers = range(len(reader.pages)) if pages is None else pages
+    results = {}
+    for number in numbers:
+        started = time.perf_counter()
+        try:
+            text = reader.pages[number].extract_text() or ""
+        except Exception as e:
+            logger.warning(f"[PDF EXTRACTION] {ENGINE_FAST} failed on page {number}: {e}")
+            text = ""
+        results[number] = {"page": number, "engine": ENGINE_FAST, "text": text, "score": score_page_text(text),
+                           "seconds": time.perf_counter() - started}
+    return results
+
+
+def _layout_pages(pdf_bytes: bytes, pages: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    import pdfplumber
+    results = {}
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        for number in pages:
+            started = time.perf_counter()
+            text = pdf.pages[number].extract_text() or ""
+            results[number] = {"page": number, "engine": ENGINE_LAYOUT, "text": text, "score": score_page_text(text),
+                               "seconds": time.perf_counter() - started}
+    return results
+
+
+def extract_pdf_text(pdf_bytes: bytes, pages: Optional[List[int]] = None,
+                     threshold: float = ESCALATION_THRESHOLD) -> Dict[str, Any]:
+    """
+    Extract the given pages (default all) with PyPDF2 and re-extract pages scoring below threshold
+    with pdfplumber, keeping whichever result scores better. Returns a plain dict:
+    {"text", "engine", "page_count", "escalated_pages", "seconds", "pages": [{"page", "engine", "score", "seconds"}]}.
+    """
+    started = time.perf_counter()
+    try:
+        results = _fast_pages(pdf_bytes, pages)
+    except Exception as e:
+        # Unreadable by PyPDF2 altogether - let pdfplumber try every page
+        logger.warning(f"[PDF EXTRACTION] {ENGINE_FAST} could not open PDF, using {ENGINE_LAYOUT}: {e}")
+        import pdfplumber
+        if pages is None:
+            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+                pages = list(range(len(pdf.pages)))
+        results = {number: {"page": number, "engine": ENGINE_FAST, "text": "", "score": 0.0, "seconds": 0.0} for number in pages}
+
+    weak = [number for number, result in results.items() if result["score"] < threshold]
+    if weak:
+        for number, layout in _layout_pages(pdf_bytes, weak).items():
+            fast = results[number]
+            seconds = fast["seconds"] + layout["seconds"]
+            if layout["score"] > fast["score"] or (not fast["text"].strip() and layout["text"].strip()):
+                results[number] = layout
+            results[number].update(seconds=seconds, escalated=True)
+    return build_report([results[number] for number in sorted(results)], time.perf_counter() - started)
+
+
+def _combined_engine(engines) -> Optional[str]:
+    engines = {engine for engine in engines if engine}
+    return engines.pop() if len(engines) == 1 else ("mixed" if engines else None)
+
+
+def build_report(page_results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    """Extraction report for page results in page order."""
+    return {
+        "text": "\n".join(result["text"].strip() for result in page_results if result["text"].strip()),
+        "engine": _combined_engine(result["engine"] for result in page_results if result["text"].strip()),
+        "page_count": len(page_results),
+        "escalated_pages": sum(1 for result in page_results if result.get("escalated")),
+        "seconds": round(seconds, 4),
+        "pages": [{"page": result["page"], "engine": result["engine"], "score": result["score"],
+                   "seconds": round(result["seconds"], 4), "escalated": result.get("escalated", False)}
+                  for result in page_results],
+    }
+
+
+def merge_reports(reports: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    """Combine the reports of consecutive page ranges, in page order, into one."""
+    return {
+        "text": "\n".join(report["text"] for report in reports if report["text"]),
+        "engine": _combined_engine(report["engine"] for report in reports),
+        "page_count": sum(report["page_count"] for report in reports),
+        "escalated_pages": sum(report["escalated_pages"] for report in reports),
+        "seconds": round(seconds, 4),
+        "pages": [page for report in reports for page in report["pages"]],
+    }
@@ -1,14 +1,31 @@
-import PyPDF2
-import pdfplumber
-import io
 import base64
+import hashlib
 import requests
+from collections import OrderedDict
+from datetime import datetime
 from typing import Optional, List, Dict
 import logging
 from fastapi import HTTPException
 
+from services.pdf_text_cache import pdf_text_cache, content_key
+from services.pdf_extraction import extract_pdf_text
+
 logger = logging.getLogger(__name__)
 
+# Retrieval indexes kept in memory, keyed by a hash of the diet text
+MAX_CACHED_INDEXES = 64
+# (user, diet file) -> content hash mappings remembered, so repeat lookups skip the download
+MAX_PDF_KEYS = 10000
+# Character cap for diet context when there is no question to retrieve for
+MAX_CONTEXT_CHARS = 4000
+
+# diet_text/{user_id}: extracted text and retrieval chunks of the user's current diet
+DIET_TEXT_COLLECTION = "diet_text"
+# Bump when chunking changes so stored chunks are rebuilt from the stored text
+CHUNKER_VERSION = 1
+# Stay well below Firestore's 1 MiB document limit; larger diets store text only
+MAX_STORED_CHUNK_CHARS = 400_000
+
 class PDFRAGService:
     """
     Service for extracting text from PDFs and providing RAG functionality
@@ -16,35 +33,32 @@ class PDFRAGService:
     """
     
     def __init__(self):
-        self.pdf_cache = {}  # Simple in-memory cache for extracted text
+        self.text_cache = pdf_text_cache  # content hash -> extracted text (memory LRU + optional disk)
+        self.pdf_keys = OrderedDict()  # "{user_id}_{diet_pdf_url}" -> (content hash, dietCacheVersion)
+        self.index_cache = OrderedDict()  # diet text hash -> DietIndex
     
     def extract_text_from_pdf_bytes(self, pdf_bytes: bytes) -> str:
         """
-        Extract text from PDF bytes using multiple methods for better coverage.
+        Extract text from PDF bytes, reusing the text of identical PDFs from the content-hash cache.
+        """
+        key = content_key(pdf_bytes)
+        cached = self.text_cache.get(key)
+        if cached is not None:
+            return cached
+        text = self._parse_pdf_bytes(pdf_bytes)
+        if text:
+            self.text_cache.set(key, text)
+        return text
+    
+    def _parse_pdf_bytes(self, pdf_bytes: bytes) -> str:
+        """
+        Extract text from PDF bytes: fast PyPDF2 pass, with poorly extracted pages redone by pdfplumber.
         """
         try:
-            # Try pdfplumber first (better for complex layouts)
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                
-                if text.strip():
-                    return text.strip()
-            
-            # Fallback to PyPDF2 if pdfplumber didn't extract much text
-            with io.BytesIO(pdf_bytes) as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                text = ""
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                
-                return text.strip()
-                
+            report = extract_pdf_text(pdf_bytes)
+            logger.info(f"Extracted {report['page_count']} PDF pages with {report['engine']} in {report['seconds']}s "
+                        f"({report['escalated_pages']} escalated)")
+            return report["text"]
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             raise HTTPException(status_code=500, detail="Failed to extract text from PDF")
@@ -87,50 +101,162 @@ class PDFRAGService:
             logger.error(f"Error extracting text from Firestore: {e}")
             raise HTTPException(status_code=500, detail="Failed to extract text from Firestore PDF")
     
-    def get_diet_pdf_text(self, user_id: str, diet_pdf_url: str, db) -> Optional[str]:
+    def _remember(self, user_id: str, diet_pdf_url: str, key: str, text: str, cache_version: Optional[float] = None):
+        """Cache text under its content hash and remember which hash (and upload version) the user's diet file has."""
+        self.text_cache.set(key, text)
+        pdf_key = f"{user_id}_{diet_pdf_url}"
+        self.pdf_keys[pdf_key] = (key, cache_version)
+        self.pdf_keys.move_to_end(pdf_key)
+        while len(self.pdf_keys) > MAX_PDF_KEYS:
+            self.pdf_keys.popitem(last=False)
+
+    def save_diet_text(self, user_id: str, diet_pdf_url: str, text: str, db, cache_version: Optional[float] = None,
+                       pdf_sha256: Optional[str] = None, extraction: Optional[Dict] = None):
+        """
+        Persist extracted diet text and its retrieval chunks to diet_text/{user_id},
+        and prime the in-memory text and index caches.
+        """
+        from services.diet_retrieval import DietIndex, chunk_diet_text
+        chunks = chunk_diet_text(text)
+        pdf_sha256 = pdf_sha256 or content_key(text.encode("utf-8"))
+        self._remember(user_id, diet_pdf_url, pdf_sha256, text, cache_version)
+        self._prime_index(text, DietIndex(chunks))
+        if db is None:
+            return
+        stored_chunks = chunks if sum(len(chunk["text"]) for chunk in chunks) + len(text) <= MAX_STORED_CHUNK_CHARS else None
+        db.collection(DIET_TEXT_COLLECTION).document(user_id).set({
+            "userId": user_id,
+            "dietPdfUrl": diet_pdf_url,
+            "dietCacheVersion": cache_version,
+            "pdfSha256": pdf_sha256,
+            "text": text,
+            "chunks": stored_chunks,
+            "chunkerVersion": CHUNKER_VERSION,
+            "extractedAt": datetime.now().isoformat(),
+            # Which engine produced the text and how long it took, when known
+            "extraction": {key: extraction[key] for key in ("engine", "page_count", "escalated_pages", "seconds") if key in extraction}
+            if extraction else None,
+        })
+        logger.info(f"Stored diet text for user {user_id} ({len(text)} chars, {len(chunks)} chunks, version {cache_version})")
+
+    def load_diet_text(self, user_id: str, db, diet_pdf_url: Optional[str] = None,
+                       cache_version: Optional[float] = None) -> Optional[Dict]:
+        """
+        The stored diet_text document for the user, or None if there is none or it belongs
+        to a different diet than diet_pdf_url (or, when given, a different upload than cache_version).
+        """
+        if db is None:
+            return None
+        snapshot = db.collection(DIET_TEXT_COLLECTION).document(user_id).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict() or {}
+        if not data.get("text") or (diet_pdf_url and data.get("dietPdfUrl") != diet_pdf_url):
+            return None
+        # The same file name can be uploaded again; the version tells the uploads apart
+        if cache_version is not None and data.get("dietCacheVersion") != cache_version:
+            return None
+        return data
+
+    def _prime_index(self, text: str, index):
+        key = hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+        self.index_cache[key] = index
+        self.index_cache.move_to_end(key)
+        while len(self.index_cache) > MAX_CACHED_INDEXES:
+            self.index_cache.popitem(last=False)
+
+    def get_diet_pdf_text(self, user_id: str, diet_pdf_url: str, db, cache_version: Optional[float] = None) -> Optional[str]:
         """
         Get diet PDF text from various storage locations.
-        Returns cached text if available, otherwise extracts and caches.
+        Returns cached text if available, then text stored at upload time for this diet, otherwise extracts
+        and stores it. Pass the profile's dietCacheVersion: the same file name can be uploaded again, and
+        only text from that upload is returned.
         """
-        cache_key = f"{user_id}_{diet_pdf_url}"
-        
         # Check cache first
-        if cache_key in self.pdf_cache:
-            return self.pdf_cache[cache_key]
+        key, version = self.pdf_keys.get(f"{user_id}_{diet_pdf_url}", (None, None))
+        if key is not None and (cache_version is None or version == cache_version):
+            cached = self.text_cache.get(key)
+            if cached is not None:
+                return cached
         
+        # Then the text stored when the diet was uploaded (survives restarts)
         try:
-            text = None
-            
-            # Handle different URL formats
-            if diet_pdf_url.startswith('https://storage.googleapis.com/'):
-                text = self.extract_text_from_firebase_url(diet_pdf_url)
-            elif diet_pdf_url.startswith('firestore://'):
-                text = self.extract_text_from_firestore(user_id, db)
-            elif diet_pdf_url.endswith('.pdf'):
-                # Assume it's a Firebase Storage blob
-                from services.firebase_client import bucket
-                blob_path = f"diets/{user_id}/{diet_pdf_url}"
-                blob = bucket.blob(blob_path)
-                pdf_bytes = blob.download_as_bytes()
-                text = self.extract_text_from_pdf_bytes(pdf_bytes)
-            else:
-                logger.warning(f"Unknown diet PDF URL format: {diet_pdf_url}")
+            stored = self.load_diet_text(user_id, db, diet_pdf_url, cache_version)
+            if stored:
+                from services.diet_retrieval import DietIndex
+                text = stored["text"]
+                self._remember(user_id, diet_pdf_url, stored.get("pdfSha256") or content_key(text.encode("utf-8")), text,
+                               stored.get("dietCacheVersion"))
+                if stored.get("chunks") and stored.get("chunkerVersion") == CHUNKER_VERSION:
+                    self._prime_index(text, DietIndex(stored["chunks"]))
+                logger.info(f"Loaded stored diet text for user {user_id}")
+                return text
+        except Exception as e:
+            logger.warning(f"Could not read stored diet text for user {user_id}, extracting from PDF: {e}")
+        
+        try:
+            pdf_bytes = self._fetch_diet_pdf_bytes(user_id, diet_pdf_url, db)
+            if pdf_bytes is None:
                 return None
-            
-            # Cache the extracted text
-            if text:
-                self.pdf_cache[cache_key] = text
-                logger.info(f"Successfully extracted and cached PDF text for user {user_id}")
-            
-            return text
-            
+            text = self.extract_text_from_pdf_bytes(pdf_bytes)
         except Exception as e:
             logger.error(f"Error getting diet PDF text for user {user_id}: {e}")
             return None
+        if text:
+            # Store it so later requests and restarts skip the PDF parse
+            try:
+                self.save_diet_text(user_id, diet_pdf_url, text, db, cache_version, pdf_sha256=content_key(pdf_bytes))
+                logger.info(f"Successfully extracted and cached PDF text for user {user_id}")
+            except Exception as e:
+                self._remember(user_id, diet_pdf_url, content_key(pdf_bytes), text, cache_version)
+                logger.warning(f"Could not store diet text for user {user_id}: {e}")
+        return text
+
+    def _fetch_diet_pdf_bytes(self, user_id: str, diet_pdf_url: str, db) -> Optional[bytes]:
+        """
+        Download diet PDF bytes from their storage location.
+        """
+        # Handle different URL formats
+        if diet_pdf_url.startswith('https://storage.googleapis.com/'):
+            response = requests.get(diet_pdf_url, timeout=30)
+            if response.status_code != 200:
+                raise HTTPException(status_code=404, detail="Failed to fetch PDF from Firebase Storage")
+            return response.content
+        elif diet_pdf_url.startswith('firestore://'):
+            doc = db.collection("diet_pdfs").document(user_id).get()
+            pdf_data = (doc.to_dict() or {}).get("pdf_data") if doc.exists else None
+            if not pdf_data:
+                raise HTTPException(status_code=404, detail="Diet PDF not found in Firestore")
+            return base64.b64decode(pdf_data)
+        elif diet_pdf_url.endswith('.pdf'):
+            # Assume it's a Firebase Storage blob
+            from services.firebase_client import bucket
+            blob_path = f"diets/{user_id}/{diet_pdf_url}"
+            blob = bucket.blob(blob_path)
+            return blob.download_as_bytes()
+        else:
+            logger.warning(f"Unknown diet PDF URL format: {diet_pdf_url}")
+            return None
     
-    def create_diet_context_prompt(self, diet_text: str) -> str:
+    def get_diet_index(self, diet_text: str):
+        """
+        BM25 index over the day/meal chunks of a diet, built once per distinct text.
+        """
+        # Imported here to avoid a circular import (diet_retrieval -> diet_notification_service -> this module)
+        from services.diet_retrieval import DietIndex
+        key = hashlib.sha256(diet_text.strip().encode("utf-8")).hexdigest()
+        index = self.index_cache.get(key)
+        if index is None:
+            index = DietIndex.from_text(diet_text)
+            self._prime_index(diet_text, index)
+        else:
+            self.index_cache.move_to_end(key)
+        return index
+
+    def create_diet_context_prompt(self, diet_text: str, question: Optional[str] = None) -> str:
         """
         Create a context prompt from diet PDF text for the chatbot.
+        With a question, only the diet chunks most relevant to it are included.
         """
         if not diet_text:
             return ""
@@ -138,29 +264,40 @@ class PDFRAGService:
         # Clean and format the diet text
         cleaned_text = diet_text.strip()
         
+        if question:
+            # Top-k day/meal chunks for this question instead of the start of the plan
+            chunks = self.get_diet_index(cleaned_text).search(question)
+            cleaned_text = "\n\n".join(chunk["text"] for chunk in chunks)
+            heading = "RELEVANT PARTS OF THE CURRENT DIET PLAN:"
+        else:
+            heading = "CURRENT DIET PLAN INFORMATION:"
+        
         # Limit the text to avoid token limits (keep first 4000 characters)
-        if len(cleaned_text) > 4000:
-            cleaned_text = cleaned_text[:4000] + "..."
+        if len(cleaned_text) > MAX_CONTEXT_CHARS:
+            cleaned_text = cleaned_text[:MAX_CONTEXT_CHARS] + "..."
         
         context_prompt = f"""
-CURRENT DIET PLAN INFORMATION:
+{heading}
 {cleaned_text}
 
 IMPORTANT: You can now answer questions about the user's current diet plan. Use this information to provide personalized advice about their meals, nutritional requirements, and dietary recommendations. Always refer to their specific diet plan when answering questions about their nutrition.
 """
         return context_prompt.strip()
     
-    def enhance_chatbot_prompt(self, user_id: str, diet_pdf_url: str, db, base_prompt: str) -> str:
+    def enhance_chatbot_prompt(self, user_id: str, diet_pdf_url: str, db, base_prompt: str, question: Optional[str] = None,
+                               cache_version: Optional[float] = None) -> str:
         """
         Enhance the chatbot prompt with diet PDF context using RAG.
+        Pass the user's question to retrieve only the relevant parts of the diet, and the profile's
+        dietCacheVersion so text from an earlier upload is never used.
         """
         if not diet_pdf_url:
             return base_prompt
         
         try:
-            diet_text = self.get_diet_pdf_text(user_id, diet_pdf_url, db)
+            diet_text = self.get_diet_pdf_text(user_id, diet_pdf_url, db, cache_version)
             if diet_text:
-                diet_context = self.create_diet_context_prompt(diet_text)
+                diet_context = self.create_diet_context_prompt(diet_text, question)
                 enhanced_prompt = f"{base_prompt}\n\n{diet_context}"
                 logger.info(f"Enhanced chatbot prompt with diet context for user {user_id}")
                 return enhanced_prompt
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+PDF Text Cache
+Extracted PDF text keyed by the SHA-256 of the PDF bytes: a byte-capped LRU in memory and an optional disk tier.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden from the environment
+DEFAULT_MAX_BYTES = int(os.getenv("PDF_TEXT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Directory shared by the workers on a host; unset disables the disk tier
+DEFAULT_DISK_DIR = os.getenv("PDF_TEXT_CACHE_DIR", "")
+DEFAULT_DISK_MAX_BYTES = int(os.getenv("PDF_TEXT_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+# The disk tier is trimmed back under its cap every this many writes
+DISK_PRUNE_EVERY = 50
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PDFTextCache:
+    """
+    Two-tier cache of extracted text. Memory entries are evicted least recently used once their
+    UTF-8 size exceeds max_bytes; disk entries are plain files written atomically, so several
+    processes can share the directory, and the oldest are pruned past disk_max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, disk_dir: Optional[str] = DEFAULT_DISK_DIR,
+                 disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0, "disk_evictions": 0, "disk_errors": 0}
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"[PDF CACHE] Disk tier disabled, cannot create {self.disk_dir}: {e}")
+                self.disk_dir = None
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.txt")
+
+    def _remember(self, key: str, text: str):
+        """Insert into the memory tier and evict down to max_bytes. Caller holds the lock."""
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._sizes[key]
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            evicted, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(evicted)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return text
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    text = f.read()
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._remember(key, text)
+                return text
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                with self._lock:
+                    self._stats["disk_errors"] += 1
+                logger.warning(f"[PDF CACHE] Failed to read {key[:12]} from disk: {e}")
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, text: str):
+        with self._lock:
+            self._stats["sets"] += 1
+            self._remember(key, text)
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            if os.path.exists(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so other workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            logger.warning(f"[PDF CACHE] Failed to write {key[:12]} to disk: {e}")
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % DISK_PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".txt"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def prune_disk(self) -> int:
+        """Delete the oldest disk entries until the tier is under disk_max_bytes. Returns files removed."""
+        if not self.disk_dir:
+            return 0
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                continue
+        if removed:
+            with self._lock:
+                self._stats["disk_evictions"] += removed
+            logger.info(f"[PDF CACHE] Pruned {removed} disk entries")
+        return removed
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left for other workers)."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["max_bytes"] = self.max_bytes
+        stats["disk_dir"] = self.disk_dir
+        if self.disk_dir:
+            files = self._disk_files()
+            stats["disk_entries"] = len(files)
+            stats["disk_bytes"] = sum(size for _, size, _ in files)
+            stats["disk_max_bytes"] = self.disk_max_bytes
+        return stats
+
+
+# Global instance
+pdf_text_cache = PDFTextCache()
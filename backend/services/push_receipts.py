@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Expo Push Receipts
+Tracks push ticket IDs, polls Expo for their receipts in batches and clears or flags dead tokens on profiles.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from firebase_admin import firestore
+
+from services.expo_push_gateway import EXPO_ACCESS_TOKEN, ticket_ok
+
+logger = logging.getLogger(__name__)
+
+PROFILES_COLLECTION = "user_profiles"
+# Pending ticket IDs, so receipts survive worker restarts; one document per ticket
+TICKETS_COLLECTION = "push_receipt_tickets"
+
+# Defaults can be overridden from the environment
+EXPO_RECEIPTS_URL = os.getenv("EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts")
+POLL_INTERVAL_SECONDS = int(os.getenv("PUSH_RECEIPT_POLL_INTERVAL_SECONDS", str(15 * 60)))
+# Expo receipts are usually ready within 15 minutes and kept for 24 hours
+RECEIPT_DELAY_SECONDS = float(os.getenv("PUSH_RECEIPT_DELAY_SECONDS", str(15 * 60)))
+RECEIPT_MAX_AGE_SECONDS = float(os.getenv("PUSH_RECEIPT_MAX_AGE_SECONDS", str(24 * 60 * 60)))
+MAX_PENDING = int(os.getenv("PUSH_RECEIPT_MAX_PENDING", "50000"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("PUSH_RECEIPT_TIMEOUT_SECONDS", "15"))
+# New and settled tickets are written to Firestore in batches this often
+SAVE_INTERVAL_SECONDS = float(os.getenv("PUSH_RECEIPT_SAVE_INTERVAL_SECONDS", "10"))
+
+# Expo accepts at most 1000 receipt IDs per request
+MAX_BATCH_SIZE = 1000
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+# The device is gone: the token is cleared from the profile
+CLEAR_TOKEN_ERRORS = {"DeviceNotRegistered"}
+# Our push credentials are wrong, not the device: the profile is flagged and the token kept
+FLAG_TOKEN_ERRORS = {"InvalidCredentials"}
+TOKEN_FIELDS = ("expoPushToken", "notificationToken")
+# Metrics of the most recent runs kept for the admin endpoint
+RUN_HISTORY_SIZE = 20
+
+
+def _error(result: Dict[str, Any]) -> str:
+    return (result.get("details") or {}).get("error") or "Unknown"
+
+
+class PushReceiptTracker:
+    """
+    record() is registered as a push gateway listener: ticket IDs are kept in memory with their
+    token and, from RECEIPT_DELAY_SECONDS after the send, run() fetches their receipts in batches of
+    up to 1000. Tokens reported dead (by a receipt, or straight away by a ticket) are cleared from
+    or flagged on the profiles that hold them, and the token cache is invalidated.
+    Tickets still unanswered after RECEIPT_MAX_AGE_SECONDS are dropped as expired.
+    Pending tickets are mirrored to the push_receipt_tickets collection (saved every
+    SAVE_INTERVAL_SECONDS and at exit) and loaded back on the first run, so restarts do not lose them.
+    """
+
+    def __init__(self, db, url: str = EXPO_RECEIPTS_URL, batch_size: int = MAX_BATCH_SIZE,
+                 receipt_delay: float = RECEIPT_DELAY_SECONDS, max_age: float = RECEIPT_MAX_AGE_SECONDS,
+                 max_pending: int = MAX_PENDING, timeout: float = REQUEST_TIMEOUT_SECONDS,
+                 access_token: str = EXPO_ACCESS_TOKEN, save_interval: float = SAVE_INTERVAL_SECONDS, clock=time.time):
+        self.db = db
+        self.url = url
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.receipt_delay = receipt_delay
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.access_token = access_token
+        self.save_interval = save_interval
+        self._clock = clock
+        self._client: Optional[httpx.Client] = None
+        # ticket id -> (token, sent_at), in send order
+        self._pending: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # Tickets not yet written to Firestore, and ticket IDs whose documents can be deleted
+        self._unsaved: Dict[str, Tuple[str, float]] = {}
+        self._settled: List[str] = []
+        self._loaded = False
+        self._saver: Optional[threading.Thread] = None
+        # token -> error, reported by tickets and waiting for the next run
+        self._dead: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._runs = deque(maxlen=RUN_HISTORY_SIZE)
+        self._totals = {
+            "tickets_ok": 0, "tickets_error": 0, "receipts_ok": 0, "receipts_error": 0, "receipts_expired": 0,
+            "dropped": 0, "requests": 0, "request_errors": 0, "tokens_cleared": 0, "tokens_flagged": 0,
+            "tickets_saved": 0, "tickets_loaded": 0, "save_errors": 0,
+        }
+        self._errors: Dict[str, int] = {}
+
+    def record(self, message: Dict[str, Any], ticket: Dict[str, Any]):
+        """Push gateway listener: remember the ticket ID, or the dead token if the ticket already says so."""
+        token = message.get("to")
+        with self._lock:
+            if ticket_ok(ticket):
+                self._totals["tickets_ok"] += 1
+                if ticket.get("id"):
+                    self._pending[ticket["id"]] = self._unsaved[ticket["id"]] = (token, self._clock())
+                    self._trim()
+                    self._start_saver()
+                return
+            self._totals["tickets_error"] += 1
+            error = _error(ticket)
+            self._errors[error] = self._errors.get(error, 0) + 1
+            if token and error in CLEAR_TOKEN_ERRORS | FLAG_TOKEN_ERRORS:
+                self._dead[token] = error
+
+    def _trim(self):
+        """Drop the oldest tickets beyond max_pending. Call with the lock held."""
+        while len(self._pending) > self.max_pending:
+            ticket_id, _ = self._pending.popitem(last=False)
+            self._settled.append(ticket_id)
+            self._totals["dropped"] += 1
+
+    def _tickets(self):
+        return self.db.collection(TICKETS_COLLECTION)
+
+    def load(self) -> int:
+        """Merge the tickets saved by earlier processes into the pending set. Blocking. Returns tickets loaded."""
+        if self.db is None:
+            self._loaded = True
+            return 0
+        saved = {}
+        for doc in self._tickets().stream():
+            data = doc.to_dict() or {}
+            if data.get("sentAt") is not None:
+                saved[doc.id] = (data.get("token"), float(data["sentAt"]))
+        with self._lock:
+            loaded = {ticket_id: entry for ticket_id, entry in saved.items() if ticket_id not in self._pending}
+            merged = sorted({**self._pending, **loaded}.items(), key=lambda item: item[1][1])
+            self._pending = OrderedDict(merged)
+            self._trim()
+            self._totals["tickets_loaded"] += len(loaded)
+            self._loaded = True
+        logger.info(f"[PUSH RECEIPTS] Loaded {len(loaded)} pending tickets from Firestore")
+        return len(loaded)
+
+    def save(self) -> int:
+        """Write new tickets and delete settled ones in batches. Blocking. Returns documents written."""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+            settled, self._settled = self._settled, []
+        if self.db is None:
+            return 0
+        settled_ids = set(settled)
+        # Tickets settled before they were ever saved need neither write
+        ops = [(ticket_id, entry) for ticket_id, entry in unsaved.items() if ticket_id not in settled_ids]
+        ops += [(ticket_id, None) for ticket_id in settled if ticket_id not in unsaved]
+        written = 0
+        try:
+            for start in range(0, len(ops), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for ticket_id, entry in ops[start:start + MAX_BATCH_WRITES]:
+                    ref = self._tickets().document(ticket_id)
+                    if entry is None:
+                        batch.delete(ref)
+                    else:
+                        batch.set(ref, {"token": entry[0], "sentAt": entry[1]})
+                batch.commit()
+                written += len(ops[start:start + MAX_BATCH_WRITES])
+        except Exception as e:
+            logger.error(f"[PUSH RECEIPTS] Failed to save pending tickets: {e}")
+            # Requeue what was not written, unless it was settled in the meantime
+            with self._lock:
+                self._totals["save_errors"] += 1
+                for ticket_id, entry in ops[written:]:
+                    if entry is None:
+                        self._settled.append(ticket_id)
+                    elif ticket_id in self._pending:
+                        self._unsaved.setdefault(ticket_id, entry)
+        with self._lock:
+            self._totals["tickets_saved"] += written
+        return written
+
+    def _start_saver(self):
+        """Start the background saver. Call with the lock held."""
+        if self.db is None or self._saver is not None:
+            return
+        self._saver = threading.Thread(target=self._save_loop, name="push-receipt-save", daemon=True)
+        self._saver.start()
+        # Worker restarts should not drop the tickets of the last interval
+        atexit.register(self.save)
+
+    def _save_loop(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+    def _http(self) -> httpx.Client:
+        if self._client is None:
+            headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate", "Content-Type": "application/json"}
+            if self.access_token:
+                headers["Authorization"] = f"Bearer {self.access_token}"
+            self._client = httpx.Client(headers=headers, timeout=self.timeout)
+        return self._client
+
+    def _fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        response = self._http().post(self.url, json={"ids": ids})
+        response.raise_for_status()
+        data = response.json().get("data")
+        if not isinstance(data, dict):
+            raise ValueError(f"Unexpected Expo receipts response: {response.text[:200]}")
+        return data
+
+    def _due(self, now: float) -> List[str]:
+        with self._lock:
+            due = []
+            for ticket_id, (_, sent_at) in self._pending.items():
+                if now - sent_at < self.receipt_delay:
+                    break
+                due.append(ticket_id)
+            return due
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Fetch receipts for due tickets and handle dead tokens; returns this run's metrics.
+        Blocking - call from a background thread or an executor. Overlapping runs are skipped.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            logger.info("[PUSH RECEIPTS] Previous run still in progress, skipping")
+            return {"skipped": True, "reason": "already running"}
+        try:
+            started = time.time()
+            if not self._loaded:
+                try:
+                    self.load()
+                except Exception as e:
+                    logger.error(f"[PUSH RECEIPTS] Failed to load saved tickets: {e}")
+            now = self._clock()
+            metrics = {"started_at": datetime.now().isoformat(), "checked": 0, "receipts_ok": 0, "receipts_error": 0,
+                       "not_ready": 0, "expired": 0, "requests": 0, "tokens_cleared": 0, "tokens_flagged": 0, "errors": []}
+            due = self._due(now)
+            for start in range(0, len(due), self.batch_size):
+                ids = due[start:start + self.batch_size]
+                metrics["requests"] += 1
+                try:
+                    receipts = self._fetch(ids)
+                except Exception as e:
+                    # The tickets stay pending and are asked for again next run
+                    logger.error(f"[PUSH RECEIPTS] Failed to fetch {len(ids)} receipts: {e}")
+                    metrics["errors"].append(str(e)[:200])
+                    continue
+                self._apply(ids, receipts, now, metrics)
+
+            with self._lock:
+                dead, self._dead = self._dead, {}
+            for token, error in dead.items():
+                try:
+                    self._handle_dead_token(token, error, metrics)
+                except Exception as e:
+                    logger.error(f"[PUSH RECEIPTS] Failed to handle dead token {token[:20]}...: {e}")
+                    metrics["errors"].append(str(e)[:200])
+                    with self._lock:
+                        self._dead.setdefault(token, error)
+
+            self.save()
+            metrics["duration_seconds"] = round(time.time() - started, 3)
+            with self._lock:
+                for field in ("receipts_ok", "receipts_error", "requests", "tokens_cleared", "tokens_flagged"):
+                    self._totals[field] += metrics[field]
+                self._totals["receipts_expired"] += metrics["expired"]
+                self._totals["request_errors"] += len(metrics["errors"])
+                self._runs.append(metrics)
+            logger.info(
+                f"[PUSH RECEIPTS] Checked {metrics['checked']} receipts ({metrics['receipts_error']} errors, "
+                f"{metrics['not_ready']} not ready), cleared {metrics['tokens_cleared']} and flagged "
+                f"{metrics['tokens_flagged']} tokens in {metrics['duration_seconds']}s"
+            )
+            return metrics
+        finally:
+            self._run_lock.release()
+
+    def _apply(self, ids: List[str], receipts: Dict[str, Dict[str, Any]], now: float, metrics: Dict[str, Any]):
+        with self._lock:
+            for ticket_id in ids:
+                entry = self._pending.get(ticket_id)
+                if entry is None:
+                    continue
+                token, sent_at = entry
+                receipt = receipts.get(ticket_id)
+                if receipt is None:
+                    # Not ready yet; give up once Expo no longer keeps it
+                    if now - sent_at >= self.max_age:
+                        del self._pending[ticket_id]
+                        self._settled.append(ticket_id)
+                        metrics["expired"] += 1
+                    else:
+                        metrics["not_ready"] += 1
+                    continue
+                del self._pending[ticket_id]
+                self._settled.append(ticket_id)
+                metrics["checked"] += 1
+                if receipt.get("status") == "ok":
+                    metrics["receipts_ok"] += 1
+                    continue
+                metrics["receipts_error"] += 1
+                error = _error(receipt)
+                self._errors[error] = self._errors.get(error, 0) + 1
+                if token and error in CLEAR_TOKEN_ERRORS | FLAG_TOKEN_ERRORS:
+                    self._dead[token] = error
+
+    def _handle_dead_token(self, token: str, error: str, metrics: Dict[str, Any]):
+        """Clear (DeviceNotRegistered) or flag (InvalidCredentials) the token on every profile holding it."""
+        if self.db is None:
+            return
+        from services.push_token_registry import get_push_token_registry
+        profiles = self.db.collection(PROFILES_COLLECTION)
+        flag = {"error": error, "token": token, "at": datetime.now().isoformat()}
+        for field in TOKEN_FIELDS:
+            for doc in profiles.where(field, "==", token).stream():
+                data = doc.to_dict() or {}
+                if error in CLEAR_TOKEN_ERRORS:
+                    doc.reference.update({field: firestore.DELETE_FIELD, "pushTokenError": flag})
+                    metrics["tokens_cleared"] += 1
+                    logger.warning(f"[PUSH RECEIPTS] Cleared {field} of {doc.id}: {error}")
+                else:
+                    doc.reference.update({"pushTokenError": flag})
+                    metrics["tokens_flagged"] += 1
+                    logger.error(f"[PUSH RECEIPTS] Push credentials rejected for {doc.id}: {error}")
+                get_push_token_registry(self.db).profile_updated(doc.id, {field: None, "isDietician": data.get("isDietician", False)})
+
+    def stats(self) -> Dict[str, Any]:
+        """Lifetime delivery rates, pending tickets and the metrics of recent runs, newest first."""
+        with self._lock:
+            totals = dict(self._totals)
+            errors = dict(self._errors)
+            pending = len(self._pending)
+            unsaved = len(self._unsaved)
+            dead = len(self._dead)
+            runs = list(reversed(self._runs))
+        tickets = totals["tickets_ok"] + totals["tickets_error"]
+        receipts = totals["receipts_ok"] + totals["receipts_error"]
+        # Delivered = accepted by Expo and confirmed by a receipt
+        settled = totals["tickets_error"] + receipts
+        return {
+            "totals": totals,
+            "errors": errors,
+            "ticket_success_rate": round(totals["tickets_ok"] / tickets, 4) if tickets else None,
+            "receipt_success_rate": round(totals["receipts_ok"] / receipts, 4) if receipts else None,
+            "delivery_success_rate": round(totals["receipts_ok"] / settled, 4) if settled else None,
+            "delivery_failure_rate": round((totals["tickets_error"] + totals["receipts_error"]) / settled, 4) if settled else None,
+            "pending_receipts": pending,
+            "unsaved_tickets": unsaved,
+            "dead_tokens_queued": dead,
+            "running": self._run_lock.locked(),
+            "recent_runs": runs,
+        }
+
+
+# Global instance
+_push_receipt_tracker = None
+
+def get_push_receipt_tracker(db) -> PushReceiptTracker:
+    """
+    Get the global push receipt tracker instance.
+    """
+    global _push_receipt_tracker
+    if _push_receipt_tracker is None:
+        _push_receipt_tracker = PushReceiptTracker(db)
+    return _push_receipt_tracker
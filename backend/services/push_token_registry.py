@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Push Token Registry
+Expo push tokens from an in-process TTL cache, kept current by a Firestore listener on token updates, with dietician tokens in one small document.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILES_COLLECTION = "user_profiles"
+# push_tokens/dietician holds the dietician accounts' tokens
+TOKENS_COLLECTION = "push_tokens"
+DIETICIAN_DOC = "dietician"
+
+# Defaults can be overridden from the environment
+TTL_SECONDS = float(os.getenv("PUSH_TOKEN_CACHE_TTL_SECONDS", "600"))
+# Users without a token are remembered for less time, so a new registration is picked up quickly
+NEGATIVE_TTL_SECONDS = float(os.getenv("PUSH_TOKEN_NEGATIVE_TTL_SECONDS", "60"))
+MAX_ENTRIES = int(os.getenv("PUSH_TOKEN_CACHE_SIZE", "5000"))
+
+# Profile fields a token lookup needs; reads are projected to these
+TOKEN_FIELDS = ["expoPushToken", "notificationToken", "isDietician"]
+
+
+def token_from_profile(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The profile's Expo token (expoPushToken, falling back to notificationToken), or None if missing or malformed."""
+    token = (data or {}).get("expoPushToken") or (data or {}).get("notificationToken")
+    if token and not token.startswith("ExponentPushToken"):
+        return None
+    return token or None
+
+
+class PushTokenRegistry:
+    """
+    user_id -> (token, is_dietician) cached for ttl_seconds. The apps write tokens straight to
+    user_profiles together with lastTokenUpdate, so watch() listens for profiles whose
+    lastTokenUpdate is newer than the listener's start and writes each change through to the
+    cache (and to push_tokens/dietician for dietician accounts). Server-side profile writes call
+    profile_updated(). Methods are blocking - call from an executor.
+    """
+
+    def __init__(self, db, ttl_seconds: float = TTL_SECONDS, negative_ttl_seconds: float = NEGATIVE_TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES, clock=time.monotonic):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Optional[str], bool]]" = OrderedDict()
+        self._dietician: Optional[Tuple[float, Optional[str]]] = None
+        self._watch = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "profile_reads": 0, "dietician_doc_reads": 0,
+                       "dietician_rebuilds": 0, "invalidations": 0, "watch_updates": 0}
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def _remember(self, user_id: str, token: Optional[str], is_dietician: bool):
+        ttl = self.ttl_seconds if token else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[user_id] = (self._clock() + ttl, token, is_dietician)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, user_id: str) -> Tuple[Optional[str], bool]:
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] > self._clock():
+                self._entries.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return cached[1], cached[2]
+            self._stats["misses"] += 1
+        self._count("profile_reads")
+        doc = self.db.collection(PROFILES_COLLECTION).document(user_id).get(field_paths=TOKEN_FIELDS)
+        data = doc.to_dict() if doc.exists else {}
+        token, is_dietician = token_from_profile(data), bool((data or {}).get("isDietician"))
+        self._remember(user_id, token, is_dietician)
+        return token, is_dietician
+
+    def get_user_token(self, user_id: str, include_dieticians: bool = True) -> Optional[str]:
+        """The user's push token; None for dietician accounts unless include_dieticians."""
+        if self.db is None:
+            return None
+        token, is_dietician = self._lookup(user_id)
+        if is_dietician and not include_dieticians:
+            return None
+        return token
+
+    def get_dietician_token(self) -> Optional[str]:
+        """The dietician's push token, from the cache or the push_tokens/dietician document."""
+        if self.db is None:
+            return None
+        with self._lock:
+            if self._dietician is not None and self._dietician[0] > self._clock():
+                self._stats["hits"] += 1
+                return self._dietician[1]
+            self._stats["misses"] += 1
+        self._count("dietician_doc_reads")
+        doc = self.db.collection(TOKENS_COLLECTION).document(DIETICIAN_DOC).get()
+        if doc.exists:
+            token = (doc.to_dict() or {}).get("token")
+            self._remember_dietician(token)
+            return token
+        # First use (or the document was removed): build it from the dietician profiles
+        return self.rebuild_dietician_tokens()
+
+    def _remember_dietician(self, token: Optional[str]):
+        with self._lock:
+            self._dietician = (self._clock() + (self.ttl_seconds if token else self.negative_ttl_seconds), token)
+
+    def rebuild_dietician_tokens(self) -> Optional[str]:
+        """Rewrite push_tokens/dietician from the dietician profiles and return the primary token."""
+        self._count("dietician_rebuilds")
+        query = self.db.collection(PROFILES_COLLECTION).where("isDietician", "==", True).select(TOKEN_FIELDS)
+        tokens: List[Dict[str, str]] = []
+        for doc in query.stream():
+            token = token_from_profile(doc.to_dict())
+            if token:
+                tokens.append({"userId": doc.id, "token": token})
+            else:
+                logger.warning(f"[PUSH TOKENS] Dietician {doc.id} has no valid push token")
+        primary = tokens[0]["token"] if tokens else None
+        self.db.collection(TOKENS_COLLECTION).document(DIETICIAN_DOC).set({
+            "token": primary,
+            "tokens": tokens,
+            "updatedAt": datetime.now().isoformat(),
+        })
+        self._remember_dietician(primary)
+        logger.info(f"[PUSH TOKENS] Dietician tokens rebuilt ({len(tokens)} token(s))")
+        return primary
+
+    def profile_updated(self, user_id: str, fields: Dict[str, Any]):
+        """Write-through for server-side profile writes that touch token or dietician fields."""
+        if not any(field in fields for field in TOKEN_FIELDS):
+            return
+        with self._lock:
+            was_dietician = user_id in self._entries and self._entries[user_id][2]
+            self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+        if was_dietician or fields.get("isDietician"):
+            self.rebuild_dietician_tokens()
+
+    def invalidate(self, user_id: str):
+        """Forget a user's cached token (e.g. Expo reported it as no longer registered)."""
+        with self._lock:
+            cached = self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+            if cached is not None and cached[2]:
+                self._dietician = None
+
+    def _on_token_updates(self, snapshots, changes, read_time):
+        dietician_changed = False
+        for change in changes:
+            if change.type.name == "REMOVED":
+                self.invalidate(change.document.id)
+                continue
+            data = change.document.to_dict() or {}
+            token, is_dietician = token_from_profile(data), bool(data.get("isDietician"))
+            with self._lock:
+                cached = self._entries.get(change.document.id)
+            if cached is not None and (cached[1], cached[2]) == (token, is_dietician):
+                continue
+            self._remember(change.document.id, token, is_dietician)
+            self._count("watch_updates")
+            dietician_changed = dietician_changed or is_dietician or (cached is not None and cached[2])
+        if dietician_changed:
+            try:
+                self.rebuild_dietician_tokens()
+            except Exception as e:
+                logger.error(f"[PUSH TOKENS] Failed to rebuild dietician tokens: {e}")
+                with self._lock:
+                    self._dietician = None
+
+    def watch(self):
+        """Listen for token registrations from now on (idempotent)."""
+        if self.db is None or self._watch is not None:
+            return
+        # The apps write lastTokenUpdate with JavaScript's toISOString(), so compare in the same format
+        since = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        query = self.db.collection(PROFILES_COLLECTION).where("lastTokenUpdate", ">=", since)
+        self._watch = query.on_snapshot(self._on_token_updates)
+        logger.info("[PUSH TOKENS] Watching push token updates")
+
+    def stop(self):
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["dietician_cached"] = self._dietician is not None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["watching"] = self._watch is not None
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
+
+
+# Global instance
+_push_token_registry = None
+
+def get_push_token_registry(db) -> PushTokenRegistry:
+    """
+    Get the global push token registry instance.
+    """
+    global _push_token_registry
+    if _push_token_registry is None:
+        _push_token_registry = PushTokenRegistry(db)
+    return _push_token_registry
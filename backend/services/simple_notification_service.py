@@ -5,11 +5,14 @@ A clean, reliable notification system based on how popular apps handle notificat
 """
 
 import json
-import requests
+import asyncio
 import logging
 from typing import Optional, Dict, Any
 from datetime import datetime
 
+from services.expo_push_gateway import expo_push_gateway, push_message, ticket_ok
+from services.push_token_registry import get_push_token_registry
+
 logger = logging.getLogger(__name__)
 
 class SimpleNotificationService:
@@ -46,25 +49,11 @@ class SimpleNotificationService:
                     logger.error(f"[SimpleNotification] ❌ No dietician token found")
                 return dietician_token
             
-            # Get user document
-            doc = self.db.collection("user_profiles").document(user_id).get()
-            
-            if not doc.exists:
-                logger.warning(f"[SimpleNotification] User {user_id} not found")
-                return None
-            
-            data = doc.to_dict()
-            
-            # Get token (prefer expoPushToken, fallback to notificationToken)
-            token = data.get("expoPushToken") or data.get("notificationToken")
+            # Cached token (prefer expoPushToken, fallback to notificationToken; malformed tokens are dropped)
+            token = get_push_token_registry(self.db).get_user_token(user_id)
             
             if not token:
-                logger.warning(f"[SimpleNotification] No token found for user {user_id}")
-                return None
-            
-            # Validate token format
-            if not token.startswith("ExponentPushToken"):
-                logger.warning(f"[SimpleNotification] Invalid token format for user {user_id}: {token[:20]}...")
+                logger.warning(f"[SimpleNotification] No valid token found for user {user_id}")
                 return None
             
             logger.info(f"[SimpleNotification] ✅ Token found for user {user_id}: {token[:20]}...")
@@ -100,71 +89,61 @@ class SimpleNotificationService:
                 logger.error(f"[SimpleNotification] ❌ No token found for user {recipient_id}")
                 return False
             
-            # Prepare notification payload
-            notification_data = {
-                "to": token,
-                "sound": "default",
-                "title": title,
-                "body": body,
-                "data": data or {}
-            }
-            
-            logger.info(f"[SimpleNotification] Payload: {json.dumps(notification_data, indent=2)}")
-            
-            # Send to Expo Push Service
-            logger.info(f"[SimpleNotification] Sending to Expo Push Service...")
-            response = requests.post(
-                "https://exp.host/--/api/v2/push/send",
-                headers={
-                    "Accept": "application/json",
-                    "Accept-encoding": "gzip, deflate",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps(notification_data),
-                timeout=10
-            )
-            
-            logger.info(f"[SimpleNotification] Expo response status: {response.status_code}")
-            logger.info(f"[SimpleNotification] Expo response: {response.text}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("data", {}).get("status") == "ok":
-                    logger.info(f"[SimpleNotification] ✅ Notification sent successfully to {recipient_id}")
-                    return True
-                else:
-                    logger.error(f"[SimpleNotification] ❌ Expo push error: {result}")
-                    return False
-            else:
-                logger.error(f"[SimpleNotification] ❌ Failed to send notification. Status: {response.status_code}")
-                return False
+            # Send to Expo Push Service (batched with other sends on the shared push gateway)
+            ticket = expo_push_gateway.send_sync(push_message(token, title, body, data))
+            return self._check_ticket(ticket, recipient_id)
                 
-        except requests.exceptions.Timeout:
-            logger.error(f"[SimpleNotification] ❌ Timeout sending notification to {recipient_id}")
-            return False
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[SimpleNotification] ❌ Request error sending notification to {recipient_id}: {e}")
+        except Exception as e:
+            logger.error(f"[SimpleNotification] ❌ Error sending notification to {recipient_id}: {e}")
             return False
+    
+    async def send_notification_async(self, recipient_id: str, title: str, body: str, data: Dict[str, Any] = None) -> bool:
+        """
+        Same as send_notification, for async code: the token lookup runs in an executor and the
+        push is awaited on the push gateway instead of blocking the event loop.
+        """
+        try:
+            logger.info(f"[SimpleNotification] Sending notification to {recipient_id}: {title}")
+            token = await asyncio.get_event_loop().run_in_executor(None, lambda: self.get_user_token(recipient_id))
+            if not token:
+                logger.error(f"[SimpleNotification] ❌ No token found for user {recipient_id}")
+                return False
+            ticket = await expo_push_gateway.send(push_message(token, title, body, data))
+            return self._check_ticket(ticket, recipient_id)
         except Exception as e:
             logger.error(f"[SimpleNotification] ❌ Error sending notification to {recipient_id}: {e}")
             return False
     
+    def _check_ticket(self, ticket: Dict[str, Any], recipient: str) -> bool:
+        """Log an Expo push ticket and return whether the push was accepted."""
+        if ticket_ok(ticket):
+            logger.info(f"[SimpleNotification] ✅ Notification sent successfully to {recipient}")
+            return True
+        logger.error(f"[SimpleNotification] ❌ Expo push error for {recipient}: {json.dumps(ticket)}")
+        return False
+    
     def send_new_diet_notification(self, user_id: str, dietician_name: str = "Your dietician") -> bool:
         """
         Send notification when new diet is uploaded.
         """
         logger.info(f"[SimpleNotification] Sending new diet notification to user {user_id}")
         
-        return self.send_notification(
-            recipient_id=user_id,
-            title="New Diet Has Arrived! 🥗",
-            body=f"{dietician_name} has uploaded a new diet plan for you.",
-            data={
+        return self.send_notification(recipient_id=user_id, **self.new_diet_content(user_id, dietician_name))
+    
+    @staticmethod
+    def new_diet_content(user_id: str, dietician_name: str = "Your dietician") -> Dict[str, Any]:
+        """
+        Title, body and data of the new diet notification.
+        """
+        return {
+            "title": "New Diet Has Arrived! 🥗",
+            "body": f"{dietician_name} has uploaded a new diet plan for you.",
+            "data": {
                 "type": "new_diet",
                 "userId": user_id,
                 "timestamp": datetime.now().isoformat()
             }
-        )
+        }
     
     def send_message_notification(self, recipient_id: str, sender_name: str, message: str, is_dietician: bool = False, sender_user_id: str = None) -> bool:
         """
@@ -310,44 +289,9 @@ class SimpleNotificationService:
                 logger.error(f"[SimpleNotification] ❌ No token provided")
                 return False
             
-            # Prepare notification payload
-            notification_data = {
-                "to": token,
-                "sound": "default",
-                "title": title,
-                "body": body,
-                "data": data or {}
-            }
-            
-            logger.info(f"[SimpleNotification] Payload: {json.dumps(notification_data, indent=2)}")
-            
-            # Send to Expo Push Service
-            logger.info(f"[SimpleNotification] Sending to Expo Push Service...")
-            response = requests.post(
-                "https://exp.host/--/api/v2/push/send",
-                headers={
-                    "Accept": "application/json",
-                    "Accept-encoding": "gzip, deflate",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps(notification_data),
-                timeout=10
-            )
-            
-            logger.info(f"[SimpleNotification] Response status: {response.status_code}")
-            logger.info(f"[SimpleNotification] Response body: {response.text}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("data", {}).get("status") == "error":
-                    logger.error(f"[SimpleNotification] ❌ Expo push error: {result}")
-                    return False
-                
-                logger.info(f"[SimpleNotification] ✅ Notification sent successfully")
-                return True
-            else:
-                logger.error(f"[SimpleNotification] ❌ Failed to send notification: {response.status_code}")
-                return False
+            # Send to Expo Push Service (batched with other sends on the shared push gateway)
+            ticket = expo_push_gateway.send_sync(push_message(token, title, body, data))
+            return self._check_ticket(ticket, f"token {token[:20]}...")
                 
         except Exception as e:
             logger.error(f"[SimpleNotification] ❌ Error sending notification to token: {e}")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Request Coalescing
+Concurrent identical lookups share one in-flight call instead of each starting their own.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+    The first caller starts the work; callers arriving while it is in flight
+    await the same task and receive the same result (or exception).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # Tasks are bound to an event loop, so in-flight calls are tracked per loop
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "coalesced": 0,
+            "errors": 0,
+        }
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run func() for key, or join the call already in flight for key.
+        Cancelling one waiter (e.g. via asyncio.wait_for) does not cancel the shared call.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            self._stats["calls"] += 1
+            task = self._inflight.get(flight_key)
+            if task is None:
+                task = loop.create_task(self._run(flight_key, func))
+                self._inflight[flight_key] = task
+                self._stats["executions"] += 1
+            else:
+                self._stats["coalesced"] += 1
+                logger.info(f"[SINGLE FLIGHT] {self.name}: joined in-flight call for {key}")
+        return await asyncio.shield(task)
+
+    async def _run(self, flight_key: tuple, func: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await func()
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(flight_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Call counters and the number of calls currently in flight."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._inflight)
+        stats["coalesce_rate"] = round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0
+        return stats
+
+
+# Global instances, one per lookup type
+_single_flights: Dict[str, SingleFlight] = {}
+_single_flights_lock = threading.Lock()
+
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    Get the global single-flight group for a lookup type.
+    """
+    with _single_flights_lock:
+        if name not in _single_flights:
+            _single_flights[name] = SingleFlight(name)
+        return _single_flights[name]
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Stats for every single-flight group created so far.
+    """
+    with _single_flights_lock:
+        groups = dict(_single_flights)
+    return {name: group.stats() for name, group in groups.items()}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Structured Tracing
+Per-category, sampled trace logging that costs one dict lookup when a category is disabled.
+"""
+
+import os
+import queue
+import random
+import logging
+import logging.handlers
+import threading
+from typing import Any, Callable, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Logger name stamped on trace records; they bypass the logging hierarchy and go straight to the queue
+TRACE_LOGGER_NAME = "trace"
+TRACE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Categories used by the hot paths. Any other name can be traced too and configured at runtime.
+FOOD_LOG_TRACE = "FOOD LOG TRACE"
+SUMMARY_TRACE = "SUMMARY TRACE"
+PUSH_DEBUG = "PUSH DEBUG"
+TOKEN_DEBUG = "TOKEN DEBUG"
+DIET_EXTRACTION_TRACE = "DIET EXTRACTION TRACE"
+KNOWN_CATEGORIES = (FOOD_LOG_TRACE, SUMMARY_TRACE, PUSH_DEBUG, TOKEN_DEBUG, DIET_EXTRACTION_TRACE)
+
+# Sampling rate for categories without an explicit rate (0 = off, 1 = every trace)
+DEFAULT_RATE = float(os.getenv("TRACE_DEFAULT_RATE", "0"))
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """
+    Parse "FOOD LOG TRACE=1,PUSH DEBUG=0.1" into {category: rate}.
+    Malformed entries are ignored; rates are clamped to [0, 1].
+    """
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        category, rate = part.rsplit("=", 1)
+        category = category.strip().upper()
+        try:
+            rates[category] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class Tracer:
+    """
+    Category-based tracer. trace() returns immediately for disabled categories, before any
+    message formatting; messages may be callables so even their arguments are built lazily.
+    Emitted records are handed to a queue and written by a background listener thread.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default_rate: float = DEFAULT_RATE, handler: Optional[logging.Handler] = None):
+        self._rates: Dict[str, float] = dict(rates or {})
+        self._default_rate = default_rate
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self._queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        if handler is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(TRACE_FORMAT))
+        self._listener = logging.handlers.QueueListener(self._queue, handler, respect_handler_level=False)
+        self._listener.start()
+
+    def enabled(self, category: str) -> bool:
+        """Sampling decision for one trace; use it to guard blocks that only exist for tracing."""
+        rate = self._rates.get(category, self._default_rate)
+        if rate <= 0.0:
+            return False
+        return rate >= 1.0 or random.random() < rate
+
+    def trace(self, category: str, message: Union[str, Callable[[], str]], *args: Any):
+        """
+        Emit "[category] message" if the category is sampled in.
+        message is either a %-style format string (formatted with args only when emitted)
+        or a zero-argument callable returning the message.
+        """
+        rate = self._rates.get(category, self._default_rate)
+        if rate <= 0.0 or (rate < 1.0 and random.random() >= rate):
+            return
+        try:
+            text = message() if callable(message) else (message % args if args else message)
+        except Exception as e:
+            text = f"<trace message failed: {e}>"
+        record = logging.LogRecord(TRACE_LOGGER_NAME, logging.INFO, __file__, 0, f"[{category}] {text}", None, None)
+        self._queue.put_nowait(record)
+        with self._lock:
+            self._counts[category] = self._counts.get(category, 0) + 1
+
+    def set_rate(self, category: str, rate: float):
+        category = category.strip().upper()
+        rate = min(1.0, max(0.0, float(rate)))
+        # Copy-on-write so trace() can read the dict without locking
+        rates = dict(self._rates)
+        rates[category] = rate
+        self._rates = rates
+        logger.info(f"[TRACING] Sampling rate for {category} set to {rate}")
+
+    def set_default_rate(self, rate: float):
+        self._default_rate = min(1.0, max(0.0, float(rate)))
+        logger.info(f"[TRACING] Default sampling rate set to {self._default_rate}")
+
+    def rates(self) -> Dict[str, float]:
+        rates = {category: self._default_rate for category in KNOWN_CATEGORIES}
+        rates.update(self._rates)
+        return rates
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "default_rate": self._default_rate,
+            "rates": self.rates(),
+            "emitted": counts,
+            "queued": self._queue.qsize(),
+        }
+
+    def stop(self):
+        """Flush queued records and stop the listener thread."""
+        self._listener.stop()
+
+
+# Global instance
+tracer = Tracer(parse_rates(os.getenv("TRACE_SAMPLING", "")))
+
+def trace(category: str, message: Union[str, Callable[[], str]], *args: Any):
+    """
+    Trace through the global tracer.
+    """
+    tracer.trace(category, message, *args)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the NutriBot context manager (no Gemini API key required).
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.chat_context import ChatContextManager, estimate_tokens
+from services import chat_context
+from services.chat_sessions import ChatSessionStore
+
+
+def _turns(count, text="x" * 40):
+    return [{"sender": "user" if i % 2 == 0 else "bot", "text": f"{i} {text}", "sequence": i} for i in range(count)]
+
+
+class FakeGateway:
+    def __init__(self):
+        self.prompts = []
+
+    async def generate(self, prompt_type, prompt):
+        self.prompts.append((prompt_type, prompt))
+        return "User is vegetarian and wants more protein."
+
+
+def test_only_recent_turns_are_sent_verbatim():
+    manager = ChatContextManager(recent_turns=4, token_budget=10000)
+    history, telemetry = manager.build("system", _turns(20), "what now?")
+    # system prompt + 4 recent turns + new message
+    assert len(history) == 6
+    assert history[1]["parts"][0]["text"].startswith("16 ")
+    assert history[-1]["parts"][0]["text"] == "what now?"
+    assert telemetry["turns_included"] == 4 and telemetry["turns_dropped"] == 16
+
+
+def test_prompt_size_stays_within_budget_however_long_the_chat():
+    manager = ChatContextManager(recent_turns=50, token_budget=300)
+    _, short = manager.build("s" * 2000, _turns(4), "hi")
+    _, long = manager.build("s" * 2000, _turns(400), "hi")
+    assert short["total_tokens"] <= 300 and long["total_tokens"] <= 300
+    assert long["system_tokens"] <= 180
+
+
+def test_summary_replaces_summarized_turns():
+    manager = ChatContextManager(recent_turns=2, token_budget=10000)
+    history, telemetry = manager.build("system", _turns(6), "hi", summary="Likes paneer.", summarized_through=4)
+    assert "Likes paneer." in history[0]["parts"][0]["text"]
+    assert telemetry["turns_summarized"] == 4 and telemetry["turns_dropped"] == 0
+    assert telemetry["summary_tokens"] == estimate_tokens("Likes paneer.")
+
+
+def test_summary_refresh_folds_older_turns_in_background():
+    gateway = FakeGateway()
+    manager = ChatContextManager(recent_turns=2, summary_batch_turns=4, gateway=gateway)
+    store = ChatSessionStore(db=None)
+    session = store.get_or_create("u1", "s")
+    store.append_turns(session, [{"sender": t["sender"], "text": t["text"]} for t in _turns(4)])
+
+    async def run():
+        # Only 2 turns outside the recent window: not enough yet
+        assert not manager.schedule_summary_refresh(session, store)
+        store.append_turns(session, [{"sender": t["sender"], "text": t["text"]} for t in _turns(2)])
+        assert manager.schedule_summary_refresh(session, store)
+        assert not manager.schedule_summary_refresh(session, store)
+        # The running refresh is strongly referenced until it finishes
+        assert len(chat_context._background_tasks) == 1
+        await asyncio.sleep(0.1)
+        assert not chat_context._background_tasks
+
+    asyncio.run(run())
+    assert session.summary == "User is vegetarian and wants more protein."
+    assert session.summarized_through == 4
+    assert gateway.prompts[0][0] == "chat_summary"
+    assert manager.stats()["totals"]["summaries_refreshed"] == 1
+
+
+if __name__ == "__main__":
+    test_only_recent_turns_are_sent_verbatim()
+    test_prompt_size_stays_within_budget_however_long_the_chat()
+    test_summary_replaces_summarized_turns()
+    test_summary_refresh_folds_older_turns_in_background()
+    print("All chat context tests passed")
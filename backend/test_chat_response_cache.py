@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the NutriBot response cache (no Firebase or Gemini required).
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.chat_response_cache import ChatResponseCache, question_signature, similarity
+
+PROFILE = {"name": "Asha", "dietPdfUrl": "diet.pdf", "dietCacheVersion": 1.0, "targetCalories": 1800}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_near_identical_questions_share_an_answer():
+    cache = ChatResponseCache(threshold=0.85)
+    cache.store("u1", "What should I eat for breakfast today?", PROFILE, "Poha with sprouts")
+    assert cache.lookup("u1", "what can i eat for breakfast today", PROFILE) == "Poha with sprouts"
+    assert cache.lookup("u1", "What should I eat for lunch today?", PROFILE) is None
+    assert cache.lookup("u2", "What should I eat for breakfast today?", PROFILE) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["hit_rate"] == round(1 / 3, 4)
+
+
+def test_days_and_follow_ups_are_not_mixed_up():
+    monday, tuesday = datetime(2025, 1, 6), datetime(2025, 1, 7)
+    assert similarity(question_signature("dinner today", monday), question_signature("dinner on monday", monday)) == 1.0
+    assert similarity(question_signature("dinner today", monday), question_signature("dinner today", tuesday)) == 0.0
+    assert similarity(question_signature("what is on day 1", monday), question_signature("what is on day 2", monday)) == 0.0
+    assert question_signature("can I have it with milk?") is None
+    cache = ChatResponseCache()
+    assert cache.store("u1", "what about that?", PROFILE, "answer") is False
+    assert cache.lookup("u1", "what about that?", PROFILE) is None
+    assert cache.stats()["skipped"] == 1
+
+
+def test_time_relative_questions_are_not_reused_across_the_day():
+    monday_morning, monday_evening = datetime(2025, 1, 6, 8), datetime(2025, 1, 6, 20)
+    for question in ["What is my next meal?", "what should I eat now", "What time should I have my snack?",
+                     "how many meals are left", "what's coming up soon"]:
+        assert question_signature(question, monday_morning) is None, question
+    cache = ChatResponseCache()
+    assert cache.store("u1", "What is my next meal?", PROFILE, "Breakfast at 8") is False
+    assert cache.lookup("u1", "What is my next meal?", PROFILE) is None
+    # "today" without a meal depends on when it is asked; naming the meal does not
+    morning = question_signature("what should I eat today", monday_morning)
+    assert similarity(morning, question_signature("what should I eat today", datetime(2025, 1, 6, 10))) == 1.0
+    assert similarity(morning, question_signature("what should I eat today", monday_evening)) == 0.0
+    assert similarity(question_signature("dinner today", monday_morning), question_signature("dinner today", monday_evening)) == 1.0
+
+
+def test_new_diet_or_profile_invalidates_answers():
+    cache = ChatResponseCache()
+    cache.store("u1", "can I have tea", PROFILE, "Yes, without sugar")
+    assert cache.lookup("u1", "Can I have tea?", PROFILE) == "Yes, without sugar"
+    assert cache.lookup("u1", "Can I have tea?", {**PROFILE, "dietCacheVersion": 2.0}) is None
+    cache.store("u1", "can I have tea", {**PROFILE, "dietCacheVersion": 2.0}, "Green tea only")
+    assert cache.lookup("u1", "Can I have tea?", {**PROFILE, "dietCacheVersion": 2.0, "targetCalories": 1500}) is None
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_answers_expire():
+    clock = FakeClock()
+    cache = ChatResponseCache(ttl_seconds=60, clock=clock)
+    cache.store("u1", "can I have tea", PROFILE, "Yes")
+    clock.now = 61
+    assert cache.lookup("u1", "can I have tea", PROFILE) is None
+    assert cache.stats()["expired"] == 1
+
+
+if __name__ == "__main__":
+    test_near_identical_questions_share_an_answer()
+    test_days_and_follow_ups_are_not_mixed_up()
+    test_time_relative_questions_are_not_reused_across_the_day()
+    test_new_diet_or_profile_invalidates_answers()
+    test_answers_expire()
+    print("All chat response cache tests passed")
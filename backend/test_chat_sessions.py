@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Unit tests for server-side chat sessions and the profile cache (no Firebase required).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import chat_sessions
+from services.chat_sessions import ChatSessionStore
+
+
+def test_sessions_are_cached_and_accumulate_turns():
+    store = ChatSessionStore(db=None)
+    session = store.get_or_create("u1", "s-1")
+    store.append_turns(session, [{"sender": "user", "text": "hi"}, {"sender": "bot", "text": "hello"}])
+    store.append_turns(session, [{"sender": "user", "text": "protein?"}, {"sender": "bot", "text": "eggs"}])
+
+    same = store.get_or_create("u1", "s-1")
+    assert same is session
+    assert same.turn_count == 4
+    assert [turn["text"] for turn in same.history()] == ["hi", "hello", "protein?", "eggs"]
+    assert [turn["sequence"] for turn in same.turns] == [0, 1, 2, 3]
+    # Sessions are scoped to their user
+    assert store.get_or_create("u2", "s-1").history() == []
+    assert store.stats()["session_hits"] == 1
+
+
+def test_invalid_session_ids_are_rejected():
+    store = ChatSessionStore(db=None)
+    for bad in ("", "a/b", "x" * 65):
+        try:
+            store.get_or_create("u1", bad)
+            assert False, f"expected ValueError for {bad!r}"
+        except ValueError:
+            pass
+
+
+def test_in_memory_turns_are_capped():
+    original = chat_sessions.MAX_SESSION_TURNS
+    chat_sessions.MAX_SESSION_TURNS = 3
+    try:
+        store = ChatSessionStore(db=None)
+        session = store.get_or_create("u1", "s")
+        store.append_turns(session, [{"sender": "user", "text": str(i)} for i in range(5)])
+        assert [turn["text"] for turn in session.history()] == ["2", "3", "4"]
+        assert session.turn_count == 5
+    finally:
+        chat_sessions.MAX_SESSION_TURNS = original
+
+
+def test_profile_cache_expires_and_invalidates():
+    now = [0.0]
+    store = ChatSessionStore(db=None, clock=lambda: now[0])
+    store.get_profile("u1")
+    store.get_profile("u1")
+    assert store.stats()["profile_loads"] == 1
+    now[0] = chat_sessions.PROFILE_TTL_SECONDS + 1
+    store.get_profile("u1")
+    store.invalidate_profile("u1")
+    store.get_profile("u1")
+    assert store.stats()["profile_loads"] == 3
+
+
+if __name__ == "__main__":
+    test_sessions_are_cached_and_accumulate_turns()
+    test_invalid_session_ids_are_rejected()
+    test_in_memory_turns_are_capped()
+    test_profile_cache_expires_and_invalidates()
+    print("All chat session tests passed")
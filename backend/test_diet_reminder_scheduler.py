@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the heap-based diet reminder scheduler (no Firebase required).
+"""
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.diet_notification_service import diet_notification_service
+from services.diet_reminder_scheduler import DietReminderScheduler, reminder_doc_id
+from services.pdf_extraction import extract_pdf_text
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FREE TRIAL DIET.pdf")
+
+OPERATORS = {
+    "==": lambda a, b: a == b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "<": lambda a, b: a is not None and a < b,
+}
+
+
+class FakeSnapshot:
+    def __init__(self, collection, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self.reference = collection.document(doc_id)
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self.collection, self.id = collection, doc_id
+
+    @property
+    def _docs(self):
+        return self.collection.db.data.setdefault(self.collection.name, {})
+
+    def get(self, field_paths=None):
+        self.collection.db.reads += 1
+        return FakeSnapshot(self.collection, self.id, self._docs.get(self.id))
+
+    def set(self, data):
+        self._docs[self.id] = dict(data)
+
+    def update(self, fields):
+        self._docs[self.id].update(fields)
+
+    def delete(self):
+        self._docs.pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=()):
+        self.collection, self.filters = collection, list(filters)
+
+    def where(self, field, op, value):
+        return FakeQuery(self.collection, self.filters + [(field, op, value)])
+
+    def order_by(self, field):
+        return self
+
+    def stream(self):
+        db = self.collection.db
+        db.queries.append(self.filters)
+        for doc_id, data in sorted(db.data.get(self.collection.name, {}).items(), key=lambda item: item[1].get("scheduled_for", "")):
+            if all(OPERATORS[op](data.get(field), value) for field, op, value in self.filters):
+                db.reads += 1
+                yield FakeSnapshot(self.collection, doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return FakeDocument(self, doc_id)
+
+
+class FakeBatch:
+    def __init__(self):
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append(lambda: ref.set(data))
+
+    def delete(self, ref):
+        self.ops.append(ref.delete)
+
+    def commit(self):
+        for op in self.ops:
+            op()
+
+
+class FakeDB:
+    def __init__(self, notifications=None):
+        self.data = {"user_notifications": notifications or {}}
+        self.queries = []
+        self.reads = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch()
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# Monday 2026-10-12 07:00 UTC
+MONDAY_7AM = datetime(2026, 10, 12, 7, 0, tzinfo=timezone.utc).timestamp()
+
+
+def make_scheduler(db, clock, **kwargs):
+    sent = []
+    scheduler = DietReminderScheduler(
+        db, enqueue=lambda user, title, body, data, source, key: sent.append((user, body, key)),
+        horizon=3600, refresh=600, jitter=30, missed_grace=900, clock=clock, **kwargs
+    )
+    return scheduler, sent
+
+
+def reminder(notification_id, time, days, message="Drink water"):
+    hour, minute = (int(part) for part in time.split(":"))
+    return {"id": notification_id, "message": message, "time": time, "hour": hour, "minute": minute, "selectedDays": days}
+
+
+def test_only_reminders_in_the_window_are_loaded_and_fired():
+    db = FakeDB({"user1": {"diet_notifications": [reminder("breakfast", "07:30", [0, 2]), reminder("lunch", "13:00", [0])]}})
+    clock = FakeClock(MONDAY_7AM)
+    scheduler, sent = make_scheduler(db, clock)
+    assert scheduler.schedule_user("user1") == 3
+    assert len(db.data["scheduled_notifications"]) == 3
+    scheduler.run_once()
+    # Only Monday's 07:30 reminder is due within the hour; the rest stay in Firestore
+    assert scheduler.stats()["tracked"] == 1
+    assert db.queries[-1] == [("status", "==", "scheduled"), ("scheduled_for", "<", "2026-10-12T08:00:00+00:00")]
+    clock.now += 29 * 60
+    assert scheduler.run_once()["fired"] == 0
+    clock.now += 60
+    assert scheduler.run_once()["fired"] == 1
+    doc_id = reminder_doc_id("user1", "breakfast", 0)
+    assert sent == [("user1", "Drink water", f"diet_reminder_{doc_id}_{int(MONDAY_7AM + 1800)}")]
+    # The reminder rolls forward a week in place
+    assert db.data["scheduled_notifications"][doc_id]["scheduled_for"] == "2026-10-19T07:30:00+00:00"
+    assert scheduler.stats()["tracked"] == 0
+
+
+def test_window_is_extended_by_range_queries():
+    db = FakeDB({"user1": {"diet_notifications": [reminder("lunch", "13:00", [0])]}})
+    clock = FakeClock(MONDAY_7AM)
+    scheduler, sent = make_scheduler(db, clock)
+    scheduler.schedule_user("user1")
+    scheduler.run_once()
+    assert scheduler.stats()["tracked"] == 0
+    clock.now += 5 * 3600 + 30 * 60
+    scheduler.run_once()
+    assert db.queries[-1][1] == ("scheduled_for", ">=", "2026-10-12T08:00:00+00:00")
+    assert scheduler.stats()["tracked"] == 1 and not sent
+    clock.now += 30 * 60
+    assert scheduler.run_once()["fired"] == 1
+
+
+def test_edits_and_cancels_update_the_heap():
+    notifications = {"user1": {"diet_notifications": [reminder("breakfast", "07:30", [0])]}}
+    db = FakeDB(notifications)
+    clock = FakeClock(MONDAY_7AM)
+    scheduler, sent = make_scheduler(db, clock)
+    scheduler.run_once()
+    scheduler.schedule_user("user1")
+    assert scheduler.stats()["tracked"] == 1
+    # Rescheduling an unchanged reminder writes nothing
+    writes = dict(db.data["scheduled_notifications"])
+    scheduler.schedule_user("user1")
+    assert db.data["scheduled_notifications"] == writes
+    # Moved earlier: the old heap entry is dropped when it reaches the top
+    notifications["user1"]["diet_notifications"] = [reminder("breakfast", "07:10", [0])]
+    scheduler.schedule_user("user1")
+    clock.now += 10 * 60
+    assert scheduler.run_once()["fired"] == 1
+    clock.now += 20 * 60
+    assert scheduler.run_once()["fired"] == 0 and len(sent) == 1
+    notifications["user1"]["diet_notifications"] = [reminder("dinner", "08:00", [0])]
+    scheduler.schedule_user("user1")
+    assert list(db.data["scheduled_notifications"]) == [reminder_doc_id("user1", "dinner", 0)]
+    assert scheduler.cancel_user("user1") == 1
+    clock.now += 30 * 60
+    assert scheduler.run_once()["fired"] == 0 and db.data["scheduled_notifications"] == {}
+
+
+def test_startup_rebuild_rolls_missed_reminders_forward():
+    db = FakeDB({"user1": {"diet_notifications": [reminder("breakfast", "07:30", [0]), reminder("snack", "06:50", [0])]}})
+    # Scheduled the Monday before at 08:00, so both are next due this Monday
+    clock = FakeClock(MONDAY_7AM - 7 * 24 * 3600 + 3600)
+    DietReminderScheduler(db, clock=clock).schedule_user("user1")
+    # The server restarts at 07:00: 06:50 was 10 minutes ago, 07:30 is coming up
+    clock.now = MONDAY_7AM
+    scheduler, sent = make_scheduler(db, clock)
+    metrics = scheduler.run_once()
+    assert metrics["fired"] == 1 and metrics["missed"] == 0 and [body for _, body, _ in sent] == ["Drink water"]
+    assert scheduler.stats()["tracked"] == 1
+    # Down for longer than the grace period: skipped to next week rather than sent late
+    clock.now += 7 * 24 * 3600 + 3600
+    restarted, late = make_scheduler(db, clock)
+    assert restarted.run_once()["missed"] == 2 and not late
+    assert db.data["scheduled_notifications"][reminder_doc_id("user1", "breakfast", 0)]["scheduled_for"] == "2026-10-26T07:30:00+00:00"
+
+
+def test_reminders_due_within_the_jitter_window_fire_together():
+    db = FakeDB({f"user{i}": {"diet_notifications": [reminder("water", f"07:{10 + i:02d}", [0])]} for i in range(3)})
+    clock = FakeClock(MONDAY_7AM)
+    scheduler, sent = make_scheduler(db, clock)
+    scheduler.run_once()
+    for i in range(3):
+        scheduler.schedule_user(f"user{i}")
+    clock.now += 10 * 60
+    # 07:10 is due; 07:11 falls within the 30 second jitter window only once it is 07:10:30
+    assert scheduler.run_once()["fired"] == 1
+    clock.now += 30
+    assert scheduler.run_once()["fired"] == 1
+    clock.now += 60
+    assert scheduler.run_once()["fired"] == 1
+    assert [user for user, _, _ in sent] == ["user0", "user1", "user2"]
+    assert scheduler.stats()["lateness_max_seconds"] <= 30
+
+
+def test_failed_sends_are_retried():
+    db = FakeDB({"user1": {"diet_notifications": [reminder("breakfast", "07:30", [0])]}})
+    clock = FakeClock(MONDAY_7AM + 1800)
+    attempts = []
+
+    def enqueue(*args, **kwargs):
+        attempts.append(kwargs["key"])
+        if len(attempts) == 1:
+            raise RuntimeError("outbox unavailable")
+
+    scheduler = DietReminderScheduler(db, enqueue=enqueue, retry=30, clock=clock)
+    scheduler.run_once()
+    clock.now -= 60
+    scheduler.schedule_user("user1")
+    clock.now += 60
+    assert scheduler.run_once()["errors"] == 1
+    clock.now += 30
+    assert scheduler.run_once()["fired"] == 1
+    assert attempts[0] == attempts[1]
+
+
+def test_free_trial_reminders_fire_once_on_their_trial_day():
+    with open(SAMPLE_PDF, "rb") as f:
+        notifications = diet_notification_service.create_notifications_from_text(extract_pdf_text(f.read())["text"])
+    assert all(n.get("trialDay") in (1, 2, 3) for n in notifications)
+    # Not yet configured by the user: no selectedDays means no reminders
+    unconfigured = {"id": "unconfigured", "message": "Walk", "time": "09:00", "hour": 9, "minute": 0}
+    db = FakeDB({"user1": {"diet_notifications": notifications + [unconfigured]}})
+    trial_start = MONDAY_7AM - 30 * 60
+    db.data["user_profiles"] = {"user1": {"freeTrialStartDate": datetime.fromtimestamp(trial_start, timezone.utc).isoformat()}}
+    clock = FakeClock(trial_start)
+    scheduler, sent = make_scheduler(db, clock)
+    assert scheduler.schedule_user("user1") == len(notifications)
+    docs = db.data["scheduled_notifications"]
+    assert len(docs) == len(notifications)
+    assert max(doc["scheduled_for"] for doc in docs.values()) < "2026-10-15T00:00:00+00:00"
+    # Run through the trial and the week after it
+    while clock.now < trial_start + 10 * 24 * 3600:
+        scheduler.run_once()
+        clock.now += 60
+    assert len(sent) == len(notifications)
+    assert {doc["status"] for doc in docs.values()} == {"sent"}
+    # Rescheduling after the trial neither resends nor recreates them
+    scheduler.schedule_user("user1")
+    assert len(docs) == 0 and len(sent) == len(notifications)
+
+
+if __name__ == "__main__":
+    test_only_reminders_in_the_window_are_loaded_and_fired()
+    test_window_is_extended_by_range_queries()
+    test_edits_and_cancels_update_the_heap()
+    test_startup_rebuild_rolls_missed_reminders_forward()
+    test_reminders_due_within_the_jitter_window_fire_together()
+    test_failed_sends_are_retried()
+    test_free_trial_reminders_fire_once_on_their_trial_day()
+    print("All diet reminder scheduler tests passed")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Unit tests for diet text chunking and BM25 retrieval (no Firebase required).
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.diet_retrieval import DietIndex, chunk_diet_text, expand_relative_days
+from services.pdf_rag_service import PDFRAGService, pdf_rag_service
+
+SAMPLE_DIET = """Diet plan for Priya
+Drink 3 litres of water daily. Avoid sugar.
+MONDAY- 11th AUG
+5:30 AM- 1 glass JEERA water
+BREAKFAST
+8 AM- vegetable poha with peanuts
+LUNCH
+1 PM- 2 multigrain roti, palak paneer, cucumber raita
+DINNER
+8 PM- moong dal khichdi
+TUESDAY- 12th AUG
+5:30 AM- 1 glass methi water
+BREAKFAST
+8 AM- besan chilla with mint chutney
+LUNCH
+1 PM- brown rice, rajma, salad
+DINNER
+8 PM- grilled tofu with sauteed vegetables
+"""
+
+
+def test_chunks_follow_day_and_meal_headers():
+    chunks = chunk_diet_text(SAMPLE_DIET)
+    labels = [(chunk["day"], chunk["meal"]) for chunk in chunks]
+    assert labels[0] == (None, None)
+    assert ("MONDAY", None) in labels and ("MONDAY", "LUNCH") in labels and ("TUESDAY", "DINNER") in labels
+    tuesday_lunch = next(chunk for chunk in chunks if chunk["day"] == "TUESDAY" and chunk["meal"] == "LUNCH")
+    assert tuesday_lunch["text"].startswith("TUESDAY - LUNCH")
+    assert "rajma" in tuesday_lunch["text"] and "paneer" not in tuesday_lunch["text"]
+
+
+def test_long_sections_are_split():
+    text = "MONDAY\n" + "\n".join(f"{i} AM- item number {i}" for i in range(1, 60))
+    chunks = chunk_diet_text(text, max_chars=200)
+    assert len(chunks) > 1
+    assert all(chunk["text"].startswith("MONDAY") for chunk in chunks)
+
+
+def test_search_ranks_relevant_day_and_meal():
+    index = DietIndex.from_text(SAMPLE_DIET)
+    top = index.search("What is my lunch on Tuesday?", k=1)[0]
+    assert (top["day"], top["meal"]) == ("TUESDAY", "LUNCH")
+    assert any("tofu" in chunk["text"] for chunk in index.search("can I swap the tofu", k=2))
+    # Nothing matches: fall back to the start of the plan
+    assert index.search("zzz", k=1)[0]["day"] is None
+
+
+def test_relative_days_become_weekdays():
+    monday = datetime(2026, 10, 12)
+    assert expand_relative_days("dinner tomorrow", monday).endswith("tuesday")
+    assert expand_relative_days("hello", monday) == "hello"
+
+
+def test_context_prompt_only_includes_retrieved_chunks():
+    prompt = pdf_rag_service.create_diet_context_prompt(SAMPLE_DIET, "Tuesday dinner")
+    assert "grilled tofu" in prompt
+    assert "vegetable poha" not in prompt
+    # Without a question the start of the plan is used, as before
+    assert "vegetable poha" in pdf_rag_service.create_diet_context_prompt(SAMPLE_DIET)
+
+
+class _FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _FakeDocument:
+    def __init__(self, docs, doc_id):
+        self.docs = docs
+        self.doc_id = doc_id
+
+    def set(self, data):
+        self.docs[self.doc_id] = dict(data)
+
+    def get(self):
+        return _FakeSnapshot(self.docs.get(self.doc_id))
+
+
+class _FakeDB:
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        assert name == "diet_text"
+        return self
+
+    def document(self, doc_id):
+        return _FakeDocument(self.docs, doc_id)
+
+
+def test_stored_diet_text_is_used_after_restart():
+    db = _FakeDB()
+    PDFRAGService().save_diet_text("u1", "diet.pdf", SAMPLE_DIET.strip(), db, cache_version=1.5)
+    stored = db.docs["u1"]
+    assert stored["dietCacheVersion"] == 1.5 and stored["chunks"]
+
+    # A fresh process must not download or parse the PDF again
+    restarted = PDFRAGService()
+    restarted._fetch_diet_pdf_bytes = lambda *args: (_ for _ in ()).throw(AssertionError("PDF was downloaded"))
+    assert restarted.get_diet_pdf_text("u1", "diet.pdf", db) == SAMPLE_DIET.strip()
+    assert len(restarted.index_cache) == 1
+    # A different diet file is not served from the stored text
+    assert restarted.load_diet_text("u1", db, "other.pdf") is None
+
+
+def test_stale_stored_text_is_re_extracted():
+    db = _FakeDB()
+    PDFRAGService().save_diet_text("u1", "diet.pdf", "old diet", db, cache_version=1.0)
+    # Text stored before the source was recorded next to it
+    db.docs["u2"] = {"text": "unknown diet"}
+    service = PDFRAGService()
+    extracted = []
+    service._fetch_diet_pdf_bytes = lambda user_id, url, db: extracted.append((user_id, url)) or b"%PDF new"
+    service.extract_text_from_pdf_bytes = lambda pdf_bytes: SAMPLE_DIET.strip()
+    # Same file name uploaded again: the version no longer matches
+    assert service.load_diet_text("u1", db, "diet.pdf", 2.0) is None
+    assert service.get_diet_pdf_text("u1", "diet.pdf", db, 2.0) == SAMPLE_DIET.strip()
+    assert db.docs["u1"]["dietCacheVersion"] == 2.0 and db.docs["u1"]["dietPdfUrl"] == "diet.pdf"
+    assert service.load_diet_text("u1", db, "diet.pdf", 2.0)["text"] == SAMPLE_DIET.strip()
+    assert service.load_diet_text("u2", db, "diet.pdf") is None
+    assert service.get_diet_pdf_text("u2", "diet.pdf", db) == SAMPLE_DIET.strip()
+    assert extracted == [("u1", "diet.pdf"), ("u2", "diet.pdf")]
+
+
+def test_reupload_under_the_same_name_is_not_served_from_memory():
+    db = _FakeDB()
+    service = PDFRAGService()
+    service.save_diet_text("u1", "diet.pdf", "old diet", db, cache_version=1.0)
+    assert service.get_diet_pdf_text("u1", "diet.pdf", db, 1.0) == "old diet"
+    # diet.pdf is uploaded again as version 2.0 but storing its text failed
+    service._fetch_diet_pdf_bytes = lambda user_id, url, db: b"%PDF new"
+    service.extract_text_from_pdf_bytes = lambda pdf_bytes: SAMPLE_DIET.strip()
+    assert service.get_diet_pdf_text("u1", "diet.pdf", db, 2.0) == SAMPLE_DIET.strip()
+    prompt = service.enhance_chatbot_prompt("u1", "diet.pdf", db, "base", question="monday lunch", cache_version=2.0)
+    assert "palak paneer" in prompt and "old diet" not in prompt
+
+
+if __name__ == "__main__":
+    test_chunks_follow_day_and_meal_headers()
+    test_long_sections_are_split()
+    test_search_ranks_relevant_day_and_meal()
+    test_relative_days_become_weekdays()
+    test_context_prompt_only_includes_retrieved_chunks()
+    test_stored_diet_text_is_used_after_restart()
+    test_stale_stored_text_is_re_extracted()
+    test_reupload_under_the_same_name_is_not_served_from_memory()
+    print("All diet retrieval tests passed")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the batched Expo push sender against a local stand-in Expo server (no Firebase required).
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.expo_push_gateway import ExpoPushGateway, push_message, ticket_ok
+
+
+class FakeExpo:
+    """Records each request's batch and answers with one ticket per message."""
+
+    def __init__(self, fail_first=0):
+        self.batches = []
+        self.fail_first = fail_first
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                messages = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if fake.fail_first > 0:
+                    fake.fail_first -= 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                fake.batches.append(messages)
+                tickets = [
+                    {"status": "error", "message": "not registered", "details": {"error": "DeviceNotRegistered"}}
+                    if message["to"].endswith("dead]") else {"status": "ok", "id": f"ticket-{message['to']}"}
+                    for message in messages
+                ]
+                body = json.dumps({"data": tickets}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/push/send"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_concurrent_sends_are_batched_in_order():
+    expo = FakeExpo()
+    gateway = ExpoPushGateway(url=expo.url, linger_seconds=0.05, http2=False)
+    messages = [push_message(f"ExponentPushToken[{i}]", "Hi", f"Message {i}") for i in range(250)]
+    messages[7]["to"] = "ExponentPushToken[dead]"
+    seen = []
+    gateway.add_listener(lambda message, ticket: seen.append((message["to"], ticket["status"])))
+
+    async def scenario():
+        return await asyncio.gather(*(gateway.send(message) for message in messages))
+
+    try:
+        tickets = asyncio.run(scenario())
+    finally:
+        gateway.close()
+        expo.stop()
+    assert sum(len(batch) for batch in expo.batches) == 250
+    assert max(len(batch) for batch in expo.batches) == 100 and len(expo.batches) <= 4
+    assert tickets[7]["details"]["error"] == "DeviceNotRegistered"
+    assert len(seen) == 250 and ("ExponentPushToken[dead]", "error") in seen
+    assert all(ticket["id"] == f"ticket-ExponentPushToken[{i}]" for i, ticket in enumerate(tickets) if i != 7)
+    stats = gateway.stats()
+    assert stats["batches"] == len(expo.batches) and stats["tickets_ok"] == 249 and stats["errors"] == {"DeviceNotRegistered": 1}
+
+
+def test_server_errors_are_retried():
+    expo = FakeExpo(fail_first=1)
+    gateway = ExpoPushGateway(url=expo.url, linger_seconds=0.01, backoff_base=0.01, http2=False)
+    try:
+        tickets = asyncio.run(gateway.send_many([push_message("ExponentPushToken[a]", "Hi", "There")]))
+    finally:
+        gateway.close()
+        expo.stop()
+    assert ticket_ok(tickets[0]) and gateway.stats()["retries"] == 1
+
+
+def test_send_sync_from_threads():
+    expo = FakeExpo()
+    gateway = ExpoPushGateway(url=expo.url, linger_seconds=0.05, http2=False)
+    results = {}
+
+    def worker(i):
+        results[i] = gateway.send_sync(push_message(f"ExponentPushToken[{i}]", "Hi", "There"))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        gateway.close()
+        expo.stop()
+    assert all(ticket_ok(results[i]) for i in range(20))
+    # The threads' messages shared requests instead of one request each
+    assert len(expo.batches) < 20
+
+
+def test_unreachable_expo_gives_error_tickets():
+    gateway = ExpoPushGateway(url="http://127.0.0.1:9/push/send", linger_seconds=0.01, max_attempts=2,
+                              backoff_base=0.01, http2=False)
+    try:
+        ticket = gateway.send_sync(push_message("ExponentPushToken[a]", "Hi", "There"))
+    finally:
+        gateway.close()
+    assert not ticket_ok(ticket) and ticket["details"]["error"] == "ConnectError"
+    assert gateway.stats()["request_errors"] == 1
+
+
+if __name__ == "__main__":
+    test_concurrent_sends_are_batched_in_order()
+    test_server_errors_are_retried()
+    test_send_sync_from_threads()
+    test_unreachable_expo_gives_error_tickets()
+    print("All Expo push gateway tests passed")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the extraction process pool (no Firebase required).
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.diet_notification_service import diet_notification_service
+from services.extraction_pool import ExtractionService, ExtractionBusyError, ExtractionTimeoutError
+from services.pdf_extraction import extract_pdf_text
+from services.pdf_text_cache import PDFTextCache, content_key
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FREE TRIAL DIET.pdf")
+
+DIET_TEXT = """MONDAY
+7 AM- 1 glass warm water
+8:30 AM- Poha with sprouts
+1 PM- Dal, rice and salad
+TUESDAY
+7 AM- 1 glass warm water
+9 AM- Oats with fruit
+"""
+
+
+# Job functions must be importable from the worker processes
+def sleep_job(seconds):
+    time.sleep(seconds)
+    return {"slept": seconds}
+
+
+def echo_job(value):
+    return {"value": value}
+
+
+def test_notifications_are_parsed_in_worker_process():
+    service = ExtractionService(max_workers=1)
+    try:
+        notifications = asyncio.run(service.create_notifications("user1", DIET_TEXT))
+    finally:
+        service.shutdown()
+    expected = diet_notification_service.create_notifications_from_text(DIET_TEXT, "user1")
+    assert [(n["time"], n["message"], n.get("selectedDays")) for n in notifications] == \
+        [(n["time"], n["message"], n.get("selectedDays")) for n in expected]
+    assert service.stats()["jobs"]["diet_notifications"]["completed"] == 1
+
+
+def test_timed_out_job_replaces_pool():
+    service = ExtractionService(max_workers=1, timeouts={"slow": 0.5})
+    try:
+        try:
+            asyncio.run(service.run("slow", sleep_job, 30))
+            assert False, "expected a timeout"
+        except ExtractionTimeoutError:
+            pass
+        assert service.stats()["pool_restarts"] == 1
+        # A fresh pool serves the next job
+        assert asyncio.run(service.run("echo", echo_job, 3)) == {"value": 3}
+    finally:
+        service.shutdown()
+    stats = service.stats()
+    assert stats["jobs"]["slow"]["timeouts"] == 1 and stats["pending"] == 0
+
+
+def test_queue_is_bounded():
+    service = ExtractionService(max_workers=1, max_pending=1, use_processes=False)
+
+    async def scenario():
+        first = asyncio.ensure_future(service.run("slow", sleep_job, 0.3))
+        await asyncio.sleep(0.05)
+        try:
+            await service.run("echo", echo_job, 1)
+            assert False, "expected the queue to be full"
+        except ExtractionBusyError:
+            pass
+        return await first
+
+    assert asyncio.run(scenario()) == {"slept": 0.3}
+    assert service.stats()["jobs"]["echo"]["rejected"] == 1
+
+
+def test_extract_text_uses_content_hash_cache():
+    service = ExtractionService(use_processes=False)
+    cache = PDFTextCache(max_bytes=1000, disk_dir=None)
+    cache.set(content_key(b"%PDF diet"), "MONDAY\n8 AM- poha")
+    assert asyncio.run(service.extract_text(b"%PDF diet", text_cache=cache)) == "MONDAY\n8 AM- poha"
+    stats = service.stats()["jobs"]["pdf_text"]
+    assert stats["cache_hits"] == 1 and stats["jobs"] == 0
+
+
+def test_long_pdfs_are_split_across_workers():
+    with open(SAMPLE_PDF, "rb") as f:
+        pdf_bytes = f.read()
+    service = ExtractionService(max_workers=2)
+    report = {}
+    try:
+        text = asyncio.run(service.extract_text(pdf_bytes, text_cache=PDFTextCache(max_bytes=1 << 20, disk_dir=None), report=report))
+    finally:
+        service.shutdown()
+    assert text == extract_pdf_text(pdf_bytes)["text"]
+    assert [page["page"] for page in report["pages"]] == list(range(report["page_count"]))
+    engines = service.stats()["pdf_engines"]
+    assert engines["parallel_documents"] == 1 and service.stats()["jobs"]["pdf_text"]["completed"] == 2
+
+
+if __name__ == "__main__":
+    test_notifications_are_parsed_in_worker_process()
+    test_timed_out_job_replaces_pool()
+    test_queue_is_bounded()
+    test_extract_text_uses_content_hash_cache()
+    test_long_pdfs_are_split_across_workers()
+    print("All extraction pool tests passed")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the local food composition database (no Firebase required).
+"""
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.food_composition_db import FoodCompositionDB, food_composition_db
+
+
+def _make_db(foods, min_confidence=0.8):
+    handle, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(handle, "w") as f:
+        json.dump({"version": "test-1", "foods": foods}, f)
+    try:
+        return FoodCompositionDB(path, min_confidence=min_confidence)
+    finally:
+        os.remove(path)
+
+
+ROTI = {"name": "roti", "aliases": ["chapati"], "calories": 300, "protein": 10, "fat": 4, "servings": {"piece": 40}, "defaultUnit": "piece"}
+RICE = {"name": "white rice", "aliases": ["rice"], "calories": 130, "protein": 2.7, "fat": 0.3, "servings": {"bowl": 150}}
+
+
+def test_bundled_dataset_loads():
+    assert food_composition_db.loaded
+    assert food_composition_db.version
+    assert food_composition_db.resolve("roti", "1 piece")["source"] == "local_db"
+
+
+def test_exact_alias_match_scales_by_serving():
+    db = _make_db([ROTI, RICE])
+    result = db.resolve("Chapati", "2 pieces")
+    assert result["matched_name"] == "roti"
+    assert result["confidence"] == 1.0
+    assert result["calories"] == 240.0
+    assert result["raw"] == "local_db:test-1"
+
+
+def test_bare_numbers_are_grams():
+    db = _make_db([ROTI, RICE])
+    # A unit-less servingSize means grams, as in the app and the daily summary
+    assert db.resolve("roti", "100")["calories"] == 300.0
+    assert db.resolve("rice", "150")["calories"] == 195.0
+    assert db.resolve("roti", "100 g")["calories"] == 300.0
+    assert db.resolve("rice", "200g")["calories"] == 260.0
+    assert db.resolve("rice", "1 bowl")["calories"] == 195.0
+    assert db.resolve("rice", "0.5 kg")["calories"] == 650.0
+    # Missing serving size defaults to 100 g
+    assert db.resolve("rice", "")["calories"] == 130.0
+
+
+def test_bare_quantities_on_bundled_dataset():
+    for food in ("roti", "rice", "milk", "banana"):
+        per_100g = food_composition_db.resolve(food, "100 g")
+        assert food_composition_db.resolve(food, "100") == per_100g, food
+        assert food_composition_db.resolve(food, "150")["calories"] == round(per_100g["calories"] * 1.5, 1), food
+
+
+def test_extra_words_are_not_fuzzy_matched():
+    assert food_composition_db.match("brown rice cake") is None
+    assert food_composition_db.match("cold coffee") is None
+    # Typos still match
+    assert food_composition_db.resolve("chiken curry", "100 g")["matched_name"] == "chicken curry"
+    assert food_composition_db.resolve("bananna", "1")["matched_name"] == "banana"
+
+
+def test_fuzzy_match_reports_confidence():
+    db = _make_db([ROTI, RICE])
+    result = db.resolve("white rices", "100g")
+    assert result["matched_name"] == "white rice"
+    assert 0.8 <= result["confidence"] < 1.0
+
+
+def test_unknown_food_or_unit_falls_through():
+    db = _make_db([ROTI, RICE])
+    assert db.resolve("pizza", "1") is None
+    assert db.resolve("roti", "1 glass") is None
+    stats = db.stats()
+    assert stats["misses"] == 1
+    assert stats["unit_misses"] == 1
+
+
+def test_missing_data_file_disables_lookups():
+    db = FoodCompositionDB("/nonexistent/food_composition.json")
+    assert not db.loaded
+    assert db.resolve("roti", "1") is None
+
+
+if __name__ == "__main__":
+    test_bundled_dataset_loads()
+    test_exact_alias_match_scales_by_serving()
+    test_bare_numbers_are_grams()
+    test_bare_quantities_on_bundled_dataset()
+    test_extra_words_are_not_fuzzy_matched()
+    test_fuzzy_match_reports_confidence()
+    test_unknown_food_or_unit_falls_through()
+    test_missing_data_file_disables_lookups()
+    print("All food composition DB tests passed")
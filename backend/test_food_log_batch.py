@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Unit tests for batched food logging and its daily totals (no Firebase required).
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+from itertools import count
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from firebase_admin import firestore
+
+from services.food_log_batch import build_food_logs, log_food_batch
+from services.nutrition_rollups import NutritionRollups, META_DOC_ID
+
+TIMESTAMP = datetime(2026, 10, 16, 13, 5)
+DAY = "2026-10-16"
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, path, doc_id):
+        self.db, self.path, self.id = db, path, doc_id
+
+    def apply(self, data, merge=False):
+        docs = self.db.data.setdefault(self.path, {})
+        current = dict(docs.get(self.id, {})) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, firestore.Increment):
+                value = current.get(field, 0) + value.value
+            current[field] = value
+        docs[self.id] = current
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self.db, self.path = db, path
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, self.path, doc_id or f"auto{next(self.db.ids)}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append((ref, data, merge))
+
+    def commit(self):
+        self.db.commits.append(len(self.ops))
+        for ref, data, merge in self.ops:
+            ref.apply(data, merge)
+
+
+class FakeDB:
+    def __init__(self):
+        self.data = {}
+        self.commits = []
+        self.ids = count()
+
+    def collection(self, path):
+        return FakeCollection(self, path)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs):
+        return [FakeSnapshot(ref.id, self.data.get(ref.path, {}).get(ref.id)) for ref in refs]
+
+
+def make_rollups():
+    db = FakeDB()
+    # An already backfilled user, so totals come straight from the rollup documents
+    db.data["users/user1/daily_nutrition"] = {META_DOC_ID: {"days": 0}}
+    return db, NutritionRollups(db)
+
+
+def batch_resolver(replies, calls):
+    async def resolve(items):
+        calls.append(items)
+        return [dict(replies[name]) for name, _ in items]
+    return resolve
+
+
+def food_logs(db):
+    return list(db.data.get("users/user1/food_logs", {}).values())
+
+
+def test_items_are_written_in_one_batch_with_day_totals():
+    db, rollups = make_rollups()
+    calls = []
+    resolve = batch_resolver({"rice": {"calories": 130, "protein": 2.7, "fat": 0.3, "source": "local_db", "confidence": 1.0}}, calls)
+    items = [
+        {"foodName": "dal", "servingSize": "1 bowl", "calories": 180, "protein": 9, "fat": 4},
+        {"foodName": "rice", "servingSize": "200"},
+        {"foodName": "curd", "servingSize": "1 cup", "calories": 98, "protein": 11, "fat": 4.3},
+    ]
+    response = asyncio.run(log_food_batch(rollups, "user1", items, TIMESTAMP, resolve,
+                                          lambda user_id, logs: rollups.log_entries(user_id, food_logs=logs)))
+    # Only the item without macros is looked up, in one call
+    assert calls == [[("rice", "200")]]
+    assert response["logged"] == 3 and all(result["success"] for result in response["results"])
+    # Three logs and their rollup increments go out in a single commit
+    assert db.commits == [6] and len(food_logs(db)) == 3
+    rice = response["results"][1]["log"]
+    assert rice["food"]["per_100g"] is True and rice["source"] == "local_db" and rice["matchConfidence"] == 1.0
+    assert response["results"][0]["log"]["food"]["per_100g"] is False
+    # Client totals as-is plus rice per 100 g scaled to 200 g
+    totals = response["dayTotals"]
+    assert totals["day"] == DAY and totals["items"] == 3
+    assert round(totals["calories"], 1) == 180 + 260 + 98
+    assert round(totals["protein"], 1) == round(9 + 5.4 + 11, 1)
+
+
+def test_totals_accumulate_across_batches():
+    db, rollups = make_rollups()
+    write = lambda user_id, logs: rollups.log_entries(user_id, food_logs=logs)
+    items = [{"foodName": "apple", "servingSize": "1", "calories": 95, "protein": 0.5, "fat": 0.3}]
+    asyncio.run(log_food_batch(rollups, "user1", items, TIMESTAMP, batch_resolver({}, []), write))
+    response = asyncio.run(log_food_batch(rollups, "user1", items * 2, TIMESTAMP, batch_resolver({}, []), write))
+    assert response["dayTotals"]["items"] == 3 and response["dayTotals"]["calories"] == 285
+
+
+def test_unresolved_items_are_reported_and_the_rest_logged():
+    db, rollups = make_rollups()
+    resolve = batch_resolver({
+        "idli": {"calories": 58, "protein": 2, "fat": 0.4, "source": "gemini"},
+        "zzz": {"calories": "Error", "protein": "Error", "fat": "Error", "raw": "Error", "source": "gemini"},
+    }, [])
+    items = [{"foodName": "zzz", "servingSize": "1"}, {"foodName": "idli", "servingSize": "100"}]
+    response = asyncio.run(log_food_batch(rollups, "user1", items, TIMESTAMP, resolve,
+                                          lambda user_id, logs: rollups.log_entries(user_id, food_logs=logs)))
+    assert response["logged"] == 1
+    failed, logged = response["results"]
+    assert failed == {"foodName": "zzz", "servingSize": "1", "success": False,
+                      "error": "Could not resolve nutrition data for this item", "source": "gemini"}
+    assert logged["success"] and [log["food"]["name"] for log in food_logs(db)] == ["idli"]
+    assert response["dayTotals"]["calories"] == 58 and response["dayTotals"]["items"] == 1
+
+
+def test_nothing_is_written_when_no_item_resolves():
+    db, rollups = make_rollups()
+    writes = []
+    resolve = batch_resolver({"zzz": {"calories": "Error", "protein": "Error", "fat": "Error", "source": "gemini"}}, [])
+    response = asyncio.run(log_food_batch(rollups, "user1", [{"foodName": "zzz", "servingSize": "1"}], TIMESTAMP, resolve,
+                                          lambda user_id, logs: writes.append(logs)))
+    assert not writes and not db.commits
+    assert response["logged"] == 0 and response["dayTotals"]["items"] == 0
+
+
+def test_partial_macros_are_resolved_rather_than_stored():
+    logs, results = build_food_logs(
+        "user1", [{"foodName": "tea", "servingSize": "1 cup", "calories": 40, "protein": None, "fat": 1}],
+        {0: {"calories": 30, "protein": 1, "fat": 1, "source": "cache"}}, TIMESTAMP
+    )
+    assert logs[0]["food"] == {"name": "tea", "calories": 30.0, "protein": 1.0, "fat": 1.0, "per_100g": True}
+    assert logs[0]["timestamp"] == TIMESTAMP and results[0]["log"]["source"] == "cache"
+
+
+if __name__ == "__main__":
+    test_items_are_written_in_one_batch_with_day_totals()
+    test_totals_accumulate_across_batches()
+    test_unresolved_items_are_reported_and_the_rest_logged()
+    test_nothing_is_written_when_no_item_resolves()
+    test_partial_macros_are_resolved_rather_than_stored()
+    print("All food log batch tests passed")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Unit tests for recent/popular food autocomplete (no Firebase required).
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.food_suggestions import FoodSuggestions, FoodTrie, suggestion_from_log, POPULARITY_COLLECTION
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def order_by(self, field, direction=None):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def stream(self):
+        return [FakeSnapshot(data) for data in self.db.data.get(self.name, {}).values()]
+
+    def document(self, doc_id):
+        return (self.name, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+
+    def set(self, ref, data, merge=False):
+        self.db.writes.append((ref, data))
+
+    def commit(self):
+        self.db.commits += 1
+
+
+class FakeDB:
+    def __init__(self, data=None):
+        self.data = data or {}
+        self.writes = []
+        self.commits = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def _entry(name, count, logged_at="2026-03-01"):
+    return {"name": name, "normalizedName": name.lower(), "servingSize": "1", "calories": 100, "count": count, "lastLoggedAt": logged_at}
+
+
+def _log(name, serving="1", calories=120):
+    return {"food": {"name": name, "calories": calories, "protein": 4, "fat": 2, "per_100g": False},
+            "servingSize": serving, "timestamp": datetime(2026, 3, 1, 9), "source": "client"}
+
+
+def test_trie_matches_any_word_start_ranked_by_count():
+    trie = FoodTrie()
+    trie.upsert(_entry("paneer butter masala", 2))
+    trie.upsert(_entry("butter chicken", 5))
+    trie.upsert(_entry("banana", 9))
+    names = [entry["name"] for entry in trie.search("but")]
+    assert names == ["butter chicken", "paneer butter masala"]
+    assert trie.search("xyz") == []
+
+
+def test_trie_ties_break_on_recency():
+    trie = FoodTrie()
+    trie.upsert(_entry("dal tadka", 3, "2026-03-01"))
+    trie.upsert(_entry("dal makhani", 3, "2026-03-05"))
+    assert trie.search("dal")[0]["name"] == "dal makhani"
+
+
+def test_suggestion_from_log_keeps_macros_and_serving():
+    entry = suggestion_from_log(_log(" Masala Dosa ", serving="2"))
+    assert entry["normalizedName"] == "masala dosa"
+    assert entry["servingSize"] == "2"
+    assert entry["calories"] == 120
+    assert suggestion_from_log({"food": {"name": "  "}}) is None
+
+
+def test_user_foods_rank_before_popular_foods():
+    suggestions = FoodSuggestions(db=None)
+    # Load both tries, then record logs the way the food log endpoints do after committing
+    suggestions.suggest("ro", "u1")
+    entries = suggestions.stage_food_logs(None, "u1", [_log("Roti with ghee"), _log("Roti with ghee")])
+    suggestions.record("u1", entries)
+    results = suggestions.suggest("ro", "u1")
+    assert results[0]["name"] == "Roti with ghee"
+    assert results[0]["scope"] == "recent"
+    assert results[0]["count"] == 2
+    assert any(result["scope"] == "popular" and result["normalizedName"] == "roti" for result in results)
+    # Other users only see it through the popularity table
+    assert suggestions.suggest("roti w", "u2")[0]["scope"] == "popular"
+
+
+def test_stored_popularity_survives_seeding():
+    roti = {**_entry("roti", 57), "normalizedName": "roti"}
+    suggestions = FoodSuggestions(FakeDB({POPULARITY_COLLECTION: {"r": roti}}))
+    results = suggestions.suggest("roti")
+    # The bundled roti entry is seeded with count 0; the stored count must win
+    assert results[0]["normalizedName"] == "roti" and results[0]["count"] == 57
+
+
+def test_popularity_increments_are_batched():
+    db = FakeDB()
+    suggestions = FoodSuggestions(db, flush_seconds=3600)
+    for _ in range(3):
+        suggestions.record("u1", suggestions.stage_food_logs(FakeBatch(db), "u1", [_log("Poha"), _log("Upma")]))
+    # Only the users' recent_foods go into the food log batches
+    assert all(ref[0] != POPULARITY_COLLECTION for ref, _ in db.writes)
+    db.writes.clear()
+    assert suggestions.flush_popularity() == 2
+    assert db.commits == 1 and len(db.writes) == 2
+    assert {data["name"]: data["count"].value for _, data in db.writes} == {"Poha": 3, "Upma": 3}
+    assert suggestions.flush_popularity() == 0 and suggestions.stats()["popularity_writes"] == 2
+
+
+if __name__ == "__main__":
+    test_trie_matches_any_word_start_ranked_by_count()
+    test_trie_ties_break_on_recency()
+    test_suggestion_from_log_keeps_macros_and_serving()
+    test_user_foods_rank_before_popular_foods()
+    test_stored_popularity_survives_seeding()
+    test_popularity_increments_are_batched()
+    print("All food suggestion tests passed")
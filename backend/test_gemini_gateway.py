@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Gemini gateway (no Gemini API key required).
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from google.api_core import exceptions as google_exceptions
+
+from services.gemini_gateway import CircuitBreaker, GeminiGateway, GeminiTimeoutError, GeminiUnavailableError
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stands in for GenerativeModel; replies from a script of results/exceptions."""
+
+    def __init__(self, script=None, delay=0.0):
+        self.script = list(script or [])
+        self.delay = delay
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        outcome = self.script.pop(0) if self.script else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+class FakeUsage:
+    prompt_token_count = 12
+    candidates_token_count = 7
+    total_token_count = 19
+
+
+class FakeStream:
+    def __init__(self, texts):
+        self.texts = texts
+        self.usage_metadata = FakeUsage()
+
+    def __iter__(self):
+        return iter(FakeResponse(text) for text in self.texts)
+
+
+class FakeChatModel:
+    def __init__(self, texts):
+        self.texts = texts
+
+    def start_chat(self, history):
+        return self
+
+    def send_message(self, message, stream=False):
+        return FakeStream(self.texts)
+
+
+def _gateway(model, **kwargs):
+    kwargs.setdefault("backoff_base", 0.0)
+    return GeminiGateway(model_factory=lambda name: model, **kwargs)
+
+
+def test_models_are_reused():
+    created = []
+    gateway = GeminiGateway(model_factory=lambda name: created.append(name) or FakeModel())
+    assert gateway.model("m") is gateway.model("m")
+    assert created == ["m"]
+
+
+def test_transient_errors_are_retried():
+    model = FakeModel([google_exceptions.ServiceUnavailable("down"), "250, 10, 5"])
+    gateway = _gateway(model, max_attempts=2)
+    assert asyncio.run(gateway.generate("nutrition", "prompt")) == "250, 10, 5"
+    stats = gateway.stats()["prompt_types"]["nutrition"]
+    assert model.calls == 2
+    assert stats["retries"] == 1 and stats["successes"] == 1
+
+
+def test_non_transient_errors_are_not_retried():
+    model = FakeModel([ValueError("blocked")])
+    gateway = _gateway(model, max_attempts=3)
+    try:
+        asyncio.run(gateway.generate("chatbot", "prompt"))
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert model.calls == 1
+    assert gateway.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_timeout_uses_prompt_type_budget():
+    gateway = _gateway(FakeModel(delay=0.3), timeouts={"workout": 0.05})
+    try:
+        asyncio.run(gateway.generate("workout", "prompt"))
+        assert False, "expected GeminiTimeoutError"
+    except asyncio.TimeoutError as e:
+        assert isinstance(e, GeminiTimeoutError)
+    assert gateway.stats()["prompt_types"]["workout"]["timeouts"] == 1
+
+
+def test_breaker_opens_and_fails_fast():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    model = FakeModel([google_exceptions.ServiceUnavailable("down")] * 2)
+    gateway = _gateway(model, max_attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        try:
+            asyncio.run(gateway.generate("nutrition", "prompt"))
+        except google_exceptions.ServiceUnavailable:
+            pass
+    assert breaker.state == CircuitBreaker.OPEN
+    try:
+        asyncio.run(gateway.generate("nutrition", "prompt"))
+        assert False, "expected GeminiUnavailableError"
+    except GeminiUnavailableError:
+        pass
+    assert model.calls == 2
+
+    # After the reset period one probe goes through and closes the breaker
+    now[0] = 11
+    assert asyncio.run(gateway.generate("nutrition", "prompt")) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_full_pool_rejects_instead_of_queueing():
+    gateway = _gateway(FakeModel(delay=0.2), max_workers=1, max_pending=1)
+
+    async def run():
+        return await asyncio.gather(gateway.generate("nutrition", "a"), gateway.generate("nutrition", "b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[0] == "ok"
+    assert isinstance(results[1], GeminiUnavailableError)
+    assert gateway.stats()["prompt_types"]["nutrition"]["rejected"] == 1
+
+
+def test_stream_yields_chunks_and_usage():
+    gateway = _gateway(FakeChatModel(["Eat ", "more ", "greens."]))
+    usage = {}
+
+    async def run():
+        return [text async for text in gateway.stream_chat_message("chatbot_stream", [], "hi", usage=usage)]
+
+    assert asyncio.run(run()) == ["Eat ", "more ", "greens."]
+    assert usage == {"prompt_tokens": 12, "response_tokens": 7, "total_tokens": 19}
+    stats = gateway.stats()["prompt_types"]["chatbot_stream"]
+    assert stats["successes"] == 1 and "first_chunk_p50_seconds" in stats
+
+
+def _half_open_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 11
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+
+def test_cancelled_probe_releases_the_breaker():
+    breaker = _half_open_breaker()
+    gateway = _gateway(FakeModel(delay=0.3), breaker=breaker)
+
+    async def run():
+        # As the request timeout middleware does when a request runs too long
+        await asyncio.wait_for(gateway.generate("nutrition", "prompt"), timeout=0.05)
+
+    try:
+        asyncio.run(run())
+        assert False, "expected TimeoutError"
+    except asyncio.TimeoutError as e:
+        assert not isinstance(e, GeminiTimeoutError)
+    # The probe said nothing about upstream health, so the next call may probe again
+    assert breaker.allow()
+
+
+def test_stream_disconnect_during_probe_releases_the_breaker():
+    breaker = _half_open_breaker()
+    gateway = _gateway(FakeChatModel(["Eat ", "more ", "greens."]), breaker=breaker)
+
+    async def run():
+        stream = gateway.stream_chat_message("chatbot_stream", [], "hi")
+        first = await stream.__anext__()
+        # The client disconnects after the first chunk
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(run()) == "Eat "
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+if __name__ == "__main__":
+    test_models_are_reused()
+    test_transient_errors_are_retried()
+    test_non_transient_errors_are_not_retried()
+    test_timeout_uses_prompt_type_budget()
+    test_breaker_opens_and_fails_fast()
+    test_full_pool_rejects_instead_of_queueing()
+    test_stream_yields_chunks_and_usage()
+    test_cancelled_probe_releases_the_breaker()
+    test_stream_disconnect_during_probe_releases_the_breaker()
+    print("All Gemini gateway tests passed")
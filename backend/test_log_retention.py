@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the scheduled food/workout log retention job (no Firebase required).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.log_retention import LogRetentionJob
+
+
+class _FakeDoc:
+    def __init__(self, store, doc_id):
+        self.reference = (store, doc_id)
+
+
+class _FakeQuery:
+    """Matches every remaining document of a store; supports select/limit/stream."""
+
+    def __init__(self, store, limit=None):
+        self.store = store
+        self._limit = limit
+
+    def where(self, *args):
+        return self
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        return _FakeQuery(self.store, count)
+
+    def stream(self):
+        ids = sorted(self.store)[: self._limit]
+        return iter([_FakeDoc(self.store, doc_id) for doc_id in ids])
+
+
+class _FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.deletes = []
+
+    def delete(self, reference):
+        self.deletes.append(reference)
+
+    def commit(self):
+        self.db.commits.append(len(self.deletes))
+        for store, doc_id in self.deletes:
+            store.discard(doc_id)
+
+
+class _FakeDB:
+    def __init__(self, food_logs, workout_logs):
+        self.food_logs = set(f"f{i}" for i in range(food_logs))
+        self.workout_logs = set(f"w{i}" for i in range(workout_logs))
+        self.commits = []
+
+    def collection_group(self, name):
+        return _FakeQuery(self.food_logs)
+
+    def collection(self, name):
+        return _FakeQuery(self.workout_logs)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+def test_deletes_in_batches_of_at_most_500():
+    db = _FakeDB(food_logs=1200, workout_logs=3)
+    metrics = LogRetentionJob(db, retention_days=7).run()
+    assert metrics["food_logs_deleted"] == 1200
+    assert metrics["workout_logs_deleted"] == 3
+    assert max(db.commits) == 500
+    assert metrics["batches"] == len(db.commits) == 4
+    assert not db.food_logs and not db.workout_logs
+
+
+def test_run_metrics_are_recorded():
+    job = LogRetentionJob(_FakeDB(food_logs=2, workout_logs=0), retention_days=30, batch_size=1)
+    job.run()
+    stats = job.stats()
+    assert stats["totals"]["runs"] == 1
+    assert stats["totals"]["food_logs_deleted"] == 2
+    assert stats["recent_runs"][0]["retention_days"] == 30
+    assert stats["recent_runs"][0]["batches"] == 2
+
+
+def test_missing_database_is_reported_not_raised():
+    metrics = LogRetentionJob(None).run()
+    assert metrics["errors"] == ["Firestore is not available"]
+    assert metrics["food_logs_deleted"] == 0
+
+
+if __name__ == "__main__":
+    test_deletes_in_batches_of_at_most_500()
+    test_run_metrics_are_recorded()
+    test_missing_database_is_reported_not_raised()
+    print("All log retention tests passed")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the notification outbox on its SQLite store (no Firebase required).
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.notification_outbox import (
+    NotificationOutbox, SQLiteOutboxStore, STATUS_FAILED, STATUS_PENDING, STATUS_SENT,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeGateway:
+    """Answers each message with the next scripted ticket for its token (ok by default)."""
+
+    timeout = 1
+    max_attempts = 1
+
+    def __init__(self, scripts=None):
+        self.scripts = scripts or {}
+        self.submits = []
+
+    def submit(self, messages):
+        self.submits.append(messages)
+        futures = []
+        for message in messages:
+            script = self.scripts.get(message["to"])
+            error = script.pop(0) if script else None
+            future = Future()
+            future.set_result({"status": "error", "message": error, "details": {"error": error}} if error
+                              else {"status": "ok", "id": f"ticket-{message['to']}"})
+            futures.append(future)
+        return futures
+
+
+TOKENS = {"user1": "ExponentPushToken[user1]", "user2": "ExponentPushToken[user2]", "dietician": "ExponentPushToken[diet]"}
+
+
+def make_outbox(gateway=None, clock=None, path=None, **kwargs):
+    path = path or os.path.join(tempfile.mkdtemp(), "outbox.db")
+    outbox = NotificationOutbox(SQLiteOutboxStore(path), TOKENS.get, gateway=gateway or FakeGateway(),
+                                clock=clock or FakeClock(), backoff_base=10, **kwargs)
+    return outbox, path
+
+
+def test_queued_notifications_are_delivered_in_one_batch():
+    gateway = FakeGateway()
+    outbox, _ = make_outbox(gateway)
+    ids = [outbox.enqueue(user, "Hi", "New diet", {"type": "new_diet"}) for user in ("user1", "user2", "dietician")]
+    assert outbox.run_once() == 3
+    assert len(gateway.submits) == 1 and [m["to"] for m in gateway.submits[0]] == [TOKENS[u] for u in ("user1", "user2", "dietician")]
+    for record_id in ids:
+        record = outbox.store.get(record_id)
+        assert record["status"] == STATUS_SENT and record["attempts"] == 1 and record["ticket"]["status"] == "ok"
+    assert outbox.run_once() == 0
+    stats = outbox.stats()
+    assert stats["sent"] == 3 and stats["backlog"] == 0
+
+
+def test_transient_errors_back_off_then_fail():
+    clock = FakeClock()
+    gateway = FakeGateway({TOKENS["user1"]: ["MessageRateExceeded"] * 3})
+    outbox, _ = make_outbox(gateway, clock, max_attempts=3)
+    record_id = outbox.enqueue("user1", "Hi", "There")
+    assert outbox.run_once() == 1
+    record = outbox.store.get(record_id)
+    assert record["status"] == STATUS_PENDING and 1005 <= record["availableAt"] <= 1010
+    # Not due again until its backoff has passed
+    assert outbox.run_once() == 0
+    clock.now += 10
+    assert outbox.run_once() == 1
+    clock.now += 20
+    assert outbox.run_once() == 1
+    record = outbox.store.get(record_id)
+    assert record["status"] == STATUS_FAILED and record["attempts"] == 3 and record["lastError"].startswith("MessageRateExceeded")
+    assert outbox.stats()["retried"] == 2
+
+
+def test_permanent_errors_and_missing_tokens_fail_at_once():
+    gateway = FakeGateway({TOKENS["user2"]: ["DeviceNotRegistered"]})
+    outbox, _ = make_outbox(gateway)
+    no_token = outbox.enqueue("unknown", "Hi", "There")
+    unregistered = outbox.enqueue("user2", "Hi", "There")
+    outbox.run_once()
+    assert outbox.store.get(no_token)["status"] == STATUS_FAILED
+    assert outbox.store.get(unregistered)["status"] == STATUS_FAILED
+    assert outbox.stats()["errors"] == {"NoToken": 1, "DeviceNotRegistered": 1}
+
+
+def test_records_survive_a_crash_and_expired_leases_are_reclaimed():
+    clock = FakeClock()
+    outbox, path = make_outbox(clock=clock, lease_seconds=60)
+    record_id = outbox.enqueue("user1", "Hi", "There")
+    # A worker claims the record and dies before recording the outcome
+    assert len(outbox.store.claim("crashed-worker", 10, 60, clock())) == 1
+    restarted, _ = make_outbox(clock=clock, path=path, lease_seconds=60)
+    assert restarted.run_once() == 0
+    clock.now += 61
+    assert restarted.run_once() == 1
+    record = restarted.store.get(record_id)
+    assert record["status"] == STATUS_SENT and record["attempts"] == 2
+
+
+def test_keyed_notifications_are_queued_once():
+    outbox, _ = make_outbox()
+    assert outbox.enqueue("dietician", "Diet Expiring Soon", "1 day left", key="diet_countdown_user1_abc") == "diet_countdown_user1_abc"
+    assert outbox.enqueue("dietician", "Diet Expiring Soon", "1 day left", key="diet_countdown_user1_abc") is None
+    assert outbox.run_once() == 1 and outbox.stats()["duplicates"] == 1
+
+
+def test_workers_deliver_in_the_background():
+    outbox, _ = make_outbox(clock=time.time, poll_seconds=0.05)
+    outbox.start()
+    try:
+        record_id = outbox.enqueue("user1", "Hi", "There")
+        deadline = time.time() + 5
+        while outbox.store.get(record_id)["status"] != STATUS_SENT and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        outbox.stop()
+    assert outbox.store.get(record_id)["status"] == STATUS_SENT
+    assert outbox.stats()["workers_running"] == 0
+
+
+if __name__ == "__main__":
+    test_queued_notifications_are_delivered_in_one_batch()
+    test_transient_errors_back_off_then_fail()
+    test_permanent_errors_and_missing_tokens_fail_at_once()
+    test_records_survive_a_crash_and_expired_leases_are_reclaimed()
+    test_keyed_notifications_are_queued_once()
+    test_workers_deliver_in_the_background()
+    print("All notification outbox tests passed")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the batched nutrition resolver (no Firebase required).
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.gemini_gateway import GeminiTimeoutError, GeminiUnavailableError
+from services.nutrition_batch import NutritionBatchResolver, parse_batch_replies, parse_nutrition_triplet
+from services.nutrition_cache import make_cache_key
+
+
+class FakeCache:
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    def get_local(self, food_name, quantity):
+        return self.entries.get(make_cache_key(food_name, quantity))
+
+    def get(self, food_name, quantity):
+        return None
+
+    def set(self, food_name, quantity, nutrition):
+        self.entries[make_cache_key(food_name, quantity)] = dict(nutrition)
+        return True
+
+
+class FakeGemini:
+    def __init__(self, reply=None, error=None):
+        self.reply, self.error = reply, error
+        self.calls = []
+
+    async def generate(self, prompt_type, prompt, timeout=None):
+        self.calls.append((prompt_type, prompt, timeout))
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def single_lookup_returning(nutrition, delay=0.0, calls=None):
+    async def lookup(food_name, quantity):
+        if calls is not None:
+            calls.append((food_name, quantity))
+        await asyncio.sleep(delay)
+        return dict(nutrition)
+    return lookup
+
+
+def test_triplet_parsing():
+    assert parse_nutrition_triplet("130, 2.7, 0.3") == (130.0, 2.7, 0.3)
+    assert parse_nutrition_triplet(" 52 ,0.3,  0.2 ") == (52.0, 0.3, 0.2)
+    for bad in ["Error", "130, 2.7", "130 kcal, 2.7g, 0.3g", ""]:
+        try:
+            parse_nutrition_triplet(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"expected ValueError for {bad!r}")
+
+
+def test_reply_lines_are_mapped_by_item_number():
+    replies = parse_batch_replies("Here you go\n2) 52, 0.3, 0.2\n1: 130, 2.7, 0.3\n 3 - Error\n")
+    assert replies == {1: "130, 2.7, 0.3", 2: "52, 0.3, 0.2", 3: "Error"}
+
+
+def test_batch_replies_reach_the_right_items():
+    # Out of order, one item missing, one unknown food, one unparseable line
+    gemini = FakeGemini("3: 52, 0.3, 0.2\n1: 130, 2.7, 0.3\n4: Error\n5: about 100 kcal")
+    cache = FakeCache({make_cache_key("dal", "1 bowl"): {"calories": 180, "protein": 9, "fat": 4}})
+    resolver = NutritionBatchResolver(gemini.generate, single_lookup_returning({}), cache=cache)
+    items = [("rice", "100 g"), ("dal", "1 bowl"), ("idli", "2"), ("apple", "1"), ("zzz", "1"), ("rice", "100g"), ("tea", "1 cup")]
+    results = asyncio.run(resolver.resolve(items))
+    assert len(gemini.calls) == 1
+    # Cache hits and duplicates are not sent to Gemini
+    prompt = gemini.calls[0][1]
+    assert "1. rice, 100 g" in prompt and "2. idli, 2" in prompt and "dal" not in prompt and "100g" not in prompt
+    assert results[0]["calories"] == 130.0 and results[5]["calories"] == 130.0
+    assert results[1]["source"] == "cache" and results[1]["calories"] == 180
+    # Item 2 (idli) has no reply line
+    assert results[2]["calories"] == "Error" and results[2]["raw"] is None
+    assert results[3]["calories"] == 52.0 and results[3]["source"] == "gemini"
+    assert results[4]["calories"] == "Error" and results[4]["raw"] == "Error"
+    assert results[6]["calories"] == "Error" and results[6]["raw"] == "about 100 kcal"
+    # Only parsed replies are cached
+    assert set(cache.entries) == {make_cache_key(*items[0]), make_cache_key(*items[1]), make_cache_key(*items[3])}
+
+
+def test_failed_batch_falls_back_to_single_lookups():
+    calls = []
+    gemini = FakeGemini(error=RuntimeError("bad response"))
+    resolver = NutritionBatchResolver(gemini.generate, single_lookup_returning({"calories": 95, "protein": 0.5, "fat": 0.3}, calls=calls))
+    results = asyncio.run(resolver.resolve([("apple", "1"), ("apple", "1"), ("banana", "1")]))
+    assert calls == [("apple", "1"), ("banana", "1")]
+    assert [result["calories"] for result in results] == [95, 95, 95]
+    assert all(result["source"] == "gemini" for result in results)
+
+
+def test_unavailable_gemini_does_not_fan_out():
+    calls = []
+    resolver = NutritionBatchResolver(FakeGemini(error=GeminiUnavailableError("breaker open")).generate,
+                                      single_lookup_returning({"calories": 1}, calls=calls))
+    results = asyncio.run(resolver.resolve([("apple", "1")]))
+    assert not calls and results[0]["calories"] == "Error"
+    unconfigured = NutritionBatchResolver(None, single_lookup_returning({"calories": 1}, calls=calls))
+    assert asyncio.run(unconfigured.resolve([("apple", "1")]))[0]["calories"] == "Error" and not calls
+
+
+def test_batch_and_fallback_stay_within_the_request_budget():
+    clock = FakeClock()
+    gemini = FakeGemini(error=GeminiTimeoutError("slow"))
+    resolver = NutritionBatchResolver(gemini.generate, single_lookup_returning({"calories": 95}, delay=0.5),
+                                      budget=27, batch_timeout=25, fallback_reserve=8, clock=clock)
+    asyncio.run(resolver.resolve([("apple", "1")]))
+    # The batch prompt leaves the reserve for single lookups
+    assert gemini.calls[0][2] == 19
+
+    # Single lookups get only what is left of the budget; unfinished ones become errors
+    async def slow_generate(prompt_type, prompt, timeout=None):
+        clock.now += 26.8
+        raise GeminiTimeoutError("slow")
+
+    resolver = NutritionBatchResolver(slow_generate, single_lookup_returning({"calories": 95}, delay=0.5),
+                                      budget=27, min_fallback=0.1, clock=clock)
+    results = asyncio.run(resolver.resolve([("apple", "1"), ("pear", "1")]))
+    assert [result["calories"] for result in results] == ["Error", "Error"]
+
+    # Too little time left: no single lookups at all
+    calls = []
+    resolver = NutritionBatchResolver(slow_generate, single_lookup_returning({"calories": 95}, calls=calls),
+                                      budget=27, clock=clock)
+    assert asyncio.run(resolver.resolve([("apple", "1")]))[0]["calories"] == "Error" and not calls
+
+
+if __name__ == "__main__":
+    test_triplet_parsing()
+    test_reply_lines_are_mapped_by_item_number()
+    test_batch_replies_reach_the_right_items()
+    test_failed_batch_falls_back_to_single_lookups()
+    test_unavailable_gemini_does_not_fan_out()
+    test_batch_and_fallback_stay_within_the_request_budget()
+    print("All nutrition batch tests passed")
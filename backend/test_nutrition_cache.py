@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the nutrition lookup cache (no Firebase required).
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.nutrition_cache import NutritionCache, make_cache_key, normalize_quantity
+
+
+def test_quantity_normalization():
+    """Equivalent serving sizes map to the same (amount, unit) pair."""
+    assert normalize_quantity("100g") == ("100", "g")
+    assert normalize_quantity("100 grams") == ("100", "g")
+    assert normalize_quantity(100) == ("100", "")
+    assert normalize_quantity("100.0") == ("100", "")
+    assert normalize_quantity("2 Slices") == ("2", "slice")
+    assert normalize_quantity("1/2 cup") == ("0.5", "cup")
+
+
+def test_food_name_normalization():
+    """Case, surrounding whitespace and punctuation do not change the key."""
+    assert make_cache_key("  Roti ", "1") == make_cache_key("roti", "1")
+    assert make_cache_key("Dal, Tadka", "1 bowl") == make_cache_key("dal tadka", "1 bowls")
+
+
+def test_memory_hit_and_miss_counters():
+    cache = NutritionCache(db=None, max_entries=10, ttl_seconds=60)
+    assert cache.get("rice", "100g") is None
+    cache.set("rice", "100g", {"calories": 130, "protein": 2.7, "fat": 0.3, "raw": "130, 2.7, 0.3"})
+    result = cache.get("Rice", "100 grams")
+    assert result == {"calories": 130.0, "protein": 2.7, "fat": 0.3, "raw": "130, 2.7, 0.3"}
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["stores"] == 1
+
+
+def test_error_results_are_not_cached():
+    cache = NutritionCache(db=None, max_entries=10, ttl_seconds=60)
+    stored = cache.set("xyz", "1", {"calories": "Error", "protein": "Error", "fat": "Error"})
+    assert stored is False
+    assert cache.get_local("xyz", "1") is None
+
+
+def test_lru_eviction():
+    cache = NutritionCache(db=None, max_entries=2, ttl_seconds=60)
+    cache.set("a", "1", {"calories": 1, "protein": 1, "fat": 1})
+    cache.set("b", "1", {"calories": 2, "protein": 2, "fat": 2})
+    cache.get_local("a", "1")  # "a" is now most recently used
+    cache.set("c", "1", {"calories": 3, "protein": 3, "fat": 3})
+    assert cache.get_local("b", "1") is None
+    assert cache.get_local("a", "1") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    cache = NutritionCache(db=None, max_entries=10, ttl_seconds=0)
+    cache.set("egg", "1", {"calories": 70, "protein": 6, "fat": 5})
+    time.sleep(0.01)
+    assert cache.get_local("egg", "1") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_purge_by_food_name():
+    cache = NutritionCache(db=None, max_entries=10, ttl_seconds=60)
+    cache.set("milk", "1 glass", {"calories": 120, "protein": 6, "fat": 5})
+    cache.set("milk", "100ml", {"calories": 50, "protein": 3, "fat": 2})
+    cache.set("egg", "1", {"calories": 70, "protein": 6, "fat": 5})
+    assert cache.purge("Milk") == 2
+    assert cache.stats()["memory_entries"] == 1
+    assert cache.purge() == 1
+    assert cache.stats()["memory_entries"] == 0
+
+
+if __name__ == "__main__":
+    test_quantity_normalization()
+    test_food_name_normalization()
+    test_memory_hit_and_miss_counters()
+    test_error_results_are_not_cached()
+    test_lru_eviction()
+    test_ttl_expiry()
+    test_purge_by_food_name()
+    print("All nutrition cache tests passed")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Unit tests for daily nutrition rollup aggregation (no Firebase required).
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.nutrition_rollups import aggregate_logs, day_range, food_log_contribution, food_log_day
+
+
+def test_per_100g_logs_scale_by_serving_size():
+    log = {"food": {"calories": 200, "protein": 10, "fat": 4, "per_100g": True}, "servingSize": "150"}
+    assert food_log_contribution(log) == {"calories": 300.0, "protein": 15.0, "fat": 6.0}
+
+
+def test_non_numeric_serving_size_counts_as_100g():
+    log = {"food": {"calories": 200, "protein": 10, "fat": 4, "per_100g": True}, "servingSize": "2 slices"}
+    assert food_log_contribution(log)["calories"] == 200.0
+
+
+def test_total_serving_logs_are_used_as_is():
+    log = {"food": {"calories": 250, "protein": 8, "fat": 9, "per_100g": False}, "servingSize": "1 bowl"}
+    assert food_log_contribution(log) == {"calories": 250.0, "protein": 8.0, "fat": 9.0}
+
+
+def test_log_day_accepts_datetimes_and_iso_strings():
+    assert food_log_day({"timestamp": datetime(2026, 3, 1, 23, 59)}) == "2026-03-01"
+    assert food_log_day({"timestamp": "2026-03-02T08:00:00"}) == "2026-03-02"
+    assert food_log_day({"timestamp": None}) is None
+
+
+def test_aggregate_logs_groups_food_and_workouts_by_day():
+    food_logs = [
+        {"food": {"calories": 100, "protein": 5, "fat": 1, "per_100g": False}, "timestamp": datetime(2026, 3, 1, 9)},
+        {"food": {"calories": 50, "protein": 2, "fat": 1, "per_100g": False}, "timestamp": datetime(2026, 3, 1, 20)},
+        {"food": {"calories": 80, "protein": 3, "fat": 2, "per_100g": False}, "timestamp": datetime(2026, 3, 2, 9)},
+        {"food": {"calories": 999}, "timestamp": "not a date"},
+    ]
+    workout_logs = [{"calories": 120, "date": "2026-03-02T18:00:00"}]
+    rollups = aggregate_logs(food_logs, workout_logs)
+    assert set(rollups) == {"2026-03-01", "2026-03-02"}
+    assert rollups["2026-03-01"]["calories"] == 150.0
+    assert rollups["2026-03-01"]["items"] == 2
+    assert rollups["2026-03-02"]["burned"] == 120.0
+    assert rollups["2026-03-02"]["workouts"] == 1
+
+
+def test_aggregate_logs_consumes_streams_once():
+    consumed = []
+
+    def stream():
+        for hour in (8, 13):
+            consumed.append(hour)
+            yield {"food": {"calories": 10, "protein": 1, "fat": 1, "per_100g": False}, "timestamp": datetime(2026, 3, 1, hour)}
+
+    rollups = aggregate_logs(stream(), iter(()))
+    assert consumed == [8, 13]
+    assert rollups["2026-03-01"]["calories"] == 20.0
+
+
+def test_day_range_is_most_recent_first():
+    assert day_range(datetime(2026, 3, 2), 3) == ["2026-03-02", "2026-03-01", "2026-02-28"]
+
+
+if __name__ == "__main__":
+    test_per_100g_logs_scale_by_serving_size()
+    test_non_numeric_serving_size_counts_as_100g()
+    test_total_serving_logs_are_used_as_is()
+    test_log_day_accepts_datetimes_and_iso_strings()
+    test_aggregate_logs_groups_food_and_workouts_by_day()
+    test_aggregate_logs_consumes_streams_once()
+    test_day_range_is_most_recent_first()
+    print("All nutrition rollup tests passed")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the adaptive PDF extraction engine (no Firebase required).
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pdfplumber
+
+from services.diet_notification_service import diet_notification_service
+from services.pdf_extraction import extract_pdf_text, merge_reports, score_page_text, ESCALATION_THRESHOLD
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FREE TRIAL DIET.pdf")
+
+
+def _notifications(text):
+    return sorted((n["time"], n.get("trialDay"), tuple(n.get("selectedDays") or []), n["message"])
+                  for n in diet_notification_service.create_notifications_from_text(text))
+
+
+def test_score_flags_pages_the_parser_would_misread():
+    clean = "DAY 1\n7:00 AM - 1 glass warm water\n8:30AM- poha with sprouts\n1 PM- dal and rice"
+    assert score_page_text(clean) == 1.0
+    assert score_page_text("") == 0.0
+    # A time split by the fast engine would become a wrong notification
+    assert score_page_text(clean.replace("7:00 AM", "7:0 0 AM")) < ESCALATION_THRESHOLD
+    # Lost line breaks put several meals on one line
+    assert score_page_text(clean.replace("\n", " ")) < ESCALATION_THRESHOLD
+    # Words split by the fast engine would show up in reminder messages
+    assert score_page_text(clean.replace("poha", "po ha")) < ESCALATION_THRESHOLD
+    assert score_page_text(clean.replace("warm water", "warm -water")) < ESCALATION_THRESHOLD
+    assert score_page_text(clean.replace("dal and rice", "dal and rice, 100 g curd or 1 kg")) == 1.0
+    # Notes pages without times or days are not escalated
+    assert score_page_text("Drink plenty of water and avoid fried food through the day.") >= ESCALATION_THRESHOLD
+
+
+def test_fast_path_escalates_only_bad_pages():
+    with open(SAMPLE_PDF, "rb") as f:
+        pdf_bytes = f.read()
+    report = extract_pdf_text(pdf_bytes)
+    assert report["page_count"] == len(report["pages"])
+    assert 0 < report["escalated_pages"] < report["page_count"]
+    assert {page["engine"] for page in report["pages"]} <= {"pypdf2", "pdfplumber"}
+    assert report["seconds"] > 0
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        layout_text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+    # Same reminders (times, days and messages) as a full pdfplumber pass
+    assert _notifications(report["text"]) == _notifications(layout_text)
+
+
+def test_page_ranges_merge_to_whole_document():
+    with open(SAMPLE_PDF, "rb") as f:
+        pdf_bytes = f.read()
+    whole = extract_pdf_text(pdf_bytes)
+    merged = merge_reports([extract_pdf_text(pdf_bytes, [0, 1]), extract_pdf_text(pdf_bytes, [2, 3])], 0.1)
+    assert merged["text"] == whole["text"]
+    assert [page["page"] for page in merged["pages"]] == [0, 1, 2, 3]
+    assert merged["escalated_pages"] == whole["escalated_pages"]
+
+
+if __name__ == "__main__":
+    test_score_flags_pages_the_parser_would_misread()
+    test_fast_path_escalates_only_bad_pages()
+    test_page_ranges_merge_to_whole_document()
+    print("All PDF extraction tests passed")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the content-hash PDF text cache (no Firebase required).
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.pdf_text_cache import PDFTextCache, content_key
+from services.pdf_rag_service import PDFRAGService
+
+
+def test_memory_tier_is_capped_by_bytes():
+    cache = PDFTextCache(max_bytes=10, disk_dir=None)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.get("a")  # a is now most recently used
+    cache.set("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345" and cache.get("c") == "12345"
+    stats = cache.stats()
+    assert stats["bytes"] == 10 and stats["evictions"] == 1
+    # Entries larger than the whole tier are not kept in memory
+    cache.set("big", "x" * 11)
+    assert cache.stats()["entries"] == 2
+
+
+def test_disk_tier_is_shared_between_instances():
+    with tempfile.TemporaryDirectory() as disk_dir:
+        writer = PDFTextCache(max_bytes=1000, disk_dir=disk_dir)
+        writer.set(content_key(b"pdf"), "diet text")
+        reader = PDFTextCache(max_bytes=1000, disk_dir=disk_dir)
+        assert reader.get(content_key(b"pdf")) == "diet text"
+        assert reader.get(content_key(b"pdf")) == "diet text"
+        stats = reader.stats()
+        assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1 and stats["disk_entries"] == 1
+
+
+def test_disk_tier_prunes_oldest_entries():
+    with tempfile.TemporaryDirectory() as disk_dir:
+        cache = PDFTextCache(max_bytes=1000, disk_dir=disk_dir, disk_max_bytes=10)
+        for key in ("k1", "k2", "k3"):
+            cache.set(key, "12345")
+        assert cache.prune_disk() == 1
+        assert cache.stats()["disk_bytes"] <= 10
+
+
+def test_identical_pdfs_are_parsed_once():
+    service = PDFRAGService()
+    service.text_cache = PDFTextCache(max_bytes=1000, disk_dir=None)
+    parses = []
+    service._parse_pdf_bytes = lambda pdf_bytes: parses.append(pdf_bytes) or "DAY 1\n8 AM- poha"
+    assert service.extract_text_from_pdf_bytes(b"%PDF free trial") == "DAY 1\n8 AM- poha"
+    assert service.extract_text_from_pdf_bytes(b"%PDF free trial") == "DAY 1\n8 AM- poha"
+    assert len(parses) == 1
+    assert service.text_cache.stats()["hit_rate"] == 0.5
+
+
+if __name__ == "__main__":
+    test_memory_tier_is_capped_by_bytes()
+    test_disk_tier_is_shared_between_instances()
+    test_disk_tier_prunes_oldest_entries()
+    test_identical_pdfs_are_parsed_once()
+    print("All PDF text cache tests passed")
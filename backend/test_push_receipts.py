@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Unit tests for Expo push receipt polling against a local stand-in Expo server (no Firebase required).
+"""
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from firebase_admin import firestore
+
+from services.push_receipts import PushReceiptTracker, TICKETS_COLLECTION
+
+
+class FakeExpoReceipts:
+    """Answers getReceipts from a ticket id -> receipt map; unknown ids are not ready yet."""
+
+    def __init__(self, receipts, status=200):
+        self.receipts = receipts
+        self.status = status
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                ids = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["ids"]
+                fake.requests.append(ids)
+                body = json.dumps({"data": {i: fake.receipts[i] for i in ids if i in fake.receipts}}).encode()
+                self.send_response(fake.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/push/getReceipts"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeDocument:
+    def __init__(self, db, doc_id):
+        self.db, self.id, self.reference = db, doc_id, self
+
+    def to_dict(self):
+        return dict(self.db.profiles[self.id])
+
+    def update(self, fields):
+        profile = self.db.profiles[self.id]
+        for field, value in fields.items():
+            if value is firestore.DELETE_FIELD:
+                profile.pop(field, None)
+            else:
+                profile[field] = value
+
+
+class FakeQuery:
+    def __init__(self, db, field, value):
+        self.db, self.field, self.value = db, field, value
+
+    def stream(self):
+        return [FakeDocument(self.db, doc_id) for doc_id, data in self.db.profiles.items() if data.get(self.field) == self.value]
+
+
+class FakeTicket:
+    def __init__(self, tickets, doc_id):
+        self.tickets, self.id = tickets, doc_id
+
+    def to_dict(self):
+        return dict(self.tickets[self.id])
+
+
+class FakeTickets:
+    def __init__(self, db):
+        self.db = db
+
+    def document(self, doc_id):
+        return doc_id
+
+    def stream(self):
+        return [FakeTicket(self.db.tickets, doc_id) for doc_id in list(self.db.tickets)]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, doc_id, data):
+        self.ops.append((doc_id, data))
+
+    def delete(self, doc_id):
+        self.ops.append((doc_id, None))
+
+    def commit(self):
+        if self.db.fail_commits:
+            raise RuntimeError("firestore unavailable")
+        for doc_id, data in self.ops:
+            if data is None:
+                self.db.tickets.pop(doc_id, None)
+            else:
+                self.db.tickets[doc_id] = dict(data)
+
+
+class FakeDB:
+    def __init__(self, profiles, tickets=None):
+        self.profiles = profiles
+        self.tickets = tickets if tickets is not None else {}
+        self.fail_commits = False
+
+    def collection(self, name):
+        return FakeTickets(self) if name == TICKETS_COLLECTION else self
+
+    def where(self, field, op, value):
+        return FakeQuery(self, field, value)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def ok(ticket_id):
+    return {"status": "ok", "id": ticket_id}
+
+
+def error(name):
+    return {"status": "error", "message": name, "details": {"error": name}}
+
+
+def test_receipts_are_polled_in_batches_and_dead_tokens_cleared():
+    db = FakeDB({"user1": {"expoPushToken": "ExponentPushToken[a]"}, "user2": {"expoPushToken": "ExponentPushToken[b]"}})
+    expo = FakeExpoReceipts({"t1": {"status": "ok"}, "t2": error("DeviceNotRegistered"), "t3": {"status": "ok"}})
+    clock = FakeClock()
+    tracker = PushReceiptTracker(db, url=expo.url, batch_size=2, receipt_delay=900, clock=clock)
+    try:
+        for ticket_id, token in (("t1", "ExponentPushToken[a]"), ("t2", "ExponentPushToken[b]"), ("t3", "ExponentPushToken[a]")):
+            tracker.record({"to": token}, ok(ticket_id))
+        # Receipts are not asked for until they can be ready
+        assert tracker.run()["requests"] == 0
+        clock.now += 900
+        metrics = tracker.run()
+    finally:
+        expo.stop()
+    assert expo.requests == [["t1", "t2"], ["t3"]]
+    assert metrics["receipts_ok"] == 2 and metrics["receipts_error"] == 1 and metrics["tokens_cleared"] == 1
+    assert "expoPushToken" not in db.profiles["user2"] and db.profiles["user2"]["pushTokenError"]["error"] == "DeviceNotRegistered"
+    assert db.profiles["user1"]["expoPushToken"] == "ExponentPushToken[a]"
+    stats = tracker.stats()
+    assert stats["pending_receipts"] == 0 and stats["receipt_success_rate"] == round(2 / 3, 4)
+
+
+def test_unready_receipts_are_retried_then_expire():
+    expo = FakeExpoReceipts({})
+    clock = FakeClock()
+    tracker = PushReceiptTracker(FakeDB({}), url=expo.url, receipt_delay=900, max_age=3600, clock=clock)
+    try:
+        tracker.record({"to": "ExponentPushToken[a]"}, ok("t1"))
+        clock.now += 900
+        assert tracker.run()["not_ready"] == 1
+        clock.now += 2700
+        assert tracker.run()["expired"] == 1
+    finally:
+        expo.stop()
+    assert tracker.stats()["pending_receipts"] == 0 and len(expo.requests) == 2
+
+
+def test_ticket_errors_are_handled_without_receipts():
+    db = FakeDB({"user1": {"notificationToken": "ExponentPushToken[gone]"}, "user2": {"expoPushToken": "ExponentPushToken[creds]"}})
+    tracker = PushReceiptTracker(db, url="http://127.0.0.1:9/unused", clock=FakeClock())
+    tracker.record({"to": "ExponentPushToken[gone]"}, error("DeviceNotRegistered"))
+    tracker.record({"to": "ExponentPushToken[creds]"}, error("InvalidCredentials"))
+    tracker.record({"to": "ExponentPushToken[busy]"}, error("MessageRateExceeded"))
+    metrics = tracker.run()
+    assert metrics["tokens_cleared"] == 1 and metrics["tokens_flagged"] == 1 and metrics["requests"] == 0
+    assert "notificationToken" not in db.profiles["user1"]
+    # Bad credentials are ours, so the device token is kept and only flagged
+    assert db.profiles["user2"]["expoPushToken"] == "ExponentPushToken[creds]"
+    assert db.profiles["user2"]["pushTokenError"]["error"] == "InvalidCredentials"
+    assert tracker.stats()["ticket_success_rate"] == 0.0
+
+
+def test_failed_fetch_keeps_tickets_pending():
+    expo = FakeExpoReceipts({"t1": {"status": "ok"}}, status=503)
+    clock = FakeClock()
+    tracker = PushReceiptTracker(FakeDB({}), url=expo.url, receipt_delay=0, clock=clock)
+    try:
+        tracker.record({"to": "ExponentPushToken[a]"}, ok("t1"))
+        assert len(tracker.run()["errors"]) == 1
+        expo.status = 200
+        assert tracker.run()["receipts_ok"] == 1
+    finally:
+        expo.stop()
+    assert tracker.stats()["delivery_success_rate"] == 1.0
+
+
+def test_pending_tickets_survive_a_restart():
+    db = FakeDB({"user1": {"expoPushToken": "ExponentPushToken[a]"}})
+    clock = FakeClock()
+    tracker = PushReceiptTracker(db, url="http://127.0.0.1:9/unused", receipt_delay=900, clock=clock)
+    tracker.record({"to": "ExponentPushToken[a]"}, ok("t1"))
+    tracker.record({"to": "ExponentPushToken[a]"}, ok("t2"))
+    # A failed save keeps the tickets queued for the next one
+    db.fail_commits = True
+    assert tracker.save() == 0 and tracker.stats()["unsaved_tickets"] == 2
+    db.fail_commits = False
+    assert tracker.save() == 2
+    assert db.tickets == {"t1": {"token": "ExponentPushToken[a]", "sentAt": 1000.0},
+                          "t2": {"token": "ExponentPushToken[a]", "sentAt": 1000.0}}
+
+    # The worker restarts before the receipts are ready; the new process polls the saved tickets
+    clock.now += 900
+    expo = FakeExpoReceipts({"t1": {"status": "ok"}, "t2": error("DeviceNotRegistered")})
+    restarted = PushReceiptTracker(db, url=expo.url, receipt_delay=900, clock=clock)
+    try:
+        metrics = restarted.run()
+    finally:
+        expo.stop()
+    assert expo.requests == [["t1", "t2"]]
+    assert metrics["receipts_ok"] == 1 and metrics["tokens_cleared"] == 1
+    assert "expoPushToken" not in db.profiles["user1"]
+    # Settled tickets are deleted from Firestore
+    assert db.tickets == {} and restarted.stats()["totals"]["tickets_loaded"] == 2
+
+
+if __name__ == "__main__":
+    test_receipts_are_polled_in_batches_and_dead_tokens_cleared()
+    test_unready_receipts_are_retried_then_expire()
+    test_ticket_errors_are_handled_without_receipts()
+    test_failed_fetch_keeps_tickets_pending()
+    test_pending_tickets_survive_a_restart()
+    print("All push receipt tests passed")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the push token registry (no Firebase required).
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.push_token_registry import PushTokenRegistry
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self.db, self.collection, self.id = db, collection, doc_id
+
+    def get(self, field_paths=None):
+        self.db.reads.append((self.collection, self.id, tuple(field_paths) if field_paths else None))
+        data = self.db.data.get(self.collection, {}).get(self.id)
+        if data is not None and field_paths:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        return FakeSnapshot(self.id, data)
+
+    def set(self, data):
+        self.db.data.setdefault(self.collection, {})[self.id] = dict(data)
+
+
+class FakeQuery:
+    def __init__(self, db, collection, field, value):
+        self.db, self.collection, self.field, self.value = db, collection, field, value
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        self.db.queries += 1
+        for doc_id, data in self.db.data.get(self.collection, {}).items():
+            if data.get(self.field) == self.value:
+                yield FakeSnapshot(doc_id, data)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.name, doc_id)
+
+    def where(self, field, op, value):
+        return FakeQuery(self.db, self.name, field, value)
+
+
+class FakeDB:
+    def __init__(self, profiles):
+        self.data = {"user_profiles": profiles}
+        self.reads = []
+        self.queries = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def profiles():
+    return {
+        "user1": {"firstName": "Asha", "expoPushToken": "ExponentPushToken[user1]", "currentWeight": 60},
+        "user2": {"notificationToken": "not-an-expo-token"},
+        "diet1": {"isDietician": True, "expoPushToken": "ExponentPushToken[diet1]"},
+    }
+
+
+def test_user_tokens_are_cached_and_projected():
+    db = FakeDB(profiles())
+    clock = FakeClock()
+    registry = PushTokenRegistry(db, ttl_seconds=600, negative_ttl_seconds=60, clock=clock)
+    assert registry.get_user_token("user1") == "ExponentPushToken[user1]"
+    assert registry.get_user_token("user1") == "ExponentPushToken[user1]"
+    assert registry.get_user_token("user2") is None
+    assert registry.get_user_token("diet1", include_dieticians=False) is None
+    assert [read[1] for read in db.reads] == ["user1", "user2", "diet1"]
+    # Only the token fields are read, not the whole profile
+    assert all(read[2] == ("expoPushToken", "notificationToken", "isDietician") for read in db.reads)
+    clock.now = 61
+    registry.get_user_token("user1")
+    registry.get_user_token("user2")
+    assert [read[1] for read in db.reads[3:]] == ["user2"]
+    assert registry.stats()["hits"] == 2
+
+
+def test_dietician_token_comes_from_a_small_document():
+    db = FakeDB(profiles())
+    registry = PushTokenRegistry(db, clock=FakeClock())
+    assert registry.get_dietician_token() == "ExponentPushToken[diet1]"
+    assert db.queries == 1
+    assert db.data["push_tokens"]["dietician"]["tokens"] == [{"userId": "diet1", "token": "ExponentPushToken[diet1]"}]
+    assert registry.get_dietician_token() == "ExponentPushToken[diet1]"
+    # Another process reads the document instead of querying user_profiles
+    assert PushTokenRegistry(db, clock=FakeClock()).get_dietician_token() == "ExponentPushToken[diet1]"
+    assert db.queries == 1
+
+
+def test_token_updates_are_written_through():
+    db = FakeDB(profiles())
+    registry = PushTokenRegistry(db, clock=FakeClock())
+    registry.get_user_token("user1")
+    registry.get_dietician_token()
+    db.data["user_profiles"]["user1"]["expoPushToken"] = "ExponentPushToken[user1-new]"
+    db.data["user_profiles"]["diet1"]["expoPushToken"] = "ExponentPushToken[diet1-new]"
+    changes = [
+        SimpleNamespace(type=SimpleNamespace(name=kind), document=FakeSnapshot(doc_id, db.data["user_profiles"][doc_id]))
+        for kind, doc_id in (("MODIFIED", "user1"), ("ADDED", "diet1"))
+    ]
+    reads = len(db.reads)
+    registry._on_token_updates([], changes, None)
+    assert registry.get_user_token("user1") == "ExponentPushToken[user1-new]"
+    assert registry.get_dietician_token() == "ExponentPushToken[diet1-new]"
+    assert db.data["push_tokens"]["dietician"]["token"] == "ExponentPushToken[diet1-new]"
+    assert len(db.reads) == reads and registry.stats()["watch_updates"] == 2
+
+
+def test_server_profile_writes_invalidate():
+    db = FakeDB(profiles())
+    registry = PushTokenRegistry(db, clock=FakeClock())
+    registry.get_user_token("user1")
+    registry.profile_updated("user1", {"currentWeight": 61})
+    registry.get_user_token("user1")
+    assert len(db.reads) == 1
+    db.data["user_profiles"]["user1"] = {"isDietician": False}
+    registry.profile_updated("user1", {"isDietician": False})
+    assert registry.get_user_token("user1") is None
+
+
+if __name__ == "__main__":
+    test_user_tokens_are_cached_and_projected()
+    test_dietician_token_comes_from_a_small_document()
+    test_token_updates_are_written_through()
+    test_server_profile_writes_invalidate()
+    print("All push token registry tests passed")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Unit tests for single-flight coalescing of concurrent lookups (no Firebase required).
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight("test")
+    executions = []
+
+    async def lookup():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return {"calories": 100}
+
+    async def run():
+        return await asyncio.gather(*[flight.do(("rice", "100", "g"), lookup) for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert len(executions) == 1
+    assert all(result == {"calories": 100} for result in results)
+    stats = flight.stats()
+    assert stats["calls"] == 5
+    assert stats["executions"] == 1
+    assert stats["coalesced"] == 4
+    assert stats["in_flight"] == 0
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight("test")
+
+    async def lookup():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def run():
+        return await asyncio.gather(flight.do("a", lookup), flight.do("b", lookup))
+
+    asyncio.run(run())
+    assert flight.stats()["executions"] == 2
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_errors_propagate_to_every_waiter():
+    flight = SingleFlight("test")
+
+    async def failing_lookup():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("x", failing_lookup), flight.do("x", failing_lookup), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["errors"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight("test")
+
+    async def slow_lookup():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        impatient = asyncio.wait_for(flight.do("k", slow_lookup), timeout=0.01)
+        patient = flight.do("k", slow_lookup)
+        return await asyncio.gather(impatient, patient, return_exceptions=True)
+
+    impatient_result, patient_result = asyncio.run(run())
+    assert isinstance(impatient_result, asyncio.TimeoutError)
+    assert patient_result == "done"
+
+
+if __name__ == "__main__":
+    test_concurrent_identical_calls_share_one_execution()
+    test_different_keys_are_not_coalesced()
+    test_errors_propagate_to_every_waiter()
+    test_cancelled_waiter_does_not_cancel_shared_call()
+    print("All single-flight tests passed")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Unit tests for sampled category tracing (no Firebase required).
+"""
+import io
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.tracing import Tracer, parse_rates
+
+
+def _make_tracer(rates=None, default_rate=0.0):
+    buffer = io.StringIO()
+    return Tracer(rates, default_rate, logging.StreamHandler(buffer)), buffer
+
+
+def test_disabled_category_never_builds_the_message():
+    tracer, buffer = _make_tracer()
+    built = []
+    tracer.trace("FOOD LOG TRACE", lambda: built.append(1) or "expensive")
+    tracer.stop()
+    assert built == []
+    assert buffer.getvalue() == ""
+
+
+def test_enabled_category_is_written_through_the_queue():
+    tracer, buffer = _make_tracer({"PUSH DEBUG": 1.0})
+    tracer.trace("PUSH DEBUG", "sent %s to %s", "hello", "token")
+    tracer.trace("PUSH DEBUG", lambda: "lazy message")
+    tracer.stop()
+    assert buffer.getvalue().splitlines() == ["[PUSH DEBUG] sent hello to token", "[PUSH DEBUG] lazy message"]
+    assert tracer.stats()["emitted"] == {"PUSH DEBUG": 2}
+
+
+def test_rates_can_change_at_runtime():
+    tracer, buffer = _make_tracer()
+    tracer.trace("SUMMARY TRACE", "before")
+    tracer.set_rate("summary trace", 1)
+    tracer.trace("SUMMARY TRACE", "after")
+    tracer.stop()
+    assert buffer.getvalue().splitlines() == ["[SUMMARY TRACE] after"]
+    assert tracer.rates()["SUMMARY TRACE"] == 1.0
+
+
+def test_partial_sampling_emits_a_fraction():
+    tracer, _ = _make_tracer({"X": 0.2})
+    for _ in range(2000):
+        tracer.trace("X", "sampled")
+    tracer.stop()
+    assert 200 < tracer.stats()["emitted"]["X"] < 600
+
+
+def test_parse_rates():
+    assert parse_rates("food log trace=1, PUSH DEBUG=0.25,bad,SUMMARY TRACE=7") == {
+        "FOOD LOG TRACE": 1.0,
+        "PUSH DEBUG": 0.25,
+        "SUMMARY TRACE": 1.0,
+    }
+
+
+if __name__ == "__main__":
+    test_disabled_category_never_builds_the_message()
+    test_enabled_category_is_written_through_the_queue()
+    test_rates_can_change_at_runtime()
+    test_partial_sampling_emits_a_fraction()
+    test_parse_rates()
+    print("All tracing tests passed")